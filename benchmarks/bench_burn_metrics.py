@@ -0,0 +1,94 @@
+"""
+Benchmark of the fused burn metric kernel (`calc_burn_metrics`) against the equivalent unfused
+xarray expressions followed by `xr.concat`, for time and peak (traced) memory.
+
+Run from the repository root with:
+
+    python -m benchmarks.bench_burn_metrics
+"""
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import xarray as xr
+from src.lib.burn_severity import (
+    calc_burn_metrics,
+    calc_nbr,
+    calc_dnbr,
+    calc_rdnbr,
+    calc_rbr,
+    BURN_METRICS,
+    DEFAULT_DTYPE,
+)
+
+SIZES = [512, 2048, 4096]
+REPEATS = 3
+
+
+def unfused_burn_metrics(prefire_nir, prefire_swir, postfire_nir, postfire_swir):
+    bands = [prefire_nir, prefire_swir, postfire_nir, postfire_swir]
+    prefire_nir, prefire_swir, postfire_nir, postfire_swir = [
+        band.astype(DEFAULT_DTYPE, copy=False) for band in bands
+    ]
+    nbr_prefire = calc_nbr(prefire_nir, prefire_swir)
+    nbr_postfire = calc_nbr(postfire_nir, postfire_swir)
+    dnbr = calc_dnbr(nbr_prefire, nbr_postfire)
+    rdnbr = calc_rdnbr(dnbr, nbr_prefire)
+    rbr = calc_rbr(dnbr, nbr_prefire)
+    return xr.concat(
+        [nbr_prefire, nbr_postfire, dnbr, rdnbr, rbr],
+        pd.Index(BURN_METRICS, name="burn_metric"),
+        coords="minimal",
+    )
+
+
+def make_bands(size, seed=0):
+    rng = np.random.default_rng(seed)
+    coords = {"y": np.arange(size), "x": np.arange(size)}
+    return [
+        xr.DataArray(
+            rng.uniform(0.01, 0.6, (size, size)).astype(DEFAULT_DTYPE),
+            dims=("y", "x"),
+            coords=coords,
+        )
+        for _ in range(4)
+    ]
+
+
+def measure(fn, bands):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn(*bands)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = fn(*bands)
+    __current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Report the memory needed beyond the result itself
+    return min(times), peak - result.nbytes
+
+
+def main():
+    rows = []
+    with np.errstate(all="ignore"):
+        for size in SIZES:
+            bands = make_bands(size)
+            unfused_seconds, unfused_peak = measure(unfused_burn_metrics, bands)
+            fused_seconds, fused_peak = measure(calc_burn_metrics, bands)
+            rows.append(
+                {
+                    "size": f"{size}x{size}",
+                    "unfused_ms": round(unfused_seconds * 1000, 1),
+                    "fused_ms": round(fused_seconds * 1000, 1),
+                    "speedup": round(unfused_seconds / fused_seconds, 2),
+                    "unfused_extra_mib": round(unfused_peak / 1024**2, 1),
+                    "fused_extra_mib": round(fused_peak / 1024**2, 1),
+                }
+            )
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark of `classify_burn` (a binary search over the sorted thresholds, then a lookup of the
+class values) against the previous per-threshold `xr.where` loop, across array sizes and
+threshold counts.
+
+Run from the repository root with:
+
+    python -m benchmarks.bench_classify_burn
+"""
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import xarray as xr
+from src.lib.burn_severity import classify_burn, CLASSIFICATION_NODATA, DEFAULT_DTYPE
+
+SIZES = [512, 2048, 4096]
+N_THRESHOLDS = [4, 8, 32]
+REPEATS = 3
+
+
+def looped_classify_burn(array, thresholds):
+    reclass = xr.full_like(array, np.nan)
+    for threshold, value in sorted(thresholds.items()):
+        reclass = xr.where((array < threshold) & (reclass.isnull()), value, reclass)
+    return reclass
+
+
+def measure(fn, *args):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn(*args)
+    __current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def main():
+    rng = np.random.default_rng(0)
+    rows = []
+    for size in SIZES:
+        array = xr.DataArray(
+            rng.uniform(-0.5, 1.5, (size, size)).astype(DEFAULT_DTYPE), dims=("y", "x")
+        )
+        array[::97, ::89] = np.nan
+        for n_thresholds in N_THRESHOLDS:
+            thresholds = {
+                float(threshold): value
+                for value, threshold in enumerate(np.linspace(-0.25, 1.0, n_thresholds))
+            }
+
+            # Sanity check the two agree, with the old NaNs as nodata
+            expected = looped_classify_burn(array, thresholds)
+            expected = expected.fillna(CLASSIFICATION_NODATA).astype("uint8")
+            assert (classify_burn(array, thresholds) == expected).all()
+
+            looped_seconds, looped_peak = measure(
+                looped_classify_burn, array, thresholds
+            )
+            searched_seconds, searched_peak = measure(classify_burn, array, thresholds)
+            rows.append(
+                {
+                    "size": f"{size}x{size}",
+                    "n_thresholds": n_thresholds,
+                    "looped_ms": round(looped_seconds * 1000, 1),
+                    "searchsorted_ms": round(searched_seconds * 1000, 1),
+                    "speedup": round(looped_seconds / searched_seconds, 1),
+                    "looped_peak_mib": round(looped_peak / 1024**2, 1),
+                    "searchsorted_peak_mib": round(searched_peak / 1024**2, 1),
+                }
+            )
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark of deriving the boundary of a large synthetic fire coarse to fine (segmenting a decimated
+metric layer, then re-deriving only the band around its boundary at full resolution) against
+deriving it at full resolution throughout, across raster sizes and decimation factors.
+
+Run from the repository root with:
+
+    python -m benchmarks.bench_derive_boundary
+"""
+import time
+import numpy as np
+import pandas as pd
+import xarray as xr
+import rioxarray
+from shapely.geometry import shape
+from scipy.ndimage import gaussian_filter
+from src.lib.derive_boundary import (
+    FloodFillSegmentation,
+    HistogramOtsuThreshold,
+    derive_boundary,
+)
+
+SIZES = [2048, 8192]
+COARSE_FACTORS = [None, 4, 8]
+RESOLUTION = 20
+
+
+def synthetic_metric_layer(size, rng):
+    # Blobby burns of a few hundred pixels across, with noise, and a NaN buffer at the edge
+    field = gaussian_filter(rng.random((size, size)), sigma=size / 50)
+    burns = field > np.quantile(field, 0.6)
+    values = np.where(burns, 0.5, 0.0) + rng.normal(0, 0.1, (size, size))
+    values[:5] = np.nan
+    values[:, -3:] = np.nan
+
+    seed = np.zeros_like(burns)
+    rows, cols = np.nonzero(burns)
+    seed_points = rng.integers(0, len(rows), 2)
+    seed[rows[seed_points], cols[seed_points]] = True
+
+    return xr.DataArray(
+        values[None],
+        dims=("seed", "y", "x"),
+        coords={
+            "y": 4000000 - RESOLUTION * (np.arange(size) + 0.5),
+            "x": 500000 + RESOLUTION * (np.arange(size) + 0.5),
+        },
+    ).rio.write_crs("EPSG:32611").assign_coords(seed=(("seed", "y", "x"), seed[None]))
+
+
+def main():
+    rng = np.random.default_rng(0)
+    rows = []
+    for size in SIZES:
+        metric_layer = synthetic_metric_layer(size, rng)
+
+        for coarse_factor in COARSE_FACTORS:
+            start = time.perf_counter()
+            geojson_boundary = derive_boundary(
+                metric_layer.copy(deep=True),
+                thresholding_strategy=HistogramOtsuThreshold(),
+                segmentation_strategy=FloodFillSegmentation(),
+                coarse_factor=coarse_factor,
+            )
+            seconds = time.perf_counter() - start
+            boundary = shape(geojson_boundary["features"][0]["geometry"])
+            if coarse_factor is None:
+                full_resolution_seconds, full_resolution = seconds, boundary
+
+            rows.append(
+                {
+                    "size": f"{size}x{size}",
+                    "coarse_factor": coarse_factor or 1,
+                    "seconds": round(seconds, 2),
+                    "speedup": round(full_resolution_seconds / seconds, 2),
+                    "iou": round(
+                        full_resolution.intersection(boundary).area
+                        / full_resolution.union(boundary).area,
+                        4,
+                    ),
+                }
+            )
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
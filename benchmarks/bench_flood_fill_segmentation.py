@@ -0,0 +1,76 @@
+"""
+Benchmark of selecting the burns containing seed points with `FloodFillSegmentation` (one
+connected-component labeling of the disturbed mask, then a lookup of the seeds' labels) against
+flood filling the whole raster from each seed point in turn, across numbers of seed points.
+
+Run from the repository root with:
+
+    python -m benchmarks.bench_flood_fill_segmentation
+"""
+import time
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy.ndimage import gaussian_filter
+from skimage.segmentation import flood_fill
+from src.lib.derive_boundary import FloodFillSegmentation
+
+SIZE = 2048
+N_SEEDS = [1, 10, 100, 1000]
+
+
+def flood_fill_each_seed(disturbed, seed_locations):
+    segmented_burns = np.zeros_like(disturbed)
+    for seed_point in seed_locations:
+        if not disturbed[seed_point]:
+            continue
+        filled = flood_fill(disturbed.astype(np.int8), seed_point, new_value=2)
+        segmented_burns = np.logical_or(segmented_burns, filled == 2)
+    return segmented_burns
+
+
+def main():
+    rng = np.random.default_rng(0)
+    # Blobby burns of a range of sizes
+    disturbed = gaussian_filter(rng.random((SIZE, SIZE)), sigma=8) > 0.505
+
+    rows = []
+    for n_seeds in N_SEEDS:
+        seed = np.zeros_like(disturbed)
+        seed_locations = list(
+            zip(rng.integers(0, SIZE, n_seeds), rng.integers(0, SIZE, n_seeds))
+        )
+        for seed_point in seed_locations:
+            seed[seed_point] = True
+        metric_layer = xr.DataArray(
+            np.zeros((1, SIZE, SIZE), dtype="float32"), dims=("seed", "y", "x")
+        ).assign_coords(
+            disturbed=(("seed", "y", "x"), disturbed[None]),
+            seed=(("seed", "y", "x"), seed[None]),
+        )
+
+        start = time.perf_counter()
+        segmented = FloodFillSegmentation().apply(metric_layer)["disturbed"].values[0]
+        labeled_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        flood_filled = flood_fill_each_seed(disturbed, seed_locations)
+        flood_fill_seconds = time.perf_counter() - start
+
+        # Sanity check the two agree
+        np.testing.assert_array_equal(segmented, flood_filled)
+
+        rows.append(
+            {
+                "size": f"{SIZE}x{SIZE}",
+                "n_seeds": n_seeds,
+                "flood_fill_each_s": round(flood_fill_seconds, 3),
+                "labeled_s": round(labeled_seconds, 3),
+                "speedup": round(flood_fill_seconds / labeled_seconds, 1),
+            }
+        )
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark of quantized (int16, scale/offset) metric COGs against float32 ones, as written by
+`CloudStaticIOClient.write_metric_cog` (plus overviews, as in `upload_cogs`): object size (which
+upload time scales with), write time, and the bytes a 256px tile read touches. Unquantized COGs
+are written uncompressed, so to separate the gain of quantizing from that of compressing, the
+reductions are against float32 COGs with the same 256px tiling and fast deflate as int16 ones (with
+the floating point predictor, horizontal differencing's counterpart for floats).
+
+Run from the repository root with:
+
+    python -m benchmarks.bench_quantized_cogs
+"""
+import os
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+import rasterio
+import rasterio.windows
+import xarray as xr
+import rioxarray
+from rasterio.enums import Resampling
+from scipy.ndimage import gaussian_filter
+from src.util.cloud_static_io import CloudStaticIOClient
+
+SIZES = [1024, 4096]
+TILE_SIZE = 256
+
+
+def synthetic_metric(size, seed=0):
+    # A smooth burn signal plus sensor noise, NaN outside an elliptical fire boundary
+    rng = np.random.default_rng(seed)
+    signal = gaussian_filter(rng.normal(size=(size, size)), sigma=size / 32)
+    signal = 0.6 * signal / np.abs(signal).max()
+    values = (signal + rng.normal(scale=0.02, size=(size, size))).astype("float32")
+
+    y, x = np.ogrid[-1 : 1 : size * 1j, -1 : 1 : size * 1j]
+    values[(x**2 + (y / 0.7) ** 2) > 1] = np.nan
+
+    coords = {
+        "y": np.linspace(40.0, 39.9, size),
+        "x": np.linspace(-120.0, -119.9, size),
+    }
+    return xr.DataArray(values, dims=("y", "x"), coords=coords).rio.write_crs(4326)
+
+
+def tile_read_bytes(path, size):
+    # Bytes of the blocks a full resolution tile read in the middle of the raster touches
+    window = rasterio.windows.Window(
+        size // 2 - TILE_SIZE // 2, size // 2 - TILE_SIZE // 2, TILE_SIZE, TILE_SIZE
+    )
+    with rasterio.open(path) as ds:
+        return sum(
+            ds.block_size(1, *block_index)
+            for block_index, block_window in ds.block_windows(1)
+            if rasterio.windows.intersect(window, block_window)
+        )
+
+
+def write(client, metric, path, mode):
+    start = time.perf_counter()
+    if mode == "float32_deflate":
+        metric.rio.to_raster(
+            path,
+            driver="GTiff",
+            tiled=True,
+            blockxsize=256,
+            blockysize=256,
+            compress="deflate",
+            zlevel=1,
+            predictor=3,
+        )
+    else:
+        client.write_metric_cog(
+            metric, path, "dnbr", quantize_metrics=mode == "int16"
+        )
+    with rasterio.open(path, "r+") as ds:
+        ds.build_overviews([2, 4, 8, 16, 32], Resampling.nearest)
+    return time.perf_counter() - start
+
+
+def main():
+    client = CloudStaticIOClient.__new__(CloudStaticIOClient)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in SIZES:
+            metric = synthetic_metric(size)
+            row = {"size": f"{size}x{size}"}
+            for mode in ["float32", "float32_deflate", "int16"]:
+                path = os.path.join(tmpdir, f"{mode}_{size}.tif")
+                write_seconds = write(client, metric, path, mode)
+                row[f"{mode}_mib"] = round(os.path.getsize(path) / 1024**2, 2)
+                row[f"{mode}_write_ms"] = round(write_seconds * 1000, 1)
+                row[f"{mode}_tile_kib"] = round(tile_read_bytes(path, size) / 1024, 1)
+            # At equal tiling and compression, so only quantizing differs
+            row["size_reduction"] = round(
+                row["float32_deflate_mib"] / row["int16_mib"], 1
+            )
+            row["tile_read_reduction"] = round(
+                row["float32_deflate_tile_kib"] / row["int16_tile_kib"], 1
+            )
+            rows.append(row)
+    print(pd.DataFrame(rows).T.to_string(header=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark of polygon statistics of a metric COG from its summary pyramid (precomputed block
+statistics, with full resolution reads only along the polygon's edge) against reading and masking
+every pixel of the polygon, across raster and polygon sizes.
+
+Run from the repository root with:
+
+    python -m benchmarks.bench_summary_pyramid
+"""
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import rasterio
+import rasterio.mask
+import shapely
+import xarray as xr
+import rioxarray
+from src.lib.burn_severity import DEFAULT_DTYPE
+from src.lib.summary_pyramid import SummaryPyramid, cog_window_reader
+
+SIZES = [2048, 8192]
+# Radius of the polygon, as a fraction of the raster's size
+POLYGON_RADII = [0.1, 0.4]
+RESOLUTION = 20
+
+
+def masked_stats(src, polygon):
+    masked, __transform = rasterio.mask.mask(src, [polygon], crop=True, filled=False)
+    values = np.ma.masked_invalid(masked.astype("float64")).compressed()
+    return {"count": values.size, "mean": values.mean(), "n_pixels_read": masked.size}
+
+
+def main():
+    rng = np.random.default_rng(0)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in SIZES:
+            metric = xr.DataArray(
+                rng.normal(0.3, 0.2, (size, size)).astype(DEFAULT_DTYPE),
+                dims=("y", "x"),
+                coords={
+                    "y": 4000000 - RESOLUTION * (np.arange(size) + 0.5),
+                    "x": 500000 + RESOLUTION * (np.arange(size) + 0.5),
+                },
+            ).rio.write_crs("EPSG:32611")
+            cog_path = os.path.join(tmpdir, f"dnbr_{size}.tif")
+            metric.rio.to_raster(
+                cog_path, driver="GTiff", tiled=True, blockxsize=256, blockysize=256
+            )
+
+            start = time.perf_counter()
+            pyramid = SummaryPyramid.from_array(metric)
+            build_seconds = time.perf_counter() - start
+
+            center = (500000 + RESOLUTION * size / 2, 4000000 - RESOLUTION * size / 2)
+            for radius in POLYGON_RADII:
+                polygon = shapely.Point(center).buffer(RESOLUTION * size * radius)
+                with rasterio.open(cog_path) as src:
+                    start = time.perf_counter()
+                    masked = masked_stats(src, polygon)
+                    masked_seconds = time.perf_counter() - start
+
+                with rasterio.open(cog_path) as src:
+                    start = time.perf_counter()
+                    stats = pyramid.polygon_stats(polygon, cog_window_reader(src))
+                    pyramid_seconds = time.perf_counter() - start
+
+                # Sanity check the two agree
+                assert stats["count"] == masked["count"]
+                np.testing.assert_allclose(stats["mean"], masked["mean"], rtol=1e-9)
+
+                rows.append(
+                    {
+                        "size": f"{size}x{size}",
+                        "polygon_radius": radius,
+                        "n_pixels": masked["count"],
+                        "build_s": round(build_seconds, 2),
+                        "masked_s": round(masked_seconds, 3),
+                        "masked_read": masked["n_pixels_read"],
+                        "pyramid_s": round(pyramid_seconds, 3),
+                        "pyramid_read": stats["n_pixels_read"],
+                        "speedup": round(masked_seconds / pyramid_seconds, 1),
+                    }
+                )
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
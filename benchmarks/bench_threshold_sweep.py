@@ -0,0 +1,83 @@
+"""
+Benchmark of scoring candidate classification thresholds with `ThresholdSweep` (one sort of the
+metric, then binary searches per threshold set) against classifying the raster with
+`classify_burn` once per threshold set, across array sizes and numbers of threshold sets.
+
+Run from the repository root with:
+
+    python -m benchmarks.bench_threshold_sweep
+"""
+import time
+import numpy as np
+import pandas as pd
+import xarray as xr
+from src.lib.burn_severity import classify_burn, DEFAULT_DTYPE
+from src.lib.threshold_sweep import ThresholdSweep, candidate_threshold_sets
+
+SIZES = [512, 2048]
+N_CANDIDATES_PER_THRESHOLD = [4, 8, 16]
+CLASSES = [1, 2, 3, 4]
+# Classifying every set is slow, so time it on a sample and extrapolate
+N_CLASSIFIED_SAMPLE = 10
+
+
+def classify_and_score(metric, reference, valid, threshold_sets):
+    return [
+        np.mean(
+            classify_burn(metric, dict(zip(threshold_set, CLASSES))).values[valid]
+            == reference[valid]
+        )
+        for threshold_set in threshold_sets
+    ]
+
+
+def main():
+    rng = np.random.default_rng(0)
+    rows = []
+    for size in SIZES:
+        metric = xr.DataArray(
+            rng.uniform(-0.5, 1.5, (size, size)).astype(DEFAULT_DTYPE), dims=("y", "x")
+        )
+        reference = np.digitize(metric.values, [0.1, 0.27, 0.66]) + 1
+        reference[::3, ::4] = rng.integers(1, 5, reference[::3, ::4].shape)
+        valid = np.isfinite(metric.values)
+
+        for n_candidates in N_CANDIDATES_PER_THRESHOLD:
+            threshold_sets = candidate_threshold_sets(
+                [
+                    np.linspace(-0.2, 0.2, n_candidates),
+                    np.linspace(0.2, 0.4, n_candidates),
+                    np.linspace(0.5, 0.8, n_candidates),
+                    [1.5],
+                ]
+            )
+
+            start = time.perf_counter()
+            result = ThresholdSweep(metric, reference).evaluate(threshold_sets, CLASSES)
+            sweep_seconds = time.perf_counter() - start
+
+            sample = threshold_sets[:N_CLASSIFIED_SAMPLE]
+            start = time.perf_counter()
+            looped_accuracy = classify_and_score(metric, reference, valid, sample)
+            looped_seconds = (
+                (time.perf_counter() - start) / len(sample) * len(threshold_sets)
+            )
+            # Sanity check the two agree
+            np.testing.assert_allclose(
+                result["overall_accuracy"][: len(sample)], looped_accuracy
+            )
+
+            rows.append(
+                {
+                    "size": f"{size}x{size}",
+                    "n_threshold_sets": len(threshold_sets),
+                    "classify_each_s": round(looped_seconds, 2),
+                    "sweep_s": round(sweep_seconds, 3),
+                    "speedup": round(looped_seconds / sweep_seconds, 1),
+                }
+            )
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,13 @@ from titiler.core.factory import TilerFactory
 from titiler.core.errors import DEFAULT_STATUS_CODES, add_exception_handlers
 
 from src.routers.check import connectivity, dns, health, sentry_error
-from src.routers.analyze import spectral_burn_metrics
+from src.routers.analyze import spectral_burn_metrics, query_plan, recovery
 from src.routers.refine import flood_fill_segmentation
 from src.routers.upload import drawn_aoi, shapefile_zip
 from src.routers.fetch import rangeland_analysis_platform, ecoclass
 from src.routers.list import derived_products
+from src.routers.query import nbr_time_series, metric_summary
+from src.routers.monitor import active_fires
 from src.routers.pages import home, map, upload, directory
 from src.routers.batch import batch_analyze_and_fetch
 
@@ -35,6 +37,8 @@ app.include_router(dns.router)
 
 ### ANALYZE ###
 app.include_router(spectral_burn_metrics.router)
+app.include_router(query_plan.router)
+app.include_router(recovery.router)
 
 ### REFINE ###
 app.include_router(flood_fill_segmentation.router)
@@ -53,6 +57,13 @@ app.include_router(batch_analyze_and_fetch.router)
 ### LIST ###
 app.include_router(derived_products.router)
 
+### QUERY ###
+app.include_router(nbr_time_series.router)
+app.include_router(metric_summary.router)
+
+### MONITOR ###
+app.include_router(active_fires.router)
+
 ### TILESERVER ###
 cog = TilerFactory(process_dependency=algorithms.dependency)
 app.include_router(cog.router, prefix="/cog", tags=["tileserver"])
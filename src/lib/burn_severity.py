@@ -1,112 +1,453 @@
-import numpy as np
-import xarray as xr
-import pandas as pd
-
-
-def calc_nbr(band_nir, band_swir):
-    """
-    Get the Normalized Burn Ratio (NBR) from the input arrays of NIR and SWIR bands.
-
-    Args:
-        band_nir (xr.DataArray): Array of the first band image (e.g., B8A).
-        band_swir (xr.DataArray): Array of the second band image (e.g., B12).
-
-    Returns:
-        array: Normalized Burn Ratio (NBR).
-    """
-    nbr = (band_nir - band_swir) / (band_nir + band_swir)
-    return nbr
-
-
-def calc_dnbr(nbr_prefire, nbr_postfire):
-    """
-    Get the difference Normalized Burn Ratio (dNBR) from the pre-fire and post-fire NBR.
-
-    Args:
-        nbr_prefire (xr.DataArray): Pre-fire NBR.
-        nbr_postfire (xr.DataArray): Post-fire NBR.
-
-    Returns:
-        array: Difference Normalized Burn Ratio (dNBR).
-    """
-    dnbr = nbr_prefire - nbr_postfire
-    return dnbr
-
-
-def calc_rdnbr(dnbr, nbr_prefire):
-    """
-    Get the relative difference Normalized Burn Ratio (rdNBR) from the dNBR and pre-fire NBR.
-
-    Args:
-        dnbr (xr.DataArray): Difference Normalized Burn Ratio (dNBR).
-        nbr_prefire (xr.DataArray): Pre-fire NBR.
-
-    Returns:
-        array: Relative difference Normalized Burn Ratio (rdNBR).
-    """
-    rdnbr = dnbr / np.abs(np.sqrt(nbr_prefire))
-    return rdnbr
-
-
-def calc_rbr(dnbr, nbr_prefire):
-    """
-    Get the relative burn ratio (rBR) from the dNBR and pre-fire NBR.
-
-    Args:
-        dnbr (xr.DataArray): Difference Normalized Burn Ratio (dNBR).
-        nbr_prefire (xr.DataArray): Pre-fire NBR.
-
-    Returns:
-        array: Relative burn ratio (rBR).
-    """
-    rbr = dnbr / (nbr_prefire + 1.001)
-    return rbr
-
-
-def calc_burn_metrics(prefire_nir, prefire_swir, postfire_nir, postfire_swir):
-    """
-    Get the NBR, dNBR, rdNBR, and rBR from the pre- and post-fire NIR and SWIR bands.
-
-    Args:
-        prefire_nir (xr.DataArray): Pre-fire NIR.
-        prefire_swir (xr.DataArray): Pre-fire SWIR.
-        postfire_nir (xr.DataArray): Post-fire NIR.
-        postfire_swir (xr.DataArray): Post-fire SWIR.
-
-    Returns:
-        xr.DataArray: Stack of NBR, dNBR, rdNBR, and rBR.
-    """
-    nbr_prefire = calc_nbr(prefire_nir, prefire_swir)
-    nbr_postfire = calc_nbr(postfire_nir, postfire_swir)
-    dnbr = calc_dnbr(nbr_prefire, nbr_postfire)
-    rdnbr = calc_rdnbr(dnbr, nbr_prefire)
-    rbr = calc_rbr(dnbr, nbr_prefire)
-
-    burn_stack = xr.concat(
-        [nbr_prefire, nbr_postfire, dnbr, rdnbr, rbr],
-        pd.Index(
-            ["nbr_prefire", "nbr_postfire", "dnbr", "rdnbr", "rbr"], name="burn_metric"
-        ),
-        coords="minimal",
-    )
-
-    return burn_stack
-
-
-def classify_burn(array, thresholds):
-    """
-    Reclassify an array based on the given thresholds.
-
-    Args:
-        array (xr.DataArray): Input array.
-        thresholds (dict): Dictionary of thresholds and their corresponding values.
-
-    Returns:
-        xr.DataArray: Reclassified array.
-    """
-    reclass = xr.full_like(array, np.nan)
-
-    for threshold, value in sorted(thresholds.items()):
-        reclass = xr.where((array < threshold) & (reclass.isnull()), value, reclass)
-
-    return reclass
+import os
+import numpy as np
+import xarray as xr
+import pandas as pd
+import dask
+import dask.array as da
+from functools import partial
+from scipy.ndimage import distance_transform_edt
+
+# Precision of the band stacks and burn metrics, end to end. NBR-derived metrics are only
+# meaningful to ~0.001, so float32 is plenty and halves memory, compute and storage vs float64.
+DEFAULT_DTYPE = "float32"
+
+BURN_METRICS = ["nbr_prefire", "nbr_postfire", "dnbr", "rdnbr", "rbr"]
+
+# Fill value of burn classifications, which are stored as uint8
+CLASSIFICATION_NODATA = 255
+# Number of pixels classified at a time
+CLASSIFY_BLOCK_SIZE = 2**16
+
+# Offset dNBR takes its reference from a ring of (presumably unburned) pixels outside the
+# perimeter - from OFFSET_RING_GAP_METERS out, to skip fire edges the perimeter missed, to
+# OFFSET_RING_GAP_METERS + OFFSET_RING_WIDTH_METERS
+OFFSET_RING_GAP_METERS = float(os.environ.get("OFFSET_RING_GAP_METERS", 60))
+OFFSET_RING_WIDTH_METERS = float(os.environ.get("OFFSET_RING_WIDTH_METERS", 480))
+# Below this many valid ring pixels, the offset is too noisy to apply
+OFFSET_RING_MIN_PIXELS = int(os.environ.get("OFFSET_RING_MIN_PIXELS", 100))
+
+
+def calc_nbr(band_nir, band_swir):
+    """
+    Get the Normalized Burn Ratio (NBR) from the input arrays of NIR and SWIR bands.
+
+    Args:
+        band_nir (xr.DataArray): Array of the first band image (e.g., B8A).
+        band_swir (xr.DataArray): Array of the second band image (e.g., B12).
+
+    Returns:
+        array: Normalized Burn Ratio (NBR).
+    """
+    nbr = (band_nir - band_swir) / (band_nir + band_swir)
+    return nbr
+
+
+def calc_dnbr(nbr_prefire, nbr_postfire):
+    """
+    Get the difference Normalized Burn Ratio (dNBR) from the pre-fire and post-fire NBR.
+
+    Args:
+        nbr_prefire (xr.DataArray): Pre-fire NBR.
+        nbr_postfire (xr.DataArray): Post-fire NBR.
+
+    Returns:
+        array: Difference Normalized Burn Ratio (dNBR).
+    """
+    dnbr = nbr_prefire - nbr_postfire
+    return dnbr
+
+
+def calc_rdnbr(dnbr, nbr_prefire):
+    """
+    Get the relative difference Normalized Burn Ratio (rdNBR) from the dNBR and pre-fire NBR.
+
+    Args:
+        dnbr (xr.DataArray): Difference Normalized Burn Ratio (dNBR).
+        nbr_prefire (xr.DataArray): Pre-fire NBR.
+
+    Returns:
+        array: Relative difference Normalized Burn Ratio (rdNBR).
+    """
+    rdnbr = dnbr / np.abs(np.sqrt(nbr_prefire))
+    return rdnbr
+
+
+def calc_rbr(dnbr, nbr_prefire):
+    """
+    Get the relative burn ratio (rBR) from the dNBR and pre-fire NBR.
+
+    Args:
+        dnbr (xr.DataArray): Difference Normalized Burn Ratio (dNBR).
+        nbr_prefire (xr.DataArray): Pre-fire NBR.
+
+    Returns:
+        array: Relative burn ratio (rBR).
+    """
+    rbr = dnbr / (nbr_prefire + 1.001)
+    return rbr
+
+
+def _fill_burn_metrics_from_nbr(burn_metrics, dnbr_offset=0.0):
+    """
+    Fill the dNBR, rdNBR and rBR of a (burn_metric, ...) block in place, from its pre- and post-fire NBR.
+    Each metric is written straight into its slot of the block, so no temporaries are allocated.
+    A `dnbr_offset` is subtracted from the dNBR before the relative metrics are derived from it.
+    """
+    nbr_prefire, nbr_postfire, dnbr, rdnbr, rbr = burn_metrics
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.subtract(nbr_prefire, nbr_postfire, out=dnbr)
+        if dnbr_offset:
+            np.subtract(dnbr, dnbr.dtype.type(dnbr_offset), out=dnbr)
+        np.sqrt(nbr_prefire, out=rdnbr)
+        np.abs(rdnbr, out=rdnbr)
+        np.divide(dnbr, rdnbr, out=rdnbr)
+        np.add(nbr_prefire, 1.001, out=rbr)
+        np.divide(dnbr, rbr, out=rbr)
+    return burn_metrics
+
+
+def _burn_metrics_block(
+    prefire_nir, prefire_swir, postfire_nir, postfire_swir, dtype=DEFAULT_DTYPE
+):
+    """
+    Calculate all five burn metrics of a block of the four bands, into a single preallocated
+    (burn_metric, ...) block. The not-yet-written metric slots double as scratch space for the
+    NBR denominators.
+    """
+    burn_metrics = np.empty((len(BURN_METRICS),) + np.shape(prefire_nir), dtype=dtype)
+    nbr_prefire, nbr_postfire, __dnbr, rdnbr, rbr = burn_metrics
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.subtract(prefire_nir, prefire_swir, out=nbr_prefire, dtype=dtype)
+        np.add(prefire_nir, prefire_swir, out=rbr, dtype=dtype)
+        np.divide(nbr_prefire, rbr, out=nbr_prefire)
+        np.subtract(postfire_nir, postfire_swir, out=nbr_postfire, dtype=dtype)
+        np.add(postfire_nir, postfire_swir, out=rdnbr, dtype=dtype)
+        np.divide(nbr_postfire, rdnbr, out=nbr_postfire)
+    return _fill_burn_metrics_from_nbr(burn_metrics)
+
+
+def _burn_metrics_from_nbr_block(nbr_prefire, nbr_postfire, dtype=DEFAULT_DTYPE):
+    burn_metrics = np.empty((len(BURN_METRICS),) + np.shape(nbr_prefire), dtype=dtype)
+    burn_metrics[0] = nbr_prefire
+    burn_metrics[1] = nbr_postfire
+    return _fill_burn_metrics_from_nbr(burn_metrics)
+
+
+def _map_burn_metrics(block_fn, arrays, dtype):
+    """
+    Apply a fused burn metric kernel blockwise over aligned DataArrays - directly for numpy-backed
+    arrays, or lazily, block by block, for dask-backed ones - and wrap the result as a
+    (burn_metric, ...) DataArray, keeping the coordinates the inputs agree on.
+    """
+    arrays = xr.align(*arrays, join="inner", copy=False)
+    template = arrays[0]
+
+    if any(dask.is_dask_collection(array.data) for array in arrays):
+        chunks = next(
+            array.data.chunks
+            for array in arrays
+            if dask.is_dask_collection(array.data)
+        )
+        blocks = [da.asarray(array.data).rechunk(chunks) for array in arrays]
+        burn_metrics = da.map_blocks(
+            partial(block_fn, dtype=dtype),
+            *blocks,
+            dtype=dtype,
+            new_axis=0,
+            chunks=((len(BURN_METRICS),),) + chunks,
+            meta=np.array((), dtype=dtype),
+        )
+    else:
+        burn_metrics = block_fn(*[array.values for array in arrays], dtype=dtype)
+
+    coords = {
+        name: coord
+        for name, coord in template.coords.items()
+        if all(
+            name in array.coords
+            and array.coords[name].variable.equals(coord.variable)
+            for array in arrays[1:]
+        )
+    }
+    return xr.DataArray(
+        burn_metrics,
+        dims=("burn_metric",) + template.dims,
+        coords={**coords, "burn_metric": BURN_METRICS},
+    )
+
+
+def unburned_ring_mask(
+    perimeter_mask,
+    pixel_size,
+    ring_gap=OFFSET_RING_GAP_METERS,
+    ring_width=OFFSET_RING_WIDTH_METERS,
+):
+    """
+    Get the mask of a ring of pixels outside a fire perimeter, between `ring_gap` and
+    `ring_gap + ring_width` from it. The distance of every pixel to the perimeter comes from a
+    single Euclidean distance transform of the rasterized perimeter, rather than buffering the
+    perimeter polygon twice and rasterizing the difference.
+
+    Args:
+        perimeter_mask (np.ndarray): Boolean (y, x) mask of the pixels inside the perimeter.
+        pixel_size (tuple): The (y, x) size of a pixel, in the units of the ring distances.
+        ring_gap (float, optional): Distance from the perimeter to the inside of the ring. Defaults to
+            `OFFSET_RING_GAP_METERS`.
+        ring_width (float, optional): Width of the ring. Defaults to `OFFSET_RING_WIDTH_METERS`.
+
+    Returns:
+        np.ndarray: Boolean (y, x) mask of the ring.
+    """
+    distance = distance_transform_edt(~np.asarray(perimeter_mask), sampling=pixel_size)
+    return (distance > ring_gap) & (distance <= ring_gap + ring_width)
+
+
+def calc_dnbr_offset(dnbr, reference_mask, min_pixels=OFFSET_RING_MIN_PIXELS):
+    """
+    Get the dNBR offset of a fire - the median dNBR of unburned reference pixels (see
+    `unburned_ring_mask`), i.e. the change in NBR between the prefire and postfire windows that
+    isn't due to the fire (phenology, soil moisture, sun angle) - and the median absolute deviation
+    of the reference pixels, as a measure of how well it is determined. With fewer than
+    `min_pixels` valid reference pixels, the offset is 0.
+
+    Args:
+        dnbr (np.ndarray): The (y, x) dNBR.
+        reference_mask (np.ndarray): Boolean (y, x) mask of the reference pixels.
+        min_pixels (int, optional): Minimum number of valid reference pixels. Defaults to `OFFSET_RING_MIN_PIXELS`.
+
+    Returns:
+        dict: The dNBR offset, the median absolute deviation of the reference dNBR, and the number
+            of valid reference pixels.
+    """
+    reference_dnbr = np.asarray(dnbr)[np.asarray(reference_mask)]
+    reference_dnbr = reference_dnbr[np.isfinite(reference_dnbr)]
+
+    n_reference_pixels = int(reference_dnbr.size)
+    if n_reference_pixels == 0:
+        median = mad = np.nan
+    else:
+        median = float(np.median(reference_dnbr))
+        mad = float(np.median(np.abs(reference_dnbr - median)))
+
+    if n_reference_pixels < min_pixels:
+        print(
+            f"Only {n_reference_pixels} valid reference pixels for the dNBR offset, not offsetting"
+        )
+        median = 0.0
+
+    return {
+        "dnbr_offset": median,
+        "dnbr_offset_mad": mad,
+        "n_reference_pixels": n_reference_pixels,
+    }
+
+
+def calc_burn_metrics(
+    prefire_nir,
+    prefire_swir,
+    postfire_nir,
+    postfire_swir,
+    dtype=DEFAULT_DTYPE,
+    reference_mask=None,
+    min_reference_pixels=OFFSET_RING_MIN_PIXELS,
+):
+    """
+    Get the NBR, dNBR, rdNBR, and rBR from the pre- and post-fire NIR and SWIR bands. All five are
+    calculated by a single fused kernel, which reads each band once and writes every metric
+    straight into a preallocated `burn_metric` stack (blockwise, if the bands are dask-backed),
+    rather than allocating a temporary per expression and copying them all into a new stack.
+
+    Given a `reference_mask` of unburned pixels, the metrics are of offset dNBR: the median dNBR of
+    the reference pixels (see `calc_dnbr_offset`) is subtracted from the dNBR, and the rdNBR and rBR
+    are derived from the offset dNBR. The offset is taken from the computed stack, and the metrics
+    are refilled from its NBR slots, so the bands are still only read once. The offset statistics
+    are kept in the attributes of the stack.
+
+    Args:
+        prefire_nir (xr.DataArray): Pre-fire NIR.
+        prefire_swir (xr.DataArray): Pre-fire SWIR.
+        postfire_nir (xr.DataArray): Post-fire NIR.
+        postfire_swir (xr.DataArray): Post-fire SWIR.
+        dtype (str, optional): Dtype to calculate the metrics in. Defaults to `DEFAULT_DTYPE`.
+        reference_mask (xr.DataArray or np.ndarray, optional): Boolean (y, x) mask of unburned reference pixels,
+            to offset the dNBR by. As the bands are aligned on the coordinates they share, a DataArray mask is
+            aligned to them too (outside it, pixels aren't reference pixels), while an array must already be
+            on their aligned grid. Defaults to None, for no offset.
+        min_reference_pixels (int, optional): Minimum number of valid reference pixels to offset by. Defaults to
+            `OFFSET_RING_MIN_PIXELS`.
+
+    Returns:
+        xr.DataArray: Stack of NBR, dNBR, rdNBR, and rBR.
+    """
+    burn_metrics = _map_burn_metrics(
+        _burn_metrics_block,
+        [prefire_nir, prefire_swir, postfire_nir, postfire_swir],
+        dtype,
+    )
+    if reference_mask is None:
+        return burn_metrics
+
+    dnbr = burn_metrics.sel(burn_metric="dnbr")
+    if isinstance(reference_mask, xr.DataArray):
+        reference_mask = reference_mask.reindex_like(dnbr, fill_value=False).values
+    elif np.shape(reference_mask) != dnbr.shape:
+        raise ValueError(
+            f"Reference mask of shape {np.shape(reference_mask)} isn't on the grid of the "
+            f"aligned bands, of shape {dnbr.shape}"
+        )
+
+    if dask.is_dask_collection(burn_metrics.data):
+        # Keep the computed blocks, so offsetting them doesn't recompute them from the bands
+        burn_metrics = burn_metrics.persist()
+        dnbr_offset = calc_dnbr_offset(
+            burn_metrics.sel(burn_metric="dnbr").values,
+            reference_mask,
+            min_pixels=min_reference_pixels,
+        )
+        burn_metrics = burn_metrics.copy(
+            data=burn_metrics.data.map_blocks(
+                lambda block: _fill_burn_metrics_from_nbr(
+                    block.copy(), dnbr_offset=dnbr_offset["dnbr_offset"]
+                ),
+                dtype=dtype,
+            )
+        )
+    else:
+        dnbr_offset = calc_dnbr_offset(
+            burn_metrics.sel(burn_metric="dnbr").values,
+            reference_mask,
+            min_pixels=min_reference_pixels,
+        )
+        _fill_burn_metrics_from_nbr(
+            burn_metrics.values, dnbr_offset=dnbr_offset["dnbr_offset"]
+        )
+
+    burn_metrics.attrs.update(dnbr_offset)
+    return burn_metrics
+
+
+def calc_burn_metrics_from_nbr(nbr_prefire, nbr_postfire, dtype=DEFAULT_DTYPE):
+    """
+    Get the NBR, dNBR, rdNBR, and rBR from the pre- and post-fire NBR, e.g. to refresh the postfire
+    metrics of an existing metrics stack without recomputing its prefire composite.
+
+    Args:
+        nbr_prefire (xr.DataArray): Pre-fire NBR.
+        nbr_postfire (xr.DataArray): Post-fire NBR.
+        dtype (str, optional): Dtype to calculate the metrics in. Defaults to `DEFAULT_DTYPE`.
+
+    Returns:
+        xr.DataArray: Stack of NBR, dNBR, rdNBR, and rBR.
+    """
+    return _map_burn_metrics(
+        _burn_metrics_from_nbr_block, [nbr_prefire, nbr_postfire], dtype
+    )
+
+
+def dtype_accuracy_report(
+    prefire_nir, prefire_swir, postfire_nir, postfire_swir, dtype=DEFAULT_DTYPE
+):
+    """
+    Compare burn metrics calculated in the given dtype against a float64 reference, to quantify
+    the precision we give up by calculating in a narrower dtype.
+
+    Args:
+        prefire_nir (xr.DataArray): Pre-fire NIR.
+        prefire_swir (xr.DataArray): Pre-fire SWIR.
+        postfire_nir (xr.DataArray): Post-fire NIR.
+        postfire_swir (xr.DataArray): Post-fire SWIR.
+        dtype (str, optional): Dtype to compare against float64. Defaults to `DEFAULT_DTYPE`.
+
+    Returns:
+        pd.DataFrame: Per burn metric, the max and mean absolute error and the max relative error
+            (ignoring pixels which are NaN in the reference), and whether NaNs agree between the two.
+    """
+    bands = [prefire_nir, prefire_swir, postfire_nir, postfire_swir]
+    reference = calc_burn_metrics(*bands, dtype="float64")
+    candidate = calc_burn_metrics(*bands, dtype=dtype)
+
+    rows = []
+    for burn_metric in reference.burn_metric.values:
+        reference_values = reference.sel(burn_metric=burn_metric).values
+        candidate_values = candidate.sel(burn_metric=burn_metric).values.astype(
+            "float64"
+        )
+        valid = ~np.isnan(reference_values)
+        abs_error = np.abs(candidate_values[valid] - reference_values[valid])
+        rel_error = abs_error / np.maximum(np.abs(reference_values[valid]), 1e-12)
+        rows.append(
+            {
+                "burn_metric": burn_metric,
+                "dtype": str(np.dtype(dtype)),
+                "max_abs_error": abs_error.max() if abs_error.size else 0.0,
+                "mean_abs_error": abs_error.mean() if abs_error.size else 0.0,
+                "max_rel_error": rel_error.max() if rel_error.size else 0.0,
+                "nan_agreement": bool(
+                    np.array_equal(np.isnan(reference_values), np.isnan(candidate_values))
+                ),
+            }
+        )
+
+    return pd.DataFrame(rows).set_index("burn_metric")
+
+
+def _classify_burn_block(
+    values, sorted_thresholds, lookup, block_size=CLASSIFY_BLOCK_SIZE
+):
+    # Index of the first threshold each value is below, i.e. its class. NaN sorts after every
+    # threshold, so it lands past the last class, on nodata - as do values above every threshold.
+    # Pixels are classified a block at a time, so the class indices never take more than a
+    # block's worth of memory, on top of the uint8 output.
+    reclass = np.empty(np.shape(values), dtype=lookup.dtype)
+    flat_values = np.ravel(values)
+    flat_reclass = reclass.reshape(-1)
+    for start in range(0, flat_values.size, block_size):
+        block = slice(start, start + block_size)
+        class_indices = np.searchsorted(
+            sorted_thresholds, flat_values[block], side="right"
+        )
+        np.take(lookup, class_indices, out=flat_reclass[block])
+    return reclass
+
+
+def classify_burn(array, thresholds, nodata=CLASSIFICATION_NODATA):
+    """
+    Reclassify an array based on the given thresholds. Each pixel takes the value of the lowest
+    threshold it is below; pixels which are NaN, or not below any threshold, are set to `nodata`.
+    The class of every pixel is found by a single binary search over the sorted thresholds,
+    followed by a lookup of its value, rather than a pass over the array per threshold.
+
+    Args:
+        array (xr.DataArray): Input array (numpy or dask-backed).
+        thresholds (dict): Dictionary of thresholds and their corresponding values, which must be
+            integers in the range of uint8 (other than `nodata`).
+        nodata (int, optional): Value of unclassified pixels. Defaults to `CLASSIFICATION_NODATA`.
+
+    Returns:
+        xr.DataArray: Reclassified array, as uint8 with `nodata` as its fill value.
+    """
+    sorted_thresholds = sorted(thresholds)
+    values = [thresholds[threshold] for threshold in sorted_thresholds]
+    if any(
+        value != int(value) or not 0 <= value <= 255 or value == nodata
+        for value in values
+    ):
+        raise ValueError(
+            f"Class values must be integers in 0-255, other than {nodata}: {values}"
+        )
+
+    # Compare in the array's precision, as `array < threshold` would
+    threshold_dtype = array.dtype if array.dtype.kind == "f" else "float64"
+    sorted_thresholds = np.asarray(sorted_thresholds, dtype=threshold_dtype)
+    lookup = np.asarray(values + [nodata], dtype="uint8")
+
+    reclass = xr.apply_ufunc(
+        _classify_burn_block,
+        array,
+        kwargs={"sorted_thresholds": sorted_thresholds, "lookup": lookup},
+        dask="parallelized",
+        output_dtypes=["uint8"],
+    )
+    reclass.attrs["_FillValue"] = nodata
+
+    return reclass
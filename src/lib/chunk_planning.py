@@ -0,0 +1,96 @@
+import os
+import math
+import numpy as np
+
+# Total memory we are willing to hand to in-flight stack chunks, across all workers. Can be
+# overridden per deployment, since the prod instance and local dev machines differ wildly.
+STACK_MEMORY_BUDGET_BYTES = int(
+    os.environ.get("STACK_MEMORY_BUDGET_BYTES", 2 * 1024**3)
+)
+
+# Spatial chunk edges are kept to multiples of this, so chunks line up with the internal
+# tiling of the Sentinel-2 COGs and we don't read the same remote block for two chunks
+SPATIAL_CHUNK_MULTIPLE = 256
+MIN_SPATIAL_CHUNK = 256
+MAX_SPATIAL_CHUNK = 4096
+
+# Taking the median over time makes a sorted copy of each chunk and allocates the output,
+# so a chunk actually costs a few times its nominal size while it is being reduced
+REDUCTION_OVERHEAD_FACTOR = 3
+
+
+def plan_stack_chunks(
+    n_time,
+    n_bands,
+    height,
+    width,
+    dtype="float64",
+    memory_budget_bytes=STACK_MEMORY_BUDGET_BYTES,
+    n_workers=None,
+    overhead_factor=REDUCTION_OVERHEAD_FACTOR,
+    chunk_bands=False,
+):
+    """
+    Choose a dask chunk shape for a (time, band, y, x) stack that will immediately be reduced
+    over time. The time dimension is always kept in a single chunk (the median needs every pass
+    for a given pixel), bands are chunked individually (unless the reduction needs every band of a
+    pixel, e.g. to derive per-pass NBR), and the spatial chunk edge is the largest
+    multiple of `SPATIAL_CHUNK_MULTIPLE` that keeps each worker's in-flight chunk within its share
+    of the memory budget. Small AOIs collapse to a single spatial chunk, so we don't pay scheduler
+    overhead for fires that fit comfortably in memory.
+
+    Args:
+        n_time (int): Number of items (passes) in the stack.
+        n_bands (int): Number of bands in the stack.
+        height (int): Height of the AOI, in pixels at the stack resolution.
+        width (int): Width of the AOI, in pixels at the stack resolution.
+        dtype (str or np.dtype, optional): Dtype of the stack. Defaults to "float64" (the stackstac default).
+        memory_budget_bytes (int, optional): Memory budget shared across all workers. Defaults to `STACK_MEMORY_BUDGET_BYTES`.
+        n_workers (int, optional): Number of chunks reduced concurrently. Defaults to the number of CPUs.
+        overhead_factor (float, optional): Multiplier on the nominal chunk size to account for temporaries
+            created during the reduction. Defaults to `REDUCTION_OVERHEAD_FACTOR`.
+        chunk_bands (bool, optional): Whether to keep every band in the same chunk. Defaults to False.
+
+    Returns:
+        dict: The chunk plan, including the `chunksize` tuple to hand to `stackstac.stack`, along with
+            the number of chunks, the nominal and estimated peak bytes per chunk, and the inputs used
+            to derive them (so the plan can be reported alongside the job).
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    itemsize = np.dtype(dtype).itemsize
+    height = max(int(height), 1)
+    width = max(int(width), 1)
+    n_time = max(int(n_time), 1)
+
+    bands_per_chunk = n_bands if chunk_bands else 1
+
+    per_worker_budget = memory_budget_bytes / n_workers
+    bytes_per_pixel = n_time * bands_per_chunk * itemsize * overhead_factor
+    max_chunk_pixels = per_worker_budget / bytes_per_pixel
+
+    chunk_edge = int(math.sqrt(max_chunk_pixels))
+    chunk_edge = (chunk_edge // SPATIAL_CHUNK_MULTIPLE) * SPATIAL_CHUNK_MULTIPLE
+    chunk_edge = min(max(chunk_edge, MIN_SPATIAL_CHUNK), MAX_SPATIAL_CHUNK)
+
+    chunk_height = min(chunk_edge, height)
+    chunk_width = min(chunk_edge, width)
+
+    n_chunks = (
+        (n_bands // bands_per_chunk)
+        * math.ceil(height / chunk_height)
+        * math.ceil(width / chunk_width)
+    )
+    chunk_bytes = n_time * bands_per_chunk * chunk_height * chunk_width * itemsize
+    peak_chunk_bytes = int(chunk_bytes * overhead_factor)
+
+    return {
+        "chunksize": (-1, bands_per_chunk, chunk_height, chunk_width),
+        "stack_shape": [n_time, n_bands, height, width],
+        "dtype": str(np.dtype(dtype)),
+        "n_chunks": n_chunks,
+        "chunk_bytes": chunk_bytes,
+        "peak_chunk_bytes": peak_chunk_bytes,
+        "n_workers": n_workers,
+        "memory_budget_bytes": memory_budget_bytes,
+        "exceeds_budget": peak_chunk_bytes > per_worker_budget,
+    }
@@ -0,0 +1,159 @@
+import os
+import warnings
+from datetime import datetime, timezone
+import numpy as np
+import xarray as xr
+from src.lib.resilient_compute import retry_with_backoff
+from src.lib.scene_screening import CLOUDY_SCL_CLASSES, SCL_NODATA
+
+COMPOSITE_COVERAGE_TARGET = float(os.environ.get("COMPOSITE_COVERAGE_TARGET", 0.99))
+COMPOSITE_MIN_OBSERVATIONS = int(os.environ.get("COMPOSITE_MIN_OBSERVATIONS", 1))
+# Penalty of each day between a scene and the target date, in percent cloud cover
+COMPOSITE_DAYS_WEIGHT = float(os.environ.get("COMPOSITE_DAYS_WEIGHT", 1.0))
+
+
+def order_items_by_quality(
+    items, target_date, days_weight=COMPOSITE_DAYS_WEIGHT, cloud_cover=None
+):
+    """
+    Order items by predicted quality, best first - the fewer clouds, and the closer to the
+    target date (e.g. ignition for prefire, containment for postfire), the better. Each item is
+    scored by its cloud cover (percent) plus `days_weight` per day away from the target date.
+
+    Args:
+        items (list): List of Sentinel items.
+        target_date (str): The target date, as `YYYY-MM-DD`.
+        days_weight (float, optional): Penalty per day from the target date, in percent cloud cover.
+            Defaults to `COMPOSITE_DAYS_WEIGHT`.
+        cloud_cover (dict, optional): Cloud cover (percent) of items over the AOI, keyed by item id. Items
+            not in it fall back to their scene-level `eo:cloud_cover`. Defaults to None.
+
+    Returns:
+        list: The items, best first.
+    """
+    cloud_cover = cloud_cover or {}
+    target = datetime.fromisoformat(target_date).replace(tzinfo=timezone.utc)
+
+    def score(item):
+        item_cloud_cover = cloud_cover.get(
+            item.id, item.properties.get("eo:cloud_cover", 100)
+        )
+        days_from_target = abs((item.datetime - target).total_seconds()) / 86400
+        return item_cloud_cover + days_weight * days_from_target
+
+    return sorted(items, key=score)
+
+
+def greedy_composite(
+    stack,
+    aoi_mask,
+    coverage_target=COMPOSITE_COVERAGE_TARGET,
+    min_observations=COMPOSITE_MIN_OBSERVATIONS,
+    scl_band=None,
+    drop_failed_items=False,
+):
+    """
+    Composite a stack scene by scene, in the order given, filling each AOI pixel with the first
+    `min_observations` clear observations it gets, and stop reading scenes as soon as
+    `coverage_target` of the AOI pixels are filled. An observation is clear if it is valid (non-NaN
+    in every band) and, with an `scl_band`, its scene classification isn't cloud or cloud shadow
+    (`CLOUDY_SCL_CLASSES`) or no data. Pixels with several observations take their median. With the
+    scenes ordered best first (see `order_items_by_quality`), one or two clear scenes usually cover
+    the AOI, so most of the stack is never read.
+
+    Args:
+        stack (xr.DataArray): The lazily-read (time, band, y, x) stack, chunked one scene per chunk.
+        aoi_mask (np.ndarray): Boolean (y, x) mask of the pixels within the AOI.
+        coverage_target (float, optional): Fraction of AOI pixels to fill before stopping.
+            Defaults to `COMPOSITE_COVERAGE_TARGET`.
+        min_observations (int, optional): Number of observations to fill each pixel with. Defaults to
+            `COMPOSITE_MIN_OBSERVATIONS`.
+        scl_band (str, optional): Band of the stack holding the scene classification (SCL), to mask
+            clouds and shadows with. It is left out of the composite. Defaults to None, for no masking.
+        drop_failed_items (bool, optional): Whether to skip scenes whose reads persistently fail,
+            rather than failing the composite. Defaults to False.
+
+    Returns:
+        tuple: The (band, y, x) composite xr.DataArray, and a dict with the number of scenes read,
+            the number of scenes available, the AOI coverage reached and the ids of any dropped items.
+    """
+    n_scenes = stack.sizes["time"]
+    band_names = list(stack["band"].values)
+    value_bands = [band for band in band_names if band != scl_band]
+    value_band_indices = [band_names.index(band) for band in value_bands]
+    n_bands, height, width = len(value_bands), stack.sizes["y"], stack.sizes["x"]
+    n_aoi_pixels = max(int(aoi_mask.sum()), 1)
+
+    observations = np.full(
+        (min_observations, n_bands, height, width), np.nan, dtype=stack.dtype
+    )
+    n_observations = np.zeros((height, width), dtype=np.int32)
+
+    n_scenes_read = 0
+    dropped_items = []
+    coverage = 0.0
+    for time_index in range(n_scenes):
+        description = f"scene {time_index} of composite"
+        try:
+            scene = retry_with_backoff(
+                stack.isel(time=time_index).compute, description=description
+            ).values
+        except Exception as e:
+            if not drop_failed_items:
+                raise
+            item_id = (
+                str(stack["id"].values[time_index])
+                if "id" in stack.coords
+                else str(time_index)
+            )
+            print(f"Persistent failure of {description} ({e}), treating it as missing")
+            dropped_items.append(item_id)
+            continue
+        n_scenes_read += 1
+
+        # Fill pixels with clear data which still need observations
+        clear = np.isfinite(scene[value_band_indices]).all(axis=0)
+        if scl_band is not None:
+            scl = scene[band_names.index(scl_band)]
+            clear &= np.isfinite(scl) & (scl != SCL_NODATA)
+            clear &= ~np.isin(scl, CLOUDY_SCL_CLASSES)
+        fill_y, fill_x = np.nonzero(clear & (n_observations < min_observations))
+        observations[n_observations[fill_y, fill_x], :, fill_y, fill_x] = scene[
+            value_band_indices
+        ][:, fill_y, fill_x].T
+        n_observations[fill_y, fill_x] += 1
+
+        coverage = (
+            np.count_nonzero((n_observations >= min_observations) & aoi_mask)
+            / n_aoi_pixels
+        )
+        if coverage >= coverage_target:
+            break
+
+    print(
+        f"Composited {n_scenes_read} of {n_scenes} scenes, reaching {coverage:.1%} AOI coverage"
+    )
+
+    if min_observations == 1:
+        composite_values = observations[0]
+    else:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)  # All-NaN pixels
+            composite_values = np.nanmedian(observations, axis=0)
+
+    value_stack = stack.isel(band=value_band_indices)
+    coords = {
+        name: coord
+        for name, coord in value_stack.coords.items()
+        if "time" not in coord.dims
+    }
+    composite = xr.DataArray(
+        composite_values, dims=("band", "y", "x"), coords=coords, attrs=stack.attrs
+    )
+
+    return composite, {
+        "n_scenes_read": n_scenes_read,
+        "n_scenes": n_scenes,
+        "coverage": coverage,
+        "dropped_items": sorted(dropped_items),
+    }
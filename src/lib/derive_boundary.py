@@ -1,11 +1,81 @@
+import os
 import xarray as xr
-from scipy.ndimage import binary_fill_holes, gaussian_filter, binary_dilation
-from skimage.filters import threshold_otsu
-from skimage.segmentation import flood_fill, clear_border
+from concurrent.futures import ThreadPoolExecutor
+from scipy.ndimage import (
+    gaussian_filter,
+    gaussian_filter1d,
+    binary_dilation,
+    generate_binary_structure,
+    label,
+    maximum_filter,
+    minimum_filter,
+)
+from skimage.filters import threshold_otsu, threshold_multiotsu
+from skimage.segmentation import clear_border
 from ..util.raster_to_poly import raster_mask_to_geojson
 from abc import ABC, abstractmethod
 import numpy as np
 
+# Number of bins of the histogram of a metric, from which Otsu thresholds are found
+OTSU_HISTOGRAM_BINS = int(os.environ.get("OTSU_HISTOGRAM_BINS", 1024))
+# Number of rows of the metric read at a time when building its histogram
+HISTOGRAM_CHUNK_ROWS = int(os.environ.get("HISTOGRAM_CHUNK_ROWS", 512))
+# Size (in pixels, along y and x) of the tiles burn masks are post-processed in, and the number
+# of tiles processed at once
+POSTPROCESS_TILE_SIZE = int(os.environ.get("POSTPROCESS_TILE_SIZE", 1024))
+POSTPROCESS_MAX_WORKERS = int(os.environ.get("POSTPROCESS_MAX_WORKERS", 4))
+# Decimation factor of the coarse pass of coarse-to-fine boundary derivation, the buffer (in full
+# resolution pixels) around the coarse boundary which is re-derived at full resolution, and the size
+# of the full resolution tiles it is re-derived in
+COARSE_TO_FINE_FACTOR = int(os.environ.get("COARSE_TO_FINE_FACTOR", 4))
+COARSE_TO_FINE_EDGE_BUFFER = int(os.environ.get("COARSE_TO_FINE_EDGE_BUFFER", 16))
+COARSE_TO_FINE_TILE_SIZE = int(os.environ.get("COARSE_TO_FINE_TILE_SIZE", 512))
+
+
+def metric_histogram(
+    values, mask=None, n_bins=OTSU_HISTOGRAM_BINS, chunk_rows=HISTOGRAM_CHUNK_ROWS
+):
+    """
+    Get the histogram of the finite values of a metric within a mask (e.g. the AOI), streaming over
+    strips of rows - once for the range of the values, and once to count them - so the metric can
+    be memory-mapped or lazy (e.g. dask) without being loaded whole.
+
+    Args:
+        values (np.ndarray or dask.array.Array): The metric, with the (y, x) dims last.
+        mask (np.ndarray, optional): Which values to count, with the shape of `values`. Defaults to all
+            finite values.
+        n_bins (int, optional): Number of bins. Defaults to `OTSU_HISTOGRAM_BINS`.
+        chunk_rows (int, optional): Number of rows read at a time. Defaults to `HISTOGRAM_CHUNK_ROWS`.
+
+    Returns:
+        dict: The counts of each bin, and the bin edges.
+    """
+
+    def strips():
+        for row_start in range(0, values.shape[-2], chunk_rows):
+            strip = np.asarray(values[..., row_start : row_start + chunk_rows, :])
+            valid = np.isfinite(strip)
+            if mask is not None:
+                valid &= np.asarray(mask[..., row_start : row_start + chunk_rows, :])
+            yield strip[valid]
+
+    low, high = np.inf, -np.inf
+    for strip in strips():
+        if strip.size:
+            low, high = min(low, float(strip.min())), max(high, float(strip.max()))
+    if low > high:
+        raise ValueError("No valid values to build a histogram from")
+    if high == low:
+        high = low + 1.0
+
+    counts = np.zeros(n_bins, dtype="int64")
+    bin_edges = np.linspace(low, high, n_bins + 1)
+    for strip in strips():
+        strip_counts, __bin_edges = np.histogram(strip, bins=bin_edges)
+        counts += strip_counts
+
+    return {"counts": counts, "bin_edges": bin_edges}
+
 
 ## THRESHOLDING STRATEGIES
 class ThresholdingStrategy(ABC):
@@ -33,6 +103,64 @@ class OtsuThreshold(ThresholdingStrategy):
         return metric_layer
 
 
+class HistogramOtsuThreshold(ThresholdingStrategy):
+    """
+    Otsu (or, with more than two classes, multi-Otsu) thresholding of a metric from the histogram
+    of its values within the AOI (see `metric_histogram`), rather than from every value of the
+    array - so NaNs, and whatever they were filled with outside the AOI, don't skew the threshold.
+    The histogram is built on the first call and kept, so later refinements of the same fire can
+    reuse it (pass it back in, e.g. from a cache) rather than passing over the metric again.
+
+    Args:
+        n_classes (int, optional): Number of classes to split the values into. Pixels above the lowest
+            threshold (i.e. all but the lowest class) are disturbed. Defaults to 2.
+        n_bins (int, optional): Number of histogram bins. Defaults to `OTSU_HISTOGRAM_BINS`.
+        histogram (dict, optional): A histogram of the metric already built by `metric_histogram`. Defaults to None.
+
+    Attributes:
+        thresholds (list): The thresholds of the last call.
+    """
+
+    def __init__(self, n_classes=2, n_bins=OTSU_HISTOGRAM_BINS, histogram=None):
+        self.n_classes = n_classes
+        self.n_bins = n_bins
+        self.histogram = histogram
+        self.thresholds = None
+
+    def apply(self, metric_layer):
+        # The values within the AOI, as recorded by `derive_boundary` before it fills NaNs
+        if "aoi" in metric_layer.coords:
+            aoi_mask = metric_layer["aoi"].values
+        else:
+            aoi_mask = np.isfinite(metric_layer.values)
+
+        if self.histogram is None:
+            self.histogram = metric_histogram(
+                metric_layer.data, mask=aoi_mask, n_bins=self.n_bins
+            )
+        counts = self.histogram["counts"]
+        bin_edges = self.histogram["bin_edges"]
+        bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+
+        if self.n_classes == 2:
+            self.thresholds = [float(threshold_otsu(hist=(counts, bin_centers)))]
+        else:
+            self.thresholds = threshold_multiotsu(
+                classes=self.n_classes, hist=(counts, bin_centers)
+            ).tolist()
+
+        if "disturbed" in metric_layer.coords:
+            metric_layer = metric_layer.drop("disturbed")
+
+        metric_layer["disturbed"] = xr.DataArray(
+            (metric_layer.values > self.thresholds[0]) & aoi_mask,
+            dims=metric_layer.dims,
+            coords=metric_layer.coords,
+        )
+
+        return metric_layer
+
+
 class SimpleThreshold(ThresholdingStrategy):
     def __init__(self, threshold=0.5):
         self.threshold = threshold
@@ -57,34 +185,29 @@ class SegmentationStrategy(ABC):
 
 class FloodFillSegmentation(SegmentationStrategy):
     def apply(self, metric_layer):
-        disturbed_layer_int = metric_layer["disturbed"].values.astype(np.int8)[0, :, :]
+        disturbed_layer = metric_layer["disturbed"].values.astype(np.int8)[0, :, :] != 0
         seed_locations_x, seed_locations_y = np.where(
             metric_layer["seed"].values[0, :, :]
         )
-        seed_locations = list(zip(seed_locations_x, seed_locations_y))
-
-        segmented_burns = np.full_like(disturbed_layer_int, fill_value=False)
-        for seed_point in seed_locations:
-
-            # Skimage needs the seed point as a tuple, for some reason
-            print(f"Processing seed point: {seed_point}")
 
-            # Skip if the seed point is not in the burn boundary, so we don't
-            # get the negative space of the burn boundary
-            if disturbed_layer_int[seed_point] == 0:
-                continue
+        # Label the connected burns once (8-connected, as skimage's flood fill is by default),
+        # rather than flood filling the whole raster from each seed point in turn. The burns
+        # which contain a seed point are then the union of the flood fills from every seed, at
+        # a cost independent of the number of seed points.
+        burn_labels, n_burns = label(
+            disturbed_layer, structure=np.ones((3, 3), dtype=bool)
+        )
+        print(f"Selecting burns from {len(seed_locations_x)} seed points")
 
-            # Flood fill the burn boundary from the seed point, and combine with
-            # the existing segmented burns from other seed points
-            burn_boundary_segmented = flood_fill(
-                image=disturbed_layer_int,
-                seed_point=seed_point,
-                new_value=True,
-            )
-            segmented_burns = np.logical_or(segmented_burns, burn_boundary_segmented)
+        # Seed points outside of the burn boundary land on label 0, which is never selected, so
+        # we don't get the negative space of the burn boundary
+        seeded_burns = np.zeros(n_burns + 1, dtype=bool)
+        seeded_burns[burn_labels[seed_locations_x, seed_locations_y]] = True
+        seeded_burns[0] = False
+        segmented_burns = seeded_burns[burn_labels]
 
         metric_layer["disturbed"] = xr.DataArray(
-            [segmented_burns.astype(bool)],
+            [segmented_burns],
             dims=metric_layer.dims,
             coords=metric_layer.coords,
         )
@@ -95,14 +218,45 @@ def derive_boundary(
     metric_layer,
     thresholding_strategy=OtsuThreshold(),
     segmentation_strategy=FloodFillSegmentation(),
+    coarse_factor=None,
+    edge_buffer_pixels=COARSE_TO_FINE_EDGE_BUFFER,
 ):
+    """
+    Derive the boundary of a burn from a metric layer - threshold it, post-process the burn mask,
+    segment the burns (e.g. those with seed points) and polygonize them.
+
+    With a `coarse_factor`, the boundary is derived coarse to fine: first on the metric layer
+    decimated by the factor, then again at full resolution only within `edge_buffer_pixels` of the
+    coarse boundary, which is where the full resolution boundary is decided (see
+    `_segment_coarse_to_fine`).
+
+    Args:
+        metric_layer (xr.DataArray): The metric layer, with `seed` points for segmentation.
+        thresholding_strategy (ThresholdingStrategy, optional): How to threshold the metric. Defaults to `OtsuThreshold()`.
+        segmentation_strategy (SegmentationStrategy, optional): How to segment the burns. Defaults to `FloodFillSegmentation()`.
+        coarse_factor (int, optional): Decimation factor of the coarse pass. Defaults to None, to derive the
+            boundary at full resolution throughout.
+        edge_buffer_pixels (int, optional): Buffer around the coarse boundary which is re-derived at full
+            resolution, in pixels. Defaults to `COARSE_TO_FINE_EDGE_BUFFER`.
+
+    Returns:
+        dict: GeoJSON of the boundary, or None if there is no burn.
+    """
 
     ## TODO: Some part of the spectral index process is creating a buffer of NaN
     ## at the outside edge of the metric layer - not an issue to replace with 0 in this case
     ## but zeros inside the image will be erroneously identified as unburned islands which is
     ## a big problem.
     metric_values_exist_binary = np.where(np.isnan(metric_layer.values), 0, 1)
-    interior_nan_filled = binary_fill_holes(metric_values_exist_binary)
+
+    # Keep track of which values are within the AOI, for thresholding strategies which only
+    # consider those (the NaNs outside are filled below)
+    metric_layer["aoi"] = xr.DataArray(
+        metric_values_exist_binary.astype(bool),
+        dims=metric_layer.dims,
+        coords=metric_layer.coords,
+    )
+    interior_nan_filled = fill_mask_holes(metric_values_exist_binary)
     no_interior_nan_detected = np.array_equal(
         interior_nan_filled, metric_values_exist_binary
     )
@@ -122,41 +276,444 @@ def derive_boundary(
         # later we may need to be robust to this
         raise ValueError("NaN values within interior of metric layer")
 
+    if coarse_factor and coarse_factor > 1:
+        segmented_burns = _segment_coarse_to_fine(
+            metric_layer,
+            thresholding_strategy,
+            segmentation_strategy,
+            coarse_factor,
+            edge_buffer_pixels,
+        )
+        metric_layer["disturbed"] = xr.DataArray(
+            segmented_burns, dims=metric_layer.dims, coords=metric_layer.coords
+        )
+        burn_boundary_raster_segmented = metric_layer
+    else:
+        burn_boundary_raster_segmented, __disturbed = _segment(
+            metric_layer, thresholding_strategy, segmentation_strategy
+        )
+
+    burn_boundary_polygon = raster_mask_to_geojson(
+        burn_boundary_raster_segmented["disturbed"]
+    )
+
+    return burn_boundary_polygon
+
+
+def _segment(metric_layer, thresholding_strategy, segmentation_strategy):
+    # Threshold, post-process and segment a metric layer, also returning the burn mask before
+    # segmentation
     burn_boundary_raster = thresholding_strategy.apply(metric_layer)
 
     burn_boundary_raster_postprocessed = postprocess_burn_mask(
         burn_boundary_raster, fill_holes=True, smooth_sigma=1, buffer_iterations=1
     )
+    disturbed = burn_boundary_raster_postprocessed["disturbed"].values.copy()
 
     burn_boundary_raster_segmented = segmentation_strategy.apply(
         burn_boundary_raster_postprocessed
     )
+    return burn_boundary_raster_segmented, disturbed
+
+
+def _coarsen_metric_layer(metric_layer, factor):
+    # The mean of the values within the AOI of each block of `factor` pixels (0 outside the
+    # AOI, as `derive_boundary` fills it), with a block in the AOI if any of its pixels are, and
+    # a seed point if any of its pixels are
+    values = metric_layer.values
+    n_rows, n_cols = values.shape[-2:]
+    n_block_rows, n_block_cols = -(-n_rows // factor), -(-n_cols // factor)
+    pad_width = [(0, 0)] * (values.ndim - 2) + [
+        (0, n_block_rows * factor - n_rows),
+        (0, n_block_cols * factor - n_cols),
+    ]
+    block_shape = values.shape[:-2] + (n_block_rows, factor, n_block_cols, factor)
+
+    def blocks(array):
+        return np.pad(array, pad_width).reshape(block_shape)
+
+    aoi_blocks = blocks(metric_layer["aoi"].values)
+    counts = aoi_blocks.sum(axis=(-3, -1))
+    sums = np.where(aoi_blocks, blocks(values), 0).sum(axis=(-3, -1))
+    coarse_values = np.where(counts > 0, sums / np.maximum(counts, 1), 0)
+
+    def block_centers(coords, n_blocks):
+        spacing = coords[1] - coords[0] if len(coords) > 1 else 1.0
+        return coords[0] + (np.arange(n_blocks) * factor + (factor - 1) / 2) * spacing
+
+    coarse_layer = xr.DataArray(
+        coarse_values,
+        dims=metric_layer.dims,
+        coords={
+            "y": block_centers(metric_layer.y.values, n_block_rows),
+            "x": block_centers(metric_layer.x.values, n_block_cols),
+        },
+    )
+    coarse_layer["aoi"] = xr.DataArray(
+        counts > 0, dims=coarse_layer.dims, coords=coarse_layer.coords
+    )
+    if "seed" in metric_layer.coords:
+        coarse_layer["seed"] = xr.DataArray(
+            blocks(metric_layer["seed"].values).any(axis=(-3, -1)),
+            dims=coarse_layer.dims,
+            coords=coarse_layer.coords,
+        )
+    return coarse_layer
 
-    burn_boundary_polygon = raster_mask_to_geojson(
-        burn_boundary_raster_segmented["disturbed"]
+
+def _segment_coarse_to_fine(
+    metric_layer,
+    thresholding_strategy,
+    segmentation_strategy,
+    coarse_factor,
+    edge_buffer_pixels,
+    tile_size=COARSE_TO_FINE_TILE_SIZE,
+):
+    """
+    Segment the burns of a (NaN filled) metric layer coarse to fine. The burns are first segmented
+    on the layer decimated by `coarse_factor`. The coarse result is kept as is away from its
+    boundary, while the band within `edge_buffer_pixels` of it is thresholded and segmented again at
+    full resolution, in tiles (with a halo of the buffer, for context). Within each tile, the coarse
+    burns selected by segmentation seed the full resolution segmentation alongside the original
+    seed points, so a burn which is selected at coarse resolution stays selected at its edges.
+
+    The threshold must be the same in every tile, so thresholding is by `SimpleThreshold`, or by
+    `HistogramOtsuThreshold` with its histogram built once, of the full resolution layer.
+
+    Args:
+        metric_layer (xr.DataArray): The NaN filled metric layer, with its `aoi`.
+        thresholding_strategy (ThresholdingStrategy): How to threshold the metric.
+        segmentation_strategy (SegmentationStrategy): How to segment the burns.
+        coarse_factor (int): Decimation factor of the coarse pass.
+        edge_buffer_pixels (int): Buffer around the coarse boundary which is re-derived at full resolution.
+        tile_size (int, optional): Size of the full resolution tiles. Defaults to `COARSE_TO_FINE_TILE_SIZE`.
+
+    Returns:
+        np.ndarray: The segmented burns, at full resolution.
+    """
+    if isinstance(thresholding_strategy, OtsuThreshold):
+        raise ValueError(
+            "Coarse-to-fine boundaries need the same threshold in every tile - use "
+            "HistogramOtsuThreshold rather than OtsuThreshold"
+        )
+    if (
+        isinstance(thresholding_strategy, HistogramOtsuThreshold)
+        and thresholding_strategy.histogram is None
+    ):
+        thresholding_strategy.histogram = metric_histogram(
+            metric_layer.values,
+            mask=metric_layer["aoi"].values,
+            n_bins=thresholding_strategy.n_bins,
+        )
+
+    print(f"Deriving coarse boundary, decimated by {coarse_factor}")
+    coarse_segmented, coarse_disturbed = _segment(
+        _coarsen_metric_layer(metric_layer, coarse_factor),
+        thresholding_strategy,
+        segmentation_strategy,
     )
+    coarse_segmented = coarse_segmented["disturbed"].values
+
+    # The coarse pixels within the buffer of the coarse boundary, i.e. whose neighborhood has
+    # both segmented and unsegmented pixels
+    buffer_blocks = -(-edge_buffer_pixels // coarse_factor)
+    neighborhood = (1,) * (coarse_segmented.ndim - 2) + (2 * buffer_blocks + 1,) * 2
+    coarse_segmented_uint8 = coarse_segmented.astype(np.uint8)
+    coarse_band = maximum_filter(
+        coarse_segmented_uint8, size=neighborhood
+    ) != minimum_filter(coarse_segmented_uint8, size=neighborhood)
+
+    n_rows, n_cols = metric_layer.shape[-2:]
+
+    def upsample(coarse):
+        return np.repeat(
+            np.repeat(coarse, coarse_factor, axis=-2), coarse_factor, axis=-1
+        )[..., :n_rows, :n_cols]
+
+    band = upsample(coarse_band)
+    segmented_burns = upsample(coarse_segmented)
+    disturbed = upsample(coarse_disturbed)
+    # Burns selected at coarse resolution, away from their boundary, seed the full resolution tiles
+    coarse_seeds = segmented_burns & ~band
+    print(f"Re-deriving {band.sum()} of {band.size} pixels at full resolution")
+
+    for row_start in range(0, n_rows, tile_size):
+        for col_start in range(0, n_cols, tile_size):
+            row_stop = min(row_start + tile_size, n_rows)
+            col_stop = min(col_start + tile_size, n_cols)
+            tile_band = band[..., row_start:row_stop, col_start:col_stop]
+            if not tile_band.any():
+                continue
 
-    return burn_boundary_polygon
+            halo_rows = slice(
+                max(row_start - edge_buffer_pixels, 0),
+                min(row_stop + edge_buffer_pixels, n_rows),
+            )
+            halo_cols = slice(
+                max(col_start - edge_buffer_pixels, 0),
+                min(col_stop + edge_buffer_pixels, n_cols),
+            )
+            tile_layer = metric_layer.isel(y=halo_rows, x=halo_cols).copy(deep=True)
+            if "disturbed" in tile_layer.coords:
+                tile_layer = tile_layer.drop("disturbed")
+
+            tile_layer = thresholding_strategy.apply(tile_layer)
+            tile_layer = postprocess_burn_mask(
+                tile_layer, fill_holes=True, smooth_sigma=1, buffer_iterations=1
+            )
+
+            # Full resolution within the band, and the coarse result around it
+            halo_band = band[..., halo_rows, halo_cols]
+            tile_layer["disturbed"] = xr.DataArray(
+                np.where(
+                    halo_band,
+                    tile_layer["disturbed"].values,
+                    disturbed[..., halo_rows, halo_cols],
+                ),
+                dims=tile_layer.dims,
+                coords=tile_layer.coords,
+            )
+            tile_seeds = coarse_seeds[..., halo_rows, halo_cols]
+            if "seed" in tile_layer.coords:
+                tile_seeds = tile_seeds | tile_layer["seed"].values
+            tile_layer["seed"] = xr.DataArray(
+                tile_seeds, dims=tile_layer.dims, coords=tile_layer.coords
+            )
+
+            tile_segmented = segmentation_strategy.apply(tile_layer)["disturbed"].values
+            tile_segmented = tile_segmented[
+                ...,
+                row_start - halo_rows.start : row_stop - halo_rows.start,
+                col_start - halo_cols.start : col_stop - halo_cols.start,
+            ]
+            tile_burns = segmented_burns[..., row_start:row_stop, col_start:col_stop]
+            tile_burns[tile_band] = tile_segmented[tile_band]
+
+    return segmented_burns
 
 
 def postprocess_burn_mask(
-    burn_mask, fill_holes=False, smooth_sigma=None, buffer_iterations=None
+    burn_mask,
+    fill_holes=False,
+    smooth_sigma=None,
+    buffer_iterations=None,
+    tile_size=POSTPROCESS_TILE_SIZE,
+    max_workers=POSTPROCESS_MAX_WORKERS,
 ):
+    """
+    Post-process a burn mask - fill its holes, smooth its boundary and buffer it. Boolean masks
+    (including any mask once its holes are filled) go through a fused pipeline on uint8 buffers
+    (see `postprocess_mask_values`), which gives exactly the result of running `binary_fill_holes`,
+    `gaussian_filter` and `binary_dilation` in turn, without float intermediates. Non-boolean values
+    that aren't hole filled are smoothed and buffered by those filters as before.
+
+    Args:
+        burn_mask (xr.DataArray): The burn mask.
+        fill_holes (bool, optional): Whether to fill holes in the mask. Defaults to False.
+        smooth_sigma (float, optional): Sigma of the gaussian smoothing of the boundary. Defaults to None.
+        buffer_iterations (int, optional): Number of iterations of buffering the boundary. Defaults to None.
+        tile_size (int, optional): Size of the tiles smoothing and buffering run in. Defaults to `POSTPROCESS_TILE_SIZE`.
+        max_workers (int, optional): Number of tiles processed at once. Defaults to `POSTPROCESS_MAX_WORKERS`.
+
+    Returns:
+        xr.DataArray: The post-processed burn mask.
+    """
     burn_mask_values = burn_mask.values
 
     # Fill holes in the burn mask
     if fill_holes:
-        burn_mask_values = binary_fill_holes(burn_mask_values)
+        burn_mask_values = fill_mask_holes(burn_mask_values)
+
+    if burn_mask_values.dtype == bool:
+        burn_mask_values = postprocess_mask_values(
+            burn_mask_values,
+            smooth_sigma=smooth_sigma,
+            buffer_iterations=buffer_iterations,
+            tile_size=tile_size,
+            max_workers=max_workers,
+        )
+    else:
+        # Smooth the boundary, removing small artifacts
+        if smooth_sigma:
+            burn_mask_values = gaussian_filter(burn_mask_values, sigma=smooth_sigma)
+
+        # Buffer the boundary to ensure it is continuous
+        if buffer_iterations:
+            burn_mask_values = binary_dilation(
+                burn_mask_values, iterations=buffer_iterations
+            )
+
+    burn_mask.values = burn_mask_values
+    return burn_mask
 
-    # Smooth the boundary, removing small artifacts
+
+def fill_mask_holes(values):
+    """
+    Fill the holes of a mask, as `scipy.ndimage.binary_fill_holes` does - background not connected
+    (along the axes) to the edge of the array is filled. Rather than propagating the background in
+    from the edge, which takes as many passes as its longest path, the background is labeled in one
+    pass, and the labels touching the edge are looked up.
+
+    Args:
+        values (np.ndarray): The mask (non-zero values are in the mask).
+
+    Returns:
+        np.ndarray: The boolean mask, with its holes filled.
+    """
+    mask = np.asarray(values) != 0
+    background_labels, n_backgrounds = label(
+        ~mask, structure=generate_binary_structure(mask.ndim, 1)
+    )
+
+    touches_edge = np.zeros(n_backgrounds + 1, dtype=bool)
+    for axis in range(mask.ndim):
+        touches_edge[np.take(background_labels, [0, -1], axis=axis)] = True
+    # Label 0 is the mask itself
+    touches_edge[0] = False
+
+    return ~touches_edge[background_labels]
+
+
+def _smoothing_radius(smooth_sigma):
+    # The radius scipy truncates the gaussian kernel at, by default
+    return int(4.0 * float(smooth_sigma) + 0.5)
+
+
+def _smoothing_keeps_full_windows(smooth_sigma):
+    # The gaussian of a boolean array is truncated back to boolean, so a pixel stays in the mask
+    # only if its whole window is - provided the kernel's weights sum to at least 1 in floating
+    # point, which is checked directly on a window
+    radius = _smoothing_radius(smooth_sigma)
+    return bool(
+        gaussian_filter1d(np.ones(2 * radius + 1, dtype=bool), sigma=smooth_sigma)[
+            radius
+        ]
+    )
+
+
+def _erode_axis(tile, radius, axis):
+    # The AND of each window of 2 * radius + 1 pixels along an axis, with the edges reflected
+    # (as scipy's "reflect" mode). Windows of doubling length are ANDed from the previous ones,
+    # and the window assembled from the lengths in its binary representation, so each axis takes
+    # a handful of whole-tile (GIL-releasing) numpy operations rather than one per pixel offset.
+    pad_width = [(0, 0)] * tile.ndim
+    pad_width[axis] = (radius, radius)
+    padded = np.pad(tile, pad_width, mode="symmetric")
+
+    def window(array, start, stop):
+        return array[(slice(None),) * axis + (slice(start, stop),)]
+
+    length = tile.shape[axis]
+    eroded, eroded_length = None, 0
+    run, run_length = padded, 1
+    remaining = 2 * radius + 1
+    while True:
+        if remaining & 1:
+            segment = window(run, eroded_length, eroded_length + length)
+            eroded = segment.copy() if eroded is None else eroded & segment
+            eroded_length += run_length
+        remaining >>= 1
+        if not remaining:
+            return eroded
+        run = window(run, 0, run.shape[axis] - run_length) & window(
+            run, run_length, run.shape[axis]
+        )
+        run_length *= 2
+
+
+def _postprocess_tile(values, smooth_sigma, buffer_iterations):
+    tile = values.view(np.uint8)
+
+    # Smoothing a boolean mask by a gaussian keeps only the pixels whose whole (square) window
+    # is in the mask, i.e. erodes it, with the edges of the array reflected
     if smooth_sigma:
-        burn_mask_values = gaussian_filter(burn_mask_values, sigma=smooth_sigma)
+        if not _smoothing_keeps_full_windows(smooth_sigma):
+            return np.zeros_like(values)
+        radius = _smoothing_radius(smooth_sigma)
+        for axis in range(tile.ndim):
+            tile = _erode_axis(tile, radius, axis)
 
-    # Buffer the boundary to ensure it is continuous
+    # Each buffer iteration adds the (axis-aligned) neighbors of the mask
     if buffer_iterations:
-        burn_mask_values = binary_dilation(
-            burn_mask_values, iterations=buffer_iterations
+        for __iteration in range(buffer_iterations):
+            buffered = tile.copy()
+            for axis in range(tile.ndim):
+                lower = [slice(None)] * tile.ndim
+                upper = [slice(None)] * tile.ndim
+                lower[axis], upper[axis] = slice(None, -1), slice(1, None)
+                buffered[tuple(lower)] |= tile[tuple(upper)]
+                buffered[tuple(upper)] |= tile[tuple(lower)]
+            tile = buffered
+
+    return tile.view(bool)
+
+
+def postprocess_mask_values(
+    values,
+    smooth_sigma=None,
+    buffer_iterations=None,
+    tile_size=POSTPROCESS_TILE_SIZE,
+    max_workers=POSTPROCESS_MAX_WORKERS,
+):
+    """
+    Smooth (by a gaussian of `smooth_sigma`) and buffer (by `buffer_iterations` of
+    `binary_dilation`) a boolean mask, in one fused pass over uint8 buffers. The result is
+    identical to that of `gaussian_filter` and `binary_dilation` (a tolerance of zero pixels),
+    since a gaussian truncated back to boolean is an erosion by the square window of the kernel,
+    and the buffer a dilation by its axis-aligned neighbors.
+
+    The mask is processed in tiles over its last two (y, x) axes, each with a halo of the radius of
+    the smoothing and buffering around it, so tiles are independent and run in parallel.
+
+    Args:
+        values (np.ndarray): The boolean mask.
+        smooth_sigma (float, optional): Sigma of the gaussian smoothing. Defaults to None.
+        buffer_iterations (int, optional): Number of buffer iterations. Defaults to None.
+        tile_size (int, optional): Size of the tiles. Defaults to `POSTPROCESS_TILE_SIZE`.
+        max_workers (int, optional): Number of tiles processed at once. Defaults to `POSTPROCESS_MAX_WORKERS`.
+
+    Returns:
+        np.ndarray: The smoothed and buffered boolean mask.
+    """
+    values = np.ascontiguousarray(values, dtype=bool)
+    if not smooth_sigma and not buffer_iterations:
+        return values.copy()
+
+    halo = (_smoothing_radius(smooth_sigma) if smooth_sigma else 0) + (
+        buffer_iterations or 0
+    )
+    n_rows, n_cols = values.shape[-2:]
+    tiles = [
+        (row_start, col_start)
+        for row_start in range(0, n_rows, tile_size)
+        for col_start in range(0, n_cols, tile_size)
+    ]
+
+    postprocessed = np.empty_like(values)
+
+    def postprocess_tile(tile):
+        row_start, col_start = tile
+        row_stop = min(row_start + tile_size, n_rows)
+        col_stop = min(col_start + tile_size, n_cols)
+        halo_row_start, halo_col_start = max(row_start - halo, 0), max(col_start - halo, 0)
+        tile_values = _postprocess_tile(
+            np.ascontiguousarray(
+                values[
+                    ...,
+                    halo_row_start : min(row_stop + halo, n_rows),
+                    halo_col_start : min(col_stop + halo, n_cols),
+                ]
+            ),
+            smooth_sigma,
+            buffer_iterations,
         )
+        postprocessed[..., row_start:row_stop, col_start:col_stop] = tile_values[
+            ...,
+            row_start - halo_row_start : row_stop - halo_row_start,
+            col_start - halo_col_start : col_stop - halo_col_start,
+        ]
 
-    burn_mask.values = burn_mask_values
-    return burn_mask
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(postprocess_tile, tiles))
+
+    return postprocessed
@@ -0,0 +1,366 @@
+import os
+import threading
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from shapely.geometry import shape, box
+from shapely.ops import unary_union
+
+FIRE_MONITOR_MAX_CONCURRENT_REFRESHES = int(
+    os.environ.get("FIRE_MONITOR_MAX_CONCURRENT_REFRESHES", 2)
+)
+FIRE_MONITOR_POLL_SECONDS = int(
+    os.environ.get("FIRE_MONITOR_POLL_SECONDS", 6 * 60 * 60)
+)
+# A claim on a fire's refresh older than this is assumed to belong to a poll which died mid-refresh
+FIRE_MONITOR_REFRESH_TIMEOUT_SECONDS = int(
+    os.environ.get("FIRE_MONITOR_REFRESH_TIMEOUT_SECONDS", 2 * 60 * 60)
+)
+
+
+class FireMonitor:
+    """
+    Tracks registered (active) fire events, and polls a STAC catalog for new passes intersecting
+    each, so that their postfire composite and metrics can be refreshed as the passes land, rather
+    than by a manual re-analysis.
+
+    Fires which share Sentinel-2 tiles are polled together: fires with overlapping bounding boxes
+    are grouped, and each group costs a single search, whose items are then matched to each
+    fire's AOI and postfire date range. Refreshes run with bounded concurrency, and a fire is never
+    refreshed twice at once - a poll claims the fires it refreshes with a `refreshing_since` marker
+    in the monitor's state, so with the state shared between instances (see `poll`), concurrent
+    polls skip each other's fires.
+
+    Args:
+        fire_events (dict, optional): Existing registered fire events, as returned by `to_dict`. Defaults to None.
+        max_concurrent_refreshes (int, optional): Number of fires refreshed concurrently. Defaults to
+            `FIRE_MONITOR_MAX_CONCURRENT_REFRESHES`.
+        collection (str, optional): STAC collection to poll. Defaults to "sentinel-2-l2a".
+
+    Attributes:
+        fire_events (dict): Registered fire events, keyed by "{affiliation}/{fire_event_name}". Each records
+            its boundary (GeoJSON), date ranges, the ids of the postfire items it has seen, when a poll claimed
+            its refresh (if one is in progress), and whatever else it was registered with (e.g. the paths of
+            its COGs and its analysis options).
+    """
+
+    def __init__(
+        self,
+        fire_events=None,
+        max_concurrent_refreshes=FIRE_MONITOR_MAX_CONCURRENT_REFRESHES,
+        collection="sentinel-2-l2a",
+    ):
+        self.fire_events = fire_events or {}
+        self.max_concurrent_refreshes = max_concurrent_refreshes
+        self.collection = collection
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dict(cls, monitor_dict, **kwargs):
+        return cls(fire_events=monitor_dict.get("fire_events", {}), **kwargs)
+
+    def to_dict(self):
+        return {"fire_events": self.fire_events}
+
+    def register(
+        self,
+        affiliation,
+        fire_event_name,
+        geojson_boundary,
+        prefire_date_range,
+        postfire_date_range,
+        seen_item_ids=(),
+        **fire_event_info,
+    ):
+        """
+        Register a fire event to monitor, replacing any existing registration of it.
+
+        Args:
+            affiliation (str): Affiliation of the fire event.
+            fire_event_name (str): Name of the fire event.
+            geojson_boundary (dict): Boundary of the fire event, as a GeoJSON FeatureCollection in EPSG:4326.
+            prefire_date_range (list): The prefire date range.
+            postfire_date_range (list): The postfire date range. Passes within it are monitored for, and
+                the fire is dropped once a poll finds its end has passed.
+            seen_item_ids (list, optional): Ids of the postfire items already in its metrics. Defaults to ().
+            **fire_event_info: Anything else to record with the fire event, for its refresh.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.fire_events[f"{affiliation}/{fire_event_name}"] = {
+                "affiliation": affiliation,
+                "fire_event_name": fire_event_name,
+                "geojson_boundary": geojson_boundary,
+                "prefire_date_range": list(prefire_date_range),
+                "postfire_date_range": list(postfire_date_range),
+                "seen_item_ids": sorted(seen_item_ids),
+                **fire_event_info,
+            }
+
+    def unregister(self, affiliation, fire_event_name):
+        with self._lock:
+            self.fire_events.pop(f"{affiliation}/{fire_event_name}", None)
+
+    def _fire_geometry(self, fire_event):
+        return unary_union(
+            [
+                shape(feature["geometry"])
+                for feature in fire_event["geojson_boundary"]["features"]
+            ]
+        )
+
+    def group_fire_events(self, fire_event_keys):
+        """
+        Group fire events whose bounding boxes overlap (i.e. which likely share tiles), so each
+        group can be polled with a single search.
+
+        Args:
+            fire_event_keys (list): Keys of the fire events to group.
+
+        Returns:
+            list: Pairs of the bounding box (shapely geometry) of each group, and the keys of its fire events.
+        """
+        fire_bboxes = {
+            key: box(*self._fire_geometry(self.fire_events[key]).bounds)
+            for key in fire_event_keys
+        }
+        merged = unary_union(list(fire_bboxes.values()))
+        group_geometries = getattr(merged, "geoms", [merged])
+
+        groups = []
+        for group_geometry in group_geometries:
+            group_bbox = box(*group_geometry.bounds)
+            group_keys = [
+                key
+                for key, bbox in fire_bboxes.items()
+                if group_geometry.intersects(bbox)
+            ]
+            groups.append((group_bbox, group_keys))
+        return groups
+
+    def find_new_items(self, catalog, now=None):
+        """
+        Search the catalog for postfire items of the registered fire events which they haven't seen yet.
+
+        Args:
+            catalog (pystac_client.Client): The STAC catalog (or anything with the same `search`).
+            now (datetime.datetime, optional): The current time. Defaults to now.
+
+        Returns:
+            dict: Lists of new items, keyed by fire event key, for fire events with any.
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        today = now.strftime("%Y-%m-%d")
+
+        with self._lock:
+            active_keys = [
+                key
+                for key, fire_event in self.fire_events.items()
+                if fire_event["postfire_date_range"][0] <= today
+            ]
+
+        new_items = {}
+        for group_bbox, group_keys in self.group_fire_events(active_keys):
+            postfire_date_ranges = [
+                self.fire_events[key]["postfire_date_range"] for key in group_keys
+            ]
+            start = min(date_range[0] for date_range in postfire_date_ranges)
+            end = min(max(date_range[1] for date_range in postfire_date_ranges), today)
+            print(f"Polling for new passes over {len(group_keys)} fire events")
+            items = catalog.search(
+                collections=[self.collection],
+                datetime=f"{start}/{end}",
+                bbox=list(group_bbox.bounds),
+            ).item_collection()
+
+            for key in group_keys:
+                fire_event = self.fire_events[key]
+                fire_geometry = self._fire_geometry(fire_event)
+                postfire_start, postfire_end = fire_event["postfire_date_range"]
+                seen_item_ids = set(fire_event["seen_item_ids"])
+
+                fire_new_items = [
+                    item
+                    for item in items
+                    if item.id not in seen_item_ids
+                    and postfire_start
+                    <= item.datetime.strftime("%Y-%m-%d")
+                    <= postfire_end
+                    and shape(item.geometry).intersects(fire_geometry)
+                ]
+                if fire_new_items:
+                    new_items[key] = fire_new_items
+
+        return new_items
+
+    def claim_refreshes(
+        self, keys, now, timeout_seconds=FIRE_MONITOR_REFRESH_TIMEOUT_SECONDS
+    ):
+        """
+        Claim the refreshes of fire events, marking them as `refreshing_since` now, unless another
+        poll has already claimed them (within `timeout_seconds`).
+
+        Args:
+            keys (list): Keys of the fire events to claim.
+            now (datetime.datetime): The current time.
+            timeout_seconds (int, optional): Age after which an earlier claim has expired. Defaults to
+                `FIRE_MONITOR_REFRESH_TIMEOUT_SECONDS`.
+
+        Returns:
+            dict: The claims made (the `refreshing_since` marker of each), keyed by fire event key.
+        """
+        claims = {}
+        with self._lock:
+            for key in keys:
+                fire_event = self.fire_events.get(key)
+                if fire_event is None:
+                    continue
+                refreshing_since = fire_event.get("refreshing_since")
+                if (
+                    refreshing_since is not None
+                    and (
+                        now - datetime.datetime.fromisoformat(refreshing_since)
+                    ).total_seconds()
+                    < timeout_seconds
+                ):
+                    continue
+                fire_event["refreshing_since"] = now.isoformat()
+                claims[key] = fire_event["refreshing_since"]
+        return claims
+
+    def complete_refreshes(self, claims, results, now):
+        """
+        Record the results of claimed refreshes: release the claims, mark the new items of successful
+        refreshes as seen (along with any updates to their fire events), and drop fire events whose
+        postfire date range has ended (and have nothing left to refresh).
+
+        Args:
+            claims (dict): The claims made, as returned by `claim_refreshes`.
+            results (dict): The result of each refresh, keyed by fire event key - whether it succeeded, the
+                ids of its new items, and any updates to its fire event.
+            now (datetime.datetime): The current time.
+
+        Returns:
+            None
+        """
+        today = now.strftime("%Y-%m-%d")
+        with self._lock:
+            for key, result in results.items():
+                fire_event = self.fire_events.get(key)
+                if fire_event is None:
+                    continue
+                # Unless our claim expired, and another poll has claimed it since
+                if fire_event.get("refreshing_since") == claims.get(key):
+                    fire_event.pop("refreshing_since", None)
+                if result["refreshed"]:
+                    fire_event.update(result.get("fire_event_updates") or {})
+                    fire_event["seen_item_ids"] = sorted(
+                        set(fire_event["seen_item_ids"]) | set(result["new_item_ids"])
+                    )
+                    fire_event["last_refreshed"] = now.strftime("%Y-%m-%d %H:%M:%S")
+
+            for key in list(self.fire_events):
+                if (
+                    self.fire_events[key]["postfire_date_range"][1] < today
+                    and results.get(key, {"refreshed": True})["refreshed"]
+                    and "refreshing_since" not in self.fire_events[key]
+                ):
+                    print(f"Postfire date range of {key} has ended, dropping it")
+                    del self.fire_events[key]
+
+    def poll(self, catalog, refresh_fire, now=None, update_state=None):
+        """
+        Poll the catalog for new passes of the registered fire events, and refresh those with any.
+        A fire's new items are only marked as seen once its refresh succeeds, so a failed refresh is
+        retried on the next poll. Fires whose postfire date range has ended (and have nothing left to
+        refresh) are dropped.
+
+        The monitor's state may be shared, e.g. stored in cloud storage and loaded by each poll, on any
+        instance. Claims and results are then applied to the latest shared state through `update_state`
+        (e.g. by a conditional write), rather than to this (possibly stale) copy, so concurrent polls
+        neither refresh the same fire twice nor lose each other's updates.
+
+        Args:
+            catalog (pystac_client.Client): The STAC catalog (or anything with the same `search`).
+            refresh_fire (callable): Refreshes the postfire composite and metrics of a fire event, given the
+                fire event (dict) and its new items. May return a dict of updates to the fire event.
+            now (datetime.datetime, optional): The current time. Defaults to now.
+            update_state (callable, optional): Applies a function (modifying a FireMonitor in place, and
+                possibly called several times) to the shared state of the monitor, persists it, and returns
+                the updated FireMonitor. Defaults to None, to apply it to this monitor alone.
+
+        Returns:
+            dict: Results of the poll, keyed by fire event key - the number of new items, and whether the
+                refresh succeeded (or the error it failed with).
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        if update_state is None:
+            update_state = lambda update: update(self) or self
+        new_items = self.find_new_items(catalog, now=now)
+
+        # Skip fires that are still being refreshed by an earlier (or concurrent) poll
+        claims = {}
+
+        def claim(fire_monitor):
+            claims.clear()
+            claims.update(fire_monitor.claim_refreshes(list(new_items), now))
+
+        if new_items:
+            update_state(claim)
+        to_refresh = {key: new_items[key] for key in claims}
+
+        def refresh(key):
+            try:
+                fire_event_updates = refresh_fire(self.fire_events[key], to_refresh[key])
+            except Exception as e:
+                print(f"Failed to refresh {key} ({e})")
+                return {"refreshed": False, "error": str(e)}
+            return {
+                "refreshed": True,
+                "new_item_ids": [item.id for item in to_refresh[key]],
+                "fire_event_updates": fire_event_updates,
+            }
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_refreshes) as executor:
+            refresh_results = dict(zip(to_refresh, executor.map(refresh, to_refresh)))
+
+        latest = update_state(
+            lambda fire_monitor: fire_monitor.complete_refreshes(
+                claims, refresh_results, now
+            )
+        )
+        if latest is not self:
+            with self._lock:
+                self.fire_events = latest.fire_events
+
+        results = {}
+        for key, refresh_result in refresh_results.items():
+            results[key] = {"n_new_items": len(to_refresh[key])}
+            results[key]["refreshed"] = refresh_result["refreshed"]
+            if not refresh_result["refreshed"]:
+                results[key]["error"] = refresh_result["error"]
+        return results
+
+    def run(
+        self, catalog, refresh_fire, stop_event, poll_seconds=FIRE_MONITOR_POLL_SECONDS
+    ):
+        """
+        Poll every `poll_seconds` until `stop_event` is set, for a long-running monitor process (on
+        a serverless deployment, trigger `poll` on a schedule instead).
+
+        Args:
+            catalog (pystac_client.Client): The STAC catalog (or anything with the same `search`).
+            refresh_fire (callable): See `poll`.
+            stop_event (threading.Event): Event to stop polling on.
+            poll_seconds (int, optional): Seconds between polls. Defaults to `FIRE_MONITOR_POLL_SECONDS`.
+
+        Returns:
+            None
+        """
+        while not stop_event.is_set():
+            try:
+                self.poll(catalog, refresh_fire)
+            except Exception as e:
+                print(f"Failed to poll for new passes ({e})")
+            stop_event.wait(poll_seconds)
@@ -0,0 +1,165 @@
+import os
+import tempfile
+import rasterio
+import rasterio.mask
+import rasterio.shutil
+import geopandas as gpd
+import numpy as np
+from src.lib.burn_severity import DEFAULT_DTYPE
+
+# Block size of the time series COGs, which overviews are built down to
+TIME_SERIES_BLOCK_SIZE = 256
+
+
+def _open_time_series_writer(path, template, n_layers, dtype):
+    """
+    Open a tiled, multi-band GeoTIFF to stream a time series into, with the grid of the template layer.
+    The COG driver can only copy a complete dataset, so the time series is staged in this first.
+
+    Args:
+        path (str): Local path of the GeoTIFF.
+        template (xr.DataArray): A 2D layer on the grid of the time series.
+        n_layers (int): Number of bands (dates) in the time series.
+        dtype (str): Dtype of the GeoTIFF.
+
+    Returns:
+        rasterio.io.DatasetWriter: The open dataset.
+    """
+    height, width = template.shape
+    return rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        height=height,
+        width=width,
+        count=n_layers,
+        dtype=dtype,
+        crs=template.rio.crs,
+        transform=template.rio.transform(),
+        nodata=np.nan,
+        tiled=True,
+        blockxsize=TIME_SERIES_BLOCK_SIZE,
+        blockysize=TIME_SERIES_BLOCK_SIZE,
+        compress="deflate",
+        interleave="band",
+    )
+
+
+def write_nbr_time_series(
+    layers, n_layers, nbr_path, dnbr_path=None, nbr_prefire=None, dtype=DEFAULT_DTYPE
+):
+    """
+    Stream a per-pass NBR time series to a multi-band COG, one band per acquisition date, and
+    optionally the corresponding dNBR (relative to a prefire NBR composite). Layers are consumed
+    one at a time and written straight to a staging GeoTIFF on disk, so memory is bounded by a single
+    layer regardless of the number of passes, which is then copied to a COG (with overviews). Band
+    descriptions hold the acquisition dates.
+
+    Args:
+        layers (iterable): Iterable of (acquisition date, NBR xr.DataArray) pairs, in date order.
+        n_layers (int): Number of layers `layers` will yield.
+        nbr_path (str): Local path to write the NBR time series to.
+        dnbr_path (str, optional): Local path to write the dNBR time series to. Requires `nbr_prefire`. Defaults to None.
+        nbr_prefire (xr.DataArray, optional): Prefire NBR composite. If given, every layer is aligned
+            to its grid. Defaults to None.
+        dtype (str, optional): Dtype of the written COGs. Defaults to `DEFAULT_DTYPE`.
+
+    Returns:
+        None
+    """
+    if n_layers < 1:
+        raise ValueError("A time series needs at least one layer (acquisition) to write")
+    if dnbr_path is not None and nbr_prefire is None:
+        raise ValueError("A prefire NBR composite is required to write dNBR")
+
+    output_paths = {"nbr": nbr_path}
+    if dnbr_path is not None:
+        output_paths["dnbr"] = dnbr_path
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        staging_paths = {
+            name: os.path.join(tmpdir, f"{name}_time_series.tif")
+            for name in output_paths
+        }
+        dsts = {}
+        template = nbr_prefire
+
+        try:
+            for band_index, (acquisition_date, nbr) in enumerate(layers, start=1):
+                # Align every pass to the same grid, so bands line up pixel for pixel
+                if template is None:
+                    template = nbr
+                else:
+                    nbr = nbr.rio.reproject_match(template, nodata=np.nan)
+
+                if not dsts:
+                    dsts = {
+                        name: _open_time_series_writer(
+                            staging_path, template, n_layers, dtype
+                        )
+                        for name, staging_path in staging_paths.items()
+                    }
+
+                dsts["nbr"].write(nbr.values.astype(dtype), band_index)
+                dsts["nbr"].set_band_description(band_index, acquisition_date)
+
+                if "dnbr" in dsts:
+                    dnbr = nbr_prefire.values - nbr.values
+                    dsts["dnbr"].write(dnbr.astype(dtype), band_index)
+                    dsts["dnbr"].set_band_description(band_index, acquisition_date)
+        finally:
+            for dst in dsts.values():
+                dst.close()
+
+        if not dsts:
+            raise ValueError("No layers were yielded to write to the time series")
+
+        for name, output_path in output_paths.items():
+            rasterio.shutil.copy(
+                staging_paths[name],
+                output_path,
+                driver="COG",
+                compress="deflate",
+                blocksize=TIME_SERIES_BLOCK_SIZE,
+                overview_resampling="nearest",
+            )
+
+
+def read_time_series(path, geojson):
+    """
+    Read the time series of a multi-band GeoTIFF (as written by `write_nbr_time_series`), for each
+    feature of a GeoJSON. Point features return the value of the pixel they fall in, and polygon
+    features return the mean over the pixels they cover (ignoring NaNs). Only the windows covering
+    the features are read, so this is cheap against a remote COG as well as a local file.
+
+    Args:
+        path (str): Local path or URL of the time series GeoTIFF.
+        geojson (dict): GeoJSON FeatureCollection of points and/or polygons, in EPSG:4326.
+
+    Returns:
+        dict: The acquisition dates, and a list with one time series (list of floats, or None
+            where there is no data) per feature.
+    """
+    features_gpd = gpd.GeoDataFrame.from_features(geojson)
+    if not features_gpd.crs:
+        features_gpd = features_gpd.set_crs("EPSG:4326")
+
+    with rasterio.open(path) as src:
+        features_gpd = features_gpd.to_crs(src.crs)
+        acquisition_dates = list(src.descriptions)
+
+        series = []
+        for geometry in features_gpd.geometry:
+            if geometry.geom_type == "Point":
+                values = next(src.sample([(geometry.x, geometry.y)], masked=True))
+                values = np.ma.filled(values.astype("float64"), np.nan)
+            else:
+                masked, __transform = rasterio.mask.mask(
+                    src, [geometry], crop=True, filled=False
+                )
+                masked = np.ma.masked_invalid(masked)
+                values = np.ma.filled(masked.mean(axis=(1, 2)), np.nan)
+
+            series.append([None if np.isnan(v) else float(v) for v in values])
+
+    return {"acquisition_dates": acquisition_dates, "time_series": series}
@@ -0,0 +1,197 @@
+import json
+import datetime
+from shapely.geometry import shape, mapping
+
+REQUIRED_METRICS = ["nbr_prefire", "nbr_postfire", "dnbr", "rdnbr", "rbr"]
+
+
+def product_key(
+    crs,
+    resolution,
+    prefire_date_range,
+    postfire_date_range,
+    band_nir,
+    band_swir,
+    dtype,
+    collection="sentinel-2-l2a",
+    compositing="median",
+    screen_scenes=False,
+    offset_dnbr=False,
+    quantized=False,
+):
+    """
+    Get the key under which a metrics stack is indexed. Two requests with the same key would
+    produce the same pixels wherever their AOIs overlap, so a product can be reused by any
+    request with the same key whose AOI it covers. Products of options whose pixels depend on the
+    requesting AOI itself aren't indexed at all (see `Sentinel2Client.reuses_products`).
+
+    Args:
+        crs (str): CRS of the metrics stack.
+        resolution (int): Resolution the Sentinel-2 bands were stacked at.
+        prefire_date_range (list): The prefire date range.
+        postfire_date_range (list): The postfire date range.
+        band_nir (str): Name of the NIR band.
+        band_swir (str): Name of the SWIR band.
+        dtype (str): Dtype of the metrics stack.
+        collection (str, optional): STAC collection of the imagery. Defaults to "sentinel-2-l2a".
+        compositing (str, optional): How the scenes were composited. Defaults to "median".
+        screen_scenes (bool, optional): Whether cloudy scenes were screened out first. Defaults to False.
+        offset_dnbr (bool, optional): Whether the dNBR was offset by an unburned reference ring. Defaults to False.
+        quantized (bool, optional): Whether the metric COGs are quantized to int16 (see `src.lib.quantization`),
+            at a coarser precision and range than floats. Defaults to False.
+
+    Returns:
+        str: The product key.
+    """
+    return json.dumps(
+        {
+            "collection": collection,
+            "crs": str(crs),
+            "resolution": resolution,
+            "prefire_date_range": list(prefire_date_range),
+            "postfire_date_range": list(postfire_date_range),
+            "band_nir": band_nir,
+            "band_swir": band_swir,
+            "dtype": str(dtype),
+            "compositing": compositing,
+            "screen_scenes": screen_scenes,
+            "offset_dnbr": offset_dnbr,
+            "quantized": quantized,
+        },
+        sort_keys=True,
+    )
+
+
+class ProductIndex:
+    """
+    An index of the metrics stacks we have already computed, keyed by `product_key`, so that
+    requests for a sub-area of an existing product (or a re-run of the same fire under a
+    different name) can be served by windowed reads of the existing COGs, rather than a
+    fresh acquisition from Sentinel-2.
+
+    Args:
+        products (dict, optional): Existing index contents, as returned by `to_dict`. Defaults to None.
+
+    Attributes:
+        products (dict): Lists of products, keyed by product key. Each product records the fire event it
+            was computed for, the boundary (GeoJSON geometry) it covers, the HTTPS paths of its COGs per
+            burn metric, and its satellite pass information.
+    """
+
+    def __init__(self, products=None):
+        self.products = products or {}
+
+    @classmethod
+    def from_dict(cls, index_dict):
+        return cls(products=index_dict.get("products", {}))
+
+    def to_dict(self):
+        return {"products": self.products}
+
+    def register(
+        self,
+        key,
+        affiliation,
+        fire_event_name,
+        boundary_geometry,
+        cog_paths,
+        satellite_pass_information,
+    ):
+        """
+        Register a newly computed product. Any existing products of the same fire event are dropped,
+        under any key, since their COGs have just been overwritten.
+
+        Args:
+            key (str): The product key (see `product_key`).
+            affiliation (str): Affiliation of the fire event.
+            fire_event_name (str): Name of the fire event.
+            boundary_geometry (shapely.geometry.base.BaseGeometry): Boundary the product was clipped to,
+                in the CRS of the product.
+            cog_paths (dict): HTTPS paths of the product's COGs, keyed by burn metric.
+            satellite_pass_information (dict): Satellite pass information of the product.
+
+        Returns:
+            None
+        """
+        missing_metrics = [m for m in REQUIRED_METRICS if m not in cog_paths]
+        if missing_metrics:
+            raise ValueError(f"Product is missing COGs for {missing_metrics}")
+
+        self.remove_fire_event(affiliation, fire_event_name)
+        self.products.setdefault(key, []).append(
+            {
+                "affiliation": affiliation,
+                "fire_event_name": fire_event_name,
+                "boundary": mapping(boundary_geometry),
+                "cog_paths": {metric: cog_paths[metric] for metric in REQUIRED_METRICS},
+                "satellite_pass_information": satellite_pass_information,
+                "last_updated": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            }
+        )
+
+    def remove_fire_event(self, affiliation, fire_event_name):
+        """
+        Remove all products of a fire event from the index, under any key.
+
+        Args:
+            affiliation (str): Affiliation of the fire event.
+            fire_event_name (str): Name of the fire event.
+
+        Returns:
+            None
+        """
+        for key in list(self.products):
+            self.products[key] = [
+                product
+                for product in self.products[key]
+                if not (
+                    product["affiliation"] == affiliation
+                    and product["fire_event_name"] == fire_event_name
+                )
+            ]
+            if not self.products[key]:
+                del self.products[key]
+
+    def remove_cog_paths(self, cog_paths):
+        """
+        Remove all products with any of the given COGs from the index, under any key - e.g. once the
+        COGs have been overwritten with something else.
+
+        Args:
+            cog_paths (list): HTTPS paths of the COGs.
+
+        Returns:
+            None
+        """
+        cog_paths = set(cog_paths)
+        for key in list(self.products):
+            self.products[key] = [
+                product
+                for product in self.products[key]
+                if cog_paths.isdisjoint(product["cog_paths"].values())
+            ]
+            if not self.products[key]:
+                del self.products[key]
+
+    def find_covering(self, key, boundary_geometry):
+        """
+        Find an existing product with the given key whose boundary covers the given boundary. If
+        several do, the smallest is returned, since it is the cheapest to read from.
+
+        Args:
+            key (str): The product key (see `product_key`).
+            boundary_geometry (shapely.geometry.base.BaseGeometry): Boundary of the new request, in the
+                CRS of the product.
+
+        Returns:
+            dict: The covering product, or None if there isn't one.
+        """
+        covering = [
+            product
+            for product in self.products.get(key, [])
+            if shape(product["boundary"]).covers(boundary_geometry)
+        ]
+        if not covering:
+            return None
+
+        return min(covering, key=lambda product: shape(product["boundary"]).area)
@@ -0,0 +1,115 @@
+import os
+import numpy as np
+
+# Burn metrics are only meaningful to ~0.001, so they can be stored as int16 with a scale factor,
+# halving (or better, once compressed) the size of their COGs vs float32. The most negative int16
+# is reserved for nodata, and values beyond the representable range are clipped to it.
+QUANTIZE_METRIC_COGS = (
+    os.environ.get("QUANTIZE_METRIC_COGS", "false").lower() == "true"
+)
+QUANTIZED_DTYPE = "int16"
+QUANTIZED_NODATA = np.iinfo(QUANTIZED_DTYPE).min
+QUANTIZED_MAX = np.iinfo(QUANTIZED_DTYPE).max
+
+# Scale of each metric. NBR and dNBR are bounded to [-2, 2], so fit at 1e-4 resolution, while
+# RdNBR and RBR blow up as prefire NBR approaches 0 or -1, so need the wider range of 1e-3.
+METRIC_SCALES = {
+    "nbr_prefire": 1e-4,
+    "nbr_postfire": 1e-4,
+    "dnbr": 1e-4,
+    "rdnbr": 1e-3,
+    "rbr": 1e-3,
+    "pct_change_dnbr_rbr": 0.1,
+    "dnbr_uncertainty": 1e-4,
+    "rbr_uncertainty": 1e-3,
+}
+DEFAULT_METRIC_SCALE = 1e-3
+
+# GDAL keeps scale and offset per band, where rio-tiler doesn't pass them on to algorithms, so
+# they are also written as dataset tags (which it does)
+QUANTIZATION_SCALE_TAG = "quantization_scale"
+QUANTIZATION_OFFSET_TAG = "quantization_offset"
+
+
+def quantize(array, scale, offset=0.0, nodata=QUANTIZED_NODATA):
+    """
+    Quantize a float array to int16, such that `value = stored * scale + offset`. NaNs are stored as
+    `nodata`, and values beyond the int16 range are clipped to the range. The scale, offset and nodata are
+    set as attributes, so `rio.to_raster` writes them as the GDAL scale/offset and nodata of the
+    raster, and readers which apply them (e.g. `rxr.open_rasterio(..., mask_and_scale=True)`) get
+    the float values back.
+
+    Args:
+        array (xr.DataArray): The float array.
+        scale (float): The scale factor (i.e. the precision) of the stored values.
+        offset (float, optional): The offset of the stored values. Defaults to 0.0.
+        nodata (int, optional): The stored value of NaNs. Defaults to `QUANTIZED_NODATA`.
+
+    Returns:
+        xr.DataArray: The quantized int16 array.
+    """
+    values = np.asarray(array.values, dtype="float64")
+    nan_mask = np.isnan(values)
+
+    stored = np.round((np.where(nan_mask, offset, values) - offset) / scale)
+    np.clip(stored, nodata + 1, QUANTIZED_MAX, out=stored)
+    stored = stored.astype(QUANTIZED_DTYPE)
+    stored[nan_mask] = nodata
+
+    quantized = array.copy(data=stored)
+    quantized.attrs = {
+        **array.attrs,
+        "scale_factor": scale,
+        "add_offset": offset,
+        "_FillValue": nodata,
+        QUANTIZATION_SCALE_TAG: scale,
+        QUANTIZATION_OFFSET_TAG: offset,
+    }
+    quantized.encoding = {}
+    return quantized
+
+
+def dequantize(
+    values, scale, offset=0.0, nodata=QUANTIZED_NODATA, dtype="float32"
+):
+    """
+    Get back the float values of quantized values (see `quantize`), with NaN where they are `nodata`.
+
+    Args:
+        values (np.ndarray): The stored int16 values.
+        scale (float): The scale factor of the stored values.
+        offset (float, optional): The offset of the stored values. Defaults to 0.0.
+        nodata (int, optional): The stored value of NaNs. Defaults to `QUANTIZED_NODATA`.
+        dtype (str, optional): Dtype of the float values. Defaults to "float32".
+
+    Returns:
+        np.ndarray: The float values.
+    """
+    float_values = values.astype(dtype) * np.dtype(dtype).type(scale)
+    float_values += np.dtype(dtype).type(offset)
+    float_values[values == nodata] = np.nan
+    return float_values
+
+
+def unscale_image_data(img):
+    """
+    Get the float values of the image data of a tile, whether it was read from a float COG, or a
+    quantized one (whose dataset tags carry its scale and offset). Masked pixels are NaN.
+
+    Args:
+        img (rio_tiler.models.ImageData): The image data of a tile.
+
+    Returns:
+        np.ndarray: The float values of the tile.
+    """
+    data = np.ma.masked_array(img.array)
+    if np.issubdtype(data.dtype, np.integer) and QUANTIZATION_SCALE_TAG in (
+        img.metadata or {}
+    ):
+        # Mask nodata ourselves too, in case the request overrode the COG's nodata
+        data = np.ma.masked_equal(data, QUANTIZED_NODATA)
+        scale = float(img.metadata[QUANTIZATION_SCALE_TAG])
+        offset = float(img.metadata.get(QUANTIZATION_OFFSET_TAG, 0.0))
+        data = data.astype("float32") * np.float32(scale) + np.float32(offset)
+
+    return np.ma.filled(data.astype("float32"), np.nan)
@@ -0,0 +1,160 @@
+import os
+import math
+import numpy as np
+from src.lib.chunk_planning import plan_stack_chunks, STACK_MEMORY_BUDGET_BYTES
+
+# Sentinel-2 L2A COGs are uint16, internally tiled in 1024px blocks, and a ~110km tile is 5490px
+# across at 20m. Reads fetch whole blocks, so an AOI costs the blocks it touches, not its pixels.
+COG_BLOCK_SIZE_PIXELS = 1024
+COG_TILE_SIZE_PIXELS = 5490
+COG_SAMPLE_BYTES = 2
+# Deflate-compressed reflectance is roughly half its raw size
+COG_COMPRESSION_RATIO = float(os.environ.get("COG_COMPRESSION_RATIO", 0.5))
+
+# Rough throughputs of the prod instance, used to turn a plan into an estimated wall time.
+# These are deliberately conservative, and can be calibrated per deployment.
+READ_BYTES_PER_SECOND = float(os.environ.get("READ_BYTES_PER_SECOND", 50 * 1024**2))
+READ_REQUEST_SECONDS = float(os.environ.get("READ_REQUEST_SECONDS", 0.2))
+REDUCE_PIXELS_PER_SECOND = float(os.environ.get("REDUCE_PIXELS_PER_SECOND", 20e6))
+
+# Metrics stack of nbr_prefire, nbr_postfire, dnbr, rdnbr and rbr
+N_BURN_METRICS = 5
+
+
+def estimate_stack_cost(
+    items,
+    height,
+    width,
+    n_bands=2,
+    dtype="float32",
+    memory_budget_bytes=STACK_MEMORY_BUDGET_BYTES,
+    n_workers=None,
+    n_reduced_bands=None,
+):
+    """
+    Estimate the cost of stacking and reducing (over time) a set of items over an AOI, without
+    reading any of them. Bytes read are estimated from the COG blocks the AOI touches in each item,
+    and peak memory from the chunk plan the stack would be computed with (see
+    `src.lib.chunk_planning.plan_stack_chunks`).
+
+    Args:
+        items (list): List of Sentinel-2 items the stack would be built from.
+        height (int): Height of the AOI, in pixels at the stack resolution.
+        width (int): Width of the AOI, in pixels at the stack resolution.
+        n_bands (int, optional): Number of bands in the stack. Defaults to 2.
+        dtype (str or np.dtype, optional): Dtype of the stack. Defaults to "float32".
+        memory_budget_bytes (int, optional): Memory budget shared across all workers. Defaults to `STACK_MEMORY_BUDGET_BYTES`.
+        n_workers (int, optional): Number of chunks reduced concurrently. Defaults to the number of CPUs.
+        n_reduced_bands (int, optional): Number of bands in the reduced stack (e.g. with the NBR MAD, or
+            without the scene classification). Defaults to `n_bands`.
+
+    Returns:
+        dict: Number of scenes and unique acquisitions, the pixels and (estimated) bytes to read,
+            the number of read requests, estimated peak memory and wall time, and the chunk plan.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    n_items = len(items)
+    chunk_plan = plan_stack_chunks(
+        n_time=n_items,
+        n_bands=n_bands,
+        height=height,
+        width=width,
+        dtype=dtype,
+        memory_budget_bytes=memory_budget_bytes,
+        n_workers=n_workers,
+    )
+
+    # On average, a window of n pixels straddles one more block boundary than it spans blocks
+    blocks_y = min(
+        math.ceil(height / COG_BLOCK_SIZE_PIXELS) + 1,
+        math.ceil(COG_TILE_SIZE_PIXELS / COG_BLOCK_SIZE_PIXELS),
+    )
+    blocks_x = min(
+        math.ceil(width / COG_BLOCK_SIZE_PIXELS) + 1,
+        math.ceil(COG_TILE_SIZE_PIXELS / COG_BLOCK_SIZE_PIXELS),
+    )
+    n_requests = n_items * n_bands * blocks_y * blocks_x
+    bytes_to_read = int(
+        n_requests
+        * COG_BLOCK_SIZE_PIXELS**2
+        * COG_SAMPLE_BYTES
+        * COG_COMPRESSION_RATIO
+    )
+    pixels_to_read = n_items * n_bands * height * width
+
+    # Chunks in flight on every worker, plus the reduced stack itself
+    n_in_flight = min(n_workers, chunk_plan["n_chunks"])
+    reduced_bytes = (
+        (n_reduced_bands or n_bands) * height * width * np.dtype(dtype).itemsize
+    )
+    peak_memory_bytes = chunk_plan["peak_chunk_bytes"] * n_in_flight + reduced_bytes
+
+    read_seconds = (
+        bytes_to_read / READ_BYTES_PER_SECOND
+        + n_requests * READ_REQUEST_SECONDS / n_workers
+    )
+    reduce_seconds = pixels_to_read / REDUCE_PIXELS_PER_SECOND / n_workers
+
+    return {
+        "n_scenes": n_items,
+        "n_unique_acquisitions": len(np.unique([item.datetime for item in items])),
+        "pixels_to_read": pixels_to_read,
+        "bytes_to_read": bytes_to_read,
+        "n_read_requests": n_requests,
+        "peak_memory_bytes": int(peak_memory_bytes),
+        "wall_time_seconds": round(read_seconds + reduce_seconds, 1),
+        "chunk_plan": chunk_plan,
+    }
+
+
+def summarize_query_cost(
+    stack_costs,
+    height,
+    width,
+    dtype="float32",
+    memory_budget_bytes=STACK_MEMORY_BUDGET_BYTES,
+    n_burn_metrics=N_BURN_METRICS,
+):
+    """
+    Combine the estimated costs of the stacks of a fire event (see `estimate_stack_cost`) into the
+    cost of the whole analysis. Stacks are computed one after the other, so bytes and time add up,
+    while peak memory is that of the largest stack, plus the composites and metrics stack that
+    are held alongside it.
+
+    Args:
+        stack_costs (dict): Estimated costs of each stack, keyed by name (e.g. "prefire", "postfire").
+        height (int): Height of the AOI, in pixels at the stack resolution.
+        width (int): Width of the AOI, in pixels at the stack resolution.
+        dtype (str or np.dtype, optional): Dtype of the composites and metrics. Defaults to "float32".
+        memory_budget_bytes (int, optional): Memory budget shared across all workers. Defaults to `STACK_MEMORY_BUDGET_BYTES`.
+        n_burn_metrics (int, optional): Number of metrics in the metrics stack (e.g. with their uncertainty).
+            Defaults to `N_BURN_METRICS`.
+
+    Returns:
+        dict: Totals over the stacks, whether the analysis is expected to fit within the memory budget,
+            and the estimates of each stack.
+    """
+    held_bytes = n_burn_metrics * height * width * np.dtype(dtype).itemsize
+    peak_memory_bytes = (
+        max([cost["peak_memory_bytes"] for cost in stack_costs.values()], default=0)
+        + held_bytes
+    )
+
+    return {
+        "n_scenes": sum(cost["n_scenes"] for cost in stack_costs.values()),
+        "n_unique_acquisitions": sum(
+            cost["n_unique_acquisitions"] for cost in stack_costs.values()
+        ),
+        "aoi_shape": [height, width],
+        "pixels_to_read": sum(cost["pixels_to_read"] for cost in stack_costs.values()),
+        "bytes_to_read": sum(cost["bytes_to_read"] for cost in stack_costs.values()),
+        "peak_memory_bytes": int(peak_memory_bytes),
+        "wall_time_seconds": round(
+            sum(cost["wall_time_seconds"] for cost in stack_costs.values()), 1
+        ),
+        "exceeds_memory_budget": peak_memory_bytes > memory_budget_bytes,
+        "sufficient_imagery": all(
+            cost["n_scenes"] > 0 for cost in stack_costs.values()
+        ),
+        "stacks": stack_costs,
+    }
@@ -1,9 +1,10 @@
 import requests
 import geopandas as gpd
 import rasterio.features
+import rasterio.warp
+from rioxarray.merge import merge_arrays
 from shapely.geometry import shape, MultiPolygon, Point
 from shapely.ops import unary_union
-from pystac_client import Client as PystacClient
 from datetime import datetime
 import planetary_computer
 import rioxarray as rxr
@@ -13,17 +14,70 @@ import stackstac
 import tempfile
 from scipy.ndimage import gaussian_filter, binary_fill_holes, binary_dilation
 import os
-from .burn_severity import calc_burn_metrics, classify_burn
+import math
+import copy
+from .burn_severity import (
+    calc_burn_metrics,
+    calc_burn_metrics_from_nbr,
+    calc_dnbr,
+    calc_nbr,
+    classify_burn,
+    unburned_ring_mask,
+    DEFAULT_DTYPE,
+    OFFSET_RING_GAP_METERS,
+    OFFSET_RING_WIDTH_METERS,
+)
+from .nbr_time_series import write_nbr_time_series
 from ..util.raster_to_poly import raster_mask_to_geojson
 from src.util.cloud_static_io import CloudStaticIOClient
+from src.util.stac_catalog import get_stac_catalog
+from src.util.scene_cache import scene_tile_key, SCENE_CACHE_TILE_SIZE_PIXELS
+from src.util.composite_tile_cache import (
+    composite_tiles,
+    composite_tile_bounds,
+    composite_tile_key,
+    COMPOSITE_TILE_SIZE_PIXELS,
+)
 from src.lib.derive_boundary import (
     derive_boundary,
     OtsuThreshold,
+    HistogramOtsuThreshold,
     SimpleThreshold,
     FloodFillSegmentation,
 )
 from pyproj import CRS
 import dask
+import dask.array as da
+from concurrent.futures import ThreadPoolExecutor
+from src.lib.chunk_planning import plan_stack_chunks, STACK_MEMORY_BUDGET_BYTES
+from src.lib.product_index import product_key, REQUIRED_METRICS
+from src.lib.compositing import order_items_by_quality, greedy_composite
+from src.lib.scene_screening import screen_items, SCL_ASSET
+from src.lib.query_planner import (
+    estimate_stack_cost,
+    summarize_query_cost,
+    N_BURN_METRICS,
+)
+from src.lib.threshold_sweep import ThresholdSweep
+from src.lib.recovery import (
+    recovery_date_ranges,
+    summarize_recovery,
+    RECOVERY_YEARS,
+    RECOVERY_MAX_CONCURRENT_YEARS,
+)
+from src.lib.uncertainty import (
+    calc_nbr_mad,
+    calc_burn_metric_uncertainty,
+    NBR_MAD_BAND,
+    UNCERTAINTY_METRICS,
+)
+from src.lib.resilient_compute import (
+    reduce_stack_by_chunk,
+    retry_with_backoff,
+    checkpoint_key,
+    ChunkCheckpoint,
+    CHUNK_CHECKPOINT_DIR,
+)
 
 dask.config.set(  ## Make super conservative memory settings to see if we can do huge areas serially, essentially
     {
@@ -37,6 +91,14 @@ dask.config.set(  ## Make super conservative memory settings to see if we can do
 SENTINEL2_PATH = "https://planetarycomputer.microsoft.com/api/stac/v1"
 DEBUG = True
 
+# Let GDAL retry transient HTTP errors itself, before a chunk read fails at all
+GDAL_ENV = stackstac.DEFAULT_GDAL_ENV.updated(
+    always=dict(
+        GDAL_HTTP_MAX_RETRY=os.environ.get("GDAL_HTTP_MAX_RETRY", "3"),
+        GDAL_HTTP_RETRY_DELAY=os.environ.get("GDAL_HTTP_RETRY_DELAY", "1"),
+    )
+)
+
 if DEBUG:
     from dask.distributed import Client  ## This wont exist on prod instance
 
@@ -57,15 +119,47 @@ class Sentinel2Client:
         crs="EPSG:4326",
         band_nir="B8A",
         band_swir="B12",
+        memory_budget_bytes=STACK_MEMORY_BUDGET_BYTES,
+        dtype=DEFAULT_DTYPE,
+        drop_failed_items=False,
+        checkpoint_dir=CHUNK_CHECKPOINT_DIR,
+        compositing="median",
+        screen_scenes=False,
+        scene_cache=None,
+        composite_tile_cache=None,
+        offset_dnbr=False,
+        uncertainty=False,
     ):
         self.path = SENTINEL2_PATH
-        self.pystac_client = PystacClient.open(
-            self.path, modifier=planetary_computer.sign_inplace
-        )
+        self._pystac_client = None
         self.band_nir = band_nir
         self.band_swir = band_swir
         self.crs = crs
         self.buffer = buffer
+        self.memory_budget_bytes = memory_budget_bytes
+        self.dtype = dtype
+        self.chunk_plan = None
+        self.chunk_plans = {}
+        self.drop_failed_items = drop_failed_items
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_dirs = []
+        self.stack_dropped_items = []
+        self.dropped_items = {}
+        if compositing not in ["median", "greedy"]:
+            raise ValueError(f"Unknown compositing mode '{compositing}'")
+        self.compositing = compositing
+        self.composite_info = {}
+        self.stack_composite_info = None
+        self.screen_scenes = screen_scenes
+        self.scene_scores = {}
+        self.scene_cache = scene_cache
+        self.composite_tile_cache = composite_tile_cache
+        self.offset_dnbr = offset_dnbr
+        self.dnbr_offset_info = None
+        if uncertainty and compositing != "median":
+            raise ValueError("Uncertainty is only derived by median compositing")
+        self.uncertainty = uncertainty
+        self.threshold_histogram = None
 
         # TODO [#17]: Settle on standards for storing polygons
         # Oscillating between geojsons and geopandas dataframes, which is a bit messy. Should pick one and stick with it.
@@ -82,6 +176,20 @@ class Sentinel2Client:
         self.derived_classifications = None
         print("Initialized Sentinel2Client with bounds: {}".format(self.bbox))
 
+    @property
+    def pystac_client(self):
+        """
+        The STAC catalog client, shared across the process (see `src.util.stac_catalog`), so that
+        constructing a Sentinel2Client doesn't touch the network, and searches reuse pooled connections.
+        """
+        if self._pystac_client is not None:
+            return self._pystac_client
+        return get_stac_catalog(self.path, modifier=planetary_computer.sign_inplace)
+
+    @pystac_client.setter
+    def pystac_client(self, pystac_client):
+        self._pystac_client = pystac_client
+
     def set_boundary(self, geojson_boundary):
         """
         Sets the boundary for later query to STAC API.
@@ -127,7 +235,85 @@ class Sentinel2Client:
 
         self.metrics_stack = metrics_stack
 
-    def get_items(self, date_range, from_bbox=True, max_items=None):
+    def get_product_key(
+        self, prefire_date_range, postfire_date_range, resolution=20, quantized=False
+    ):
+        """
+        Get the key this client's products are indexed under, for the given date ranges (see
+        `src.lib.product_index.product_key`).
+
+        Args:
+            prefire_date_range (list): The prefire date range.
+            postfire_date_range (list): The postfire date range.
+            resolution (int, optional): Resolution the bands are stacked at. Defaults to 20.
+            quantized (bool, optional): Whether the metric COGs are stored quantized. Defaults to False.
+
+        Returns:
+            str: The product key.
+        """
+        return product_key(
+            crs=self.crs,
+            resolution=resolution,
+            prefire_date_range=prefire_date_range,
+            postfire_date_range=postfire_date_range,
+            band_nir=self.band_nir,
+            band_swir=self.band_swir,
+            dtype=self.dtype,
+            compositing=self.compositing,
+            screen_scenes=self.screen_scenes,
+            offset_dnbr=self.offset_dnbr,
+            quantized=quantized,
+        )
+
+    @property
+    def reuses_products(self):
+        """
+        Whether this client's products can be indexed, and reused by other requests (see
+        `src.lib.product_index`) - only if their pixels don't depend on the requesting AOI, as with
+        offset dNBR, whose offset is taken from the unburned ring around it, greedy compositing,
+        which stops reading scenes once it is covered, or scene screening, which judges scenes by their
+        clouds over it.
+        """
+        return (
+            not self.offset_dnbr
+            and self.compositing != "greedy"
+            and not self.screen_scenes
+        )
+
+    def load_metrics_stack_from_cogs(self, cog_paths):
+        """
+        Loads the metrics stack from existing metric COGs which cover our boundary (e.g. those of a
+        product found in the `ProductIndex`), rather than computing it from Sentinel-2. Only the
+        window of each COG covering our boundary is read, after which the stack is clipped to the
+        boundary itself, as if it had been computed for it.
+
+        Args:
+            cog_paths (dict): Paths or HTTPS URLs of the existing COGs, keyed by burn metric.
+
+        Returns:
+            None
+        """
+        minx, miny, maxx, maxy = self.geojson_boundary.total_bounds
+
+        metric_layers = []
+        for metric_name in REQUIRED_METRICS:
+            metric_layer = rxr.open_rasterio(
+                cog_paths[metric_name], mask_and_scale=True
+            )
+            metric_layer = metric_layer.rio.clip_box(minx, miny, maxx, maxy)
+            metric_layer = metric_layer.rename({"band": "burn_metric"})
+            metric_layer["burn_metric"] = [metric_name]
+            metric_layers.append(metric_layer)
+
+        metrics_stack = xr.concat(metric_layers, dim="burn_metric")
+        metrics_stack = metrics_stack.rio.clip(
+            self.geojson_boundary.geometry.values, self.geojson_boundary.crs
+        )
+
+        # Load now, since we are likely about to overwrite the COGs we're reading from
+        self.ingest_metrics_stack(metrics_stack.astype(self.dtype).load())
+
+    def get_items(self, date_range, from_bbox=True, max_items=None, bbox=None):
         """
         Retrieves items from the Sentinel-2-L2A collection based on the specified date range and optional parameters.
 
@@ -135,6 +321,7 @@ class Sentinel2Client:
             date_range (tuple): A tuple containing the start and end dates of the desired date range in the format (start_date, end_date).
             from_bbox (bool, optional): Specifies whether to search for items within the bounding box defined by the `bbox` attribute. Defaults to True.
             max_items (int, optional): The maximum number of items to retrieve. Defaults to None, which retrieves all available items.
+            bbox (list, optional): Bounding box to search within, rather than the `bbox` attribute. Defaults to None.
 
         Returns:
             pystac.ItemCollection: A collection of items matching the specified criteria.
@@ -151,7 +338,7 @@ class Sentinel2Client:
         }
 
         if from_bbox:
-            query["bbox"] = self.bbox
+            query["bbox"] = bbox if bbox is not None else self.bbox
         else:
             query["intersects"] = self.geojson_boundary
 
@@ -186,9 +373,110 @@ class Sentinel2Client:
         )
         return barc_classifications
 
+    def get_stack_bounds(self, epsg, resolution, pad_pixels=2):
+        """
+        Get the bounds of the boundary in the given CRS, padded by a few pixels so that clipping to
+        the boundary later never falls off the edge of the stack (and, for offset dNBR, by the
+        unburned reference ring around it too).
+
+        Args:
+            epsg (int): EPSG code of the CRS to get the bounds in (usually that of the STAC items).
+            resolution (int): Resolution of the stack, in units of the CRS.
+            pad_pixels (int, optional): Number of pixels to pad the bounds by. Defaults to 2.
+
+        Returns:
+            tuple: The (minx, miny, maxx, maxy) bounds.
+        """
+        minx, miny, maxx, maxy = self.geojson_boundary.to_crs(epsg).total_bounds
+        pad = pad_pixels * resolution + self.reference_ring_distance
+        return (minx - pad, miny - pad, maxx + pad, maxy + pad)
+
+    @property
+    def reduced_bands(self):
+        """
+        Bands of our reduced stacks - the NIR and SWIR composites, plus the MAD of the per-pass NBR
+        with uncertainty (see `reduce_time_range`).
+        """
+        if not self.uncertainty:
+            return [self.band_nir, self.band_swir]
+        return [self.band_nir, self.band_swir, NBR_MAD_BAND]
+
+    @property
+    def reference_ring_distance(self):
+        """
+        How far outside the boundary (in meters) the stacks extend, to hold the unburned
+        reference ring of offset dNBR - or 0, without offset dNBR.
+        """
+        if not self.offset_dnbr:
+            return 0
+        return OFFSET_RING_GAP_METERS + OFFSET_RING_WIDTH_METERS
+
+    def get_reference_ring_mask(self, stack):
+        """
+        Get the mask of the unburned reference ring around our boundary (see
+        `src.lib.burn_severity.unburned_ring_mask`), on the grid of a stack in our CRS. The mask
+        keeps the stack's coordinates, so it can be aligned with the bands it is applied to.
+
+        Args:
+            stack (xarray.DataArray): A stack on the grid of the metrics stack.
+
+        Returns:
+            xarray.DataArray: Boolean (y, x) mask of the ring.
+        """
+        perimeter_mask = rasterio.features.geometry_mask(
+            self.geojson_boundary.geometry.values,
+            out_shape=(stack.rio.height, stack.rio.width),
+            transform=stack.rio.transform(),
+            invert=True,
+        )
+        resolution_x, resolution_y = stack.rio.resolution()
+        pixel_size = np.abs([resolution_y, resolution_x])
+        if CRS.from_user_input(stack.rio.crs).is_geographic:
+            # Degrees to meters, at the latitude of the boundary
+            latitude = np.mean(self.geojson_boundary.total_bounds[[1, 3]])
+            pixel_size = pixel_size * [111320, 111320 * np.cos(np.radians(latitude))]
+        return xr.DataArray(
+            unburned_ring_mask(perimeter_mask, pixel_size=pixel_size),
+            dims=("y", "x"),
+            coords={"y": stack.y.values, "x": stack.x.values},
+        )
+
+    def plan_chunks(self, items, bounds, resolution):
+        """
+        Plan the dask chunk shape of a stack of items over the given bounds, according to our
+        memory budget (see `src.lib.chunk_planning.plan_stack_chunks`). The plan is kept on
+        `self.chunk_plan` so it can be reported with the job.
+
+        Args:
+            items (list): List of Sentinel items to stack.
+            bounds (tuple): The (minx, miny, maxx, maxy) bounds of the stack.
+            resolution (int): Resolution of the stack, in units of the bounds' CRS.
+
+        Returns:
+            dict: The chunk plan.
+        """
+        minx, miny, maxx, maxy = bounds
+        self.chunk_plan = plan_stack_chunks(
+            n_time=len(items),
+            n_bands=2,
+            height=math.ceil((maxy - miny) / resolution),
+            width=math.ceil((maxx - minx) / resolution),
+            dtype=self.dtype,
+            memory_budget_bytes=self.memory_budget_bytes,
+            # The per-pass NBR behind the uncertainty needs both bands of a pixel at once
+            chunk_bands=self.uncertainty,
+        )
+        print(f"Chunk plan: {self.chunk_plan}")
+        return self.chunk_plan
+
     def arrange_stack(self, items, resolution=20):
         """
         Arrange and process (reduce the time dimension, according to `reduce_time_range`) a stack of Sentinel items.
+        The reduction is computed chunk by chunk, with retries, and completed chunks are checkpointed, so a
+        transient read error costs a re-read of a single chunk (see `src.lib.resilient_compute`). If
+        `drop_failed_items` is set, items whose reads persistently fail are treated as missing, and recorded
+        in `self.stack_dropped_items`.
+        If the client has a scene cache, the stack is arranged through it instead (see `arrange_cached_stack`).
 
         Args:
             items (list): List of Sentinel items to stack.
@@ -201,35 +489,392 @@ class Sentinel2Client:
             None
 
         """
+        if self.scene_cache is not None:
+            return self.arrange_cached_stack(items, resolution)
+
         # Get CRS from first item (this isn't inferred by stackstac, for some reason)
         stac_endpoint_crs = items[0].properties["proj:epsg"]
 
+        # Only stack the area we actually need, rather than the entire ~110km tiles
+        stack_bounds = self.get_stack_bounds(stac_endpoint_crs, resolution)
+        stack = self.reduce_items(items, stack_bounds, resolution)
+
+        stack = self.clip_and_reproject(stack, stac_endpoint_crs)
+
+        return stack
+
+    def reduce_items(self, items, stack_bounds, resolution=20, epsg=None):
+        """
+        Stack Sentinel items over the given bounds and reduce the time dimension (according to
+        `reduce_time_range`), chunk by chunk, with retries and checkpoints (see `arrange_stack`).
+
+        Args:
+            items (list): List of Sentinel items to stack.
+            stack_bounds (tuple): The (minx, miny, maxx, maxy) bounds of the stack, in the CRS of the items.
+            resolution (int): Resolution of the stacked data.
+            epsg (int, optional): EPSG code of the stack's CRS, which `stack_bounds` are in. Defaults to None,
+                for that of the first item.
+
+        Returns:
+            stack (xarray.DataArray): The reduced (band, y, x) stack, in the STAC endpoint's CRS.
+        """
+        # Get CRS from first item (this isn't inferred by stackstac, for some reason)
+        stac_endpoint_crs = epsg
+        if stac_endpoint_crs is None:
+            stac_endpoint_crs = items[0].properties["proj:epsg"]
+
+        # Size our chunks according to the area, the number of passes and our memory budget
+        chunk_plan = self.plan_chunks(items, stack_bounds, resolution)
+
         # Filter to our relevant bands and stack (again forcing the above crs, from the endpoint itself)
         print("About to stack ^")
         stack = stackstac.stack(
             items,
             epsg=stac_endpoint_crs,
             resolution=resolution,
+            bounds=stack_bounds,
             assets=[self.band_nir, self.band_swir],
-            chunksize=(
-                -1,
-                1,
-                512,
-                512,
-            ),  # Recommended by stackstac docs if we're immediately reducing time
+            chunksize=chunk_plan["chunksize"],
+            dtype=self.dtype,
+            fill_value=np.dtype(self.dtype).type(np.nan),
+            gdal_env=GDAL_ENV,
         )
         stack.rio.write_crs(stac_endpoint_crs, inplace=True)
 
-        # Reduce over the time dimension
+        # Reduce over the time dimension, chunk by chunk, checkpointing as we go
         print("About to reduce stack")
-        stack = self.reduce_time_range(stack)
+        checkpoint_dir = os.path.join(
+            self.checkpoint_dir,
+            checkpoint_key(
+                sorted(item.id for item in items),
+                stack_bounds,
+                resolution,
+                chunk_plan["chunksize"],
+                self.reduced_bands,
+                self.dtype,
+            ),
+        )
+        self.checkpoint_dirs.append(checkpoint_dir)
+
+        # To tell which items of a failing chunk are at fault, they need to be read one at a time
+        item_stack = None
+        if self.drop_failed_items:
+            __time, __band, chunk_height, chunk_width = chunk_plan["chunksize"]
+            item_stack = stackstac.stack(
+                items,
+                epsg=stac_endpoint_crs,
+                resolution=resolution,
+                bounds=stack_bounds,
+                assets=[self.band_nir, self.band_swir],
+                chunksize=(1, 1, chunk_height, chunk_width),
+                dtype=self.dtype,
+                fill_value=np.dtype(self.dtype).type(np.nan),
+                gdal_env=GDAL_ENV,
+            )
 
+        stack, dropped_items = reduce_stack_by_chunk(
+            stack,
+            reducer=self.reduce_time_range,
+            checkpoint_dir=checkpoint_dir,
+            drop_failed_items=self.drop_failed_items,
+            item_stack=item_stack,
+            max_workers=chunk_plan["n_workers"],
+            reduced_bands=self.reduced_bands if self.uncertainty else None,
+        )
+        if dropped_items:
+            print(f"Dropped items with persistently failing reads: {dropped_items}")
+        self.stack_dropped_items = dropped_items
+
+        return stack
+
+    def arrange_tiled_composite(self, items, date_range, resolution=20):
+        """
+        Arrange a (median) composite over our boundary from the composite tile cache
+        (`src.util.composite_tile_cache`), rather than reducing the items over our AOI alone. Tiles of
+        a fixed grid are shared by every fire in the region with the same date window, so only tiles
+        which aren't cached yet are computed (and cached). As tiles extend beyond our AOI, the items
+        for missing tiles are searched for over the tiles themselves. The number of tiles and scenes
+        read is kept on `self.stack_composite_info`.
+
+        Args:
+            items (list): List of Sentinel items over our AOI, in the date window (these give the tile grid's CRS).
+            date_range (list): The date window of the composite.
+            resolution (int): Resolution of the stacked data.
+
+        Returns:
+            stack (xarray.DataArray): The composite, in our desired CRS, clipped to the boundary.
+        """
+        stac_endpoint_crs = items[0].properties["proj:epsg"]
+        stack_bounds = self.get_stack_bounds(stac_endpoint_crs, resolution)
+        reducer_config = {
+            "reducer": "median",
+            "collection": "sentinel-2-l2a",
+            "bands": self.reduced_bands,
+            "dtype": str(self.dtype),
+        }
+
+        tile_keys = {
+            tile_index: composite_tile_key(
+                stac_endpoint_crs, tile_index, resolution, date_range, reducer_config
+            )
+            for tile_index in composite_tiles(stack_bounds, resolution)
+        }
+        tiles = {
+            tile_index: self.composite_tile_cache.load(key)
+            for tile_index, key in tile_keys.items()
+        }
+        missing_tiles = [tile_index for tile_index, tile in tiles.items() if tile is None]
+        print(f"Computing {len(missing_tiles)} of {len(tiles)} composite tiles")
+
+        tile_items = []
+        dropped_items = set()
+        if missing_tiles:
+            missing_bounds = np.array(
+                [composite_tile_bounds(tile_index, resolution) for tile_index in missing_tiles]
+            )
+            tiles_bbox = rasterio.warp.transform_bounds(
+                stac_endpoint_crs,
+                "EPSG:4326",
+                missing_bounds[:, 0].min(),
+                missing_bounds[:, 1].min(),
+                missing_bounds[:, 2].max(),
+                missing_bounds[:, 3].max(),
+            )
+            # The wider search can reach into a neighbouring UTM zone, whose items are on another grid
+            tile_items = [
+                item
+                for item in self.get_items(date_range, bbox=list(tiles_bbox))
+                if item.properties["proj:epsg"] == stac_endpoint_crs
+            ]
+            if not tile_items:
+                raise ValueError(
+                    f"No items in EPSG:{stac_endpoint_crs} over the composite tiles"
+                )
+
+            for tile_index in missing_tiles:
+                print(f"About to compute composite tile {tile_index}")
+                tile = self.reduce_items(
+                    tile_items,
+                    composite_tile_bounds(tile_index, resolution),
+                    resolution,
+                    epsg=stac_endpoint_crs,
+                )
+                self.composite_tile_cache.save(tile_keys[tile_index], tile)
+                tiles[tile_index] = self.composite_tile_cache.load(tile_keys[tile_index])
+                if tiles[tile_index] is None:
+                    # Evicted already, by a concurrent request's prune
+                    tiles[tile_index] = tile
+                dropped_items.update(self.stack_dropped_items)
+            self.composite_tile_cache.prune()
+
+        self.stack_dropped_items = sorted(dropped_items)
+        self.stack_composite_info = {
+            "n_tiles": len(tiles),
+            "n_tiles_computed": len(missing_tiles),
+            "n_scenes_read": len(tile_items),
+        }
+
+        stack = merge_arrays(
+            [tile.rio.write_crs(stac_endpoint_crs) for tile in tiles.values()],
+            nodata=np.nan,
+        )
+        stack = stack.rio.clip_box(*stack_bounds)
+        stack = self.clip_and_reproject(stack, stac_endpoint_crs)
+
+        return stack
+
+    def arrange_cached_stack(self, items, resolution=20):
+        """
+        Arrange and process a stack of Sentinel items as `arrange_stack` does, but through the scene
+        cache (`src.util.scene_cache`): each item's arrays are read once per tile of a fixed grid and
+        cached, so only tiles of items which aren't cached yet (e.g. a new postfire pass, or the part
+        of a neighbouring fire's AOI which doesn't overlap ours) are read. Tile reads are retried with
+        backoff, and if `drop_failed_items` is set, items whose reads of a tile persistently fail are
+        treated as missing over it, and recorded in `self.stack_dropped_items`. The time dimension is
+        then reduced chunk by chunk over the (memory-mapped) cached tiles, with checkpoints, as in
+        `reduce_items`.
+
+        Args:
+            items (list): List of Sentinel items to stack.
+            resolution (int): Resolution of the stacked data.
+
+        Returns:
+            stack (xarray.DataArray): Stacked and processed Sentinel data, in our desired CRS, clipped to the boundary.
+        """
+        stac_endpoint_crs = items[0].properties["proj:epsg"]
+        stack_bounds = self.get_stack_bounds(stac_endpoint_crs, resolution)
+        bands = [self.band_nir, self.band_swir]
+
+        # The tiles of the fixed grid which cover our AOI, and the scenes over all of them
+        tile_size = SCENE_CACHE_TILE_SIZE_PIXELS
+        tile_indices = composite_tiles(
+            stack_bounds, resolution, tile_size_pixels=tile_size
+        )
+        tile_bounds = np.array(
+            [
+                composite_tile_bounds(tile_index, resolution, tile_size_pixels=tile_size)
+                for tile_index in tile_indices
+            ]
+        )
+        grid_minx, grid_miny = tile_bounds[:, :2].min(axis=0)
+        grid_maxx, grid_maxy = tile_bounds[:, 2:].max(axis=0)
+        stack = self.stack_scenes(
+            items, resolution, bounds=(grid_minx, grid_miny, grid_maxx, grid_maxy)
+        )
+
+        def tile_slices(tile_index):
+            minx, miny, maxx, maxy = composite_tile_bounds(
+                tile_index, resolution, tile_size_pixels=tile_size
+            )
+            row_start = round((grid_maxy - maxy) / resolution)
+            col_start = round((minx - grid_minx) / resolution)
+            return (
+                slice(row_start, row_start + tile_size),
+                slice(col_start, col_start + tile_size),
+            )
+
+        tile_keys = {
+            tile_index: scene_tile_key(
+                stac_endpoint_crs,
+                tile_index,
+                resolution,
+                bands,
+                self.dtype,
+                tile_size_pixels=tile_size,
+            )
+            for tile_index in tile_indices
+        }
+        item_ids = [str(item_id) for item_id in stack["id"].values]
+        tile_shape = (len(bands), tile_size, tile_size)
+        scenes = {}
+        for time_index, item_id in enumerate(item_ids):
+            for tile_index in tile_indices:
+                scene = self.scene_cache.load(tile_keys[tile_index], item_id)
+                if scene is not None and scene.shape != tile_shape:
+                    scene = None
+                scenes[(time_index, tile_index)] = scene
+        uncached = [scene_tile for scene_tile, scene in scenes.items() if scene is None]
+        print(
+            f"Reading {len(uncached)} of {len(scenes)} scene tiles, the rest are cached"
+        )
+
+        def read_scene_tile(scene_tile):
+            time_index, tile_index = scene_tile
+            y_slice, x_slice = tile_slices(tile_index)
+            description = f"scene {item_ids[time_index]} over tile {tile_index}"
+            try:
+                values = retry_with_backoff(
+                    stack.isel(time=time_index, y=y_slice, x=x_slice).compute,
+                    description=description,
+                ).values
+            except Exception as e:
+                if not self.drop_failed_items:
+                    raise
+                print(f"Persistent failure of {description} ({e}), treating it as missing")
+                return None
+            self.scene_cache.save(tile_keys[tile_index], item_ids[time_index], values)
+            # Map it back from the cache, rather than holding every new tile in memory
+            return self.scene_cache.load(tile_keys[tile_index], item_ids[time_index])
+
+        chunk_plan = self.plan_chunks(items, stack_bounds, resolution)
+        with ThreadPoolExecutor(max_workers=chunk_plan["n_workers"]) as executor:
+            for scene_tile, scene in zip(
+                uncached, executor.map(read_scene_tile, uncached)
+            ):
+                scenes[scene_tile] = scene
+        dropped_scene_tiles = sorted(
+            (item_ids[time_index], tile_index)
+            for (time_index, tile_index), scene in scenes.items()
+            if scene is None
+        )
+        self.stack_dropped_items = sorted(
+            {item_id for item_id, __tile_index in dropped_scene_tiles}
+        )
+        if self.stack_dropped_items:
+            print(
+                f"Dropped items with persistently failing reads: {self.stack_dropped_items}"
+            )
+        if uncached:
+            self.scene_cache.prune()
+
+        # A lazy stack of the cached tiles (NaN where an item was dropped), cropped to our AOI
+        def scene_tile_array(time_index, tile_index):
+            scene = scenes[(time_index, tile_index)]
+            if scene is None:
+                return da.full(tile_shape, np.nan, dtype=self.dtype)
+            return da.from_array(scene, chunks=tile_shape)
+
+        tile_columns = sorted({column for column, __row in tile_indices})
+        # Rows of the array run north to south, and rows of the grid south to north
+        tile_rows = sorted({row for __column, row in tile_indices}, reverse=True)
+        cached_stack = stack.copy(
+            data=da.stack(
+                [
+                    da.block(
+                        [
+                            [
+                                scene_tile_array(time_index, (column, row))
+                                for column in tile_columns
+                            ]
+                            for row in tile_rows
+                        ]
+                    )
+                    for time_index in range(len(item_ids))
+                ]
+            )
+        )
+        cached_stack = cached_stack.rio.clip_box(*stack_bounds)
+        __time, bands_per_chunk, chunk_height, chunk_width = chunk_plan["chunksize"]
+        cached_stack = cached_stack.chunk(
+            {"time": -1, "band": bands_per_chunk, "y": chunk_height, "x": chunk_width}
+        )
+
+        print("About to reduce cached stack")
+        checkpoint_dir = os.path.join(
+            self.checkpoint_dir,
+            checkpoint_key(
+                sorted(item_ids),
+                dropped_scene_tiles,
+                stack_bounds,
+                resolution,
+                chunk_plan["chunksize"],
+                self.reduced_bands,
+                self.dtype,
+            ),
+        )
+        self.checkpoint_dirs.append(checkpoint_dir)
+        stack, __dropped_items = reduce_stack_by_chunk(
+            cached_stack,
+            reducer=self.reduce_time_range,
+            checkpoint_dir=checkpoint_dir,
+            max_workers=chunk_plan["n_workers"],
+            reduced_bands=self.reduced_bands if self.uncertainty else None,
+        )
+        stack.rio.write_crs(stac_endpoint_crs, inplace=True)
+
+        stack = self.clip_and_reproject(stack, stac_endpoint_crs)
+
+        return stack
+
+    def clip_and_reproject(self, stack, stac_endpoint_crs):
+        """
+        Clip a stack (with no time dimension) to our boundary and reproject it to our desired CRS.
+
+        Args:
+            stack (xarray.DataArray): The stack to clip and reproject, in the STAC endpoint's CRS.
+            stac_endpoint_crs (int): EPSG code of the STAC endpoint's CRS.
+
+        Returns:
+            xarray.DataArray: The clipped and reprojected stack.
+        """
         # Buffer the bounds to ensure we get all the data we need, plus a
         # little extra for visualization outside burn area
 
-        bounds_stac_crs = self.geojson_boundary.to_crs(
-            stac_endpoint_crs
-        ).geometry.values
+        clip_geometry = self.geojson_boundary.to_crs(stac_endpoint_crs).geometry
+        if self.offset_dnbr:
+            # Keep the unburned reference ring, until the offset has been taken from it
+            clip_geometry = clip_geometry.buffer(self.reference_ring_distance)
+        bounds_stac_crs = clip_geometry.values
 
         # Clip to our bounds (need to temporarily convert to the endpoint crs, since we can't reproject til we have <= 3 dims)
         stack = stack.rio.clip(bounds_stac_crs, bounds_stac_crs.crs)
@@ -238,17 +883,369 @@ class Sentinel2Client:
         print("About to reproject")
         stack = stack.rio.reproject(dst_crs=self.crs, nodata=np.nan)
 
+        return stack
+
+    def check_stack_has_data(self, stack):
+        """
+        Check that an arranged stack has data in both of our bands - it won't if, say, none of the
+        items' valid pixels fall within our boundary.
+
+        Args:
+            stack (xarray.DataArray): The arranged stack, as returned by e.g. `arrange_stack`.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If either band is entirely NaN.
+        """
         if (
-            np.isnan(stack.sel(band="B8A").values).all()
-            or np.isnan(stack.sel(band="B12").values).all()
+            np.isnan(stack.sel(band=self.band_nir).values).all()
+            or np.isnan(stack.sel(band=self.band_swir).values).all()
         ):
             raise ValueError("No data in the stack")
 
+    def stack_scenes(
+        self, items, resolution=20, sortby_date=True, bounds=None, assets=None
+    ):
+        """
+        Lazily stack Sentinel items one scene per chunk, for reading a single scene at a time
+        (rather than reducing over all of them at once, as in `arrange_stack`). The chunk plan is
+        kept on `self.chunk_plan`, as `plan_chunks` does.
+
+        Args:
+            items (list): List of Sentinel items to stack.
+            resolution (int): Resolution of the stacked data.
+            sortby_date (bool, optional): Whether to sort the scenes by date, rather than keep the order
+                of `items`. Defaults to True.
+            bounds (tuple, optional): The (minx, miny, maxx, maxy) bounds of the stack, in the CRS of the
+                items. Defaults to None, for those of our boundary (see `get_stack_bounds`).
+            assets (list, optional): Assets (bands) to stack. Defaults to None, for our NIR and SWIR bands.
+
+        Returns:
+            xarray.DataArray: The (time, band, y, x) stack, in the STAC endpoint's CRS.
+        """
+        if assets is None:
+            assets = [self.band_nir, self.band_swir]
+        stac_endpoint_crs = items[0].properties["proj:epsg"]
+        stack_bounds = bounds
+        if stack_bounds is None:
+            stack_bounds = self.get_stack_bounds(stac_endpoint_crs, resolution)
+
+        # We read a single scene at a time, so plan the spatial chunks as if there were one scene
+        self.chunk_plan = plan_stack_chunks(
+            n_time=1,
+            n_bands=len(assets),
+            height=math.ceil((stack_bounds[3] - stack_bounds[1]) / resolution),
+            width=math.ceil((stack_bounds[2] - stack_bounds[0]) / resolution),
+            dtype=self.dtype,
+            memory_budget_bytes=self.memory_budget_bytes,
+        )
+        __time, __band, chunk_height, chunk_width = self.chunk_plan["chunksize"]
+
+        stack = stackstac.stack(
+            items,
+            epsg=stac_endpoint_crs,
+            resolution=resolution,
+            bounds=stack_bounds,
+            assets=assets,
+            chunksize=(1, 1, chunk_height, chunk_width),
+            dtype=self.dtype,
+            fill_value=np.dtype(self.dtype).type(np.nan),
+            sortby_date=sortby_date,
+            gdal_env=GDAL_ENV,
+        )
+        stack.rio.write_crs(stac_endpoint_crs, inplace=True)
+
+        return stack
+
+    def arrange_greedy_composite(self, items, target_date, resolution=20):
+        """
+        Arrange a composite of Sentinel items greedily, rather than taking the median of every
+        scene: scenes are read best first (fewest clouds, closest to `target_date`), filling AOI
+        pixels as they go, until the AOI is covered (see `src.lib.compositing`). The number of
+        scenes actually read is kept on `self.stack_composite_info`. Each scene's clouds and cloud
+        shadows are masked by its scene classification (SCL) band, so they are never composited. If
+        `drop_failed_items` is set, scenes whose reads persistently fail are skipped, and recorded in
+        `self.stack_dropped_items`.
+
+        Args:
+            items (list): List of Sentinel items to composite.
+            target_date (str): Date the scenes should ideally be closest to (`YYYY-MM-DD`), e.g. the
+                ignition date for prefire, or the containment date for postfire.
+            resolution (int): Resolution of the stacked data.
+
+        Returns:
+            stack (xarray.DataArray): The composite, in our desired CRS, clipped to the boundary.
+        """
+        stac_endpoint_crs = items[0].properties["proj:epsg"]
+        ordered_items = order_items_by_quality(
+            items,
+            target_date,
+            cloud_cover={
+                item_id: score["cloud_cover"]
+                for item_id, score in self.scene_scores.items()
+                if score["cloud_cover"] is not None
+            },
+        )
+        stack = self.stack_scenes(
+            ordered_items,
+            resolution,
+            sortby_date=False,
+            assets=[self.band_nir, self.band_swir, SCL_ASSET],
+        )
+
+        aoi_mask = rasterio.features.geometry_mask(
+            self.geojson_boundary.to_crs(stac_endpoint_crs).geometry.values,
+            out_shape=(stack.sizes["y"], stack.sizes["x"]),
+            transform=stack.rio.transform(),
+            invert=True,
+        )
+
+        print("About to composite stack")
+        stack, self.stack_composite_info = greedy_composite(
+            stack,
+            aoi_mask,
+            scl_band=SCL_ASSET,
+            drop_failed_items=self.drop_failed_items,
+        )
+        self.stack_dropped_items = self.stack_composite_info["dropped_items"]
+        if self.stack_dropped_items:
+            print(
+                f"Dropped items with persistently failing reads: {self.stack_dropped_items}"
+            )
+        stack.rio.write_crs(stac_endpoint_crs, inplace=True)
+
+        stack = self.clip_and_reproject(stack, stac_endpoint_crs)
+
         return stack
 
+    def get_acquisition_dates(self, items):
+        """
+        Get the unique acquisition dates of a set of items. Adjacent tiles of the same pass share
+        a date, so this is the number of layers in a per-pass time series.
+
+        Args:
+            items (list): List of Sentinel items.
+
+        Returns:
+            list: Sorted list of unique acquisition dates, as `YYYY-MM-DD` strings.
+        """
+        return sorted(set(item.datetime.strftime("%Y-%m-%d") for item in items))
+
+    def arrange_time_series(self, items, resolution=20):
+        """
+        Arrange a stack of Sentinel items as a per-pass NBR time series, rather than reducing the
+        time dimension. This is a generator which yields one acquisition date at a time (mosaicing
+        tiles acquired on the same date), so only a single date is ever held in memory, no matter
+        how many passes are in the date range.
+
+        Args:
+            items (list): List of Sentinel items to stack.
+            resolution (int): Resolution of the stacked data.
+
+        Yields:
+            tuple: The acquisition date (`YYYY-MM-DD`) and the NBR (xarray.DataArray) for that date,
+                in our desired CRS, clipped to the boundary.
+        """
+        stac_endpoint_crs = items[0].properties["proj:epsg"]
+        stack = self.stack_scenes(items, resolution)
+
+        acquisition_dates = stack.time.dt.strftime("%Y-%m-%d").values
+        for acquisition_date in self.get_acquisition_dates(items):
+            print(f"About to arrange NBR for {acquisition_date}")
+            date_stack = stack.isel(time=acquisition_dates == acquisition_date)
+
+            # Mosaic the tiles of this pass - they only overlap at their edges
+            date_stack = date_stack.median(dim="time")
+            nbr = calc_nbr(
+                date_stack.sel(band=self.band_nir), date_stack.sel(band=self.band_swir)
+            )
+            nbr = retry_with_backoff(nbr.compute, description=f"NBR of {acquisition_date}")
+            nbr.rio.write_crs(stac_endpoint_crs, inplace=True)
+
+            yield acquisition_date, self.clip_and_reproject(nbr, stac_endpoint_crs)
+
+    def calc_nbr_time_series(self, nbr_path, dnbr_path=None):
+        """
+        Calculates per-pass NBR (and optionally dNBR, relative to the prefire NBR composite of the
+        metrics stack) across both the prefire and postfire date ranges, streaming one acquisition
+        date at a time into multi-band GeoTIFFs (one band per date). Requires `query_fire_event` to
+        have been called, and `calc_burn_metrics` as well if `dnbr_path` is given.
+
+        Args:
+            nbr_path (str): Local path to write the NBR time series to.
+            dnbr_path (str, optional): Local path to write the dNBR time series to. Defaults to None.
+
+        Returns:
+            list: The acquisition dates of the time series, in band order.
+        """
+        items = list(self.prefire_items) + list(self.postfire_items)
+        acquisition_dates = self.get_acquisition_dates(items)
+
+        nbr_prefire = None
+        if dnbr_path is not None:
+            nbr_prefire = self.metrics_stack.sel(burn_metric="nbr_prefire")
+
+        write_nbr_time_series(
+            layers=self.arrange_time_series(items),
+            n_layers=len(acquisition_dates),
+            nbr_path=nbr_path,
+            dnbr_path=dnbr_path,
+            nbr_prefire=nbr_prefire,
+        )
+
+        return acquisition_dates
+
+    def calc_recovery(
+        self,
+        prefire_date_range,
+        n_years=RECOVERY_YEARS,
+        resolution=20,
+        max_workers=RECOVERY_MAX_CONCURRENT_YEARS,
+    ):
+        """
+        Build an NBR composite for each year after the fire, in the season of the prefire composite
+        (see `src.lib.recovery.recovery_date_ranges`), and the dNBR of each relative to the prefire
+        NBR of the metrics stack, so requires `calc_burn_metrics` (or `load_metrics_stack_from_cogs`)
+        to have been called. Years are composited in parallel, on a bounded executor, each on a copy
+        of this client with an equal share of the memory budget, and its own per-stack state (chunk
+        plans, dropped items and checkpoints), which is merged back into this client's under
+        "recovery_year_{n}" once every year is done. The scene and composite tile caches are shared
+        by the years on purpose, as their writes are atomic. Every year is reprojected onto the grid
+        of the metrics stack and masked to the boundary, so the years line up pixel for pixel. The
+        (year, y, x) NBR and dNBR are kept on `self.recovery_nbr` and `self.recovery_dnbr`.
+
+        Args:
+            prefire_date_range (list): The prefire date range.
+            n_years (int, optional): Number of years after the fire. Defaults to `RECOVERY_YEARS`.
+            resolution (int, optional): Resolution of the stacked data. Defaults to 20.
+            max_workers (int, optional): Number of years composited at once. Defaults to `RECOVERY_MAX_CONCURRENT_YEARS`.
+
+        Returns:
+            dict: The date range of each year, and the number of passes composited for it (0 for years
+                without imagery, which are left out of the recovery stacks).
+        """
+        nbr_prefire = self.metrics_stack.sel(burn_metric="nbr_prefire", drop=True)
+        aoi_mask = rasterio.features.geometry_mask(
+            self.geojson_boundary.geometry.values,
+            out_shape=(nbr_prefire.rio.height, nbr_prefire.rio.width),
+            transform=nbr_prefire.rio.transform(),
+            invert=True,
+        )
+        aoi_mask = xr.DataArray(aoi_mask, dims=("y", "x"))
+        date_ranges = recovery_date_ranges(prefire_date_range, n_years)
+        n_workers = max(min(max_workers, len(date_ranges)), 1)
+
+        def composite_year(n_year):
+            # Per-stack state (chunk plans, dropped items, checkpoints) is kept on the client, so each
+            # year gets its own copy of it, rather than sharing this client's lists and dicts
+            year_client = copy.copy(self)
+            year_client.memory_budget_bytes = self.memory_budget_bytes // n_workers
+            year_client.chunk_plan = None
+            year_client.chunk_plans = {}
+            year_client.checkpoint_dirs = []
+            year_client.stack_dropped_items = []
+            year_client.dropped_items = {}
+
+            items = year_client.get_items(date_ranges[n_year])
+            if len(items) == 0:
+                print(f"No imagery for year {n_year} after the fire")
+                return 0, None, year_client
+
+            print(f"About to composite year {n_year} after the fire")
+            stack = year_client.arrange_stack(items, resolution)
+            year_client.check_stack_has_data(stack)
+            nbr = calc_nbr(
+                stack.sel(band=self.band_nir, drop=True),
+                stack.sel(band=self.band_swir, drop=True),
+            )
+            nbr = nbr.rio.reproject_match(nbr_prefire, nodata=np.nan)
+            nbr = nbr.assign_coords(x=nbr_prefire.x, y=nbr_prefire.y).where(aoi_mask)
+            return len(np.unique([item.datetime for item in items])), nbr, year_client
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            composites = dict(zip(date_ranges, executor.map(composite_year, date_ranges)))
+
+        for n_year, (__n, nbr, year_client) in composites.items():
+            self.checkpoint_dirs.extend(year_client.checkpoint_dirs)
+            if nbr is not None:
+                self.chunk_plans[f"recovery_year_{n_year}"] = year_client.chunk_plan
+                self.dropped_items[f"recovery_year_{n_year}"] = (
+                    year_client.stack_dropped_items
+                )
+
+        years = [
+            n_year
+            for n_year, (__n, nbr, __client) in composites.items()
+            if nbr is not None
+        ]
+        if not years:
+            raise ValueError("No imagery in any year after the fire")
+
+        self.recovery_nbr = xr.concat(
+            [composites[n_year][1] for n_year in years], dim="year"
+        ).assign_coords(year=years)
+        self.recovery_nbr = self.recovery_nbr.astype(self.dtype)
+        self.recovery_dnbr = calc_dnbr(nbr_prefire, self.recovery_nbr)
+
+        return {
+            "date_ranges": date_ranges,
+            "n_passes": {
+                n_year: n for n_year, (n, __nbr, __client) in composites.items()
+            },
+        }
+
+    def summarize_recovery(self, thresholds, burn_metric="dnbr"):
+        """
+        Summarize the recovery (see `calc_recovery`) into a curve for each severity class, the
+        classes being those of the metrics stack under the given thresholds (see
+        `src.lib.recovery.summarize_recovery`).
+
+        Args:
+            thresholds (dict): Thresholds of the severity classes (see `classify_burn`).
+            burn_metric (str, optional): Metric to classify severity by. Defaults to "dnbr".
+
+        Returns:
+            dict: The recovery curves of each severity class.
+        """
+        severity = classify_burn(
+            self.metrics_stack.sel(burn_metric=burn_metric), thresholds=thresholds
+        )
+        return summarize_recovery(
+            self.recovery_dnbr, severity, classes=sorted(set(thresholds.values()))
+        )
+
+    def write_recovery(self, nbr_path, dnbr_path):
+        """
+        Write the recovery stacks (see `calc_recovery`) as multi-band GeoTIFFs, one band per year
+        after the fire (see `src.lib.nbr_time_series.write_nbr_time_series`).
+
+        Args:
+            nbr_path (str): Local path to write the yearly NBR to.
+            dnbr_path (str): Local path to write the yearly dNBR to.
+
+        Returns:
+            None
+        """
+        nbr_prefire = self.metrics_stack.sel(burn_metric="nbr_prefire", drop=True)
+        write_nbr_time_series(
+            layers=(
+                (f"year_{int(year)}", self.recovery_nbr.sel(year=year, drop=True))
+                for year in self.recovery_nbr.year.values
+            ),
+            n_layers=self.recovery_nbr.sizes["year"],
+            nbr_path=nbr_path,
+            dnbr_path=dnbr_path,
+            nbr_prefire=nbr_prefire,
+            dtype=self.dtype,
+        )
+
     def reduce_time_range(self, range_stack):
         """
         Reduces the time range of the given range stack by taking the median along the time dimension.
+        With uncertainty, the MAD of the per-pass NBR is appended as a band (see
+        `src.lib.uncertainty.calc_nbr_mad`), from the same in-memory range stack as the median.
 
         Args:
             range_stack (xarray.DataArray): The range stack to be reduced.
@@ -263,7 +1260,25 @@ class Sentinel2Client:
         # we might want to look into time-series effects of greenup, drying, etc, in the adjacent
         # non-burned areas so attempt to isolate fire effects vs exogenous seasonal stuff. Ultimately,
         # we just want a decent reducer to squash the time dim, so median works for now.
-        return range_stack.median(dim="time")
+        reduced = range_stack.median(dim="time")
+        if not self.uncertainty:
+            return reduced
+
+        nbr_mad = calc_nbr_mad(
+            range_stack.sel(band=self.band_nir, drop=True),
+            range_stack.sel(band=self.band_swir, drop=True),
+        ).expand_dims(band=[NBR_MAD_BAND])
+        # Per-band metadata (e.g. stackstac's band titles) has no value for the derived band
+        reduced = reduced.drop_vars(
+            [
+                name
+                for name, coord in reduced.coords.items()
+                if "band" in coord.dims and name != "band"
+            ]
+        )
+        return xr.concat(
+            [reduced, nbr_mad.astype(reduced.dtype)], dim="band", coords="minimal"
+        )
 
     def query_fire_event(
         self, prefire_date_range, postfire_date_range, from_bbox=True, max_items=None
@@ -298,10 +1313,61 @@ class Sentinel2Client:
                 "Date ranges insufficient for enough imagery to calculate burn metrics"
             )
 
-        print("About to arrange prefire stack")
-        self.prefire_stack = self.arrange_stack(prefire_items)
-        print("About to arrange postfire stack")
-        self.postfire_stack = self.arrange_stack(postfire_items)
+        if self.screen_scenes:
+            # Drop scenes which are cloudy over our AOI, from a cheap read of their SCL overviews
+            print("About to screen prefire and postfire items")
+            prefire_items, prefire_scores = screen_items(
+                prefire_items, self.geojson_boundary
+            )
+            postfire_items, postfire_scores = screen_items(
+                postfire_items, self.geojson_boundary
+            )
+            self.scene_scores = {**prefire_scores, **postfire_scores}
+
+        self.prefire_items = prefire_items
+        self.postfire_items = postfire_items
+
+        if self.compositing == "greedy":
+            # Prefer scenes just before ignition, and just after containment
+            print("About to composite prefire stack")
+            self.prefire_stack = self.arrange_greedy_composite(
+                prefire_items, target_date=prefire_date_range[1]
+            )
+            self.composite_info["prefire"] = self.stack_composite_info
+            self.chunk_plans["prefire"] = self.chunk_plan
+            self.dropped_items["prefire"] = self.stack_dropped_items
+            print("About to composite postfire stack")
+            self.postfire_stack = self.arrange_greedy_composite(
+                postfire_items, target_date=postfire_date_range[0]
+            )
+            self.composite_info["postfire"] = self.stack_composite_info
+            self.chunk_plans["postfire"] = self.chunk_plan
+            self.dropped_items["postfire"] = self.stack_dropped_items
+        else:
+            if self.composite_tile_cache is not None and not self.screen_scenes:
+                # Prefire composites are shared by fires in the same region and season
+                print("About to arrange prefire stack from composite tiles")
+                self.prefire_stack = self.arrange_tiled_composite(
+                    prefire_items, date_range=prefire_date_range
+                )
+                prefire_composite_info = self.stack_composite_info
+            else:
+                print("About to arrange prefire stack")
+                self.prefire_stack = self.arrange_stack(prefire_items)
+                prefire_composite_info = {"n_scenes_read": len(prefire_items)}
+            self.chunk_plans["prefire"] = self.chunk_plan
+            self.dropped_items["prefire"] = self.stack_dropped_items
+            print("About to arrange postfire stack")
+            self.postfire_stack = self.arrange_stack(postfire_items)
+            self.chunk_plans["postfire"] = self.chunk_plan
+            self.dropped_items["postfire"] = self.stack_dropped_items
+            self.composite_info = {
+                "prefire": prefire_composite_info,
+                "postfire": {"n_scenes_read": len(postfire_items)},
+            }
+
+        for stack in [self.prefire_stack, self.postfire_stack]:
+            self.check_stack_has_data(stack)
 
         n_unique_datetimes_prefire = len(
             np.unique([item.datetime for item in prefire_items])
@@ -318,21 +1384,250 @@ class Sentinel2Client:
             ),
         }
 
+    def plan_query(
+        self,
+        prefire_date_range,
+        postfire_date_range,
+        resolution=20,
+        from_bbox=True,
+        max_items=None,
+    ):
+        """
+        Estimate the cost of `query_fire_event` (and the burn metrics that follow it) without reading
+        any raster data - only the STAC searches are run. The estimate follows the client's options as
+        `query_fire_event` would: the stacks extend over the unburned reference ring with offset dNBR,
+        carry the NBR MAD (and the metrics their uncertainty) with uncertainty, read the scene
+        classification with greedy compositing, and cover whole tiles of the composite tile and scene
+        cache grids. It assumes a cold read of every scene, so it is an upper bound when scenes or
+        composites are cached, and with greedy compositing (which stops once the AOI is covered) or scene
+        screening (which drops cloudy scenes) - these are listed under "not_estimated". See
+        `src.lib.query_planner`.
+
+        Args:
+            prefire_date_range (tuple): A tuple representing the date range for prefire items.
+            postfire_date_range (tuple): A tuple representing the date range for postfire items.
+            resolution (int, optional): Resolution the bands would be stacked at. Defaults to 20.
+            from_bbox (bool, optional): Flag indicating whether to retrieve items from bounding box. Defaults to True.
+            max_items (int, optional): Maximum number of items to retrieve. Defaults to None.
+
+        Returns:
+            dict: The estimated scene count, unique acquisitions, pixels and bytes to read, peak memory and
+                wall time, in total and per stack, and the options whose savings aren't estimated.
+        """
+        items = {
+            "prefire": self.get_items(
+                prefire_date_range, from_bbox=from_bbox, max_items=max_items
+            ),
+            "postfire": self.get_items(
+                postfire_date_range, from_bbox=from_bbox, max_items=max_items
+            ),
+        }
+
+        # Stacks are in the CRS of their first item; any will do to size the AOI
+        epsg = next(
+            (
+                stack_items[0].properties["proj:epsg"]
+                for stack_items in items.values()
+                if len(stack_items) > 0
+            ),
+            self.geojson_boundary.estimate_utm_crs().to_epsg(),
+        )
+        stack_bounds = self.get_stack_bounds(epsg, resolution)
+        minx, miny, maxx, maxy = stack_bounds
+        height = math.ceil((maxy - miny) / resolution)
+        width = math.ceil((maxx - minx) / resolution)
+
+        def tile_grid_shape(tile_size_pixels):
+            # Stacks on a tile grid are read over the whole tiles covering the AOI
+            tiles = composite_tiles(stack_bounds, resolution, tile_size_pixels)
+            return (
+                len({row for __column, row in tiles}) * tile_size_pixels,
+                len({column for column, __row in tiles}) * tile_size_pixels,
+            )
+
+        stack_costs = {}
+        for stack_name, stack_items in items.items():
+            compositing = self.compositing
+            stack_height, stack_width = height, width
+            if compositing == "greedy":
+                # Read with the scene classification, to mask clouds, which isn't composited
+                n_bands, n_reduced_bands = 3, 2
+            else:
+                n_bands, n_reduced_bands = 2, len(self.reduced_bands)
+                if (
+                    stack_name == "prefire"
+                    and self.composite_tile_cache is not None
+                    and not self.screen_scenes
+                ):
+                    compositing = "tiled"
+                    stack_height, stack_width = tile_grid_shape(
+                        COMPOSITE_TILE_SIZE_PIXELS
+                    )
+                elif self.scene_cache is not None:
+                    stack_height, stack_width = tile_grid_shape(
+                        SCENE_CACHE_TILE_SIZE_PIXELS
+                    )
+
+            stack_costs[stack_name] = {
+                **estimate_stack_cost(
+                    stack_items,
+                    height=stack_height,
+                    width=stack_width,
+                    n_bands=n_bands,
+                    dtype=self.dtype,
+                    memory_budget_bytes=self.memory_budget_bytes,
+                    n_reduced_bands=n_reduced_bands,
+                ),
+                "compositing": compositing,
+            }
+
+        n_burn_metrics = N_BURN_METRICS
+        if self.uncertainty and self.compositing != "greedy":
+            n_burn_metrics += len(UNCERTAINTY_METRICS)
+        query_cost = summarize_query_cost(
+            stack_costs,
+            height=height,
+            width=width,
+            dtype=self.dtype,
+            memory_budget_bytes=self.memory_budget_bytes,
+            n_burn_metrics=n_burn_metrics,
+        )
+        query_cost["not_estimated"] = []
+        if self.compositing == "greedy":
+            query_cost["not_estimated"].append("greedy_early_stopping")
+        if self.screen_scenes:
+            query_cost["not_estimated"].append("scene_screening")
+        print(f"Query plan: {query_cost}")
+        return query_cost
+
+    def clear_checkpoints(self):
+        """
+        Remove the chunk checkpoints of the stacks arranged by this client. Call this once the job's
+        results are safely stored - until then, a re-run of the job resumes from the checkpoints.
+
+        Returns:
+            None
+        """
+        for checkpoint_dir in self.checkpoint_dirs:
+            ChunkCheckpoint(checkpoint_dir).clear()
+        self.checkpoint_dirs = []
+
     def calc_burn_metrics(self):
         """
-        Calculates burn metrics using prefire and postfire Sentinel satellite data.
+        Calculates burn metrics using prefire and postfire Sentinel satellite data. If the stacks carry
+        the MAD of their per-pass NBR, the uncertainty of dNBR and rBR is added to the stack too (see
+        `src.lib.uncertainty.calc_burn_metric_uncertainty`). With offset dNBR,
+        the dNBR is offset by that of the unburned reference ring around the boundary (see
+        `src.lib.burn_severity.calc_burn_metrics`), which is then clipped off.
 
         Returns:
             metrics_stack (xarray.DataArray): Stack of burn metrics, wiht bands of nir and swir,
                 named according to self.band_nir and self.band_swir.
         """
+        reference_mask = None
+        if self.offset_dnbr:
+            reference_mask = self.get_reference_ring_mask(self.prefire_stack)
+
         self.metrics_stack = calc_burn_metrics(
             prefire_nir=self.prefire_stack.sel(band=self.band_nir),
             prefire_swir=self.prefire_stack.sel(band=self.band_swir),
             postfire_nir=self.postfire_stack.sel(band=self.band_nir),
             postfire_swir=self.postfire_stack.sel(band=self.band_swir),
+            dtype=self.dtype,
+            reference_mask=reference_mask,
         )
 
+        if (
+            NBR_MAD_BAND in self.prefire_stack.band
+            and NBR_MAD_BAND in self.postfire_stack.band
+        ):
+            # Propagate the noise of the passes behind each composite to dNBR and rBR
+            uncertainty_metrics = calc_burn_metric_uncertainty(
+                nbr_prefire=self.metrics_stack.sel(burn_metric="nbr_prefire", drop=True),
+                rbr=self.metrics_stack.sel(burn_metric="rbr", drop=True),
+                nbr_mad_prefire=self.prefire_stack.sel(band=NBR_MAD_BAND, drop=True),
+                nbr_mad_postfire=self.postfire_stack.sel(band=NBR_MAD_BAND, drop=True),
+            )
+            uncertainty_metrics = uncertainty_metrics.astype(self.metrics_stack.dtype)
+            self.metrics_stack = xr.concat(
+                [self.metrics_stack, uncertainty_metrics],
+                dim="burn_metric",
+                coords="minimal",
+                combine_attrs="override",
+            )
+
+        if self.offset_dnbr:
+            # NaN (without any reference pixels) as None, so it can be reported as JSON
+            self.dnbr_offset_info = {
+                key: None if np.isnan(value) else value
+                for key, value in self.metrics_stack.attrs.items()
+                if key in ["dnbr_offset", "dnbr_offset_mad", "n_reference_pixels"]
+            }
+            print(f"dNBR offset: {self.dnbr_offset_info}")
+            self.metrics_stack = self.metrics_stack.rio.clip(
+                self.geojson_boundary.geometry.values, self.geojson_boundary.crs
+            )
+
+    def refresh_postfire(self, postfire_items, postfire_date_range=None):
+        """
+        Refresh the postfire composite and burn metrics of an existing metrics stack (e.g. as new
+        passes of an active fire land), keeping its prefire NBR, rather than re-acquiring the prefire
+        imagery too. With a scene cache, only postfire items which aren't cached yet are read. Scenes
+        are screened and composited as in `query_fire_event`. The offset dNBR and uncertainty need more
+        of the prefire imagery than the metrics stack keeps, so refresh those with `query_fire_event`.
+
+        Args:
+            postfire_items (list): All postfire items, including new ones.
+            postfire_date_range (list, optional): The postfire date range, for greedy compositing. Defaults to None.
+
+        Returns:
+            dict: The number of postfire passes and the latest pass.
+        """
+        if self.offset_dnbr or self.uncertainty:
+            raise ValueError(
+                "The offset dNBR and uncertainty can't be refreshed from the metrics stack alone, "
+                "re-run query_fire_event instead"
+            )
+        if self.compositing == "greedy" and postfire_date_range is None:
+            raise ValueError("Greedy compositing needs the postfire date range")
+
+        nbr_prefire = self.metrics_stack.sel(burn_metric="nbr_prefire", drop=True)
+
+        if self.screen_scenes:
+            print("About to screen postfire items")
+            postfire_items, self.scene_scores = screen_items(
+                postfire_items, self.geojson_boundary
+            )
+        self.postfire_items = postfire_items
+
+        if self.compositing == "greedy":
+            print("About to composite postfire stack")
+            postfire_stack = self.arrange_greedy_composite(
+                postfire_items, target_date=postfire_date_range[0]
+            )
+        else:
+            print("About to arrange postfire stack")
+            postfire_stack = self.arrange_stack(postfire_items)
+        self.check_stack_has_data(postfire_stack)
+        self.postfire_stack = postfire_stack.rio.reproject_match(
+            nbr_prefire, nodata=np.nan
+        )
+
+        nbr_postfire = calc_nbr(
+            self.postfire_stack.sel(band=self.band_nir, drop=True),
+            self.postfire_stack.sel(band=self.band_swir, drop=True),
+        )
+        self.metrics_stack = calc_burn_metrics_from_nbr(
+            nbr_prefire, nbr_postfire, dtype=self.dtype
+        )
+
+        return {
+            "n_postfire_passes": len(np.unique([item.datetime for item in postfire_items])),
+            "latest_pass": max([item.datetime for item in postfire_items]).strftime(
+                format="%Y-%m-%d"
+            ),
+        }
+
     def classify(self, thresholds, threshold_source, burn_metric="dnbr"):
         """
         Classify the metrics stack based on the given thresholds and threshold source. Note that,
@@ -370,15 +1665,52 @@ class Sentinel2Client:
                 dim="classification_source",
             )
 
-    def derive_boundary_flood_fill(self, seed_points, metric_name="rbr", inplace=True):
+    def sweep_thresholds(self, threshold_sets, classes, burn_metric="dnbr", reference=None):
+        """
+        Score candidate classification thresholds of a burn metric against reference classes (see
+        `src.lib.threshold_sweep.ThresholdSweep`), e.g. to calibrate them against BARC.
+
+        Args:
+            threshold_sets (np.ndarray): The (n_sets, n_thresholds) threshold sets, each ascending.
+            classes (list): Class of each threshold (the same for every set).
+            burn_metric (str, optional): Metric to classify. Defaults to "dnbr".
+            reference (xarray.DataArray, optional): Reference classes, e.g. rasterized field plots.
+                Defaults to the BARC classifications.
+
+        Returns:
+            dict: Agreement scores of each threshold set (see `ThresholdSweep.evaluate`).
+        """
+        metric = self.metrics_stack.sel(burn_metric=burn_metric)
+        if reference is None:
+            reference = self.barc_classifications
+        reference = reference.rio.reproject_match(metric, nodata=np.nan)
+
+        sweep = ThresholdSweep(metric, reference)
+        return sweep.evaluate(threshold_sets, classes)
+
+    def derive_boundary_flood_fill(
+        self,
+        seed_points,
+        metric_name="rbr",
+        inplace=True,
+        histogram=None,
+        coarse_factor=None,
+    ):
         """
         Derive a boundary from the given metric layer based on the specified threshold, and set it as the boundary of the Sentinel2Client.
         This means that, when we derive boundary, we use the derived boundary for visualization (and this boundary is saved as `boundary.geojson`
         within the s3 bucket), and we clip the metrics stack to this boundary.
 
+        The metric is thresholded by Otsu's method, from the histogram of its values within the AOI. The histogram
+        is kept as `threshold_histogram`, so later refinements of the same fire can pass it back in.
+
         Args:
             metric_name (str): Name of the metric layer.
             threshold (float): Threshold value for the metric layer.
+            histogram (dict, optional): Histogram of the metric within the AOI, from an earlier refinement
+                (see `src.lib.derive_boundary.metric_histogram`). Defaults to None, to build it.
+            coarse_factor (int, optional): Derive the boundary coarse to fine, with a coarse pass decimated by this
+                factor (see `src.lib.derive_boundary.derive_boundary`). Defaults to None, for full resolution throughout.
 
         Returns:
             None
@@ -402,11 +1734,14 @@ class Sentinel2Client:
                     True
                 )
 
+        thresholding_strategy = HistogramOtsuThreshold(histogram=histogram)
         geojson_boundary = derive_boundary(
             metric_layer=metric_layer,
-            thresholding_strategy=OtsuThreshold(),
+            thresholding_strategy=thresholding_strategy,
             segmentation_strategy=FloodFillSegmentation(),
+            coarse_factor=coarse_factor,
         )
+        self.threshold_histogram = thresholding_strategy.histogram
         geojson_boundary_gpd = gpd.GeoDataFrame.from_features(geojson_boundary)
 
         if not geojson_boundary:
@@ -0,0 +1,83 @@
+import os
+import datetime
+import numpy as np
+
+# Number of years after the fire to follow recovery for, by default
+RECOVERY_YEARS = int(os.environ.get("RECOVERY_YEARS", 5))
+# Most years after the fire a request may follow recovery for. Each year is another composite to
+# read and upload (and Sentinel-2 L2A only reaches back to 2017)
+RECOVERY_MAX_YEARS = int(os.environ.get("RECOVERY_MAX_YEARS", 10))
+# Number of yearly composites built at once. Each is itself reduced chunk by chunk on a share of
+# the memory budget, so this bounds memory as well as concurrent reads.
+RECOVERY_MAX_CONCURRENT_YEARS = int(os.environ.get("RECOVERY_MAX_CONCURRENT_YEARS", 2))
+# Percentiles of each severity class's dNBR, for the spread of its recovery curve
+RECOVERY_PERCENTILES = [25, 50, 75]
+
+
+def _shift_years(date, n_years):
+    shifted = datetime.date.fromisoformat(date)
+    try:
+        return shifted.replace(year=shifted.year + n_years).isoformat()
+    except ValueError:
+        # February 29th, into a year that has none
+        return shifted.replace(year=shifted.year + n_years, day=28).isoformat()
+
+
+def recovery_date_ranges(prefire_date_range, n_years=RECOVERY_YEARS):
+    """
+    Get the date ranges of the yearly composites of a recovery analysis - the prefire date range,
+    shifted forward by each of 1 to `n_years` years. Each year is then composited in the same season
+    as the prefire composite, so the dNBR between them reflects recovery rather than phenology.
+
+    Args:
+        prefire_date_range (list): The prefire date range (`YYYY-MM-DD`).
+        n_years (int, optional): Number of years after the fire. Defaults to `RECOVERY_YEARS`.
+
+    Returns:
+        dict: Date ranges of each year after the fire, keyed by the number of years.
+    """
+    start, end = prefire_date_range
+    return {
+        n_year: [_shift_years(start, n_year), _shift_years(end, n_year)]
+        for n_year in range(1, n_years + 1)
+    }
+
+
+def summarize_recovery(
+    recovery_dnbr, severity, classes, percentiles=RECOVERY_PERCENTILES
+):
+    """
+    Summarize per-year dNBR into a recovery curve for each severity class: the percentiles of the
+    dNBR of the class's pixels in each year. As vegetation returns, a class's dNBR relative to
+    prefire falls back towards 0.
+
+    Args:
+        recovery_dnbr (xr.DataArray): The (year, y, x) dNBR of each year, relative to prefire.
+        severity (xr.DataArray): The (y, x) severity class of each pixel, on the same grid.
+        classes (list): The severity classes to summarize.
+        percentiles (list, optional): Percentiles of the dNBR of each class. Defaults to `RECOVERY_PERCENTILES`.
+
+    Returns:
+        dict: The years, and for each class (keyed by its string), its number of pixels and, for each
+            percentile, its dNBR in each year (None where there is no data).
+    """
+    dnbr_values = np.asarray(recovery_dnbr.values).reshape(recovery_dnbr.shape[0], -1)
+    severity_values = np.ravel(np.asarray(severity.values))
+
+    curves = {}
+    for severity_class in classes:
+        class_dnbr = dnbr_values[:, severity_values == severity_class]
+        curve = {"n_pixels": int(class_dnbr.shape[1])}
+        for percentile in percentiles:
+            values = np.full(class_dnbr.shape[0], np.nan)
+            has_data = np.isfinite(class_dnbr).any(axis=1)
+            if has_data.any():
+                values[has_data] = np.nanpercentile(
+                    class_dnbr[has_data], percentile, axis=1
+                )
+            curve[f"p{percentile}"] = [
+                None if np.isnan(value) else round(float(value), 4) for value in values
+            ]
+        curves[str(severity_class)] = curve
+
+    return {"years": [int(year) for year in recovery_dnbr.year.values], "classes": curves}
@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import xarray as xr
+
+CHUNK_MAX_RETRIES = int(os.environ.get("CHUNK_MAX_RETRIES", 3))
+CHUNK_RETRY_BACKOFF_SECONDS = float(os.environ.get("CHUNK_RETRY_BACKOFF_SECONDS", 2))
+CHUNK_CHECKPOINT_DIR = os.environ.get(
+    "CHUNK_CHECKPOINT_DIR",
+    os.path.join(tempfile.gettempdir(), "burn-severity-chunk-checkpoints"),
+)
+
+
+def retry_with_backoff(
+    fn,
+    max_retries=CHUNK_MAX_RETRIES,
+    backoff_seconds=CHUNK_RETRY_BACKOFF_SECONDS,
+    description="",
+):
+    """
+    Call `fn`, retrying with exponential backoff if it raises.
+
+    Args:
+        fn (callable): Function to call, with no arguments.
+        max_retries (int, optional): Number of retries after the first attempt. Defaults to `CHUNK_MAX_RETRIES`.
+        backoff_seconds (float, optional): Wait before the first retry, doubling for each retry after
+            that. Defaults to `CHUNK_RETRY_BACKOFF_SECONDS`.
+        description (str, optional): Description of what is being called, for logging. Defaults to "".
+
+    Returns:
+        The return value of `fn`.
+
+    Raises:
+        Exception: Whatever `fn` raised on its last attempt.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            wait_seconds = backoff_seconds * 2**attempt
+            print(
+                f"Attempt {attempt + 1} of {description} failed ({e}), retrying in {wait_seconds}s"
+            )
+            time.sleep(wait_seconds)
+
+
+def checkpoint_key(*parts):
+    """
+    Get a stable key for a set of JSON-serializable parts (e.g. item ids, bounds and chunk shape),
+    to name the checkpoint directory of a chunked computation.
+
+    Returns:
+        str: The key.
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ChunkCheckpoint:
+    """
+    Completed chunks of a chunked computation, persisted to local disk so that a failed job
+    can be re-run without recomputing (and re-reading) the chunks it already completed.
+
+    Args:
+        checkpoint_dir (str): Directory of this computation's checkpoint.
+    """
+
+    def __init__(self, checkpoint_dir):
+        self.checkpoint_dir = checkpoint_dir
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+    def _path(self, chunk_index, suffix):
+        return os.path.join(
+            self.checkpoint_dir, "_".join(str(i) for i in chunk_index) + suffix
+        )
+
+    def load(self, chunk_index):
+        """
+        Load a completed chunk.
+
+        Args:
+            chunk_index (tuple): Index of the chunk.
+
+        Returns:
+            tuple: The chunk values (np.ndarray) and the ids of any items dropped while computing it,
+                or None if the chunk hasn't been completed.
+        """
+        try:
+            values = np.load(self._path(chunk_index, ".npy"))
+        except FileNotFoundError:
+            return None
+
+        dropped_items = []
+        if os.path.exists(self._path(chunk_index, ".dropped.json")):
+            with open(self._path(chunk_index, ".dropped.json")) as f:
+                dropped_items = json.load(f)
+
+        return values, dropped_items
+
+    def save(self, chunk_index, values, dropped_items):
+        """
+        Save a completed chunk. The values are written to a temporary file and renamed into place,
+        so an interrupted save never leaves a partial chunk behind.
+
+        Args:
+            chunk_index (tuple): Index of the chunk.
+            values (np.ndarray): The chunk values.
+            dropped_items (list): Ids of any items dropped while computing the chunk.
+
+        Returns:
+            None
+        """
+        if dropped_items:
+            with open(self._path(chunk_index, ".dropped.json"), "w") as f:
+                json.dump(dropped_items, f)
+
+        with tempfile.NamedTemporaryFile(
+            dir=self.checkpoint_dir, suffix=".npy", delete=False
+        ) as tmp:
+            np.save(tmp, values)
+        os.replace(tmp.name, self._path(chunk_index, ".npy"))
+
+    def clear(self):
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+
+def _reduce_chunk(
+    stack,
+    item_stack,
+    chunk_slices,
+    reducer,
+    drop_failed_items,
+    retry_kwargs,
+    n_reduced_bands=None,
+):
+    """
+    Read and reduce a single chunk of the stack, retrying with backoff. If the chunk keeps failing
+    and `drop_failed_items` is set, each item (time slice) of the chunk is read on its own from
+    `item_stack`, and those which keep failing are treated as missing.
+
+    Returns:
+        tuple: The reduced chunk values and the ids of any dropped items.
+    """
+    band_slice, y_slice, x_slice = chunk_slices
+    chunk = stack.isel(band=band_slice, y=y_slice, x=x_slice)
+    description = f"chunk (band={band_slice}, y={y_slice}, x={x_slice})"
+
+    try:
+        return (
+            retry_with_backoff(
+                lambda: reducer(chunk.compute()).values,
+                description=description,
+                **retry_kwargs,
+            ),
+            [],
+        )
+    except Exception as e:
+        if not drop_failed_items:
+            raise
+        print(f"Persistent failure of {description} ({e}), reading items individually")
+
+    readable = []
+    dropped_items = []
+    item_chunks = item_stack.isel(band=band_slice, y=y_slice, x=x_slice)
+    for time_index in range(chunk.sizes["time"]):
+        item_chunk = item_chunks.isel(time=[time_index])
+        try:
+            readable.append(
+                retry_with_backoff(
+                    item_chunk.compute,
+                    description=f"item {time_index} of {description}",
+                    **retry_kwargs,
+                )
+            )
+        except Exception:
+            item_id = (
+                str(item_chunk["id"].values[0])
+                if "id" in item_chunk.coords
+                else str(time_index)
+            )
+            print(f"Treating item {item_id} as missing for {description}")
+            dropped_items.append(item_id)
+
+    if not readable:
+        n_bands = n_reduced_bands or chunk.sizes["band"]
+        shape = (n_bands, chunk.sizes["y"], chunk.sizes["x"])
+        return np.full(shape, np.nan, dtype=stack.dtype), dropped_items
+
+    return reducer(xr.concat(readable, dim="time")).values, dropped_items
+
+
+def reduce_stack_by_chunk(
+    stack,
+    reducer,
+    checkpoint_dir=None,
+    drop_failed_items=False,
+    item_stack=None,
+    max_workers=None,
+    max_retries=CHUNK_MAX_RETRIES,
+    backoff_seconds=CHUNK_RETRY_BACKOFF_SECONDS,
+    reduced_bands=None,
+):
+    """
+    Reduce a lazily-read (dask backed) stack over time, one chunk at a time, so that a transient
+    read error only costs a re-read of the chunk it hit, rather than the whole stack. Each chunk is
+    retried with exponential backoff, and completed chunks are checkpointed to local disk so a
+    re-run of a failed job only computes the chunks that didn't complete.
+
+    Args:
+        stack (xr.DataArray): The (time, band, y, x) stack, chunked along band, y and x only.
+        reducer (callable): Reduces an in-memory (time, band, y, x) xr.DataArray over time, to a (band, y, x) xr.DataArray.
+        checkpoint_dir (str, optional): Directory to checkpoint completed chunks to. Defaults to None (no checkpointing).
+        drop_failed_items (bool, optional): Whether to treat items whose reads persistently fail as missing,
+            rather than failing the whole reduction. Defaults to False.
+        item_stack (xr.DataArray, optional): The same stack, chunked one item per chunk, to read items individually
+            from when dropping failed items. A time slice of `stack` would still read every item of its chunk.
+            Defaults to `stack`.
+        max_workers (int, optional): Number of chunks to reduce concurrently. Defaults to the number of CPUs.
+        max_retries (int, optional): Number of retries per read. Defaults to `CHUNK_MAX_RETRIES`.
+        backoff_seconds (float, optional): Wait before the first retry of a read. Defaults to `CHUNK_RETRY_BACKOFF_SECONDS`.
+        reduced_bands (list, optional): Bands of the reducer's output, if they aren't those of the stack (e.g. a
+            reducer which also derives bands from the time series). The stack must then be a single band chunk.
+            Defaults to None, for the stack's bands.
+
+    Returns:
+        tuple: The reduced (band, y, x) xr.DataArray, and the sorted ids of any items which were dropped.
+    """
+    checkpoint = ChunkCheckpoint(checkpoint_dir) if checkpoint_dir else None
+    retry_kwargs = {"max_retries": max_retries, "backoff_seconds": backoff_seconds}
+    if item_stack is None:
+        item_stack = stack
+
+    __time_chunks, band_chunks, y_chunks, x_chunks = stack.chunks
+    n_reduced_bands = None
+    if reduced_bands is not None:
+        if len(band_chunks) > 1:
+            raise ValueError(
+                "Reducing to other bands needs every band in the same chunk"
+            )
+        n_reduced_bands = len(reduced_bands)
+    chunk_slices = {}
+    for chunk_index in itertools.product(
+        range(len(band_chunks)), range(len(y_chunks)), range(len(x_chunks))
+    ):
+        chunk_slices[chunk_index] = tuple(
+            slice(sum(chunks[:i]), sum(chunks[: i + 1]))
+            for chunks, i in zip([band_chunks, y_chunks, x_chunks], chunk_index)
+        )
+
+    def reduce_chunk(chunk_index):
+        if checkpoint is not None:
+            completed = checkpoint.load(chunk_index)
+            if completed is not None:
+                return completed
+
+        values, dropped_items = _reduce_chunk(
+            stack,
+            item_stack,
+            chunk_slices[chunk_index],
+            reducer,
+            drop_failed_items,
+            retry_kwargs,
+            n_reduced_bands=n_reduced_bands,
+        )
+        if checkpoint is not None:
+            checkpoint.save(chunk_index, values, dropped_items)
+        return values, dropped_items
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        reduced_chunks = dict(
+            zip(chunk_slices, executor.map(reduce_chunk, chunk_slices))
+        )
+
+    reduced_values = None
+    dropped_items = set()
+    for chunk_index, (values, chunk_dropped_items) in reduced_chunks.items():
+        if reduced_values is None:
+            n_bands = n_reduced_bands or stack.sizes["band"]
+            shape = (n_bands, stack.sizes["y"], stack.sizes["x"])
+            reduced_values = np.full(shape, np.nan, dtype=values.dtype)
+        band_slice, y_slice, x_slice = chunk_slices[chunk_index]
+        if reduced_bands is not None:
+            band_slice = slice(None)
+        reduced_values[band_slice, y_slice, x_slice] = values
+        dropped_items.update(chunk_dropped_items)
+
+    coords = {
+        name: coord for name, coord in stack.coords.items() if "time" not in coord.dims
+    }
+    if reduced_bands is not None:
+        coords = {
+            name: coord for name, coord in coords.items() if "band" not in coord.dims
+        }
+        coords["band"] = list(reduced_bands)
+    reduced = xr.DataArray(
+        reduced_values, dims=("band", "y", "x"), coords=coords, attrs=stack.attrs
+    )
+    if stack.rio.crs is not None:
+        reduced.rio.write_crs(stack.rio.crs, inplace=True)
+
+    return reduced, sorted(dropped_items)
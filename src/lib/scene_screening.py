@@ -0,0 +1,144 @@
+import os
+import math
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import rasterio
+import rasterio.features
+import rasterio.windows
+from rasterio.enums import Resampling
+from src.lib.resilient_compute import retry_with_backoff
+
+# Scene classification (SCL) classes which occlude the surface: cloud shadow, cloud (medium and
+# high probability) and thin cirrus
+CLOUDY_SCL_CLASSES = [3, 8, 9, 10]
+SCL_NODATA = 0
+SCL_ASSET = "SCL"
+
+SCENE_MAX_AOI_CLOUD_COVER = float(os.environ.get("SCENE_MAX_AOI_CLOUD_COVER", 50))
+SCENE_MIN_AOI_DATA_COVERAGE = float(os.environ.get("SCENE_MIN_AOI_DATA_COVERAGE", 1))
+# Read SCL at 1/8 of its native (20m) resolution, i.e. 160m, from the COG's overviews
+SCENE_SCREENING_DECIMATION = int(os.environ.get("SCENE_SCREENING_DECIMATION", 8))
+
+
+def score_item_cloudiness(item, aoi_gpd, decimation=SCENE_SCREENING_DECIMATION):
+    """
+    Score the cloudiness of an item over the AOI (rather than over its whole ~110km tile, as
+    `eo:cloud_cover` does), from a decimated read of its scene classification (SCL) band. Only
+    the window covering the AOI is read, and at the reduced resolution, GDAL reads from the COG's
+    overviews, so this costs a small fraction of the bytes of a full resolution read.
+
+    Args:
+        item (pystac.Item): The Sentinel-2 L2A item, with signed asset URLs.
+        aoi_gpd (gpd.GeoDataFrame): The AOI.
+        decimation (int, optional): Factor to reduce the SCL resolution by. Defaults to `SCENE_SCREENING_DECIMATION`.
+
+    Returns:
+        dict: The percent of the item's AOI pixels which are cloudy (None if it has no data over the AOI),
+            and the percent of AOI pixels the item has data for.
+    """
+    aoi_item_crs = aoi_gpd.to_crs(item.properties["proj:epsg"])
+
+    with rasterio.Env(GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR"):
+        with rasterio.open(item.assets[SCL_ASSET].href) as src:
+            window = rasterio.windows.from_bounds(
+                *aoi_item_crs.total_bounds, transform=src.transform
+            )
+            window = window.round_offsets().round_lengths()
+            out_shape = (
+                max(math.ceil(window.height / decimation), 1),
+                max(math.ceil(window.width / decimation), 1),
+            )
+            scl = src.read(
+                1,
+                window=window,
+                out_shape=out_shape,
+                resampling=Resampling.nearest,
+                boundless=True,
+                fill_value=SCL_NODATA,
+            )
+            window_transform = src.window_transform(window) @ rasterio.Affine.scale(
+                window.width / out_shape[1], window.height / out_shape[0]
+            )
+
+    aoi_mask = rasterio.features.geometry_mask(
+        aoi_item_crs.geometry.values,
+        out_shape=out_shape,
+        transform=window_transform,
+        invert=True,
+        all_touched=True,
+    )
+    n_aoi_pixels = max(int(aoi_mask.sum()), 1)
+    has_data = aoi_mask & (scl != SCL_NODATA)
+    n_data_pixels = int(has_data.sum())
+
+    cloud_cover = None
+    if n_data_pixels > 0:
+        n_cloudy_pixels = int((has_data & np.isin(scl, CLOUDY_SCL_CLASSES)).sum())
+        cloud_cover = 100 * n_cloudy_pixels / n_data_pixels
+
+    return {
+        "cloud_cover": cloud_cover,
+        "data_coverage": 100 * n_data_pixels / n_aoi_pixels,
+    }
+
+
+def screen_items(
+    items,
+    aoi_gpd,
+    max_cloud_cover=SCENE_MAX_AOI_CLOUD_COVER,
+    min_data_coverage=SCENE_MIN_AOI_DATA_COVERAGE,
+    decimation=SCENE_SCREENING_DECIMATION,
+    max_workers=None,
+):
+    """
+    Screen candidate items before reading them at full resolution, keeping only those which are
+    mostly clear over the AOI (see `score_item_cloudiness`), and which have any data over it at all.
+    Items which fail to be scored are kept, as are all items if none pass, so screening never
+    leaves a job with less imagery than it would have had without it.
+
+    Args:
+        items (list): List of Sentinel-2 L2A items, with signed asset URLs.
+        aoi_gpd (gpd.GeoDataFrame): The AOI.
+        max_cloud_cover (float, optional): Maximum percent of the AOI that may be cloudy. Defaults to
+            `SCENE_MAX_AOI_CLOUD_COVER`.
+        min_data_coverage (float, optional): Minimum percent of the AOI the item must have data for.
+            Defaults to `SCENE_MIN_AOI_DATA_COVERAGE`.
+        decimation (int, optional): Factor to reduce the SCL resolution by. Defaults to `SCENE_SCREENING_DECIMATION`.
+        max_workers (int, optional): Number of items to score concurrently. Defaults to the number of CPUs.
+
+    Returns:
+        tuple: The kept items (in their original order), and the scores of all scored items, keyed by item id.
+    """
+
+    def score(item):
+        try:
+            return retry_with_backoff(
+                lambda: score_item_cloudiness(item, aoi_gpd, decimation),
+                description=f"screening of {item.id}",
+            )
+        except Exception as e:
+            print(f"Failed to screen {item.id} ({e}), keeping it")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        scores = dict(zip([item.id for item in items], executor.map(score, items)))
+
+    def passes(item):
+        item_score = scores[item.id]
+        if item_score is None:
+            return True
+        return (
+            item_score["data_coverage"] >= min_data_coverage
+            and item_score["cloud_cover"] is not None
+            and item_score["cloud_cover"] <= max_cloud_cover
+        )
+
+    kept_items = [item for item in items if passes(item)]
+    if not kept_items:
+        print("No items passed screening, keeping them all")
+        kept_items = list(items)
+
+    print(f"Kept {len(kept_items)} of {len(items)} items after screening")
+    scores = {item_id: score for item_id, score in scores.items() if score is not None}
+
+    return kept_items, scores
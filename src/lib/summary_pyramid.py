@@ -0,0 +1,557 @@
+import os
+import numpy as np
+import shapely
+from rasterio.transform import Affine
+from rasterio.windows import Window, from_bounds
+
+# Block sizes (in pixels) of the levels of a summary pyramid, finest first. Each must divide the
+# next, so a block of one level is exactly covered by blocks of the finer level below it.
+SUMMARY_PYRAMID_BLOCK_SIZES = [
+    int(block_size)
+    for block_size in os.environ.get(
+        "SUMMARY_PYRAMID_BLOCK_SIZES", "32,128,512,2048"
+    ).split(",")
+]
+# Bins of the coarse histogram of each block, spanning the range of the metric
+SUMMARY_PYRAMID_HISTOGRAM_BINS = int(
+    os.environ.get("SUMMARY_PYRAMID_HISTOGRAM_BINS", 32)
+)
+# Whether `upload_cogs` emits a summary pyramid alongside each metric COG
+UPLOAD_SUMMARY_PYRAMIDS = (
+    os.environ.get("UPLOAD_SUMMARY_PYRAMIDS", "true").lower() == "true"
+)
+
+_BLOCK_STATS = ["count", "sum", "sum_sq", "min", "max", "histogram"]
+
+
+def _bin_index(values, bin_edges):
+    n_bins = len(bin_edges) - 1
+    scaled = (values - bin_edges[0]) / (bin_edges[-1] - bin_edges[0]) * n_bins
+    return np.clip(np.floor(scaled), 0, n_bins - 1).astype("int64")
+
+
+def _histogram_dtype(block_size):
+    return np.min_scalar_type(block_size * block_size)
+
+
+def _finest_level(values, block_size, bin_edges):
+    n_rows, n_cols = values.shape
+    n_block_rows = -(-n_rows // block_size)
+    n_block_cols = -(-n_cols // block_size)
+
+    padded = np.full(
+        (n_block_rows * block_size, n_block_cols * block_size), np.nan, dtype="float64"
+    )
+    padded[:n_rows, :n_cols] = values
+    blocks = padded.reshape(n_block_rows, block_size, n_block_cols, block_size)
+    valid = np.isfinite(blocks)
+
+    filled = np.where(valid, blocks, 0.0)
+    level = {
+        "count": valid.sum(axis=(1, 3), dtype="int64"),
+        "sum": filled.sum(axis=(1, 3)),
+        "sum_sq": (filled * filled).sum(axis=(1, 3)),
+        "min": np.where(valid, blocks, np.inf).min(axis=(1, 3)),
+        "max": np.where(valid, blocks, -np.inf).max(axis=(1, 3)),
+    }
+
+    # Count the valid values of each block in each bin, in one pass over the raster
+    n_bins = len(bin_edges) - 1
+    block_ids = np.arange(n_block_rows * n_block_cols).reshape(
+        n_block_rows, 1, n_block_cols, 1
+    )
+    block_ids = np.broadcast_to(block_ids, blocks.shape)[valid]
+    bins = _bin_index(blocks[valid], bin_edges)
+    level["histogram"] = (
+        np.bincount(
+            block_ids * n_bins + bins, minlength=n_block_rows * n_block_cols * n_bins
+        )
+        .reshape(n_block_rows, n_block_cols, n_bins)
+        .astype(_histogram_dtype(block_size))
+    )
+    return level
+
+
+def _aggregate_level(level, factor, block_size):
+    n_block_rows, n_block_cols = level["count"].shape
+    n_rows = -(-n_block_rows // factor)
+    n_cols = -(-n_block_cols // factor)
+
+    aggregated = {}
+    for stat, empty, reduce in [
+        ("count", 0, np.sum),
+        ("sum", 0.0, np.sum),
+        ("sum_sq", 0.0, np.sum),
+        ("min", np.inf, np.min),
+        ("max", -np.inf, np.max),
+        ("histogram", 0, np.sum),
+    ]:
+        values = level[stat]
+        padded = np.full(
+            (n_rows * factor, n_cols * factor) + values.shape[2:],
+            empty,
+            dtype="int64" if stat == "histogram" else values.dtype,
+        )
+        padded[:n_block_rows, :n_block_cols] = values
+        padded = padded.reshape(
+            (n_rows, factor, n_cols, factor) + values.shape[2:]
+        )
+        aggregated[stat] = reduce(padded, axis=(1, 3))
+    aggregated["histogram"] = aggregated["histogram"].astype(
+        _histogram_dtype(block_size)
+    )
+    return aggregated
+
+
+def build_summary_pyramid(
+    values,
+    block_sizes=SUMMARY_PYRAMID_BLOCK_SIZES,
+    n_bins=SUMMARY_PYRAMID_HISTOGRAM_BINS,
+    bin_range=None,
+):
+    """
+    Get the per-block statistics of a raster at each of several block sizes - the count, sum, sum of
+    squares, min and max of the valid (finite) values of each block, and a coarse histogram of them.
+    The finest level is computed from the raster, in one pass, and each coarser level from the
+    level below it.
+
+    Args:
+        values (np.ndarray): The (y, x) raster.
+        block_sizes (list, optional): Block sizes of the levels, each dividing the next. Defaults to `SUMMARY_PYRAMID_BLOCK_SIZES`.
+        n_bins (int, optional): Number of histogram bins. Defaults to `SUMMARY_PYRAMID_HISTOGRAM_BINS`.
+        bin_range (tuple, optional): The (min, max) of the histogram bins. Defaults to the range of the raster.
+
+    Returns:
+        tuple: The levels (a dict of the (block_row, block_col) arrays of each statistic, keyed by
+            block size), and the histogram bin edges. Blocks without valid values have a min of inf
+            and a max of -inf.
+    """
+    block_sizes = sorted(block_sizes)
+    for block_size, next_block_size in zip(block_sizes, block_sizes[1:]):
+        if next_block_size % block_size:
+            raise ValueError(
+                f"Block sizes must each divide the next, got {block_size} and {next_block_size}"
+            )
+
+    values = np.asarray(values)
+    if bin_range is None:
+        finite = values[np.isfinite(values)]
+        bin_range = (
+            (float(finite.min()), float(finite.max())) if finite.size else (0.0, 1.0)
+        )
+    low, high = bin_range
+    if high <= low:
+        high = low + 1.0
+    bin_edges = np.linspace(low, high, n_bins + 1)
+
+    # The finest level is built a strip of rows at a time, to bound the memory of the float64
+    # temporaries to a strip rather than the whole raster
+    strips = [
+        _finest_level(
+            values[strip_start : strip_start + block_sizes[-1]],
+            block_sizes[0],
+            bin_edges,
+        )
+        for strip_start in range(0, max(values.shape[0], 1), block_sizes[-1])
+    ]
+    levels = {
+        block_sizes[0]: {
+            stat: np.concatenate([strip[stat] for strip in strips])
+            for stat in _BLOCK_STATS
+        }
+    }
+    for block_size, next_block_size in zip(block_sizes, block_sizes[1:]):
+        levels[next_block_size] = _aggregate_level(
+            levels[block_size], next_block_size // block_size, next_block_size
+        )
+    return levels, bin_edges
+
+
+class _WindowQuery:
+    def __init__(self, row_start, row_stop, col_start, col_stop):
+        self.row_start, self.row_stop = row_start, row_stop
+        self.col_start, self.col_stop = col_start, col_stop
+
+    def block_coverage(self, row_starts, row_stops, col_starts, col_stops):
+        inside = (
+            (row_starts >= self.row_start)
+            & (row_stops <= self.row_stop)
+            & (col_starts >= self.col_start)
+            & (col_stops <= self.col_stop)
+        )
+        touches = (
+            (row_starts < self.row_stop)
+            & (row_stops > self.row_start)
+            & (col_starts < self.col_stop)
+            & (col_stops > self.col_start)
+        )
+        return inside, touches
+
+    def read_pixels(self, read_window, row_start, row_stop, col_start, col_stop):
+        # Only the part of the block within the window
+        return read_window(
+            max(row_start, self.row_start),
+            min(row_stop, self.row_stop),
+            max(col_start, self.col_start),
+            min(col_stop, self.col_stop),
+        )
+
+
+class _PolygonQuery:
+    def __init__(self, geometry, transform):
+        self.geometry = geometry
+        self.transform = transform
+        shapely.prepare(self.geometry)
+
+    def block_coverage(self, row_starts, row_stops, col_starts, col_stops):
+        # Corners of each block, in the CRS of the pyramid
+        x_0, y_0 = self.transform @ (col_starts, row_starts)
+        x_1, y_1 = self.transform @ (col_stops, row_stops)
+        boxes = shapely.box(
+            np.minimum(x_0, x_1),
+            np.minimum(y_0, y_1),
+            np.maximum(x_0, x_1),
+            np.maximum(y_0, y_1),
+        )
+        return shapely.covers(self.geometry, boxes), shapely.intersects(
+            self.geometry, boxes
+        )
+
+    def read_pixels(self, read_window, row_start, row_stop, col_start, col_stop):
+        values = read_window(row_start, row_stop, col_start, col_stop)
+        # Pixels whose center is within the polygon, as `rasterio.mask.mask` takes them. Testing
+        # the centers against the prepared polygon is much cheaper than rasterizing it per block.
+        rows, cols = np.mgrid[row_start:row_stop, col_start:col_stop]
+        x, y = self.transform @ (cols + 0.5, rows + 0.5)
+        return values[shapely.contains_xy(self.geometry, x, y)]
+
+
+class SummaryPyramid:
+    """
+    Per-block summary statistics of a metric raster at several block sizes (see
+    `build_summary_pyramid`), which answer statistics over a window or polygon without reading the
+    raster itself. A query is resolved coarse to fine: blocks of the coarsest level wholly within it
+    contribute their precomputed statistics, blocks it partly covers are split into the blocks of the
+    next level, and so on. Only blocks of the finest level on the query's edge are read at full
+    resolution, so the pixels read scale with its perimeter rather than its area.
+
+    Args:
+        levels (dict): Per-block statistics of each level, keyed by block size.
+        bin_edges (np.ndarray): Edges of the histogram bins.
+        shape (tuple): The (y, x) shape of the raster.
+        transform (affine.Affine, optional): Transform of the raster, for polygon and bounds queries. Defaults to None.
+        crs (str, optional): CRS of the raster (as WKT or an authority string). Defaults to None.
+
+    Attributes:
+        block_sizes (list): Block sizes of the levels, finest first.
+    """
+
+    def __init__(self, levels, bin_edges, shape, transform=None, crs=None):
+        self.levels = levels
+        self.block_sizes = sorted(levels)
+        self.bin_edges = np.asarray(bin_edges, dtype="float64")
+        self.shape = tuple(int(size) for size in shape)
+        self.transform = transform
+        self.crs = crs
+
+    @classmethod
+    def from_array(
+        cls,
+        metric,
+        block_sizes=SUMMARY_PYRAMID_BLOCK_SIZES,
+        n_bins=SUMMARY_PYRAMID_HISTOGRAM_BINS,
+    ):
+        """
+        Build the summary pyramid of a (y, x) metric, keeping its transform and CRS.
+
+        Args:
+            metric (xr.DataArray): The metric.
+            block_sizes (list, optional): Block sizes of the levels. Defaults to `SUMMARY_PYRAMID_BLOCK_SIZES`.
+            n_bins (int, optional): Number of histogram bins. Defaults to `SUMMARY_PYRAMID_HISTOGRAM_BINS`.
+
+        Returns:
+            SummaryPyramid: The summary pyramid.
+        """
+        levels, bin_edges = build_summary_pyramid(
+            metric.values, block_sizes=block_sizes, n_bins=n_bins
+        )
+        crs = metric.rio.crs
+        return cls(
+            levels,
+            bin_edges,
+            metric.shape,
+            transform=metric.rio.transform(),
+            crs=crs.to_wkt() if crs else None,
+        )
+
+    def to_npz(self, path):
+        """
+        Write the summary pyramid to a compressed `.npz` file.
+
+        Args:
+            path (str): Path of the file.
+
+        Returns:
+            None
+        """
+        arrays = {
+            f"{block_size}_{stat}": level[stat]
+            for block_size, level in self.levels.items()
+            for stat in _BLOCK_STATS
+        }
+        arrays["block_sizes"] = np.array(self.block_sizes)
+        arrays["bin_edges"] = self.bin_edges
+        arrays["shape"] = np.array(self.shape)
+        if self.transform is not None:
+            arrays["transform"] = np.array(self.transform[:6])
+        if self.crs is not None:
+            arrays["crs"] = np.array(self.crs)
+        with open(path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def from_npz(cls, path):
+        """
+        Read a summary pyramid written by `to_npz`.
+
+        Args:
+            path (str): Path of the file.
+
+        Returns:
+            SummaryPyramid: The summary pyramid.
+        """
+        with np.load(path) as arrays:
+            levels = {
+                int(block_size): {
+                    stat: arrays[f"{block_size}_{stat}"] for stat in _BLOCK_STATS
+                }
+                for block_size in arrays["block_sizes"]
+            }
+            return cls(
+                levels,
+                arrays["bin_edges"],
+                arrays["shape"],
+                transform=(
+                    Affine(*arrays["transform"]) if "transform" in arrays else None
+                ),
+                crs=str(arrays["crs"]) if "crs" in arrays else None,
+            )
+
+    def window_stats(self, row_off, col_off, height, width, read_window):
+        """
+        Get the statistics of a pixel window of the raster.
+
+        Args:
+            row_off (int): First row of the window.
+            col_off (int): First column of the window.
+            height (int): Number of rows of the window.
+            width (int): Number of columns of the window.
+            read_window (callable): Reads the full resolution values of a window of the raster, given
+                its row start, row stop, column start and column stop (see `cog_window_reader`).
+
+        Returns:
+            dict: The statistics of the window (see `_summarize`).
+        """
+        row_start, col_start = max(row_off, 0), max(col_off, 0)
+        row_stop = min(row_off + height, self.shape[0])
+        col_stop = min(col_off + width, self.shape[1])
+        return self._query(
+            _WindowQuery(row_start, row_stop, col_start, col_stop),
+            (row_start, row_stop, col_start, col_stop),
+            read_window,
+        )
+
+    def bounds_stats(self, bounds, read_window):
+        """
+        Get the statistics of the pixels intersecting bounds, in the CRS of the raster.
+
+        Args:
+            bounds (tuple): The (minx, miny, maxx, maxy) bounds.
+            read_window (callable): Reads the full resolution values of a window of the raster (see `window_stats`).
+
+        Returns:
+            dict: The statistics of the bounds (see `_summarize`).
+        """
+        window = (
+            from_bounds(*bounds, transform=self.transform)
+            .round_offsets()
+            .round_lengths()
+        )
+        return self.window_stats(
+            window.row_off, window.col_off, window.height, window.width, read_window
+        )
+
+    def polygon_stats(self, geometry, read_window):
+        """
+        Get the statistics of the pixels whose center is within a polygon.
+
+        Args:
+            geometry (shapely.Geometry): The polygon, in the CRS of the raster.
+            read_window (callable): Reads the full resolution values of a window of the raster (see `window_stats`).
+
+        Returns:
+            dict: The statistics of the polygon (see `_summarize`).
+        """
+        window = (
+            from_bounds(*geometry.bounds, transform=self.transform)
+            .round_offsets()
+            .round_lengths()
+        )
+        pixel_bounds = (
+            max(window.row_off, 0),
+            min(window.row_off + window.height, self.shape[0]),
+            max(window.col_off, 0),
+            min(window.col_off + window.width, self.shape[1]),
+        )
+        return self._query(
+            _PolygonQuery(geometry, self.transform), pixel_bounds, read_window
+        )
+
+    def _query(self, query, pixel_bounds, read_window):
+        stats = {
+            "count": 0,
+            "sum": 0.0,
+            "sum_sq": 0.0,
+            "min": np.inf,
+            "max": -np.inf,
+            "histogram": np.zeros(len(self.bin_edges) - 1, dtype="int64"),
+            "n_pixels_read": 0,
+        }
+        row_start, row_stop, col_start, col_stop = pixel_bounds
+        if row_stop <= row_start or col_stop <= col_start:
+            return self._summarize(stats)
+
+        # Blocks of the coarsest level overlapping the query's bounding window
+        coarsest = self.block_sizes[-1]
+        block_rows, block_cols = np.meshgrid(
+            np.arange(row_start // coarsest, -(-row_stop // coarsest)),
+            np.arange(col_start // coarsest, -(-col_stop // coarsest)),
+            indexing="ij",
+        )
+        block_rows, block_cols = block_rows.ravel(), block_cols.ravel()
+
+        for level_index in range(len(self.block_sizes) - 1, -1, -1):
+            block_size = self.block_sizes[level_index]
+            level = self.levels[block_size]
+
+            row_starts = block_rows * block_size
+            col_starts = block_cols * block_size
+            row_stops = np.minimum(row_starts + block_size, self.shape[0])
+            col_stops = np.minimum(col_starts + block_size, self.shape[1])
+            inside, touches = query.block_coverage(
+                row_starts, row_stops, col_starts, col_stops
+            )
+
+            # Blocks wholly within the query contribute their precomputed statistics
+            counts = level["count"][block_rows[inside], block_cols[inside]]
+            if counts.sum():
+                stats["count"] += int(counts.sum())
+                stats["sum"] += float(
+                    level["sum"][block_rows[inside], block_cols[inside]].sum()
+                )
+                stats["sum_sq"] += float(
+                    level["sum_sq"][block_rows[inside], block_cols[inside]].sum()
+                )
+                stats["min"] = min(
+                    stats["min"],
+                    float(level["min"][block_rows[inside], block_cols[inside]].min()),
+                )
+                stats["max"] = max(
+                    stats["max"],
+                    float(level["max"][block_rows[inside], block_cols[inside]].max()),
+                )
+                stats["histogram"] += level["histogram"][
+                    block_rows[inside], block_cols[inside]
+                ].sum(axis=0, dtype="int64")
+
+            # Blocks on the edge of the query, with valid values, are split into finer blocks
+            edge = touches & ~inside
+            edge[edge] = level["count"][block_rows[edge], block_cols[edge]] > 0
+            block_rows, block_cols = block_rows[edge], block_cols[edge]
+
+            if level_index == 0:
+                for block_row, block_col in zip(block_rows, block_cols):
+                    self._add_pixels(
+                        stats,
+                        query.read_pixels(
+                            read_window,
+                            block_row * block_size,
+                            min((block_row + 1) * block_size, self.shape[0]),
+                            block_col * block_size,
+                            min((block_col + 1) * block_size, self.shape[1]),
+                        ),
+                    )
+            else:
+                factor = block_size // self.block_sizes[level_index - 1]
+                offset_rows, offset_cols = np.divmod(np.arange(factor * factor), factor)
+                block_rows = (block_rows[:, None] * factor + offset_rows).ravel()
+                block_cols = (block_cols[:, None] * factor + offset_cols).ravel()
+                finer_shape = self.levels[self.block_sizes[level_index - 1]]["count"].shape
+                in_raster = (block_rows < finer_shape[0]) & (block_cols < finer_shape[1])
+                block_rows, block_cols = block_rows[in_raster], block_cols[in_raster]
+
+        return self._summarize(stats)
+
+    def _add_pixels(self, stats, values):
+        values = np.asarray(values, dtype="float64").ravel()
+        stats["n_pixels_read"] += values.size
+        values = values[np.isfinite(values)]
+        if not values.size:
+            return
+        stats["count"] += values.size
+        stats["sum"] += float(values.sum())
+        stats["sum_sq"] += float((values * values).sum())
+        stats["min"] = min(stats["min"], float(values.min()))
+        stats["max"] = max(stats["max"], float(values.max()))
+        stats["histogram"] += np.bincount(
+            _bin_index(values, self.bin_edges), minlength=len(self.bin_edges) - 1
+        )
+
+    def _summarize(self, stats):
+        """
+        Get the summary statistics of accumulated block and pixel statistics.
+
+        Returns:
+            dict: The count of valid pixels, their mean, standard deviation, min and max (None if
+                there are none), their histogram and its bin edges, and the number of pixels read at
+                full resolution.
+        """
+        count = stats["count"]
+        mean = std = None
+        if count:
+            mean = stats["sum"] / count
+            std = float(np.sqrt(max(stats["sum_sq"] / count - mean * mean, 0.0)))
+        return {
+            "count": count,
+            "mean": mean,
+            "std": std,
+            "min": stats["min"] if count else None,
+            "max": stats["max"] if count else None,
+            "histogram": [int(n) for n in stats["histogram"]],
+            "bin_edges": [float(edge) for edge in self.bin_edges],
+            "n_pixels_read": int(stats["n_pixels_read"]),
+        }
+
+
+def cog_window_reader(src):
+    """
+    Get a window reader of the first band of an open raster (see `SummaryPyramid.window_stats`),
+    which applies the band's scale and offset (as of quantized metric COGs) and masks its nodata.
+
+    Args:
+        src (rasterio.DatasetReader): The open raster, e.g. a metric COG.
+
+    Returns:
+        callable: Reads the values of a window, given its row start, row stop, column start and column stop.
+    """
+    scale, offset, nodata = src.scales[0], src.offsets[0], src.nodata
+
+    def read_window(row_start, row_stop, col_start, col_stop):
+        window = Window.from_slices((row_start, row_stop), (col_start, col_stop))
+        stored = src.read(1, window=window)
+        values = stored * scale + offset
+        if nodata is not None:
+            values[stored == nodata] = np.nan
+        return values
+
+    return read_window
@@ -0,0 +1,146 @@
+import itertools
+import numpy as np
+
+
+def candidate_threshold_sets(candidate_thresholds):
+    """
+    Get every strictly ascending threshold set with one threshold from each list of candidates,
+    e.g. to sweep the low/moderate/high dNBR thresholds over a grid.
+
+    Args:
+        candidate_thresholds (list): Lists of candidate values of each threshold, lowest threshold first.
+
+    Returns:
+        np.ndarray: The (n_sets, n_thresholds) threshold sets.
+    """
+    threshold_sets = [
+        threshold_set
+        for threshold_set in itertools.product(*candidate_thresholds)
+        if all(low < high for low, high in zip(threshold_set, threshold_set[1:]))
+    ]
+    return np.array(threshold_sets, dtype="float64").reshape(
+        -1, len(candidate_thresholds)
+    )
+
+
+class ThresholdSweep:
+    """
+    Scores candidate classification thresholds of a burn metric against reference labels (e.g.
+    BARC, or rasterized field plots), without classifying the raster once per candidate.
+
+    The metric values of each reference class are sorted once, up front. With the classes of
+    `src.lib.burn_severity.classify_burn` (a pixel takes the class of the lowest threshold it is
+    below), the number of pixels of a reference class which a threshold set puts in each class is
+    then a difference of cumulative counts - the number of the class's values below each
+    threshold, found by binary search of its sorted values. Thousands of threshold sets are scored
+    with a handful of searches each, and no further pass over the raster.
+
+    Args:
+        metric (np.ndarray or xr.DataArray): The burn metric (e.g. dNBR).
+        reference (np.ndarray or xr.DataArray): Reference class of each pixel, on the grid of `metric`.
+        reference_nodata (int, optional): Reference value of unlabelled pixels, besides NaN. Defaults to None.
+
+    Attributes:
+        reference_classes (np.ndarray): The reference classes, ascending.
+        n_pixels (int): Number of pixels with both a metric value and a reference class.
+    """
+
+    def __init__(self, metric, reference, reference_nodata=None):
+        values = np.ravel(np.asarray(metric))
+        labels = np.ravel(np.asarray(reference))
+        if values.shape != labels.shape:
+            raise ValueError("The metric and reference must be on the same grid")
+
+        valid = np.isfinite(values)
+        if labels.dtype.kind == "f":
+            valid &= np.isfinite(labels)
+        if reference_nodata is not None:
+            valid &= labels != reference_nodata
+
+        values = values[valid]
+        labels = labels[valid]
+        self.dtype = values.dtype
+        self.n_pixels = int(values.size)
+        self.reference_classes = np.unique(labels)
+
+        # One sort, by class and then by value, leaves each class's values contiguous and sorted
+        order = np.lexsort((values, labels))
+        class_starts = np.searchsorted(labels[order], self.reference_classes)
+        self._sorted_values = (
+            np.split(values[order], class_starts[1:]) if self.n_pixels else []
+        )
+
+    def confusion(self, threshold_sets, classes):
+        """
+        Get the confusion matrix of each threshold set against the reference classes.
+
+        Args:
+            threshold_sets (np.ndarray): The (n_sets, n_thresholds) threshold sets, each ascending.
+            classes (list): Class of each threshold (the same for every set).
+
+        Returns:
+            np.ndarray: The (n_sets, n_reference_classes, n_thresholds + 1) counts of the pixels of each
+                reference class put in the class of each threshold, and (last) left unclassified.
+        """
+        threshold_sets = np.atleast_2d(np.asarray(threshold_sets, dtype="float64"))
+        if threshold_sets.shape[1] != len(classes):
+            raise ValueError(
+                f"Expected {len(classes)} thresholds per set, got {threshold_sets.shape[1]}"
+            )
+        if np.any(np.diff(threshold_sets, axis=1) <= 0):
+            raise ValueError("Thresholds within each set must be strictly ascending")
+
+        # Compare in the metric's precision, as `classify_burn` does
+        if self.dtype.kind == "f":
+            threshold_sets = threshold_sets.astype(self.dtype)
+
+        confusion = np.empty(
+            (len(threshold_sets), len(self.reference_classes), len(classes) + 1),
+            dtype="int64",
+        )
+        for class_index, sorted_values in enumerate(self._sorted_values):
+            # Number of the class's values below each threshold
+            n_below = np.searchsorted(sorted_values, threshold_sets, side="left")
+            confusion[:, class_index, :-1] = np.diff(n_below, axis=1, prepend=0)
+            confusion[:, class_index, -1] = sorted_values.size - n_below[:, -1]
+        return confusion
+
+    def evaluate(self, threshold_sets, classes):
+        """
+        Score each threshold set by its agreement with the reference classes.
+
+        Args:
+            threshold_sets (np.ndarray): The (n_sets, n_thresholds) threshold sets, each ascending
+                (see `candidate_threshold_sets`).
+            classes (list): Class of each threshold (the same for every set), comparable to the reference classes.
+
+        Returns:
+            dict: The threshold sets, their overall accuracy and Cohen's kappa, the index of the set
+                with the highest kappa, and the confusion matrices (see `confusion`).
+        """
+        threshold_sets = np.atleast_2d(np.asarray(threshold_sets, dtype="float64"))
+        confusion = self.confusion(threshold_sets, classes)
+        n_pixels = max(self.n_pixels, 1)
+
+        # Which (reference class, threshold) pairs agree - unclassified pixels never do
+        agrees = np.zeros(confusion.shape[1:], dtype=bool)
+        agrees[:, :-1] = self.reference_classes[:, None] == np.asarray(classes)[None, :]
+
+        overall_accuracy = (confusion * agrees).sum(axis=(1, 2)) / n_pixels
+
+        # Chance agreement, from the share of pixels in each class in the reference and the prediction
+        reference_share = confusion.sum(axis=2) / n_pixels
+        predicted_share = (confusion.sum(axis=1)[:, None, :] * agrees).sum(
+            axis=2
+        ) / n_pixels
+        chance_agreement = (reference_share * predicted_share).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            kappa = (overall_accuracy - chance_agreement) / (1 - chance_agreement)
+
+        return {
+            "threshold_sets": threshold_sets,
+            "overall_accuracy": overall_accuracy,
+            "kappa": kappa,
+            "best_index": int(np.nanargmax(kappa)) if np.isfinite(kappa).any() else None,
+            "confusion": confusion,
+        }
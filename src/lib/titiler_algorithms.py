@@ -2,6 +2,7 @@ from titiler.core.algorithm import BaseAlgorithm
 from titiler.core.algorithm import algorithms as default_algorithms
 from rio_tiler.models import ImageData
 import numpy as np
+from src.lib.quantization import unscale_image_data
 
 
 def convert_to_rgb(classified: np.ndarray, mask: np.ndarray, color: str) -> np.ndarray:
@@ -46,7 +47,8 @@ class Classify(BaseAlgorithm):
     def __call__(self, img: ImageData) -> ImageData:
         """
         Apply classification algorithm to the input image. Essentially, this converts floats to
-        integers based on a set of thresholds, input by the GET request for a tile.
+        integers based on a set of thresholds, input by the GET request for a tile. Quantized
+        (int16) COGs are unscaled to floats first.
 
         Args:
             img (ImageData): Input image data.
@@ -54,7 +56,7 @@ class Classify(BaseAlgorithm):
         Returns:
             ImageData: Classified image data.
         """
-        float_burn_data = img.data.squeeze()
+        float_burn_data = unscale_image_data(img).squeeze()
         float_thresholds = {float(k): v for k, v in self.thresholds.items()}
         png_int_values = list(float_thresholds.values())
 
@@ -97,25 +99,28 @@ class CensorAndScale(BaseAlgorithm):
         scale_min = float(self.thresholds["min"])
         scale_max = float(self.thresholds["max"])
 
+        # Unscale quantized (int16) COGs to floats
+        burn_data = unscale_image_data(img)
+
         # Create masks for values below min and above max
-        mask_below = img.data < scale_min
-        mask_above = img.data > scale_max
+        mask_below = burn_data < scale_min
+        mask_above = burn_data > scale_max
 
         # Create a mask for NaN values or values equal to -99
-        mask_transparent = (np.isnan(img.data)) | (img.data == -99)
+        mask_transparent = (np.isnan(burn_data)) | (burn_data == -99)
 
         # Set values below min to white (255, 255, 255) and above max to red (255, 0, 0)
-        img.data[mask_below] = 255
-        img.data[mask_above] = 0
+        burn_data[mask_below] = 255
+        burn_data[mask_above] = 0
 
         # Scale values between min and max to 255 to 0
         mask_middle = ~mask_below & ~mask_above
-        img.data[mask_middle] = (
-            255 - ((img.data[mask_middle] - scale_min) / (scale_max - scale_min)) * 255
+        burn_data[mask_middle] = (
+            255 - ((burn_data[mask_middle] - scale_min) / (scale_max - scale_min)) * 255
         )
 
         # Convert to uint8
-        int_data = img.data.astype(np.uint8).squeeze()
+        int_data = burn_data.astype(np.uint8).squeeze()
 
         final_img = convert_to_rgb(int_data, mask_transparent, self.color)
 
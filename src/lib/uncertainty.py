@@ -0,0 +1,57 @@
+import numpy as np
+import xarray as xr
+
+# Band of a reduced (band, y, x) stack holding the median absolute deviation (MAD) of the per-pass
+# NBR, alongside the median NIR and SWIR
+NBR_MAD_BAND = "nbr_mad"
+
+# Burn metrics holding the uncertainty of dNBR and rBR, in units of NBR MAD
+UNCERTAINTY_METRICS = ["dnbr_uncertainty", "rbr_uncertainty"]
+
+
+def calc_nbr_mad(band_nir, band_swir, dim="time"):
+    """
+    Get the median absolute deviation of the per-pass NBR of a stack - how noisy each pixel's
+    passes were, which a median composite hides. This is taken from the same in-memory chunk as
+    the median composite itself, so it doesn't add a pass over the time stack. Pixels with fewer
+    than two valid passes have no measure of their spread, so are NaN.
+
+    Args:
+        band_nir (xr.DataArray): NIR of each pass.
+        band_swir (xr.DataArray): SWIR of each pass.
+        dim (str, optional): The time dimension. Defaults to "time".
+
+    Returns:
+        xr.DataArray: The MAD of the per-pass NBR.
+    """
+    nbr = (band_nir - band_swir) / (band_nir + band_swir)
+    nbr_median = nbr.median(dim=dim)
+    nbr_mad = np.abs(nbr - nbr_median).median(dim=dim)
+    return nbr_mad.where(nbr.notnull().sum(dim=dim) >= 2)
+
+
+def calc_burn_metric_uncertainty(nbr_prefire, rbr, nbr_mad_prefire, nbr_mad_postfire):
+    """
+    Propagate the uncertainty of the prefire and postfire NBR (see `calc_nbr_mad`) to dNBR and rBR,
+    to first order, treating the prefire and postfire passes as independent. As
+    `rbr = (nbr_prefire - nbr_postfire) / (nbr_prefire + 1.001)`, its sensitivity to the prefire NBR
+    is `(1 - rbr) / (nbr_prefire + 1.001)`, and to the postfire NBR `-1 / (nbr_prefire + 1.001)`.
+
+    Args:
+        nbr_prefire (xr.DataArray): Pre-fire NBR.
+        rbr (xr.DataArray): Relative burn ratio (rBR).
+        nbr_mad_prefire (xr.DataArray): MAD of the per-pass pre-fire NBR.
+        nbr_mad_postfire (xr.DataArray): MAD of the per-pass post-fire NBR.
+
+    Returns:
+        xr.DataArray: Stack of the dNBR and rBR uncertainty, along `burn_metric`.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dnbr_uncertainty = np.sqrt(nbr_mad_prefire**2 + nbr_mad_postfire**2)
+        rbr_uncertainty = np.sqrt(
+            ((1 - rbr) * nbr_mad_prefire) ** 2 + nbr_mad_postfire**2
+        ) / np.abs(nbr_prefire + 1.001)
+
+    return xr.concat(
+        [dnbr_uncertainty, rbr_uncertainty], dim="burn_metric", coords="minimal"
+    ).assign_coords(burn_metric=UNCERTAINTY_METRICS)
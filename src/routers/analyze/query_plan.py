@@ -0,0 +1,165 @@
+from fastapi import Depends, APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+from logging import Logger
+from typing import Any
+from pydantic import BaseModel
+import sentry_sdk
+import json
+from shapely.ops import unary_union
+
+from ..dependencies import (
+    get_cloud_logger,
+    get_cloud_static_io_client,
+    get_scene_cache,
+    get_composite_tile_cache,
+    init_sentry,
+)
+from src.lib.query_sentinel import Sentinel2Client
+from src.lib.quantization import QUANTIZE_METRIC_COGS
+from src.util.cloud_static_io import CloudStaticIOClient
+from src.util.scene_cache import SceneCache
+from src.util.composite_tile_cache import CompositeTileCache
+
+router = APIRouter()
+
+
+class QueryPlanPOSTBody(BaseModel):
+    """
+    Represents the request body for estimating the cost of analyzing burn metrics.
+
+    Attributes:
+        geojson (str): The GeoJSON data in string format.
+        date_ranges (dict): The date ranges for analysis.
+        fire_event_name (str): The name of the fire event.
+        time_series (bool): Flag indicating whether the analysis would also produce per-pass time series.
+        compositing (str): How the analysis would composite the scenes (see `/api/analyze/spectral-burn-metrics`).
+        screen_scenes (bool): Flag indicating whether the analysis would screen out cloudy scenes.
+        offset_dnbr (bool): Flag indicating whether the analysis would offset the dNBR by an unburned ring.
+        uncertainty (bool): Flag indicating whether the analysis would also produce the uncertainty of dNBR and rBR.
+        quantize_metrics (bool): Flag indicating whether the analysis would store the metric COGs quantized to int16.
+    """
+
+    geojson: Any
+    date_ranges: dict
+    fire_event_name: str
+    time_series: bool = False
+    compositing: str = "median"
+    screen_scenes: bool = False
+    offset_dnbr: bool = False
+    uncertainty: bool = False
+    quantize_metrics: bool = QUANTIZE_METRIC_COGS
+
+
+@router.post(
+    "/api/analyze/spectral-burn-metrics/dry-run",
+    tags=["analysis"],
+    description="Estimate the cost of deriving spectral burn metrics within a boundary, without reading any imagery.",
+)
+def plan_spectral_burn_metrics(
+    body: QueryPlanPOSTBody,
+    cloud_static_io_client: CloudStaticIOClient = Depends(get_cloud_static_io_client),
+    scene_cache: SceneCache = Depends(get_scene_cache),
+    composite_tile_cache: CompositeTileCache = Depends(get_composite_tile_cache),
+    __sentry: None = Depends(init_sentry),
+    logger: Logger = Depends(get_cloud_logger),
+):
+    """
+    Estimates the cost of `/api/analyze/spectral-burn-metrics` for a given fire event - the scene count,
+    unique acquisitions, pixels and bytes to read, peak memory and wall time - from the STAC searches
+    alone, so that admission and scheduling decisions can be made before committing to the analysis.
+
+    Args:
+        body (QueryPlanPOSTBody): The request body containing the fire event.
+        cloud_static_io_client (CloudStaticIOClient, optional): The client for interacting with the cloud storage service. FastAPI handles this as a dependency injection.
+        scene_cache (SceneCache, optional): Cache of individual scenes' arrays on the instance's local disk, or None unless `SCENE_CACHE_ENABLED`. FastAPI handles this as a dependency injection.
+        composite_tile_cache (CompositeTileCache, optional): Cache of regional prefire composite tiles on the instance's local disk, or None unless `COMPOSITE_TILE_CACHE_ENABLED`. FastAPI handles this as a dependency injection.
+        __sentry (None, optional): Sentry client, just needs to be initialized. FastAPI handles this as a dependency injection.
+        logger (Logger, optional): Google cloud logger. FastAPI handles this as a dependency injection.
+
+    Returns:
+        JSONResponse: The estimated cost of the analysis.
+    """
+    sentry_sdk.set_context("fire-event", {"request": body})
+    geojson_boundary = json.loads(body.geojson)
+
+    return main(
+        geojson_boundary,
+        body.date_ranges,
+        body.fire_event_name,
+        logger,
+        cloud_static_io_client,
+        time_series=body.time_series,
+        compositing=body.compositing,
+        screen_scenes=body.screen_scenes,
+        offset_dnbr=body.offset_dnbr,
+        uncertainty=body.uncertainty,
+        quantize_metrics=body.quantize_metrics,
+        scene_cache=scene_cache,
+        composite_tile_cache=composite_tile_cache,
+    )
+
+
+def main(
+    geojson_boundary,
+    date_ranges,
+    fire_event_name,
+    logger,
+    cloud_static_io_client,
+    time_series=False,
+    compositing="median",
+    screen_scenes=False,
+    offset_dnbr=False,
+    uncertainty=False,
+    quantize_metrics=QUANTIZE_METRIC_COGS,
+    scene_cache=None,
+    composite_tile_cache=None,
+):
+    logger.info(f"Received dry-run request for {fire_event_name}")
+
+    try:
+        # With the same options as the analysis, so the plan (and product key) match it
+        geo_client = Sentinel2Client(
+            geojson_boundary=geojson_boundary,
+            buffer=0.1,
+            compositing=compositing,
+            screen_scenes=screen_scenes,
+            scene_cache=scene_cache,
+            composite_tile_cache=composite_tile_cache,
+            offset_dnbr=offset_dnbr,
+            uncertainty=uncertainty,
+        )
+
+        # An existing product covering the AOI is reused, rather than re-acquired
+        reuses_product = False
+        if geo_client.reuses_products and not time_series and not uncertainty:
+            product_index = cloud_static_io_client.get_product_index()
+            key = geo_client.get_product_key(
+                prefire_date_range=date_ranges["prefire"],
+                postfire_date_range=date_ranges["postfire"],
+                quantized=quantize_metrics,
+            )
+            boundary_geometry = unary_union(geo_client.geojson_boundary.geometry.values)
+            reuses_product = (
+                product_index.find_covering(key, boundary_geometry) is not None
+            )
+
+        query_plan = geo_client.plan_query(
+            prefire_date_range=date_ranges["prefire"],
+            postfire_date_range=date_ranges["postfire"],
+            from_bbox=True,
+        )
+        logger.info(f"Query plan for {fire_event_name}: {query_plan}")
+
+        return JSONResponse(
+            status_code=200,
+            content={
+                "fire_event_name": fire_event_name,
+                "reuses_product": reuses_product,
+                "query_plan": query_plan,
+            },
+        )
+
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        logger.error(f"Error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,161 @@
+from fastapi import Depends, APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+from logging import Logger
+from typing import Any
+from pydantic import BaseModel
+import tempfile
+import os
+import sentry_sdk
+import json
+
+from ..dependencies import get_cloud_logger, get_cloud_static_io_client, init_sentry
+from src.lib.query_sentinel import Sentinel2Client
+from src.lib.product_index import REQUIRED_METRICS
+from src.lib.recovery import RECOVERY_YEARS, RECOVERY_MAX_YEARS
+from src.util.cloud_static_io import CloudStaticIOClient
+
+router = APIRouter()
+
+
+class AnalyzeRecoveryPOSTBody(BaseModel):
+    """
+    Represents the request body for analyzing post-fire recovery.
+
+    Attributes:
+        geojson (str): The GeoJSON data in string format.
+        date_ranges (dict): The date ranges of the original analysis - each year after the fire is composited in
+            the season of its prefire date range.
+        fire_event_name (str): The name of the fire event, which must already have been analyzed.
+        affiliation (str): The affiliation of the fire event.
+        thresholds (dict): Thresholds of the severity classes to summarize recovery for (see `classify_burn`).
+        burn_metric (str): Metric the thresholds apply to.
+        n_years (int): Number of years after the fire to follow recovery for, at most `RECOVERY_MAX_YEARS`.
+    """
+
+    geojson: Any
+    date_ranges: dict
+    fire_event_name: str
+    affiliation: str
+    thresholds: dict
+    burn_metric: str = "dnbr"
+    n_years: int = RECOVERY_YEARS
+
+
+@router.post(
+    "/api/analyze/recovery",
+    tags=["analysis"],
+    description="Derive yearly post-fire NBR and dNBR, and recovery curves per severity class, of an analyzed fire event.",
+)
+def analyze_recovery(
+    body: AnalyzeRecoveryPOSTBody,
+    cloud_static_io_client: CloudStaticIOClient = Depends(get_cloud_static_io_client),
+    __sentry: None = Depends(init_sentry),
+    logger: Logger = Depends(get_cloud_logger),
+):
+    """
+    Analyzes the recovery of a fire event in the years after it: a composite of each year, in the
+    season of the prefire composite, and its dNBR relative to the prefire NBR of the fire's existing
+    metrics. The yearly NBR and dNBR are uploaded as multi-band GeoTIFFs (one band per year), along
+    with the recovery curves of each severity class.
+
+    Args:
+        body (AnalyzeRecoveryPOSTBody): The request body containing the fire event.
+        cloud_static_io_client (CloudStaticIOClient, optional): The client for interacting with the cloud storage service. FastAPI handles this as a dependency injection.
+        __sentry (None, optional): Sentry client, just needs to be initialized. FastAPI handles this as a dependency injection.
+        logger (Logger, optional): Google cloud logger. FastAPI handles this as a dependency injection.
+
+    Returns:
+        JSONResponse: The recovery curves, and the paths of the uploaded products.
+    """
+    sentry_sdk.set_context("fire-event", {"request": body})
+    geojson_boundary = json.loads(body.geojson)
+
+    return main(
+        geojson_boundary,
+        body.date_ranges,
+        body.fire_event_name,
+        body.affiliation,
+        {float(threshold): value for threshold, value in body.thresholds.items()},
+        logger,
+        cloud_static_io_client,
+        burn_metric=body.burn_metric,
+        n_years=body.n_years,
+    )
+
+
+def main(
+    geojson_boundary,
+    date_ranges,
+    fire_event_name,
+    affiliation,
+    thresholds,
+    logger,
+    cloud_static_io_client,
+    burn_metric="dnbr",
+    n_years=RECOVERY_YEARS,
+):
+    logger.info(f"Received recovery request for {fire_event_name}")
+
+    try:
+        if not 1 <= n_years <= RECOVERY_MAX_YEARS:
+            raise ValueError(
+                f"n_years must be between 1 and {RECOVERY_MAX_YEARS}, got {n_years}"
+            )
+
+        geo_client = Sentinel2Client(geojson_boundary=geojson_boundary, buffer=0.1)
+
+        # The prefire NBR and severity come from the fire's existing metrics
+        geo_client.load_metrics_stack_from_cogs(
+            {
+                metric_name: cloud_static_io_client.https_prefix
+                + f"/public/{affiliation}/{fire_event_name}/{metric_name}.tif"
+                for metric_name in REQUIRED_METRICS
+            }
+        )
+
+        recovery_info = geo_client.calc_recovery(
+            prefire_date_range=date_ranges["prefire"], n_years=n_years
+        )
+        logger.info(f"Composited recovery years for {fire_event_name}: {recovery_info}")
+
+        recovery_summary = geo_client.summarize_recovery(
+            thresholds, burn_metric=burn_metric
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            recovery_paths = {
+                "nbr_recovery": os.path.join(tmpdir, "nbr_recovery.tif"),
+                "dnbr_recovery": os.path.join(tmpdir, "dnbr_recovery.tif"),
+            }
+            geo_client.write_recovery(
+                nbr_path=recovery_paths["nbr_recovery"],
+                dnbr_path=recovery_paths["dnbr_recovery"],
+            )
+            cloud_static_io_client.upload_time_series(
+                time_series_paths=recovery_paths,
+                fire_event_name=fire_event_name,
+                affiliation=affiliation,
+            )
+        cloud_static_io_client.upload_recovery_summary(
+            recovery_summary,
+            fire_event_name=fire_event_name,
+            affiliation=affiliation,
+        )
+        geo_client.clear_checkpoints()
+        logger.info(f"Recovery uploaded for {fire_event_name}")
+
+        return JSONResponse(
+            status_code=200,
+            content={
+                "message": f"Recovery uploaded for {fire_event_name}",
+                "fire_event_name": fire_event_name,
+                "cloud_cog_paths": cloud_static_io_client.cloud_cog_paths,
+                "recovery_info": recovery_info,
+                "recovery_summary": recovery_summary,
+            },
+        )
+
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        logger.error(f"Error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
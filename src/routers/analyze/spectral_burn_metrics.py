@@ -4,13 +4,27 @@ from logging import Logger
 from typing import Any
 from pydantic import BaseModel
 import tempfile
+import os
 import sentry_sdk
 import json
 import rioxarray as rxr
 import xarray as xr
-from ..dependencies import get_cloud_logger, get_cloud_static_io_client, init_sentry
+from ..dependencies import (
+    get_cloud_logger,
+    get_cloud_static_io_client,
+    get_local_metrics_store,
+    get_scene_cache,
+    get_composite_tile_cache,
+    init_sentry,
+)
 from src.lib.query_sentinel import Sentinel2Client, NoFireBoundaryDetectedError
+from src.lib.product_index import REQUIRED_METRICS
+from src.lib.quantization import QUANTIZE_METRIC_COGS
 from src.util.cloud_static_io import CloudStaticIOClient
+from src.util.local_metrics_store import LocalMetricsStore, metrics_store_signature
+from src.util.scene_cache import SceneCache
+from src.util.composite_tile_cache import CompositeTileCache
+from shapely.ops import unary_union
 import numpy as np
 
 router = APIRouter()
@@ -27,6 +41,23 @@ class AnaylzeBurnPOSTBody(BaseModel):
         date_ranges (dict): The date ranges for analysis.
         fire_event_name (str): The name of the fire event.
         affiliation (str): The affiliation of the analysis.
+        time_series (bool): Flag indicating whether to also produce per-pass NBR and dNBR time series.
+        drop_failed_items (bool): Flag indicating whether to treat scenes whose reads persistently fail as
+            missing, rather than failing the analysis. Dropped scenes are listed in the response.
+        compositing (str): How to composite the prefire and postfire scenes - "median" of every scene, or
+            "greedy", reading the best scenes first until the AOI is covered.
+        screen_scenes (bool): Flag indicating whether to drop scenes which are cloudy over the AOI, judged from a
+            low resolution read of their scene classification, before reading them at full resolution.
+        monitor (bool): Flag indicating whether to monitor the fire event for new postfire passes, refreshing
+            its postfire metrics as they land (see `/api/monitor/poll`).
+        quantize_metrics (bool): Flag indicating whether to store the metric COGs as int16 with a scale/offset,
+            rather than as floats, at ~0.001 precision for a fraction of the size.
+        offset_dnbr (bool): Flag indicating whether to offset the dNBR (and the rdNBR and rBR derived from it) by
+            the median dNBR of an unburned ring around the boundary, to correct for differences between the
+            prefire and postfire windows that aren't due to the fire. The offset is reported in the response.
+        uncertainty (bool): Flag indicating whether to also produce the uncertainty of dNBR and rBR, from the spread
+            (MAD) of the per-pass NBR behind the prefire and postfire composites, as extra metric COGs. Only
+            available with "median" compositing.
     """
 
     geojson: Any
@@ -34,6 +65,14 @@ class AnaylzeBurnPOSTBody(BaseModel):
     fire_event_name: str
     affiliation: str
     final: bool = True
+    time_series: bool = False
+    drop_failed_items: bool = False
+    compositing: str = "median"
+    screen_scenes: bool = False
+    monitor: bool = False
+    quantize_metrics: bool = QUANTIZE_METRIC_COGS
+    offset_dnbr: bool = False
+    uncertainty: bool = False
 
 
 # TODO [#5]: Decide on / implement cloud tasks or other async batch
@@ -47,6 +86,9 @@ class AnaylzeBurnPOSTBody(BaseModel):
 def analyze_spectral_burn_metrics(
     body: AnaylzeBurnPOSTBody,
     cloud_static_io_client: CloudStaticIOClient = Depends(get_cloud_static_io_client),
+    local_metrics_store: LocalMetricsStore = Depends(get_local_metrics_store),
+    scene_cache: SceneCache = Depends(get_scene_cache),
+    composite_tile_cache: CompositeTileCache = Depends(get_composite_tile_cache),
     __sentry: None = Depends(init_sentry),
     logger: Logger = Depends(get_cloud_logger),
 ):
@@ -56,6 +98,9 @@ def analyze_spectral_burn_metrics(
     Args:
         body (AnaylzeBurnPOSTBody): The request body containing the necessary information for analysis.
         cloud_static_io_client (CloudStaticIOClient, optional): The client for interacting with the cloud storage service.  FastAPI handles this as a dependency injection.
+        local_metrics_store (LocalMetricsStore, optional): Store of metrics stacks on the instance's local disk. FastAPI handles this as a dependency injection.
+        scene_cache (SceneCache, optional): Cache of individual scenes' arrays on the instance's local disk, or None unless `SCENE_CACHE_ENABLED`. FastAPI handles this as a dependency injection.
+        composite_tile_cache (CompositeTileCache, optional): Cache of regional prefire composite tiles on the instance's local disk, or None unless `COMPOSITE_TILE_CACHE_ENABLED`. FastAPI handles this as a dependency injection.
         __sentry (None, optional): Sentry client, just needs to be initialized. FastAPI handles this as a dependency injection.
         logger (Logger, optional): Google cloud logger. FastAPI handles this as a dependency injection.
         final (bool, optional): Flag indicating whether this is the final analysis, which simply uploads the COGs to the cloud storage without the 'intermediate_' prefix. Defaults to True.
@@ -69,6 +114,14 @@ def analyze_spectral_burn_metrics(
     fire_event_name = body.fire_event_name
     affiliation = body.affiliation
     final = body.final
+    time_series = body.time_series
+    drop_failed_items = body.drop_failed_items
+    compositing = body.compositing
+    screen_scenes = body.screen_scenes
+    monitor = body.monitor
+    quantize_metrics = body.quantize_metrics
+    offset_dnbr = body.offset_dnbr
+    uncertainty = body.uncertainty
 
     return main(
         geojson_boundary,
@@ -78,6 +131,17 @@ def analyze_spectral_burn_metrics(
         final,
         logger,
         cloud_static_io_client,
+        time_series=time_series,
+        local_metrics_store=local_metrics_store,
+        drop_failed_items=drop_failed_items,
+        compositing=compositing,
+        screen_scenes=screen_scenes,
+        scene_cache=scene_cache,
+        composite_tile_cache=composite_tile_cache,
+        monitor=monitor,
+        quantize_metrics=quantize_metrics,
+        offset_dnbr=offset_dnbr,
+        uncertainty=uncertainty,
     )
 
 
@@ -89,29 +153,87 @@ def main(
     final,
     logger,
     cloud_static_io_client,
+    time_series=False,
+    local_metrics_store=None,
+    drop_failed_items=False,
+    compositing="median",
+    screen_scenes=False,
+    scene_cache=None,
+    composite_tile_cache=None,
+    monitor=False,
+    quantize_metrics=QUANTIZE_METRIC_COGS,
+    offset_dnbr=False,
+    uncertainty=False,
 ):
     logger.info(f"Received analyze-fire-event request for {fire_event_name}")
     satellite_pass_information = None
 
     try:
         # create a Sentinel2Client instance
-        geo_client = Sentinel2Client(geojson_boundary=geojson_boundary, buffer=0.1)
-
-        print("Querying fire event")
+        geo_client = Sentinel2Client(
+            geojson_boundary=geojson_boundary,
+            buffer=0.1,
+            drop_failed_items=drop_failed_items,
+            compositing=compositing,
+            screen_scenes=screen_scenes,
+            scene_cache=scene_cache,
+            composite_tile_cache=composite_tile_cache,
+            offset_dnbr=offset_dnbr,
+            uncertainty=uncertainty,
+        )
 
-        # get imagery data before and after the fire
-        satellite_pass_information = geo_client.query_fire_event(
+        # Look for an existing product with the same grid, date ranges and sensor parameters
+        # covering our AOI, in which case we can read it rather than re-acquire from Sentinel-2.
+        # The per-pass time series and uncertainty need the imagery itself, so always re-acquire then,
+        # as with options whose pixels depend on the AOI (see `Sentinel2Client.reuses_products`).
+        product_index = cloud_static_io_client.get_product_index()
+        key = geo_client.get_product_key(
             prefire_date_range=date_ranges["prefire"],
             postfire_date_range=date_ranges["postfire"],
-            from_bbox=True,
+            quantized=quantize_metrics,
         )
+        boundary_geometry = unary_union(geo_client.geojson_boundary.geometry.values)
+        existing_product = None
+        if geo_client.reuses_products and not time_series and not uncertainty:
+            existing_product = product_index.find_covering(key, boundary_geometry)
+
+        if existing_product is not None:
+            logger.info(
+                f"Reusing existing product of {existing_product['fire_event_name']} for {fire_event_name}"
+            )
+            geo_client.load_metrics_stack_from_cogs(existing_product["cog_paths"])
+            satellite_pass_information = existing_product["satellite_pass_information"]
+
+        else:
+            print("Querying fire event")
+
+            # get imagery data before and after the fire
+            satellite_pass_information = geo_client.query_fire_event(
+                prefire_date_range=date_ranges["prefire"],
+                postfire_date_range=date_ranges["postfire"],
+                from_bbox=True,
+            )
 
-        print("Obtained imagery")
+            print("Obtained imagery")
 
-        logger.info(f"Obtained imagery for {fire_event_name}")
+            logger.info(f"Obtained imagery for {fire_event_name}")
+            logger.info(
+                f"Stack chunk plans for {fire_event_name}: {geo_client.chunk_plans}"
+            )
+            logger.info(
+                f"Scenes read for {fire_event_name}: {geo_client.composite_info}"
+            )
+            if any(geo_client.dropped_items.values()):
+                logger.warning(
+                    f"Dropped items with failing reads for {fire_event_name}: {geo_client.dropped_items}"
+                )
 
-        # calculate burn metrics
-        geo_client.calc_burn_metrics()
+            # calculate burn metrics
+            geo_client.calc_burn_metrics()
+            if offset_dnbr:
+                logger.info(
+                    f"dNBR offset for {fire_event_name}: {geo_client.dnbr_offset_info}"
+                )
 
         if np.isnan(geo_client.metrics_stack.sel(burn_metric="rbr").values).all():
             ## Intermittent bug where tif is all NA - not sure if here or in saving
@@ -129,9 +251,94 @@ def main(
             postfire_date_range=date_ranges["postfire"],
             final=final,  # will be overwritten to True when we use flood fill later
             satellite_pass_information=satellite_pass_information,
+            quantize_metrics=quantize_metrics,
         )
         logger.info(f"Cogs uploaded for {fire_event_name}")
 
+        # The metrics are safely stored, so we won't need to resume the stack reads
+        geo_client.clear_checkpoints()
+
+        # Keep a local copy of the intermediate metrics stack, so that refining it (on any worker
+        # process of this instance) needn't re-download and decode the COGs we just uploaded
+        if local_metrics_store is not None and not final:
+            local_metrics_store.save(
+                metrics_stack=geo_client.metrics_stack,
+                affiliation=affiliation,
+                fire_event_name=fire_event_name,
+                source_signature=metrics_store_signature(
+                    bounds=[
+                        round(pos, 4) for pos in geo_client.metrics_stack.rio.bounds()
+                    ],
+                    prefire_date_range=date_ranges["prefire"],
+                    postfire_date_range=date_ranges["postfire"],
+                    satellite_pass_information=satellite_pass_information,
+                ),
+            )
+
+        # Index the product we just uploaded, so later requests it covers can reuse it
+        cog_prefix = "" if final else "intermediate_"
+        cog_paths = {
+            metric_name: cloud_static_io_client.cloud_cog_paths[cog_prefix + metric_name]
+            for metric_name in REQUIRED_METRICS
+        }
+        if geo_client.reuses_products:
+            cloud_static_io_client.update_product_index(
+                lambda latest_product_index: latest_product_index.register(
+                    key=key,
+                    affiliation=affiliation,
+                    fire_event_name=fire_event_name,
+                    boundary_geometry=boundary_geometry,
+                    cog_paths=cog_paths,
+                    satellite_pass_information=satellite_pass_information,
+                )
+            )
+
+        if monitor:
+            # Refresh the postfire metrics as new passes land, with the same analysis options
+            postfire_item_ids = [
+                item.id for item in getattr(geo_client, "postfire_items", [])
+            ]
+            cloud_static_io_client.update_fire_monitor(
+                lambda fire_monitor: fire_monitor.register(
+                    affiliation=affiliation,
+                    fire_event_name=fire_event_name,
+                    geojson_boundary=geojson_boundary,
+                    prefire_date_range=date_ranges["prefire"],
+                    postfire_date_range=date_ranges["postfire"],
+                    seen_item_ids=postfire_item_ids,
+                    cog_paths=cog_paths,
+                    final=final,
+                    satellite_pass_information=satellite_pass_information,
+                    quantized_metrics=quantize_metrics,
+                    analysis_options={
+                        "drop_failed_items": drop_failed_items,
+                        "compositing": compositing,
+                        "screen_scenes": screen_scenes,
+                        "offset_dnbr": offset_dnbr,
+                        "uncertainty": uncertainty,
+                    },
+                )
+            )
+            logger.info(f"Monitoring {fire_event_name} for new passes")
+
+        if time_series:
+            # Stream per-pass NBR / dNBR to disk one date at a time, then upload
+            with tempfile.TemporaryDirectory() as tmpdir:
+                time_series_paths = {
+                    "nbr": os.path.join(tmpdir, "nbr_time_series.tif"),
+                    "dnbr": os.path.join(tmpdir, "dnbr_time_series.tif"),
+                }
+                geo_client.calc_nbr_time_series(
+                    nbr_path=time_series_paths["nbr"],
+                    dnbr_path=time_series_paths["dnbr"],
+                )
+                cloud_static_io_client.upload_time_series(
+                    time_series_paths=time_series_paths,
+                    fire_event_name=fire_event_name,
+                    affiliation=affiliation,
+                )
+            logger.info(f"Time series uploaded for {fire_event_name}")
+
         return JSONResponse(
             status_code=200,
             content={
@@ -139,6 +346,12 @@ def main(
                 "fire_event_name": fire_event_name,
                 "cloud_cog_paths": cloud_static_io_client.cloud_cog_paths,
                 "satellite_pass_information": satellite_pass_information,
+                "chunk_plans": geo_client.chunk_plans,
+                "dropped_items": geo_client.dropped_items,
+                "composite_info": geo_client.composite_info,
+                "scene_scores": geo_client.scene_scores,
+                "reused_product": existing_product is not None,
+                "dnbr_offset": geo_client.dnbr_offset_info,
             },
         )
 
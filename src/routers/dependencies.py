@@ -4,6 +4,12 @@ from logging import Logger
 from google.cloud import logging as google_logging
 import sentry_sdk
 from src.util.cloud_static_io import CloudStaticIOClient
+from src.util.local_metrics_store import LocalMetricsStore
+from src.util.scene_cache import SceneCache, SCENE_CACHE_ENABLED
+from src.util.composite_tile_cache import (
+    CompositeTileCache,
+    COMPOSITE_TILE_CACHE_ENABLED,
+)
 from src.util.gcp_secrets import get_mapbox_secret as gcp_get_mapbox_secret
 import os
 import logging as python_logging
@@ -66,6 +72,42 @@ def get_cloud_static_io_client(logger: Logger = Depends(get_cloud_logger)):
     return CloudStaticIOClient(s3_bucket_name, "s3", logger)
 
 
+def get_local_metrics_store():
+    """
+    Get an instance of LocalMetricsStore, for metrics stacks persisted on this instance's local disk.
+
+    Returns:
+        LocalMetricsStore: An instance of LocalMetricsStore.
+    """
+    return LocalMetricsStore()
+
+
+def get_scene_cache():
+    """
+    Get an instance of SceneCache, for the arrays of individual scenes cached on this instance's local disk,
+    if it is enabled (see `SCENE_CACHE_ENABLED`).
+
+    Returns:
+        SceneCache: An instance of SceneCache, or None if the cache isn't enabled.
+    """
+    if not SCENE_CACHE_ENABLED:
+        return None
+    return SceneCache()
+
+
+def get_composite_tile_cache():
+    """
+    Get an instance of CompositeTileCache, for composite tiles cached on this instance's local disk, if
+    it is enabled (see `COMPOSITE_TILE_CACHE_ENABLED`).
+
+    Returns:
+        CompositeTileCache: An instance of CompositeTileCache, or None if the cache isn't enabled.
+    """
+    if not COMPOSITE_TILE_CACHE_ENABLED:
+        return None
+    return CompositeTileCache()
+
+
 def get_manifest(
     cloud_static_io_client: CloudStaticIOClient = Depends(get_cloud_static_io_client),
     logger: Logger = Depends(get_cloud_logger),
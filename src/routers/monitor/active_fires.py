@@ -0,0 +1,226 @@
+from fastapi import Depends, APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+from logging import Logger
+from pydantic import BaseModel
+import sentry_sdk
+import planetary_computer
+from shapely.ops import unary_union
+
+from ..dependencies import (
+    get_cloud_logger,
+    get_cloud_static_io_client,
+    get_scene_cache,
+    init_sentry,
+)
+from src.lib.query_sentinel import Sentinel2Client, SENTINEL2_PATH
+from src.util.cloud_static_io import CloudStaticIOClient
+from src.util.scene_cache import SceneCache
+from src.util.stac_catalog import get_stac_catalog
+
+router = APIRouter()
+
+
+class UnregisterFireEventPOSTBody(BaseModel):
+    """
+    Represents the request body for no longer monitoring a fire event.
+
+    Attributes:
+        fire_event_name (str): The name of the fire event.
+        affiliation (str): The affiliation of the fire event.
+    """
+
+    fire_event_name: str
+    affiliation: str
+
+
+@router.post(
+    "/api/monitor/poll",
+    tags=["monitor"],
+    description="Poll for new passes of monitored fire events, and refresh their postfire metrics.",
+)
+def poll_active_fires(
+    cloud_static_io_client: CloudStaticIOClient = Depends(get_cloud_static_io_client),
+    scene_cache: SceneCache = Depends(get_scene_cache),
+    __sentry: None = Depends(init_sentry),
+    logger: Logger = Depends(get_cloud_logger),
+):
+    """
+    Polls Sentinel-2 for new passes over the monitored fire events (those analyzed with `monitor`
+    set), and refreshes the postfire composite and burn metrics of those with any. Intended to be
+    triggered on a schedule.
+
+    Args:
+        cloud_static_io_client (CloudStaticIOClient, optional): The client for interacting with the cloud storage service. FastAPI handles this as a dependency injection.
+        scene_cache (SceneCache, optional): Cache of individual scenes' arrays on the instance's local disk, or None unless `SCENE_CACHE_ENABLED`. FastAPI handles this as a dependency injection.
+        __sentry (None, optional): Sentry client, just needs to be initialized. FastAPI handles this as a dependency injection.
+        logger (Logger, optional): Google cloud logger. FastAPI handles this as a dependency injection.
+
+    Returns:
+        JSONResponse: The results of the poll, per refreshed fire event.
+    """
+    return main(logger, cloud_static_io_client, scene_cache=scene_cache)
+
+
+@router.post(
+    "/api/monitor/unregister-fire-event",
+    tags=["monitor"],
+    description="Stop monitoring a fire event for new passes.",
+)
+def unregister_fire_event(
+    body: UnregisterFireEventPOSTBody,
+    cloud_static_io_client: CloudStaticIOClient = Depends(get_cloud_static_io_client),
+    __sentry: None = Depends(init_sentry),
+    logger: Logger = Depends(get_cloud_logger),
+):
+    """
+    Stops monitoring a fire event for new passes.
+
+    Args:
+        body (UnregisterFireEventPOSTBody): The request body containing the fire event.
+        cloud_static_io_client (CloudStaticIOClient, optional): The client for interacting with the cloud storage service. FastAPI handles this as a dependency injection.
+        __sentry (None, optional): Sentry client, just needs to be initialized. FastAPI handles this as a dependency injection.
+        logger (Logger, optional): Google cloud logger. FastAPI handles this as a dependency injection.
+
+    Returns:
+        JSONResponse: Confirmation message.
+    """
+    sentry_sdk.set_context("fire-event", {"request": body})
+
+    try:
+        cloud_static_io_client.update_fire_monitor(
+            lambda fire_monitor: fire_monitor.unregister(
+                body.affiliation, body.fire_event_name
+            )
+        )
+
+        return JSONResponse(
+            status_code=200,
+            content={"message": f"No longer monitoring {body.fire_event_name}"},
+        )
+
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        logger.error(f"Error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def refresh_fire_event(
+    fire_event, new_items, logger, cloud_static_io_client, scene_cache=None
+):
+    """
+    Refresh the postfire composite and burn metrics of a monitored fire event, with the analysis
+    options it was registered with, and upload them in place of the existing ones. Its prefire NBR is
+    kept, unless the offset dNBR or uncertainty need the prefire imagery itself, in which case the
+    fire event is re-analyzed in full (reading cached scenes where it can).
+
+    Args:
+        fire_event (dict): The monitored fire event (see `src.lib.fire_monitor.FireMonitor`).
+        new_items (list): The new postfire items of the fire event.
+        logger (Logger): Google cloud logger.
+        cloud_static_io_client (CloudStaticIOClient): The client for interacting with the cloud storage service.
+        scene_cache (SceneCache, optional): Cache of individual scenes' arrays, so only new scenes are read. Defaults to None.
+
+    Returns:
+        dict: Updates to the fire event (its satellite pass information).
+    """
+    fire_event_name = fire_event["fire_event_name"]
+    affiliation = fire_event["affiliation"]
+    logger.info(f"Refreshing {fire_event_name} with {len(new_items)} new items")
+
+    geo_client = Sentinel2Client(
+        geojson_boundary=fire_event["geojson_boundary"],
+        buffer=0.1,
+        scene_cache=scene_cache,
+        **fire_event.get("analysis_options", {}),
+    )
+    if geo_client.offset_dnbr or geo_client.uncertainty:
+        satellite_pass_information = geo_client.query_fire_event(
+            prefire_date_range=fire_event["prefire_date_range"],
+            postfire_date_range=fire_event["postfire_date_range"],
+            from_bbox=True,
+        )
+        geo_client.calc_burn_metrics()
+    else:
+        geo_client.load_metrics_stack_from_cogs(fire_event["cog_paths"])
+        postfire_items = geo_client.get_items(fire_event["postfire_date_range"])
+        satellite_pass_information = {
+            **fire_event["satellite_pass_information"],
+            **geo_client.refresh_postfire(
+                postfire_items, postfire_date_range=fire_event["postfire_date_range"]
+            ),
+        }
+
+    cloud_static_io_client.upload_fire_event(
+        metrics_stack=geo_client.metrics_stack,
+        affiliation=affiliation,
+        fire_event_name=fire_event_name,
+        prefire_date_range=fire_event["prefire_date_range"],
+        postfire_date_range=fire_event["postfire_date_range"],
+        final=fire_event["final"],
+        satellite_pass_information=satellite_pass_information,
+        quantize_metrics=fire_event.get("quantized_metrics", False),
+    )
+
+    if geo_client.reuses_products:
+        key = geo_client.get_product_key(
+            prefire_date_range=fire_event["prefire_date_range"],
+            postfire_date_range=fire_event["postfire_date_range"],
+            quantized=fire_event.get("quantized_metrics", False),
+        )
+        boundary_geometry = unary_union(geo_client.geojson_boundary.geometry.values)
+        cloud_static_io_client.update_product_index(
+            lambda product_index: product_index.register(
+                key=key,
+                affiliation=affiliation,
+                fire_event_name=fire_event_name,
+                boundary_geometry=boundary_geometry,
+                cog_paths=fire_event["cog_paths"],
+                satellite_pass_information=satellite_pass_information,
+            )
+        )
+
+    geo_client.clear_checkpoints()
+    logger.info(f"Refreshed {fire_event_name}")
+    return {"satellite_pass_information": satellite_pass_information}
+
+
+def main(logger, cloud_static_io_client, scene_cache=None, catalog=None):
+    logger.info("Received poll for monitored fire events")
+
+    try:
+        fire_monitor = cloud_static_io_client.get_fire_monitor()
+        if catalog is None:
+            catalog = get_stac_catalog(
+                SENTINEL2_PATH, modifier=planetary_computer.sign_inplace
+            )
+
+        results = fire_monitor.poll(
+            catalog,
+            refresh_fire=lambda fire_event, new_items: refresh_fire_event(
+                fire_event,
+                new_items,
+                logger,
+                cloud_static_io_client,
+                scene_cache=scene_cache,
+            ),
+            # Claim and record refreshes in the shared monitor, so concurrent polls on other
+            # instances neither refresh the same fire nor lose each other's updates
+            update_state=cloud_static_io_client.update_fire_monitor,
+        )
+
+        for key, result in results.items():
+            if not result["refreshed"]:
+                logger.error(f"Failed to refresh {key}: {result['error']}")
+
+        return JSONResponse(
+            status_code=200,
+            content={
+                "message": f"Polled {len(results)} fire events with new passes",
+                "results": results,
+            },
+        )
+
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        logger.error(f"Error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,132 @@
+from fastapi import Depends, APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+from logging import Logger
+from typing import Any, Optional
+from pydantic import BaseModel
+import geopandas as gpd
+import rasterio
+from rasterio.warp import transform_bounds
+import sentry_sdk
+
+from ..dependencies import get_cloud_logger, get_cloud_static_io_client, init_sentry
+from src.lib.summary_pyramid import cog_window_reader
+from src.util.cloud_static_io import CloudStaticIOClient
+
+router = APIRouter()
+
+
+class QueryMetricSummaryPOSTBody(BaseModel):
+    """
+    Represents the request body for querying summary statistics of a metric.
+
+    Attributes:
+        fire_event_name (str): The name of the fire event.
+        affiliation (str): The affiliation of the fire event.
+        metric (str): The metric to summarize, e.g. "dnbr".
+        geojson (dict, optional): GeoJSON FeatureCollection of polygons to summarize.
+        bounds (list, optional): The (minx, miny, maxx, maxy) bounds of a map window to summarize, in EPSG:4326.
+    """
+
+    fire_event_name: str
+    affiliation: str
+    metric: str = "dnbr"
+    geojson: Optional[Any] = None
+    bounds: Optional[list] = None
+
+
+@router.post(
+    "/api/query/metric-summary",
+    tags=["query"],
+    description="Get summary statistics (count, mean, std, min, max, histogram) of a metric of a fire event, over polygons and/or a map window.",
+)
+def query_metric_summary(
+    body: QueryMetricSummaryPOSTBody,
+    cloud_static_io_client: CloudStaticIOClient = Depends(get_cloud_static_io_client),
+    __sentry: None = Depends(init_sentry),
+    logger: Logger = Depends(get_cloud_logger),
+):
+    """
+    Summarizes a metric of a fire event over polygons and/or a map window, from the metric's summary
+    pyramid (uploaded alongside its COG). Only the pixels along the edges of each polygon or window
+    are read from the COG itself, so this is fast regardless of their size.
+
+    Args:
+        body (QueryMetricSummaryPOSTBody): The request body containing the fire event, and the polygons and/or window.
+        cloud_static_io_client (CloudStaticIOClient, optional): The client for interacting with the cloud storage service. FastAPI handles this as a dependency injection.
+        __sentry (None, optional): Sentry client, just needs to be initialized. FastAPI handles this as a dependency injection.
+        logger (Logger, optional): Google cloud logger. FastAPI handles this as a dependency injection.
+
+    Returns:
+        JSONResponse: The statistics of each polygon, and of the window.
+    """
+    sentry_sdk.set_context("fire-event", {"request": body})
+
+    return main(
+        fire_event_name=body.fire_event_name,
+        affiliation=body.affiliation,
+        metric=body.metric,
+        geojson=body.geojson,
+        bounds=body.bounds,
+        logger=logger,
+        cloud_static_io_client=cloud_static_io_client,
+    )
+
+
+def main(
+    fire_event_name,
+    affiliation,
+    metric,
+    geojson,
+    bounds,
+    logger,
+    cloud_static_io_client,
+):
+    logger.info(f"Received {metric} summary request for {fire_event_name}")
+
+    try:
+        if geojson is None and bounds is None:
+            raise ValueError("Either polygons (geojson) or bounds must be given")
+
+        summary_pyramid = cloud_static_io_client.get_summary_pyramid(
+            metric, fire_event_name, affiliation
+        )
+        metric_url = (
+            cloud_static_io_client.https_prefix
+            + f"/public/{affiliation}/{fire_event_name}/{metric}.tif"
+        )
+
+        polygon_stats = []
+        window_stats = None
+        with rasterio.open(metric_url) as src:
+            read_window = cog_window_reader(src)
+
+            if geojson is not None:
+                features_gpd = gpd.GeoDataFrame.from_features(geojson)
+                if not features_gpd.crs:
+                    features_gpd = features_gpd.set_crs("EPSG:4326")
+                features_gpd = features_gpd.to_crs(src.crs)
+                polygon_stats = [
+                    summary_pyramid.polygon_stats(geometry, read_window)
+                    for geometry in features_gpd.geometry
+                ]
+
+            if bounds is not None:
+                window_stats = summary_pyramid.bounds_stats(
+                    transform_bounds("EPSG:4326", src.crs, *bounds), read_window
+                )
+
+        return JSONResponse(
+            status_code=200,
+            content={
+                "fire_event_name": fire_event_name,
+                "affiliation": affiliation,
+                "metric": metric,
+                "polygon_stats": polygon_stats,
+                "window_stats": window_stats,
+            },
+        )
+
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        logger.error(f"Error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
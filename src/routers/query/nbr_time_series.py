@@ -0,0 +1,95 @@
+from fastapi import Depends, APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+from logging import Logger
+from typing import Any
+from pydantic import BaseModel
+import sentry_sdk
+
+from ..dependencies import get_cloud_logger, get_cloud_static_io_client, init_sentry
+from src.lib.nbr_time_series import read_time_series
+from src.util.cloud_static_io import CloudStaticIOClient
+
+router = APIRouter()
+
+
+class QueryNBRTimeSeriesPOSTBody(BaseModel):
+    """
+    Represents the request body for querying a per-pass time series.
+
+    Attributes:
+        geojson (dict): GeoJSON FeatureCollection of points and/or polygons to query.
+        fire_event_name (str): The name of the fire event.
+        affiliation (str): The affiliation of the fire event.
+        metric (str): The time series to query, either "nbr" or "dnbr".
+    """
+
+    geojson: Any
+    fire_event_name: str
+    affiliation: str
+    metric: str = "dnbr"
+
+
+@router.post(
+    "/api/query/nbr-time-series",
+    tags=["query"],
+    description="Get per-pass NBR or dNBR time series for points (per-pixel) or polygons (mean) of a fire event.",
+)
+def query_nbr_time_series(
+    body: QueryNBRTimeSeriesPOSTBody,
+    cloud_static_io_client: CloudStaticIOClient = Depends(get_cloud_static_io_client),
+    __sentry: None = Depends(init_sentry),
+    logger: Logger = Depends(get_cloud_logger),
+):
+    """
+    Reads the per-pass time series of a fire event (produced by the analyze endpoint, with
+    `time_series` set) at the given points or polygons. Only the windows covering the features
+    are read from the COG, so this is fast regardless of the size of the fire.
+
+    Args:
+        body (QueryNBRTimeSeriesPOSTBody): The request body containing the features and fire event.
+        cloud_static_io_client (CloudStaticIOClient, optional): The client for interacting with the cloud storage service. FastAPI handles this as a dependency injection.
+        __sentry (None, optional): Sentry client, just needs to be initialized. FastAPI handles this as a dependency injection.
+        logger (Logger, optional): Google cloud logger. FastAPI handles this as a dependency injection.
+
+    Returns:
+        JSONResponse: The acquisition dates, and the time series of each feature.
+    """
+    sentry_sdk.set_context("fire-event", {"request": body})
+
+    return main(
+        geojson=body.geojson,
+        fire_event_name=body.fire_event_name,
+        affiliation=body.affiliation,
+        metric=body.metric,
+        logger=logger,
+        cloud_static_io_client=cloud_static_io_client,
+    )
+
+
+def main(geojson, fire_event_name, affiliation, metric, logger, cloud_static_io_client):
+    logger.info(f"Received {metric} time series request for {fire_event_name}")
+
+    try:
+        if metric not in ["nbr", "dnbr"]:
+            raise ValueError(f"Unsupported time series metric: {metric}")
+
+        time_series_url = (
+            cloud_static_io_client.https_prefix
+            + f"/public/{affiliation}/{fire_event_name}/{metric}_time_series.tif"
+        )
+        time_series = read_time_series(time_series_url, geojson)
+
+        return JSONResponse(
+            status_code=200,
+            content={
+                "fire_event_name": fire_event_name,
+                "affiliation": affiliation,
+                "metric": metric,
+                **time_series,
+            },
+        )
+
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        logger.error(f"Error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
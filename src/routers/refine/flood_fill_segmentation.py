@@ -8,9 +8,16 @@ import sentry_sdk
 import json
 import rioxarray as rxr
 import xarray as xr
-from ..dependencies import get_cloud_logger, get_cloud_static_io_client, init_sentry
+from ..dependencies import (
+    get_cloud_logger,
+    get_cloud_static_io_client,
+    get_local_metrics_store,
+    init_sentry,
+)
 from src.lib.query_sentinel import Sentinel2Client, NoFireBoundaryDetectedError
+from src.lib.derive_boundary import COARSE_TO_FINE_FACTOR
 from src.util.cloud_static_io import CloudStaticIOClient
+from src.util.local_metrics_store import LocalMetricsStore, metrics_store_signature
 
 router = APIRouter()
 
@@ -23,11 +30,14 @@ class FloodFillSegmentationPOSTBody(BaseModel):
         geojson (str): The GeoJSON data in string format.
         fire_event_name (str): The name of the fire event.
         affiliation (str): The affiliation of the analysis.
+        coarse_to_fine (bool, optional): Whether to derive the boundary coarse to fine - on a decimated metric
+            layer, then at full resolution only around the coarse boundary. Faster for large fires.
     """
 
     geojson: Any
     fire_event_name: str
     affiliation: str
+    coarse_to_fine: bool = False
 
 
 # TODO [#5]: Decide on / implement cloud tasks or other async batch
@@ -41,6 +51,7 @@ class FloodFillSegmentationPOSTBody(BaseModel):
 def refine_flood_fill_segmentation(
     body: FloodFillSegmentationPOSTBody,
     cloud_static_io_client: CloudStaticIOClient = Depends(get_cloud_static_io_client),
+    local_metrics_store: LocalMetricsStore = Depends(get_local_metrics_store),
     __sentry: None = Depends(init_sentry),
     logger: Logger = Depends(get_cloud_logger),
 ):
@@ -50,6 +61,7 @@ def refine_flood_fill_segmentation(
     Args:
         body (AnaylzeBurnPOSTBody): The request body containing the necessary information for analysis.
         cloud_static_io_client (CloudStaticIOClient, optional): The client for interacting with the cloud storage service.  FastAPI handles this as a dependency injection.
+        local_metrics_store (LocalMetricsStore, optional): Store of metrics stacks on the instance's local disk. FastAPI handles this as a dependency injection.
         __sentry (None, optional): Sentry client, just needs to be initialized. FastAPI handles this as a dependency injection.
         logger (Logger, optional): Google cloud logger. FastAPI handles this as a dependency injection.
 
@@ -71,6 +83,8 @@ def refine_flood_fill_segmentation(
         affiliation,
         logger,
         cloud_static_io_client,
+        local_metrics_store=local_metrics_store,
+        coarse_to_fine=body.coarse_to_fine,
     )
 
 
@@ -80,6 +94,8 @@ def main(
     affiliation,
     logger,
     cloud_static_io_client,
+    local_metrics_store=None,
+    coarse_to_fine=False,
 ):
     ## NOTE: derive_boundary is accepted for now to maintain compatibility with the frontend,
     ## but will shortly be a different endpoint
@@ -94,24 +110,62 @@ def main(
         ## TODO: Since we are running serverless, and don't have a live database, we are
         ## required to re-construct the metrics stack from the existing files, in the case
         ## where the user has identified fire boundaries from our intermediate rbr output.
-        ## This is not ideal, but not sure there is a better solution without using something
-        ## like redis or another live cache.
-        metric_layers = []
-        for metric_name in ["nbr_prefire", "nbr_postfire", "dnbr", "rdnbr", "rbr"]:
-            with tempfile.NamedTemporaryFile(suffix=".tif", delete=False) as tmp:
-                tmp_tiff = tmp.name
-                cloud_static_io_client.download(
-                    remote_path=f"public/{affiliation}/{fire_event_name}/intermediate_{metric_name}.tif",
-                    target_local_path=tmp_tiff,
-                )
-
-                metric_layer = rxr.open_rasterio(tmp_tiff)
-                metric_layer = metric_layer.rename({"band": "burn_metric"})
-                metric_layer["burn_metric"] = [metric_name]
+        ## If this instance analyzed the fire event, we can memory-map the stack it persisted
+        ## locally, but otherwise we fall back to downloading and decoding the COGs.
+        existing_metrics_stack = None
+        threshold_histogram = None
+        if local_metrics_store is not None:
+            this_manifest = cloud_static_io_client.get_manifest()[affiliation][
+                fire_event_name
+            ]
+            source_signature = metrics_store_signature(
+                bounds=this_manifest["bounds"],
+                prefire_date_range=this_manifest["prefire_date_range"],
+                postfire_date_range=this_manifest["postfire_date_range"],
+                satellite_pass_information=this_manifest["satellite_pass_information"],
+            )
+            existing_metrics_stack = local_metrics_store.open(
+                affiliation=affiliation,
+                fire_event_name=fire_event_name,
+                source_signature=source_signature,
+            )
 
-                metric_layers.append(metric_layer)
+        if existing_metrics_stack is None:
+            metric_layers = []
+            for metric_name in ["nbr_prefire", "nbr_postfire", "dnbr", "rdnbr", "rbr"]:
+                with tempfile.NamedTemporaryFile(suffix=".tif", delete=False) as tmp:
+                    tmp_tiff = tmp.name
+                    cloud_static_io_client.download(
+                        remote_path=f"public/{affiliation}/{fire_event_name}/intermediate_{metric_name}.tif",
+                        target_local_path=tmp_tiff,
+                    )
+
+                    # Quantized (int16) COGs are unscaled and masked back to floats
+                    metric_layer = rxr.open_rasterio(tmp_tiff, mask_and_scale=True)
+                    metric_layer = metric_layer.rename({"band": "burn_metric"})
+                    metric_layer["burn_metric"] = [metric_name]
+
+                    metric_layers.append(metric_layer)
+
+            existing_metrics_stack = xr.concat(metric_layers, dim="burn_metric")
+
+            if local_metrics_store is not None:
+                local_metrics_store.save(
+                    metrics_stack=existing_metrics_stack,
+                    affiliation=affiliation,
+                    fire_event_name=fire_event_name,
+                    source_signature=source_signature,
+                )
+        else:
+            logger.info(f"Using locally persisted metrics stack for {fire_event_name}")
+            # The histogram of the metric, if an earlier refinement of this stack built one
+            threshold_histogram = local_metrics_store.open_histogram(
+                affiliation=affiliation,
+                fire_event_name=fire_event_name,
+                metric_name="rbr",
+                source_signature=source_signature,
+            )
 
-        existing_metrics_stack = xr.concat(metric_layers, dim="burn_metric")
         geo_client.ingest_metrics_stack(existing_metrics_stack)
 
         logger.info(f"Loaded existing metrics stack for {fire_event_name}")
@@ -121,7 +175,16 @@ def main(
             seed_points=geojson_seed_points,
             metric_name="rbr",
             inplace=True,
+            histogram=threshold_histogram,
+            coarse_factor=COARSE_TO_FINE_FACTOR if coarse_to_fine else None,
         )
+        if local_metrics_store is not None and threshold_histogram is None:
+            local_metrics_store.save_histogram(
+                histogram=geo_client.threshold_histogram,
+                affiliation=affiliation,
+                fire_event_name=fire_event_name,
+                metric_name="rbr",
+            )
 
         # save the derived boundary to the FTP server
         with tempfile.NamedTemporaryFile(suffix=".geojson", delete=False) as tmp:
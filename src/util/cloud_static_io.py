@@ -11,13 +11,31 @@ import tempfile
 import subprocess
 import os
 import boto3
+import random
+import botocore.exceptions
 import google.auth
 import requests
 from google.auth.transport import requests as gcp_requests
 from google.oauth2 import id_token
 from google.auth import impersonated_credentials, exceptions
+from src.lib.burn_severity import DEFAULT_DTYPE
+from src.lib.quantization import (
+    quantize,
+    METRIC_SCALES,
+    DEFAULT_METRIC_SCALE,
+    QUANTIZE_METRIC_COGS,
+)
+from src.lib.summary_pyramid import SummaryPyramid, UPLOAD_SUMMARY_PYRAMIDS
+from src.lib.product_index import ProductIndex
+from src.lib.fire_monitor import FireMonitor
 
 BUCKET_HTTPS_PREFIX = "https://{s3_bucket_name}.s3.us-east-2.amazonaws.com"
+# Retries of a conditional update of a shared JSON file (e.g. the product index) which lost a race
+# with a concurrent update, and the wait before the first retry (doubling, with jitter)
+JSON_UPDATE_MAX_RETRIES = int(os.environ.get("JSON_UPDATE_MAX_RETRIES", 5))
+JSON_UPDATE_BACKOFF_SECONDS = float(os.environ.get("JSON_UPDATE_BACKOFF_SECONDS", 0.5))
+# S3's error codes for a conditional write whose condition no longer holds
+CONDITIONAL_WRITE_CONFLICT_CODES = ["PreconditionFailed", "ConditionalRequestConflict"]
 
 
 class CloudStaticIOClient:
@@ -248,17 +266,33 @@ class CloudStaticIOClient:
         except Exception as err:
             raise Exception(err)
 
-    def upload_cogs(self, metrics_stack, fire_event_name, affiliation, final=True):
+    def upload_cogs(
+        self,
+        metrics_stack,
+        fire_event_name,
+        affiliation,
+        final=True,
+        dtype=DEFAULT_DTYPE,
+        quantize_metrics=QUANTIZE_METRIC_COGS,
+        summary_pyramids=UPLOAD_SUMMARY_PYRAMIDS,
+    ):
         """
         Uploads COGs (Cloud-Optimized GeoTIFFs) to a remote location, according to
         `public/{affiliation}/{fire_event_name}/{band_name}.tif`. Also adds
-        overviews to the COGs for faster loading at lower zoom levels.
+        overviews to the COGs for faster loading at lower zoom levels, and (optionally)
+        uploads a summary pyramid of each metric alongside it, to
+        `public/{affiliation}/{fire_event_name}/{band_name}_summary_pyramid.npz`
+        (see `src.lib.summary_pyramid`).
 
         Args:
             metrics_stack (xarray.DataArray): Stack of metrics data.
             fire_event_name (str): Name of the fire event.
             affiliation (str): Affiliation of the data.
             final (bool): Whether to prefix 'intermediate_' to resultant tiffs.
+            dtype (str, optional): Dtype of the written COGs. Defaults to `DEFAULT_DTYPE`.
+            quantize_metrics (bool, optional): Whether to store the metrics as int16, with GDAL scale/offset
+                and nodata, rather than in `dtype` (see `src.lib.quantization`). Defaults to `QUANTIZE_METRIC_COGS`.
+            summary_pyramids (bool, optional): Whether to upload the summary pyramid of each metric. Defaults to `UPLOAD_SUMMARY_PYRAMIDS`.
 
         Returns:
             None
@@ -267,8 +301,13 @@ class CloudStaticIOClient:
             for band_name in metrics_stack.burn_metric.to_index():
                 # Save the band as a local COG
                 local_cog_path = os.path.join(tmpdir, f"{band_name}.tif")
-                band_cog = metrics_stack.sel(burn_metric=band_name).rio
-                band_cog.to_raster(local_cog_path, driver="GTiff")
+                self.write_metric_cog(
+                    metrics_stack.sel(burn_metric=band_name),
+                    local_cog_path,
+                    band_name,
+                    dtype=dtype,
+                    quantize_metrics=quantize_metrics,
+                )
 
                 # Update the COG with overviews, for faster loading at lower zoom levels
                 self.logger.info(f"Updating {band_name} with overviews")
@@ -302,12 +341,160 @@ class CloudStaticIOClient:
                 / metrics_stack.sel(burn_metric="dnbr")
                 * 100
             )
-            pct_change.rio.to_raster(local_cog_path, driver="GTiff")
+            self.write_metric_cog(
+                pct_change,
+                local_cog_path,
+                "pct_change_dnbr_rbr",
+                dtype=dtype,
+                quantize_metrics=quantize_metrics,
+            )
             self.upload(
                 source_local_path=local_cog_path,
                 remote_path=f"public/{affiliation}/{fire_event_name}/pct_change_dnbr_rbr.tif",
             )
 
+            if summary_pyramids:
+                for band_name in metrics_stack.burn_metric.to_index():
+                    self.upload_summary_pyramid(
+                        metrics_stack.sel(burn_metric=band_name),
+                        band_name if final else f"intermediate_{band_name}",
+                        fire_event_name,
+                        affiliation,
+                    )
+
+    def upload_summary_pyramid(self, metric, metric_name, fire_event_name, affiliation):
+        """
+        Builds the summary pyramid of a metric (see `src.lib.summary_pyramid.SummaryPyramid`) and uploads
+        it to `public/{affiliation}/{fire_event_name}/{metric_name}_summary_pyramid.npz`. It is built from
+        the float values of the metric, so is the same whether or not its COG is quantized.
+
+        Args:
+            metric (xarray.DataArray): The metric.
+            metric_name (str): Name of the metric.
+            fire_event_name (str): Name of the fire event.
+            affiliation (str): Affiliation of the data.
+
+        Returns:
+            None
+        """
+        self.logger.info(f"Building the summary pyramid of {metric_name}")
+        summary_pyramid = SummaryPyramid.from_array(metric)
+        remote_path = (
+            f"public/{affiliation}/{fire_event_name}/{metric_name}_summary_pyramid.npz"
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_pyramid_path = os.path.join(tmpdir, f"{metric_name}_summary_pyramid.npz")
+            summary_pyramid.to_npz(tmp_pyramid_path)
+            self.upload(source_local_path=tmp_pyramid_path, remote_path=remote_path)
+        self.cloud_cog_paths[f"{metric_name}_summary_pyramid"] = (
+            self.https_prefix + f"/{remote_path}"
+        )
+
+    def get_summary_pyramid(self, metric_name, fire_event_name, affiliation):
+        """
+        Retrieves the summary pyramid of a metric of a fire event (see `upload_summary_pyramid`).
+
+        Args:
+            metric_name (str): Name of the metric.
+            fire_event_name (str): Name of the fire event.
+            affiliation (str): Affiliation of the data.
+
+        Returns:
+            SummaryPyramid: The summary pyramid.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_pyramid_path = os.path.join(tmpdir, f"{metric_name}_summary_pyramid.npz")
+            self.download(
+                f"public/{affiliation}/{fire_event_name}/{metric_name}_summary_pyramid.npz",
+                tmp_pyramid_path,
+            )
+            self.logger.info(f"Got {metric_name}_summary_pyramid.npz")
+            return SummaryPyramid.from_npz(tmp_pyramid_path)
+
+    def write_metric_cog(
+        self,
+        metric,
+        local_cog_path,
+        metric_name,
+        dtype=DEFAULT_DTYPE,
+        quantize_metrics=QUANTIZE_METRIC_COGS,
+    ):
+        """
+        Writes a single metric to a local GeoTIFF, either as floats in `dtype`, or quantized to int16
+        with the metric's scale (see `src.lib.quantization`). Quantized metrics are also tiled in
+        256px blocks (the size of a map tile) and compressed (fast deflate, with horizontal
+        differencing), so a tile request only reads the few compressed blocks it covers.
+
+        Args:
+            metric (xarray.DataArray): The metric.
+            local_cog_path (str): Path to write the GeoTIFF to.
+            metric_name (str): Name of the metric, which determines its quantization scale.
+            dtype (str, optional): Dtype of unquantized metrics. Defaults to `DEFAULT_DTYPE`.
+            quantize_metrics (bool, optional): Whether to quantize the metric. Defaults to `QUANTIZE_METRIC_COGS`.
+
+        Returns:
+            None
+        """
+        if not quantize_metrics:
+            metric.astype(dtype).rio.to_raster(local_cog_path, driver="GTiff")
+            return
+
+        quantized = quantize(
+            metric, scale=METRIC_SCALES.get(metric_name, DEFAULT_METRIC_SCALE)
+        )
+        quantized.rio.to_raster(
+            local_cog_path,
+            driver="GTiff",
+            tiled=True,
+            blockxsize=256,
+            blockysize=256,
+            compress="deflate",
+            zlevel=1,
+            predictor=2,
+        )
+
+    def upload_time_series(self, time_series_paths, fire_event_name, affiliation):
+        """
+        Uploads per-pass time series COGs (as written by `src.lib.nbr_time_series.write_nbr_time_series`,
+        which already carry overviews) to a remote location, according to
+        `public/{affiliation}/{fire_event_name}/{name}_time_series.tif`.
+
+        Args:
+            time_series_paths (dict): Local paths of the time series, keyed by name (e.g. "nbr", "dnbr").
+            fire_event_name (str): Name of the fire event.
+            affiliation (str): Affiliation of the data.
+
+        Returns:
+            None
+        """
+        for name, local_path in time_series_paths.items():
+            remote_path = f"public/{affiliation}/{fire_event_name}/{name}_time_series.tif"
+            self.upload(source_local_path=local_path, remote_path=remote_path)
+            self.cloud_cog_paths[f"{name}_time_series"] = (
+                self.https_prefix + f"/{remote_path}"
+            )
+
+    def upload_recovery_summary(self, recovery_summary, fire_event_name, affiliation):
+        """
+        Uploads the recovery curves of a fire event (see `src.lib.recovery.summarize_recovery`) as JSON,
+        to `public/{affiliation}/{fire_event_name}/recovery_summary.json`.
+
+        Args:
+            recovery_summary (dict): The recovery curves.
+            fire_event_name (str): Name of the fire event.
+            affiliation (str): Affiliation of the data.
+
+        Returns:
+            None
+        """
+        remote_path = f"public/{affiliation}/{fire_event_name}/recovery_summary.json"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_summary_path = os.path.join(tmpdir, "recovery_summary.json")
+            with open(tmp_summary_path, "w") as f:
+                json.dump(recovery_summary, f)
+            self.upload(source_local_path=tmp_summary_path, remote_path=remote_path)
+        self.cloud_cog_paths["recovery_summary"] = self.https_prefix + f"/{remote_path}"
+
     def upload_rap_estimates(self, rap_estimates, fire_event_name, affiliation):
         """
         Uploads RAP estimates to a remote location, according to
@@ -350,10 +537,13 @@ class CloudStaticIOClient:
         affiliation,
         derive_boundary,
         satellite_pass_information,
+        quantized_metrics=False,
     ):
         """
         Updates the manifest with the given fire event information for the specified affiliation. If the fire event
-        already exists in the manifest, it will be overwritten.
+        already exists in the manifest, it will be overwritten. The update is applied to the latest manifest, and
+        written conditionally, so concurrent uploads (on any instance) don't lose each other's fire events (see
+        `update_json`).
 
         Args:
             fire_event_name (str): The name of the fire event.
@@ -362,39 +552,32 @@ class CloudStaticIOClient:
             postfire_date_range (tuple): The postfire date range of the fire event.
             affiliation (str): The affiliation for which the manifest is being updated.
             derive_boundary (bool): Flag indicating whether to derive the boundary.
+            quantized_metrics (bool, optional): Whether the metric COGs are quantized to int16. Defaults to False.
 
         Returns:
             None
         """
-        with tempfile.TemporaryDirectory() as tmpdir:
-            manifest = self.get_manifest()
-
+        fire_event = {
+            "bounds": bounds,
+            "prefire_date_range": prefire_date_range,
+            "postfire_date_range": postfire_date_range,
+            "last_updated": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "derive_boundary": derive_boundary,
+            "satellite_pass_information": satellite_pass_information,
+            "quantized_metrics": quantized_metrics,
+        }
+
+        def update(manifest):
+            manifest = manifest or {}
             if affiliation in manifest and fire_event_name in manifest[affiliation]:
                 self.logger.info(
                     f"Fire event {fire_event_name} already exists in manifest for affiliation {affiliation}. Overwriting."
                 )
-                del manifest[affiliation][fire_event_name]
-
-            if affiliation not in manifest:
-                manifest[affiliation] = {}
-
-            manifest[affiliation][fire_event_name] = {
-                "bounds": bounds,
-                "prefire_date_range": prefire_date_range,
-                "postfire_date_range": postfire_date_range,
-                "last_updated": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "derive_boundary": derive_boundary,
-                "satellite_pass_information": satellite_pass_information,
-            }
-
-            # Upload the manifest to our SFTP server
-            tmp_manifest_path = os.path.join(tmpdir, "manifest_updated.json")
-            with open(tmp_manifest_path, "w") as f:
-                json.dump(manifest, f)
-            self.upload(
-                source_local_path=tmp_manifest_path, remote_path="manifest.json"
-            )
-            self.logger.info(f"Uploaded/updated manifest.json")
+            manifest.setdefault(affiliation, {})[fire_event_name] = fire_event
+            return manifest
+
+        self.update_json("manifest.json", update)
+        self.logger.info(f"Uploaded/updated manifest.json")
 
     def upload_fire_event(
         self,
@@ -405,6 +588,7 @@ class CloudStaticIOClient:
         affiliation,
         final,
         satellite_pass_information,
+        quantize_metrics=QUANTIZE_METRIC_COGS,
     ):
         """
         Uploads a fire event to the cloud storage location (uploads COGs and updates the manifest.json file).
@@ -416,6 +600,8 @@ class CloudStaticIOClient:
             postfire_date_range (tuple): The date range after the fire event.
             affiliation (str): The affiliation of the fire event.
             final (bool): Whether to prefix 'intermediate_' to resultant tiffs.
+            quantize_metrics (bool, optional): Whether to store the metrics as int16 (see `upload_cogs`).
+                Defaults to `QUANTIZE_METRIC_COGS`.
 
         Returns:
             None
@@ -427,6 +613,7 @@ class CloudStaticIOClient:
             fire_event_name=fire_event_name,
             affiliation=affiliation,
             final=final,
+            quantize_metrics=quantize_metrics,
         )
 
         bounds = [round(pos, 4) for pos in metrics_stack.rio.bounds()]
@@ -439,6 +626,7 @@ class CloudStaticIOClient:
             affiliation=affiliation,
             derive_boundary=final,
             satellite_pass_information=satellite_pass_information,
+            quantized_metrics=quantize_metrics,
         )
 
     def update_fire_event(
@@ -449,6 +637,8 @@ class CloudStaticIOClient:
     ):
         """
         Updates a fire event in the cloud storage location (uploads COGs and updates the manifest.json file).
+        The final COGs are overwritten, clipped to the derived boundary, so any indexed product of them
+        (from an analysis with `final` set) no longer covers its boundary, and is removed from the index.
 
         Args:
             metrics_stack (xr.DataArray): The metrics stack containing the fire event data.
@@ -463,14 +653,24 @@ class CloudStaticIOClient:
         """
         self.logger.info(f"Updating fire event {fire_event_name}")
 
+        existing_manifest = self.get_manifest()
+        this_manifest = existing_manifest[affiliation][fire_event_name]
+
+        # Keep the COGs in the form they were first uploaded in
+        quantized_metrics = this_manifest.get("quantized_metrics", False)
         self.upload_cogs(
             metrics_stack=metrics_stack,
             fire_event_name=fire_event_name,
             affiliation=affiliation,
+            quantize_metrics=quantized_metrics,
+        )
+        overwritten_cog_paths = [
+            self.cloud_cog_paths[metric_name]
+            for metric_name in metrics_stack.burn_metric.to_index()
+        ]
+        self.update_product_index(
+            lambda product_index: product_index.remove_cog_paths(overwritten_cog_paths)
         )
-
-        existing_manifest = self.get_manifest()
-        this_manifest = existing_manifest[affiliation][fire_event_name]
 
         self.update_manifest(
             fire_event_name=fire_event_name,
@@ -480,6 +680,7 @@ class CloudStaticIOClient:
             prefire_date_range=this_manifest["prefire_date_range"],
             postfire_date_range=this_manifest["postfire_date_range"],
             satellite_pass_information=this_manifest["satellite_pass_information"],
+            quantized_metrics=quantized_metrics,
         )
 
     def get_manifest(self):
@@ -495,6 +696,159 @@ class CloudStaticIOClient:
             manifest = json.load(open(tmpdir + "tmp_manifest.json", "r"))
             return manifest
 
+    def get_product_index(self):
+        """
+        Retrieves the index of already computed products from the cloud storage. If there is no
+        index yet, an empty one is returned.
+
+        Returns:
+            ProductIndex: The product index.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_index_path = os.path.join(tmpdir, "product_index.json")
+            try:
+                self.download("product_index.json", tmp_index_path)
+            except Exception as err:
+                self.logger.info(f"No product_index.json found ({err}), starting a new one")
+                return ProductIndex()
+
+            self.logger.info(f"Got product_index.json")
+            with open(tmp_index_path, "r") as f:
+                return ProductIndex.from_dict(json.load(f))
+
+    def update_json(
+        self,
+        remote_path,
+        update,
+        max_retries=JSON_UPDATE_MAX_RETRIES,
+        backoff_seconds=JSON_UPDATE_BACKOFF_SECONDS,
+    ):
+        """
+        Read-modify-write a JSON file shared by concurrent requests (e.g. the product index), without
+        losing concurrent updates. The file is read along with its ETag, and written back only if it
+        still has that ETag (or, if it didn't exist, only if it still doesn't). If another request
+        wrote it in between, the update is re-applied to its new contents, with exponential backoff.
+
+        Args:
+            remote_path (str): The path of the JSON file in the bucket.
+            update (callable): Takes the current contents (dict, or None if there is no file yet) and
+                returns the new contents. It may be called several times, so shouldn't have side effects.
+            max_retries (int, optional): Number of retries after a conflicting write. Defaults to
+                `JSON_UPDATE_MAX_RETRIES`.
+            backoff_seconds (float, optional): Wait before the first retry, doubling for each retry after
+                that. Defaults to `JSON_UPDATE_BACKOFF_SECONDS`.
+
+        Returns:
+            dict: The contents written.
+
+        Raises:
+            botocore.exceptions.ClientError: If the write still conflicts after `max_retries` retries.
+        """
+        self.validate_credentials()
+        s3_client = self.boto_session.client("s3")
+
+        for attempt in range(max_retries + 1):
+            try:
+                response = s3_client.get_object(
+                    Bucket=self.s3_bucket_name, Key=remote_path
+                )
+                contents = json.loads(response["Body"].read())
+                condition = {"IfMatch": response["ETag"]}
+            except s3_client.exceptions.NoSuchKey:
+                contents = None
+                condition = {"IfNoneMatch": "*"}
+
+            updated_contents = update(contents)
+            try:
+                s3_client.put_object(
+                    Bucket=self.s3_bucket_name,
+                    Key=remote_path,
+                    Body=json.dumps(updated_contents).encode(),
+                    ContentType="application/json",
+                    **condition,
+                )
+                return updated_contents
+            except botocore.exceptions.ClientError as err:
+                if (
+                    err.response["Error"]["Code"] not in CONDITIONAL_WRITE_CONFLICT_CODES
+                    or attempt == max_retries
+                ):
+                    raise
+                wait_seconds = backoff_seconds * 2**attempt * random.uniform(1, 2)
+                self.logger.info(
+                    f"{remote_path} was updated concurrently, retrying in {wait_seconds:.1f}s"
+                )
+                time.sleep(wait_seconds)
+
+    def update_product_index(self, update):
+        """
+        Updates the index of already computed products in the cloud storage. The update is applied to
+        the latest index, and written conditionally, so concurrent updates aren't lost (see `update_json`).
+
+        Args:
+            update (callable): Modifies a ProductIndex in place, e.g. registering a product. It may be called
+                several times, on fresh copies of the index.
+
+        Returns:
+            ProductIndex: The updated product index.
+        """
+
+        def update_index(index_dict):
+            product_index = ProductIndex.from_dict(index_dict or {})
+            update(product_index)
+            return product_index.to_dict()
+
+        product_index = ProductIndex.from_dict(
+            self.update_json("product_index.json", update_index)
+        )
+        self.logger.info(f"Uploaded/updated product_index.json")
+        return product_index
+
+    def get_fire_monitor(self):
+        """
+        Retrieves the monitor of active fire events from the cloud storage. If there is no monitor
+        yet, an empty one is returned.
+
+        Returns:
+            FireMonitor: The fire monitor.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp_monitor_path = os.path.join(tmpdir, "fire_monitor.json")
+            try:
+                self.download("fire_monitor.json", tmp_monitor_path)
+            except Exception as err:
+                self.logger.info(f"No fire_monitor.json found ({err}), starting a new one")
+                return FireMonitor()
+
+            self.logger.info(f"Got fire_monitor.json")
+            with open(tmp_monitor_path, "r") as f:
+                return FireMonitor.from_dict(json.load(f))
+
+    def update_fire_monitor(self, update):
+        """
+        Updates the monitor of active fire events in the cloud storage. The update is applied to the
+        latest monitor, and written conditionally, so concurrent polls and registrations (on any instance)
+        don't lose each other's updates (see `update_json`).
+
+        Args:
+            update (callable): Modifies a FireMonitor in place, e.g. registering a fire event. It may be
+                called several times, on fresh copies of the monitor.
+
+        Returns:
+            FireMonitor: The updated fire monitor.
+        """
+
+        def update_monitor(monitor_dict):
+            fire_monitor = FireMonitor.from_dict(monitor_dict or {})
+            update(fire_monitor)
+            return fire_monitor.to_dict()
+
+        fire_monitor = FireMonitor.from_dict(
+            self.update_json("fire_monitor.json", update_monitor)
+        )
+        self.logger.info(f"Uploaded/updated fire_monitor.json")
+        return fire_monitor
+
     def get_derived_products(self, affiliation, fire_event_name):
         """
         Retrieves the derived products associated with a specific affiliation and fire event. We basically
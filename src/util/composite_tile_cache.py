@@ -0,0 +1,229 @@
+import os
+import json
+import math
+import time
+import hashlib
+import tempfile
+import xarray as xr
+import rioxarray as rxr
+
+# Off by default, as prefire composites are then built from whole regional tiles, which for small
+# AOIs means a wider search and more reads than compositing the AOI alone
+COMPOSITE_TILE_CACHE_ENABLED = (
+    os.environ.get("COMPOSITE_TILE_CACHE_ENABLED", "false").lower() == "true"
+)
+COMPOSITE_TILE_CACHE_DIR = os.environ.get(
+    "COMPOSITE_TILE_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "burn-severity-composite-tiles"),
+)
+COMPOSITE_TILE_CACHE_MAX_AGE_SECONDS = int(
+    os.environ.get("COMPOSITE_TILE_CACHE_MAX_AGE_SECONDS", 90 * 24 * 60 * 60)
+)
+# Beyond this, the least recently used tiles are evicted by `prune`
+COMPOSITE_TILE_CACHE_MAX_BYTES = int(
+    os.environ.get("COMPOSITE_TILE_CACHE_MAX_BYTES", 5 * 1024**3)
+)
+# 512 pixels is ~10km at Sentinel-2's 20m resolution
+COMPOSITE_TILE_SIZE_PIXELS = int(os.environ.get("COMPOSITE_TILE_SIZE_PIXELS", 512))
+
+
+def composite_tile_bounds(
+    tile_index, resolution, tile_size_pixels=COMPOSITE_TILE_SIZE_PIXELS
+):
+    """
+    Get the bounds of a tile of the fixed composite tile grid (anchored at the origin of the CRS).
+
+    Args:
+        tile_index (tuple): The (column, row) index of the tile.
+        resolution (int): Resolution of the grid, in units of the CRS.
+        tile_size_pixels (int, optional): Width and height of tiles, in pixels. Defaults to `COMPOSITE_TILE_SIZE_PIXELS`.
+
+    Returns:
+        tuple: The (minx, miny, maxx, maxy) bounds of the tile.
+    """
+    tile_size = tile_size_pixels * resolution
+    column, row = tile_index
+    return (
+        column * tile_size,
+        row * tile_size,
+        (column + 1) * tile_size,
+        (row + 1) * tile_size,
+    )
+
+
+def composite_tiles(bounds, resolution, tile_size_pixels=COMPOSITE_TILE_SIZE_PIXELS):
+    """
+    Get the tiles of the fixed composite tile grid which cover the given bounds.
+
+    Args:
+        bounds (tuple): The (minx, miny, maxx, maxy) bounds to cover.
+        resolution (int): Resolution of the grid, in units of the CRS.
+        tile_size_pixels (int, optional): Width and height of tiles, in pixels. Defaults to `COMPOSITE_TILE_SIZE_PIXELS`.
+
+    Returns:
+        list: The (column, row) indices of the covering tiles.
+    """
+    tile_size = tile_size_pixels * resolution
+    minx, miny, maxx, maxy = bounds
+    return [
+        (column, row)
+        for column in range(math.floor(minx / tile_size), math.ceil(maxx / tile_size))
+        for row in range(math.floor(miny / tile_size), math.ceil(maxy / tile_size))
+    ]
+
+
+def composite_tile_key(epsg, tile_index, resolution, date_range, reducer_config):
+    """
+    Get the key of a composite tile. Any fire whose AOI overlaps the tile, with the same date window
+    and reducer configuration, shares the tile.
+
+    Args:
+        epsg (int): EPSG code of the tile grid.
+        tile_index (tuple): The (column, row) index of the tile.
+        resolution (int): Resolution of the grid, in units of the CRS.
+        date_range (list): The date window of the composite.
+        reducer_config (dict): Configuration of the composite (reducer, bands, dtype, etc.).
+
+    Returns:
+        str: The tile key.
+    """
+    tile = {
+        "epsg": int(epsg),
+        "tile_index": list(tile_index),
+        "resolution": resolution,
+        "date_range": list(date_range),
+        "reducer_config": reducer_config,
+    }
+    return hashlib.sha1(json.dumps(tile, sort_keys=True).encode()).hexdigest()
+
+
+class CompositeTileCache:
+    """
+    A cache of composite (time-reduced) tiles, on the instance's local disk, as tiled GeoTIFFs
+    keyed by `composite_tile_key`. Fires in the same region and season build their prefire
+    composites from the same scenes, so each tile only needs to be reduced once. A tile's
+    modification time is when it was cached, and its access time when it was last loaded (set
+    explicitly), for least recently used eviction.
+
+    Args:
+        root_dir (str, optional): Directory of the cache. Defaults to `COMPOSITE_TILE_CACHE_DIR`.
+        max_age_seconds (int, optional): Tiles older than this are ignored (and removed by `prune`).
+            Defaults to `COMPOSITE_TILE_CACHE_MAX_AGE_SECONDS`.
+        max_bytes (int, optional): Size of the cache beyond which `prune` evicts the least recently
+            used tiles. Defaults to `COMPOSITE_TILE_CACHE_MAX_BYTES`.
+    """
+
+    def __init__(
+        self,
+        root_dir=COMPOSITE_TILE_CACHE_DIR,
+        max_age_seconds=COMPOSITE_TILE_CACHE_MAX_AGE_SECONDS,
+        max_bytes=COMPOSITE_TILE_CACHE_MAX_BYTES,
+    ):
+        self.root_dir = root_dir
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.root_dir, f"{key}.tif")
+
+    def load(self, key):
+        """
+        Load a cached tile.
+
+        Args:
+            key (str): Key of the tile (see `composite_tile_key`).
+
+        Returns:
+            xr.DataArray: The (band, y, x) tile, or None if it isn't cached (or is stale).
+        """
+        path = self.path(key)
+        try:
+            modified_time = os.path.getmtime(path)
+            if time.time() - modified_time > self.max_age_seconds:
+                return None
+            with rxr.open_rasterio(path, masked=True) as tile:
+                tile = tile.load()
+            os.utime(path, (time.time(), modified_time))
+        except FileNotFoundError:
+            # Never cached, or evicted concurrently
+            return None
+
+        band_names = tile.attrs.pop("long_name")
+        if isinstance(band_names, str):
+            band_names = [band_names]
+        tile["band"] = list(band_names)
+        return tile
+
+    def save(self, key, tile):
+        """
+        Cache a tile. It is written to a temporary file and renamed into place, so concurrent
+        readers never see a partially written tile.
+
+        Args:
+            key (str): Key of the tile (see `composite_tile_key`).
+            tile (xr.DataArray): The (band, y, x) tile, with a CRS.
+
+        Returns:
+            None
+        """
+        os.makedirs(self.root_dir, exist_ok=True)
+
+        tile = xr.DataArray(
+            tile.values,
+            dims=("band", "y", "x"),
+            coords={"band": tile.band.values, "y": tile.y.values, "x": tile.x.values},
+            attrs={"long_name": tuple(str(band) for band in tile.band.values)},
+        ).rio.write_crs(tile.rio.crs)
+
+        # Not a ".tif", so `prune` never removes a tile mid-write
+        fd, tmp_path = tempfile.mkstemp(dir=self.root_dir, suffix=".tif.tmp")
+        os.close(fd)
+        try:
+            tile.rio.to_raster(
+                tmp_path,
+                driver="GTiff",
+                tiled=True,
+                blockxsize=256,
+                blockysize=256,
+                compress="deflate",
+            )
+            os.replace(tmp_path, self.path(key))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def prune(self):
+        """
+        Remove stale tiles, then the least recently used tiles while the cache is larger than
+        `max_bytes`.
+
+        Returns:
+            None
+        """
+        if not os.path.isdir(self.root_dir):
+            return
+
+        tiles = []
+        for filename in os.listdir(self.root_dir):
+            if not filename.endswith(".tif"):
+                continue
+            path = os.path.join(self.root_dir, filename)
+            try:
+                stat = os.stat(path)
+                if time.time() - stat.st_mtime > self.max_age_seconds:
+                    os.remove(path)
+                else:
+                    tiles.append((stat.st_atime, stat.st_size, path))
+            except FileNotFoundError:
+                # Pruned concurrently, by another request
+                continue
+
+        total_bytes = sum(size for __atime, size, __path in tiles)
+        for __atime, size, path in sorted(tiles):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
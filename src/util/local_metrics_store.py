@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import numpy as np
+import xarray as xr
+import rioxarray as rxr
+
+LOCAL_METRICS_STORE_DIR = os.environ.get(
+    "LOCAL_METRICS_STORE_DIR",
+    os.path.join(tempfile.gettempdir(), "burn-severity-metrics-store"),
+)
+LOCAL_METRICS_STORE_MAX_AGE_SECONDS = int(
+    os.environ.get("LOCAL_METRICS_STORE_MAX_AGE_SECONDS", 24 * 60 * 60)
+)
+
+HEADER_FILENAME = "header.json"
+VALUES_FILENAME = "metrics.npy"
+HISTOGRAM_FILENAME = "histogram_{metric_name}.npz"
+
+
+def metrics_store_signature(
+    bounds, prefire_date_range, postfire_date_range, satellite_pass_information
+):
+    """
+    Get the signature identifying the source of a metrics stack, as recorded in the manifest
+    when the fire event was analyzed. If a fire event is re-analyzed (on any instance) with a
+    different boundary or date ranges, or new passes are available, the signature changes.
+
+    Args:
+        bounds (list): Bounds of the metrics stack, as recorded in the manifest.
+        prefire_date_range (list): The prefire date range.
+        postfire_date_range (list): The postfire date range.
+        satellite_pass_information (dict): Satellite pass information of the fire event.
+
+    Returns:
+        dict: The signature, normalized such that it compares equal to itself after a JSON round trip.
+    """
+    return json.loads(
+        json.dumps(
+            {
+                "bounds": bounds,
+                "prefire_date_range": prefire_date_range,
+                "postfire_date_range": postfire_date_range,
+                "satellite_pass_information": satellite_pass_information,
+            }
+        )
+    )
+
+
+class LocalMetricsStore:
+    """
+    A store of computed metrics stacks on the instance's local disk, so that follow-up requests
+    on a fire event (flood fill, classification, statistics) can skip downloading and decoding
+    the COGs from S3. Each stack is persisted as a raw `.npy` array alongside a small JSON header
+    holding its coordinates, CRS and source signature. Any worker process on the instance can
+    then memory-map the array, rather than reading it into memory.
+
+    Entries are written to a temporary directory and renamed into place, so readers in other
+    processes never see a partially written entry (and keep a valid mapping of the old entry
+    if it is replaced while they hold it).
+
+    Args:
+        root_dir (str, optional): Directory of the store. Defaults to `LOCAL_METRICS_STORE_DIR`.
+        max_age_seconds (int, optional): Entries older than this are considered stale. Defaults to
+            `LOCAL_METRICS_STORE_MAX_AGE_SECONDS`.
+    """
+
+    def __init__(
+        self,
+        root_dir=LOCAL_METRICS_STORE_DIR,
+        max_age_seconds=LOCAL_METRICS_STORE_MAX_AGE_SECONDS,
+    ):
+        self.root_dir = root_dir
+        self.max_age_seconds = max_age_seconds
+
+    def entry_dir(self, affiliation, fire_event_name):
+        return os.path.join(self.root_dir, affiliation, fire_event_name)
+
+    def save(self, metrics_stack, affiliation, fire_event_name, source_signature):
+        """
+        Persist a metrics stack, replacing any existing entry for the fire event.
+
+        Args:
+            metrics_stack (xr.DataArray): The metrics stack, with dims (burn_metric, y, x).
+            affiliation (str): Affiliation of the fire event.
+            fire_event_name (str): Name of the fire event.
+            source_signature (dict): Signature of the source of the stack (see `metrics_store_signature`).
+
+        Returns:
+            None
+        """
+        metrics_stack = metrics_stack.transpose("burn_metric", "y", "x")
+        entry_dir = self.entry_dir(affiliation, fire_event_name)
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir))
+        try:
+            values = np.lib.format.open_memmap(
+                os.path.join(tmp_dir, VALUES_FILENAME),
+                mode="w+",
+                dtype=metrics_stack.dtype,
+                shape=metrics_stack.shape,
+            )
+            values[:] = metrics_stack.values
+            values.flush()
+            del values
+
+            header = {
+                "burn_metric": [str(m) for m in metrics_stack.burn_metric.values],
+                "x": metrics_stack.x.values.tolist(),
+                "y": metrics_stack.y.values.tolist(),
+                "crs": metrics_stack.rio.crs.to_wkt() if metrics_stack.rio.crs else None,
+                "created": time.time(),
+                "source_signature": source_signature,
+            }
+            with open(os.path.join(tmp_dir, HEADER_FILENAME), "w") as f:
+                json.dump(header, f)
+
+            # Swap the new entry into place, then clean up the old one
+            stale_dir = None
+            if os.path.isdir(entry_dir):
+                stale_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir))
+                os.replace(entry_dir, os.path.join(stale_dir, "entry"))
+            os.replace(tmp_dir, entry_dir)
+            if stale_dir is not None:
+                shutil.rmtree(stale_dir, ignore_errors=True)
+
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def open(self, affiliation, fire_event_name, source_signature=None):
+        """
+        Open a persisted metrics stack, memory-mapped copy-on-write (so reads are zero-copy, and
+        any in-place edits stay private to the calling process).
+
+        Args:
+            affiliation (str): Affiliation of the fire event.
+            fire_event_name (str): Name of the fire event.
+            source_signature (dict, optional): Expected signature of the source of the stack. If given,
+                and it doesn't match that of the entry, the entry is considered stale. Defaults to None.
+
+        Returns:
+            xr.DataArray: The metrics stack, or None if there is no entry or it is stale.
+        """
+        entry_dir = self.entry_dir(affiliation, fire_event_name)
+        header = self._read_valid_header(entry_dir, fire_event_name, source_signature)
+        if header is None:
+            return None
+        try:
+            values = np.load(os.path.join(entry_dir, VALUES_FILENAME), mmap_mode="c")
+        except (FileNotFoundError, ValueError):
+            return None
+
+        metrics_stack = xr.DataArray(
+            values,
+            dims=["burn_metric", "y", "x"],
+            coords={
+                "burn_metric": header["burn_metric"],
+                "y": header["y"],
+                "x": header["x"],
+            },
+        )
+        if header["crs"]:
+            metrics_stack = metrics_stack.rio.write_crs(header["crs"])
+
+        return metrics_stack
+
+    def _read_valid_header(self, entry_dir, fire_event_name, source_signature=None):
+        try:
+            with open(os.path.join(entry_dir, HEADER_FILENAME), "r") as f:
+                header = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if time.time() - header["created"] > self.max_age_seconds:
+            print(f"Local metrics stack for {fire_event_name} is stale (too old)")
+            return None
+
+        if (
+            source_signature is not None
+            and header["source_signature"] != source_signature
+        ):
+            print(f"Local metrics stack for {fire_event_name} is stale (new source)")
+            return None
+
+        return header
+
+    def save_histogram(self, histogram, affiliation, fire_event_name, metric_name):
+        """
+        Persist the histogram of a metric of a persisted metrics stack (see
+        `src.lib.derive_boundary.metric_histogram`), alongside it. The histogram lives in the stack's
+        entry, so it is dropped along with the stack when the entry is replaced or invalidated. If
+        there is no entry for the fire event, nothing is saved.
+
+        Args:
+            histogram (dict): The counts of each bin, and the bin edges.
+            affiliation (str): Affiliation of the fire event.
+            fire_event_name (str): Name of the fire event.
+            metric_name (str): Name of the metric.
+
+        Returns:
+            None
+        """
+        entry_dir = self.entry_dir(affiliation, fire_event_name)
+        if not os.path.isdir(entry_dir):
+            return
+
+        # Write then rename, so readers never see a partially written histogram
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f, counts=histogram["counts"], bin_edges=histogram["bin_edges"]
+                )
+            os.replace(
+                tmp_path,
+                os.path.join(
+                    entry_dir, HISTOGRAM_FILENAME.format(metric_name=metric_name)
+                ),
+            )
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open_histogram(
+        self, affiliation, fire_event_name, metric_name, source_signature=None
+    ):
+        """
+        Open the persisted histogram of a metric of a persisted metrics stack (see `save_histogram`).
+
+        Args:
+            affiliation (str): Affiliation of the fire event.
+            fire_event_name (str): Name of the fire event.
+            metric_name (str): Name of the metric.
+            source_signature (dict, optional): Expected signature of the source of the stack (see `open`). Defaults to None.
+
+        Returns:
+            dict: The counts of each bin, and the bin edges, or None if there is no histogram or its stack is stale.
+        """
+        entry_dir = self.entry_dir(affiliation, fire_event_name)
+        if self._read_valid_header(entry_dir, fire_event_name, source_signature) is None:
+            return None
+        try:
+            with np.load(
+                os.path.join(
+                    entry_dir, HISTOGRAM_FILENAME.format(metric_name=metric_name)
+                )
+            ) as histogram:
+                return {
+                    "counts": histogram["counts"],
+                    "bin_edges": histogram["bin_edges"],
+                }
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def invalidate(self, affiliation, fire_event_name):
+        """
+        Remove the persisted metrics stack of a fire event, if there is one.
+
+        Args:
+            affiliation (str): Affiliation of the fire event.
+            fire_event_name (str): Name of the fire event.
+
+        Returns:
+            None
+        """
+        shutil.rmtree(self.entry_dir(affiliation, fire_event_name), ignore_errors=True)
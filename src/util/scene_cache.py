@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import numpy as np
+
+# Off by default, as every scene read is then also written to local disk
+SCENE_CACHE_ENABLED = (
+    os.environ.get("SCENE_CACHE_ENABLED", "false").lower() == "true"
+)
+SCENE_CACHE_DIR = os.environ.get(
+    "SCENE_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "burn-severity-scene-cache"),
+)
+SCENE_CACHE_MAX_AGE_SECONDS = int(
+    os.environ.get("SCENE_CACHE_MAX_AGE_SECONDS", 30 * 24 * 60 * 60)
+)
+# Beyond this, the least recently used scenes are evicted by `prune`
+SCENE_CACHE_MAX_BYTES = int(os.environ.get("SCENE_CACHE_MAX_BYTES", 10 * 1024**3))
+# 256 pixels is ~5km at Sentinel-2's 20m resolution
+SCENE_CACHE_TILE_SIZE_PIXELS = int(os.environ.get("SCENE_CACHE_TILE_SIZE_PIXELS", 256))
+
+
+def scene_tile_key(
+    epsg, tile_index, resolution, bands, dtype, tile_size_pixels=SCENE_CACHE_TILE_SIZE_PIXELS
+):
+    """
+    Get the key of a tile of the fixed grid scenes are cached on (the composite tile grid, see
+    `src.util.composite_tile_cache.composite_tiles`, at `tile_size_pixels`). Any AOI which overlaps
+    the tile shares its cached scenes.
+
+    Args:
+        epsg (int): EPSG code of the grid.
+        tile_index (tuple): The (column, row) index of the tile.
+        resolution (int): Resolution of the grid, in units of the CRS.
+        bands (list): Names of the cached bands.
+        dtype (str): Dtype of the cached arrays.
+        tile_size_pixels (int, optional): Width and height of tiles, in pixels. Defaults to `SCENE_CACHE_TILE_SIZE_PIXELS`.
+
+    Returns:
+        str: The tile key.
+    """
+    tile = {
+        "epsg": int(epsg),
+        "tile_index": list(tile_index),
+        "tile_size_pixels": tile_size_pixels,
+        "resolution": resolution,
+        "bands": list(bands),
+        "dtype": str(dtype),
+    }
+    return hashlib.sha1(json.dumps(tile, sort_keys=True).encode()).hexdigest()
+
+
+class SceneCache:
+    """
+    A cache of the band arrays of individual scenes (STAC items) over tiles of a fixed grid, on
+    the instance's local disk, keyed by tile (see `scene_tile_key`) and item id. A scene's pixels never change
+    once published, so when a new pass arrives for an active fire, re-running the analysis only
+    needs to read the new items - the reduction is recomputed from the cached arrays of the rest.
+
+    Each scene is stored as a raw `.npy` array (band, y, x), written to a temporary file and
+    renamed into place, and read back memory-mapped. A scene's modification time is when it was
+    cached, and its access time when it was last loaded (set explicitly, so it doesn't depend on
+    how the disk is mounted), for least recently used eviction.
+
+    Args:
+        root_dir (str, optional): Directory of the cache. Defaults to `SCENE_CACHE_DIR`.
+        max_age_seconds (int, optional): Cached scenes older than this are ignored (and removed by
+            `prune`). Defaults to `SCENE_CACHE_MAX_AGE_SECONDS`.
+        max_bytes (int, optional): Size of the cache beyond which `prune` evicts the least recently
+            used scenes. Defaults to `SCENE_CACHE_MAX_BYTES`.
+    """
+
+    def __init__(
+        self,
+        root_dir=SCENE_CACHE_DIR,
+        max_age_seconds=SCENE_CACHE_MAX_AGE_SECONDS,
+        max_bytes=SCENE_CACHE_MAX_BYTES,
+    ):
+        self.root_dir = root_dir
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+
+    def path(self, tile_key, item_id):
+        return os.path.join(self.root_dir, tile_key, f"{item_id}.npy")
+
+    def load(self, tile_key, item_id):
+        """
+        Load the cached arrays of a scene, memory-mapped read only.
+
+        Args:
+            tile_key (str): Key of the tile (see `scene_tile_key`).
+            item_id (str): Id of the item.
+
+        Returns:
+            np.ndarray: The (band, y, x) arrays of the scene, or None if they aren't cached (or are stale).
+        """
+        path = self.path(tile_key, item_id)
+        try:
+            modified_time = os.path.getmtime(path)
+            if time.time() - modified_time > self.max_age_seconds:
+                return None
+            values = np.load(path, mmap_mode="r")
+            os.utime(path, (time.time(), modified_time))
+            return values
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, tile_key, item_id, values):
+        """
+        Cache the arrays of a scene.
+
+        Args:
+            tile_key (str): Key of the tile (see `scene_tile_key`).
+            item_id (str): Id of the item.
+            values (np.ndarray): The (band, y, x) arrays of the scene.
+
+        Returns:
+            None
+        """
+        tile_dir = os.path.join(self.root_dir, tile_key)
+        os.makedirs(tile_dir, exist_ok=True)
+
+        # Not a ".npy", so `prune` never removes a scene mid-write
+        with tempfile.NamedTemporaryFile(
+            dir=tile_dir, suffix=".npy.tmp", delete=False
+        ) as tmp:
+            np.save(tmp, values)
+        os.replace(tmp.name, self.path(tile_key, item_id))
+
+    def prune(self):
+        """
+        Remove stale scenes, then the least recently used scenes while the cache is larger than
+        `max_bytes`, and tiles left without any scenes.
+
+        Returns:
+            None
+        """
+        if not os.path.isdir(self.root_dir):
+            return
+
+        scenes = []
+        for tile_key in os.listdir(self.root_dir):
+            tile_dir = os.path.join(self.root_dir, tile_key)
+            try:
+                for filename in os.listdir(tile_dir):
+                    if not filename.endswith(".npy"):
+                        continue
+                    path = os.path.join(tile_dir, filename)
+                    stat = os.stat(path)
+                    if time.time() - stat.st_mtime > self.max_age_seconds:
+                        os.remove(path)
+                    else:
+                        scenes.append((stat.st_atime, stat.st_size, path))
+            except FileNotFoundError:
+                # Pruned concurrently, by another request
+                continue
+
+        total_bytes = sum(size for __atime, size, __path in scenes)
+        for __atime, size, path in sorted(scenes):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+        for tile_key in os.listdir(self.root_dir):
+            try:
+                # Only if it's empty, so a scene being saved to it concurrently isn't lost
+                os.rmdir(os.path.join(self.root_dir, tile_key))
+            except OSError:
+                continue
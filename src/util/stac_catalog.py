@@ -0,0 +1,86 @@
+import os
+import time
+import threading
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pystac_client import Client as PystacClient
+from pystac_client.stac_api_io import StacApiIO
+
+STAC_CATALOG_REFRESH_SECONDS = int(os.environ.get("STAC_CATALOG_REFRESH_SECONDS", 3600))
+STAC_HTTP_POOL_MAXSIZE = int(os.environ.get("STAC_HTTP_POOL_MAXSIZE", 16))
+STAC_HTTP_MAX_RETRIES = int(os.environ.get("STAC_HTTP_MAX_RETRIES", 5))
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def open_stac_catalog(url, modifier=None):
+    """
+    Open a STAC API catalog, with a pooled HTTP session, so that searches against it reuse
+    keep-alive connections (including from several threads at once), and retry transient errors.
+    This fetches the catalog root and conformance classes over the network.
+
+    Args:
+        url (str): URL of the STAC API.
+        modifier (callable, optional): Modifier applied to the catalog's results (e.g. signing of
+            asset URLs). Defaults to None.
+
+    Returns:
+        pystac_client.Client: The open catalog.
+    """
+    stac_io = StacApiIO()
+    adapter = HTTPAdapter(
+        pool_connections=STAC_HTTP_POOL_MAXSIZE,
+        pool_maxsize=STAC_HTTP_POOL_MAXSIZE,
+        max_retries=Retry(
+            total=STAC_HTTP_MAX_RETRIES,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=None,
+        ),
+    )
+    stac_io.session.mount("https://", adapter)
+    stac_io.session.mount("http://", adapter)
+
+    return PystacClient.open(url, modifier=modifier, stac_io=stac_io)
+
+
+def get_stac_catalog(url, modifier=None, refresh_seconds=STAC_CATALOG_REFRESH_SECONDS):
+    """
+    Get the process-wide catalog of a STAC API, opening it on first use and re-opening it once it
+    is older than `refresh_seconds` (to pick up changes to the catalog root). Safe to call from
+    several threads - the catalog is only opened once, however many threads ask for it at once.
+
+    Args:
+        url (str): URL of the STAC API.
+        modifier (callable, optional): Modifier applied to the catalog's results (e.g. signing of
+            asset URLs). Defaults to None.
+        refresh_seconds (int, optional): Age after which the catalog is re-opened. Defaults to
+            `STAC_CATALOG_REFRESH_SECONDS`.
+
+    Returns:
+        pystac_client.Client: The shared catalog.
+    """
+    key = (url, modifier)
+    with _catalogs_lock:
+        cached = _catalogs.get(key)
+        if cached is None or time.monotonic() - cached["opened"] > refresh_seconds:
+            print(f"Opening STAC catalog {url}")
+            cached = {
+                "catalog": open_stac_catalog(url, modifier=modifier),
+                "opened": time.monotonic(),
+            }
+            _catalogs[key] = cached
+
+        return cached["catalog"]
+
+
+def clear_stac_catalog_cache():
+    """
+    Drop all shared catalogs, such that the next `get_stac_catalog` re-opens them.
+
+    Returns:
+        None
+    """
+    with _catalogs_lock:
+        _catalogs.clear()
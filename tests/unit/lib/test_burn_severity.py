@@ -1,6 +1,8 @@
 import pytest
 import src.lib.burn_severity as burn_severity
 import xarray as xr
+import numpy as np
+import dask
 
 
 def test_calc_nbr(
@@ -66,3 +68,217 @@ def test_calc_rbr(test_3d_valid_xarray_epsg_4326):
     result = burn_severity.calc_rbr(test_dnbr, test_nbr_prefire)
     assert result is not None
     assert result.shape == test_nbr_prefire.shape == test_nbr_prefire.shape
+
+
+def test_calc_burn_metrics_dtype(test_3d_valid_xarray_epsg_4326):
+    prefire_nir = test_3d_valid_xarray_epsg_4326.sel(band="band1")
+    prefire_swir = test_3d_valid_xarray_epsg_4326.sel(band="band2")
+    postfire_nir = prefire_swir * 0.8
+    postfire_swir = prefire_nir * 1.2
+
+    # Defaults to float32, regardless of the (float64) inputs
+    result = burn_severity.calc_burn_metrics(
+        prefire_nir, prefire_swir, postfire_nir, postfire_swir
+    )
+    assert result.dtype == "float32"
+
+    result = burn_severity.calc_burn_metrics(
+        prefire_nir, prefire_swir, postfire_nir, postfire_swir, dtype="float64"
+    )
+    assert result.dtype == "float64"
+
+
+def test_dtype_accuracy_report(test_3d_valid_xarray_epsg_4326):
+    prefire_nir = test_3d_valid_xarray_epsg_4326.sel(band="band1")
+    prefire_swir = test_3d_valid_xarray_epsg_4326.sel(band="band2")
+    postfire_nir = prefire_swir * 0.8
+    postfire_swir = prefire_nir * 1.2
+
+    report = burn_severity.dtype_accuracy_report(
+        prefire_nir, prefire_swir, postfire_nir, postfire_swir, dtype="float32"
+    )
+
+    assert set(report.index) == {"nbr_prefire", "nbr_postfire", "dnbr", "rdnbr", "rbr"}
+    assert report["nan_agreement"].all()
+
+    # Well within the ~0.001 precision the metrics are meaningful to (rdNBR and RBR are
+    # unbounded as prefire NBR approaches 0 or -1, so their absolute error is too)
+    bounded_metrics = ["nbr_prefire", "nbr_postfire", "dnbr"]
+    assert (report.loc[bounded_metrics, "max_abs_error"] < 1e-5).all()
+
+
+def _unfused_burn_metrics(prefire_nir, prefire_swir, postfire_nir, postfire_swir, dtype):
+    nbr_prefire = burn_severity.calc_nbr(
+        prefire_nir.astype(dtype), prefire_swir.astype(dtype)
+    )
+    nbr_postfire = burn_severity.calc_nbr(
+        postfire_nir.astype(dtype), postfire_swir.astype(dtype)
+    )
+    dnbr = burn_severity.calc_dnbr(nbr_prefire, nbr_postfire)
+    return [
+        nbr_prefire,
+        nbr_postfire,
+        dnbr,
+        burn_severity.calc_rdnbr(dnbr, nbr_prefire),
+        burn_severity.calc_rbr(dnbr, nbr_prefire),
+    ]
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float64"])
+@pytest.mark.parametrize("chunked", [False, True])
+def test_calc_burn_metrics_fused(test_3d_valid_xarray_epsg_4326, dtype, chunked):
+    prefire_nir = test_3d_valid_xarray_epsg_4326.sel(band="band1")
+    prefire_swir = test_3d_valid_xarray_epsg_4326.sel(band="band2")
+    postfire_nir = prefire_swir * 0.8
+    postfire_swir = prefire_nir * 1.2
+    # Zero denominators and missing pixels propagate as they would through the expressions
+    prefire_nir[0, 0] = np.nan
+    prefire_nir[1, 1] = prefire_swir[1, 1] = 0
+
+    bands = [prefire_nir, prefire_swir, postfire_nir, postfire_swir]
+    expected = _unfused_burn_metrics(*bands, dtype=dtype)
+    if chunked:
+        bands = [band.chunk({"x": 3, "y": 4}) for band in bands]
+
+    result = burn_severity.calc_burn_metrics(*bands, dtype=dtype)
+    assert list(result.burn_metric.values) == burn_severity.BURN_METRICS
+    assert result.dims == ("burn_metric",) + prefire_nir.dims
+    assert result.rio.crs == test_3d_valid_xarray_epsg_4326.rio.crs
+    assert dask.is_dask_collection(result.data) == chunked
+
+    for burn_metric, expected_metric in zip(burn_severity.BURN_METRICS, expected):
+        np.testing.assert_array_equal(
+            result.sel(burn_metric=burn_metric).values, expected_metric.values
+        )
+
+    from_nbr = burn_severity.calc_burn_metrics_from_nbr(
+        result.sel(burn_metric="nbr_prefire", drop=True),
+        result.sel(burn_metric="nbr_postfire", drop=True),
+        dtype=dtype,
+    )
+    np.testing.assert_array_equal(from_nbr.values, result.values)
+
+
+def test_classify_burn():
+    thresholds = {0.1: 1, -0.1: 0, 0.27: 2, 0.66: 3}
+    array = xr.DataArray(
+        [[-0.5, -0.1, 0.0, 0.1], [0.3, 0.66, 1.0, np.nan]], dims=("y", "x")
+    )
+
+    result = burn_severity.classify_burn(array, thresholds)
+    nodata = burn_severity.CLASSIFICATION_NODATA
+
+    assert result.dtype == "uint8"
+    assert result.attrs["_FillValue"] == nodata
+    # Values on a threshold fall in the class above it; NaN and values above every
+    # threshold are unclassified
+    np.testing.assert_array_equal(
+        result.values, [[0, 1, 1, 2], [3, nodata, nodata, nodata]]
+    )
+
+    chunked = burn_severity.classify_burn(array.chunk({"x": 2}), thresholds)
+    assert dask.is_dask_collection(chunked.data)
+    np.testing.assert_array_equal(chunked.values, result.values)
+
+    with pytest.raises(ValueError):
+        burn_severity.classify_burn(array, {0.1: 1.5})
+    with pytest.raises(ValueError):
+        burn_severity.classify_burn(array, {0.1: nodata})
+
+
+def test_unburned_ring_mask():
+    perimeter_mask = np.zeros((40, 40), dtype=bool)
+    perimeter_mask[15:25, 15:25] = True
+
+    ring_mask = burn_severity.unburned_ring_mask(
+        perimeter_mask, pixel_size=(20, 20), ring_gap=40, ring_width=100
+    )
+
+    assert not (ring_mask & perimeter_mask).any()
+    # Pixels more than 40m (2 pixels) and at most 140m (7 pixels) from the perimeter
+    assert not ring_mask[20, 13:15].any()
+    assert ring_mask[20, 8:13].all()
+    assert not ring_mask[20, :8].any()
+    assert ring_mask[20, 27:32].all()
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_calc_burn_metrics_offset(test_3d_valid_xarray_epsg_4326, chunked):
+    prefire_nir = test_3d_valid_xarray_epsg_4326.sel(band="band1") + 1
+    prefire_swir = test_3d_valid_xarray_epsg_4326.sel(band="band2")
+    postfire_nir = prefire_nir.copy()
+    postfire_swir = prefire_swir.copy()
+    bands = [prefire_nir, prefire_swir, postfire_nir, postfire_swir]
+    if chunked:
+        bands = [band.chunk({"x": 3, "y": 4}) for band in bands]
+
+    # With unchanged bands, every reference pixel has the same dNBR, shifted by the offset
+    reference_mask = np.zeros(prefire_nir.shape, dtype=bool)
+    reference_mask[:2] = True
+    unoffset = burn_severity.calc_burn_metrics(*bands)
+    result = burn_severity.calc_burn_metrics(
+        *bands, reference_mask=reference_mask, min_reference_pixels=10
+    )
+
+    assert result.attrs["n_reference_pixels"] == reference_mask.sum()
+    assert result.attrs["dnbr_offset"] == 0
+    np.testing.assert_array_equal(result.values, unoffset.values)
+
+    postfire_nir = postfire_nir * 0.9
+    bands[2] = postfire_nir.chunk({"x": 3, "y": 4}) if chunked else postfire_nir
+    unoffset = burn_severity.calc_burn_metrics(*bands, dtype="float64")
+    result = burn_severity.calc_burn_metrics(
+        *bands, reference_mask=reference_mask, min_reference_pixels=10, dtype="float64"
+    )
+    assert dask.is_dask_collection(result.data) == chunked
+
+    dnbr_offset = np.median(unoffset.sel(burn_metric="dnbr").values[reference_mask])
+    assert result.attrs["dnbr_offset"] == pytest.approx(dnbr_offset, rel=1e-5)
+    assert np.median(
+        result.sel(burn_metric="dnbr").values[reference_mask]
+    ) == pytest.approx(0, abs=1e-6)
+
+    offset_dnbr = result.sel(burn_metric="dnbr")
+    nbr_prefire = result.sel(burn_metric="nbr_prefire")
+    np.testing.assert_allclose(
+        result.sel(burn_metric="rbr").values,
+        burn_severity.calc_rbr(offset_dnbr, nbr_prefire).values,
+    )
+    np.testing.assert_array_equal(
+        result.sel(burn_metric=["nbr_prefire", "nbr_postfire"]).values,
+        unoffset.sel(burn_metric=["nbr_prefire", "nbr_postfire"]).values,
+    )
+
+    # Too few reference pixels to trust an offset
+    result = burn_severity.calc_burn_metrics(
+        *bands, reference_mask=np.zeros(prefire_nir.shape, dtype=bool)
+    )
+    assert result.attrs["dnbr_offset"] == 0
+    assert result.attrs["n_reference_pixels"] == 0
+
+
+def test_calc_burn_metrics_offset_aligns_mask(test_3d_valid_xarray_epsg_4326):
+    prefire_nir = test_3d_valid_xarray_epsg_4326.sel(band="band1") + 1
+    prefire_swir = test_3d_valid_xarray_epsg_4326.sel(band="band2")
+    # The postfire stack is a row short, so the bands are aligned on the rows they share
+    postfire_nir = (prefire_nir * 0.9).isel(y=slice(1, None))
+    postfire_swir = prefire_swir.isel(y=slice(1, None))
+    bands = [prefire_nir, prefire_swir, postfire_nir, postfire_swir]
+
+    # A mask on the prefire grid, whose reference rows the alignment shifts
+    reference_mask = xr.zeros_like(prefire_nir, dtype=bool)
+    reference_mask[1:3] = True
+    result = burn_severity.calc_burn_metrics(
+        *bands, reference_mask=reference_mask, min_reference_pixels=1, dtype="float64"
+    )
+    unoffset = burn_severity.calc_burn_metrics(*bands, dtype="float64")
+
+    assert result.sizes["y"] == prefire_nir.sizes["y"] - 1
+    assert result.attrs["n_reference_pixels"] == reference_mask[1:3].size
+    assert result.attrs["dnbr_offset"] == pytest.approx(
+        np.median(unoffset.sel(burn_metric="dnbr").values[:2])
+    )
+
+    # An array mask can't be aligned, so must already be on the aligned grid
+    with pytest.raises(ValueError, match="grid of the aligned bands"):
+        burn_severity.calc_burn_metrics(*bands, reference_mask=reference_mask.values)
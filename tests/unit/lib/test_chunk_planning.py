@@ -0,0 +1,56 @@
+import pytest
+from src.lib.chunk_planning import plan_stack_chunks, MIN_SPATIAL_CHUNK
+
+
+def test_plan_stack_chunks_small_aoi():
+    # A small fire with few passes should fit in a single spatial chunk
+    plan = plan_stack_chunks(
+        n_time=3, n_bands=2, height=300, width=200, memory_budget_bytes=2 * 1024**3
+    )
+
+    assert plan["chunksize"] == (-1, 1, 300, 200)
+    assert plan["n_chunks"] == 2
+    assert not plan["exceeds_budget"]
+
+
+def test_plan_stack_chunks_large_aoi():
+    # A large fire with many passes should be split, with each chunk within budget
+    memory_budget_bytes = 1024**3
+    plan = plan_stack_chunks(
+        n_time=60,
+        n_bands=2,
+        height=20000,
+        width=20000,
+        memory_budget_bytes=memory_budget_bytes,
+        n_workers=4,
+    )
+
+    __time, __band, chunk_height, chunk_width = plan["chunksize"]
+    assert chunk_height < 20000 and chunk_width < 20000
+    assert chunk_height % MIN_SPATIAL_CHUNK == 0
+    assert plan["peak_chunk_bytes"] <= memory_budget_bytes / 4
+    assert plan["n_chunks"] > 2
+
+
+def test_plan_stack_chunks_dtype():
+    # Halving the itemsize should never shrink the chunks
+    plan_64 = plan_stack_chunks(
+        n_time=30, n_bands=2, height=10000, width=10000, dtype="float64", n_workers=4
+    )
+    plan_32 = plan_stack_chunks(
+        n_time=30, n_bands=2, height=10000, width=10000, dtype="float32", n_workers=4
+    )
+
+    assert plan_32["chunksize"][2] >= plan_64["chunksize"][2]
+    assert plan_32["dtype"] == "float32"
+
+
+def test_plan_stack_chunks_chunk_bands():
+    # Keeping both bands in a chunk halves the spatial chunk area, to stay within budget
+    kwargs = dict(n_time=30, n_bands=2, height=10000, width=10000, n_workers=4)
+    plan = plan_stack_chunks(**kwargs)
+    plan_bands = plan_stack_chunks(**kwargs, chunk_bands=True)
+
+    assert plan_bands["chunksize"][1] == 2
+    assert plan_bands["chunksize"][2] < plan["chunksize"][2]
+    assert plan_bands["chunk_bytes"] <= plan["chunk_bytes"]
@@ -0,0 +1,139 @@
+import pytest
+import numpy as np
+import xarray as xr
+import dask.array as da
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+from src.lib.compositing import order_items_by_quality, greedy_composite
+
+
+def _item(item_id, date, cloud_cover):
+    return SimpleNamespace(
+        id=item_id,
+        datetime=datetime.fromisoformat(date).replace(tzinfo=timezone.utc),
+        properties={"eo:cloud_cover": cloud_cover},
+    )
+
+
+def _stack(scenes):
+    data = da.from_array(np.stack(scenes).astype("float32"), chunks=(1, -1, -1, -1))
+    return xr.DataArray(
+        data,
+        dims=("time", "band", "y", "x"),
+        coords={"band": ["B8A", "B12"], "y": np.arange(4), "x": np.arange(4)},
+    )
+
+
+def test_order_items_by_quality():
+    items = [
+        _item("cloudy_close", "2023-06-01", 80),
+        _item("clear_far", "2023-05-01", 0),
+        _item("clear_close", "2023-05-30", 5),
+    ]
+    ordered = order_items_by_quality(items, target_date="2023-06-01")
+    assert [item.id for item in ordered] == ["clear_close", "clear_far", "cloudy_close"]
+
+    # AOI-local cloud cover overrides the scene-level cloud cover
+    ordered = order_items_by_quality(
+        items, target_date="2023-06-01", cloud_cover={"cloudy_close": 0}
+    )
+    assert ordered[0].id == "cloudy_close"
+
+
+def test_greedy_composite_stops_when_covered():
+    half_cloudy = np.full((2, 4, 4), 1.0)
+    half_cloudy[:, :2, :] = np.nan
+    clear = np.full((2, 4, 4), 2.0)
+    never_read = np.full((2, 4, 4), 3.0)
+
+    composite, info = greedy_composite(
+        _stack([half_cloudy, clear, never_read]),
+        aoi_mask=np.ones((4, 4), dtype=bool),
+        coverage_target=1.0,
+    )
+
+    assert info["n_scenes_read"] == 2
+    assert info["n_scenes"] == 3
+    assert info["coverage"] == 1.0
+    assert composite.dims == ("band", "y", "x")
+    # Earlier scenes take precedence wherever they have data
+    assert np.all(composite.values[:, :2, :] == 2.0)
+    assert np.all(composite.values[:, 2:, :] == 1.0)
+
+
+def test_greedy_composite_ignores_pixels_outside_aoi():
+    partial = np.full((2, 4, 4), 1.0)
+    partial[:, 0, :] = np.nan
+    aoi_mask = np.ones((4, 4), dtype=bool)
+    aoi_mask[0, :] = False
+
+    __composite, info = greedy_composite(
+        _stack([partial, partial]), aoi_mask=aoi_mask, coverage_target=1.0
+    )
+    assert info["n_scenes_read"] == 1
+
+
+def test_greedy_composite_min_observations():
+    scenes = [np.full((2, 4, 4), value) for value in [1.0, 2.0, 6.0, 100.0]]
+
+    composite, info = greedy_composite(
+        _stack(scenes),
+        aoi_mask=np.ones((4, 4), dtype=bool),
+        coverage_target=1.0,
+        min_observations=3,
+    )
+    assert info["n_scenes_read"] == 3
+    assert np.all(composite.values == 2.0)
+
+
+def test_greedy_composite_masks_clouds():
+    # Finite reflectance everywhere, but the top half of the first scene is cloud (SCL 9)
+    # and its bottom left corner cloud shadow (SCL 3)
+    cloudy = np.full((3, 4, 4), 1.0)
+    cloudy[2] = 4
+    cloudy[2, :2, :] = 9
+    cloudy[2, 3, 0] = 3
+    clear = np.full((3, 4, 4), 2.0)
+    clear[2] = 4
+    scenes = [cloudy, clear]
+    data = da.from_array(np.stack(scenes).astype("float32"), chunks=(1, -1, -1, -1))
+    stack = xr.DataArray(
+        data,
+        dims=("time", "band", "y", "x"),
+        coords={"band": ["B8A", "B12", "SCL"], "y": np.arange(4), "x": np.arange(4)},
+    )
+
+    composite, info = greedy_composite(
+        stack, aoi_mask=np.ones((4, 4), dtype=bool), coverage_target=1.0, scl_band="SCL"
+    )
+
+    assert info["n_scenes_read"] == 2
+    assert list(composite.band.values) == ["B8A", "B12"]
+    assert np.all(composite.values[:, :2, :] == 2.0)
+    assert np.all(composite.values[:, 3, 0] == 2.0)
+    assert np.all(composite.values[:, 2, :] == 1.0)
+
+
+def test_greedy_composite_drop_failed_items():
+    def read(block, block_info=None):
+        if block_info[0]["chunk-location"][0] == 0:
+            raise OSError("Read failed")
+        return block
+
+    stack = _stack([np.full((2, 4, 4), value) for value in [1.0, 2.0]])
+    stack = stack.copy(data=stack.data.map_blocks(read, dtype="float32"))
+    stack = stack.assign_coords(id=("time", ["failing", "readable"]))
+
+    with patch("src.lib.resilient_compute.time.sleep"):
+        composite, info = greedy_composite(
+            stack,
+            aoi_mask=np.ones((4, 4), dtype=bool),
+            coverage_target=1.0,
+            drop_failed_items=True,
+        )
+        assert info["dropped_items"] == ["failing"]
+        assert np.all(composite.values == 2.0)
+
+        with pytest.raises(OSError):
+            greedy_composite(stack, aoi_mask=np.ones((4, 4), dtype=bool))
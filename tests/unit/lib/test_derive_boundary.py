@@ -0,0 +1,200 @@
+import pytest
+import numpy as np
+import xarray as xr
+import rioxarray
+from shapely.geometry import shape
+from scipy.ndimage import binary_fill_holes, gaussian_filter, binary_dilation, label
+from skimage.segmentation import flood_fill
+from src.lib.derive_boundary import (
+    FloodFillSegmentation,
+    HistogramOtsuThreshold,
+    OtsuThreshold,
+    derive_boundary,
+    fill_mask_holes,
+    metric_histogram,
+    postprocess_burn_mask,
+)
+
+
+def test_flood_fill_segmentation_matches_flood_fill():
+    rng = np.random.default_rng(0)
+    disturbed = rng.random((60, 80)) > 0.55
+    seed = np.zeros_like(disturbed)
+    seed_rows = rng.integers(0, 60, 12)
+    seed_cols = rng.integers(0, 80, 12)
+    seed[seed_rows, seed_cols] = True
+
+    metric_layer = xr.DataArray(
+        rng.random((1, 60, 80)), dims=("seed", "y", "x")
+    ).assign_coords(
+        disturbed=(("seed", "y", "x"), disturbed[None]),
+        seed=(("seed", "y", "x"), seed[None]),
+    )
+
+    segmented = FloodFillSegmentation().apply(metric_layer)["disturbed"].values[0]
+
+    # The union of the flood fills of the burn from each seed point within it
+    expected = np.zeros_like(disturbed)
+    for seed_point in zip(seed_rows, seed_cols):
+        if disturbed[seed_point]:
+            filled = flood_fill(disturbed.astype(np.int8), seed_point, new_value=2)
+            expected |= filled == 2
+
+    assert expected.any() and not expected.all()
+    np.testing.assert_array_equal(segmented, expected)
+    assert segmented.dtype == bool
+
+
+def test_flood_fill_segmentation_no_seed_in_burn():
+    disturbed = np.zeros((10, 10), dtype=bool)
+    disturbed[2:5, 2:5] = True
+    seed = np.zeros_like(disturbed)
+    seed[8, 8] = True
+
+    metric_layer = xr.DataArray(
+        np.zeros((1, 10, 10)), dims=("seed", "y", "x")
+    ).assign_coords(
+        disturbed=(("seed", "y", "x"), disturbed[None]),
+        seed=(("seed", "y", "x"), seed[None]),
+    )
+
+    segmented = FloodFillSegmentation().apply(metric_layer)["disturbed"].values[0]
+    assert not segmented.any()
+
+
+def test_metric_histogram_streams_masked_values():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(1, 50, 40))
+    values[0, :5] = np.nan
+    mask = np.ones(values.shape, dtype=bool)
+    mask[0, :, :3] = False
+
+    histogram = metric_histogram(values, mask=mask, n_bins=16, chunk_rows=7)
+
+    expected = values[mask & np.isfinite(values)]
+    assert histogram["bin_edges"][0] == expected.min()
+    assert histogram["bin_edges"][-1] == expected.max()
+    np.testing.assert_array_equal(
+        histogram["counts"], np.histogram(expected, bins=histogram["bin_edges"])[0]
+    )
+
+
+def test_histogram_otsu_threshold_ignores_outside_aoi():
+    rng = np.random.default_rng(0)
+    values = np.concatenate(
+        [rng.normal(0.0, 0.05, 600), rng.normal(0.6, 0.05, 400)]
+    ).reshape(1, 25, 40)
+    aoi = np.ones(values.shape, dtype=bool)
+    aoi[0, :, :8] = False
+    # Outside the AOI, filled with a value that would drag the threshold down
+    values[~aoi] = -5.0
+
+    metric_layer = xr.DataArray(values, dims=("seed", "y", "x")).assign_coords(
+        aoi=(("seed", "y", "x"), aoi)
+    )
+    strategy = HistogramOtsuThreshold()
+    disturbed = strategy.apply(metric_layer)["disturbed"].values
+
+    assert 0.1 < strategy.thresholds[0] < 0.5
+    np.testing.assert_array_equal(disturbed, (values > strategy.thresholds[0]) & aoi)
+
+    # Multi-Otsu, from the histogram kept from the first call
+    multi_strategy = HistogramOtsuThreshold(n_classes=3, histogram=strategy.histogram)
+    multi_strategy.apply(metric_layer)
+    assert len(multi_strategy.thresholds) == 2
+    assert multi_strategy.histogram is strategy.histogram
+
+
+@pytest.mark.parametrize("smooth_sigma", [None, 0.13, 1, 1.7])
+@pytest.mark.parametrize("buffer_iterations", [None, 1, 3])
+def test_postprocess_burn_mask_matches_scipy(smooth_sigma, buffer_iterations):
+    rng = np.random.default_rng(0)
+    values = rng.random((1, 70, 90))
+    values[values < 0.4] = 0
+    burn_mask = xr.DataArray(values.copy(), dims=("seed", "y", "x"))
+
+    # Small tiles, so results cross tile boundaries
+    postprocessed = postprocess_burn_mask(
+        burn_mask,
+        fill_holes=True,
+        smooth_sigma=smooth_sigma,
+        buffer_iterations=buffer_iterations,
+        tile_size=16,
+    ).values
+
+    expected = binary_fill_holes(values)
+    if smooth_sigma:
+        expected = gaussian_filter(expected, sigma=smooth_sigma)
+    if buffer_iterations:
+        expected = binary_dilation(expected, iterations=buffer_iterations)
+    np.testing.assert_array_equal(postprocessed, expected)
+
+
+def test_fill_mask_holes_matches_scipy():
+    rng = np.random.default_rng(0)
+    mask = rng.random((60, 50)) > 0.3
+    mask[10:20, 10:20] = False
+    mask[9, 9:21] = mask[20, 9:21] = mask[9:21, 9] = mask[9:21, 20] = True
+
+    filled = fill_mask_holes(mask)
+    assert filled[10:20, 10:20].all()
+    np.testing.assert_array_equal(filled, binary_fill_holes(mask))
+    np.testing.assert_array_equal(
+        fill_mask_holes(mask[None]), binary_fill_holes(mask[None])
+    )
+
+
+def _synthetic_metric_layer(size=256):
+    rng = np.random.default_rng(0)
+    burns = gaussian_filter(rng.random((size, size)), sigma=12) > 0.5
+    values = np.where(burns, 0.5, 0.0) + rng.normal(0, 0.1, (size, size))
+    # A NaN buffer at the edge, as the spectral index process leaves
+    values[:3] = np.nan
+    metric_layer = xr.DataArray(
+        values[None],
+        dims=("seed", "y", "x"),
+        coords={
+            "y": 4000000 - 20 * (np.arange(size) + 0.5),
+            "x": 500000 + 20 * (np.arange(size) + 0.5),
+        },
+    ).rio.write_crs("EPSG:32611")
+
+    # Seed points in every other burn
+    labeled, n_burns = label(burns)
+    seed = np.zeros_like(burns)
+    for burn_label in range(1, n_burns + 1, 2):
+        rows, cols = np.nonzero(labeled == burn_label)
+        seed[rows[len(rows) // 2], cols[len(cols) // 2]] = True
+    return metric_layer.assign_coords(seed=(("seed", "y", "x"), seed[None]))
+
+
+@pytest.mark.parametrize("coarse_factor", [4, 8])
+def test_derive_boundary_coarse_to_fine_matches_full_resolution(coarse_factor):
+    full_resolution = shape(
+        derive_boundary(
+            _synthetic_metric_layer(),
+            thresholding_strategy=HistogramOtsuThreshold(),
+        )["features"][0]["geometry"]
+    )
+    coarse_to_fine = shape(
+        derive_boundary(
+            _synthetic_metric_layer(),
+            thresholding_strategy=HistogramOtsuThreshold(),
+            coarse_factor=coarse_factor,
+        )["features"][0]["geometry"]
+    )
+
+    iou = (
+        full_resolution.intersection(coarse_to_fine).area
+        / full_resolution.union(coarse_to_fine).area
+    )
+    assert iou > 0.98
+
+
+def test_derive_boundary_coarse_to_fine_needs_consistent_threshold():
+    with pytest.raises(ValueError):
+        derive_boundary(
+            _synthetic_metric_layer(),
+            thresholding_strategy=OtsuThreshold(),
+            coarse_factor=4,
+        )
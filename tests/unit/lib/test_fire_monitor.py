@@ -0,0 +1,189 @@
+import pytest
+import datetime
+import threading
+from types import SimpleNamespace
+from shapely.geometry import box, mapping
+from src.lib.fire_monitor import FireMonitor
+
+PREFIRE = ["2023-06-01", "2023-06-30"]
+POSTFIRE = ["2023-08-01", "2023-08-31"]
+NOW = datetime.datetime(2023, 8, 15, tzinfo=datetime.timezone.utc)
+
+
+def _boundary(*bounds):
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "properties": {}, "geometry": mapping(box(*bounds))}
+        ],
+    }
+
+
+def _item(item_id, date, *bounds):
+    return SimpleNamespace(
+        id=item_id,
+        datetime=datetime.datetime(*date, tzinfo=datetime.timezone.utc),
+        geometry=mapping(box(*bounds)),
+    )
+
+
+class StubCatalog:
+    def __init__(self, items):
+        self.items = items
+        self.queries = []
+
+    def search(self, **query):
+        self.queries.append(query)
+        return SimpleNamespace(item_collection=lambda: self.items)
+
+
+@pytest.fixture
+def fire_monitor():
+    fire_monitor = FireMonitor()
+    # Two fires sharing a tile, and one far away
+    fire_monitor.register(
+        "test", "east", _boundary(0, 0, 1, 1), PREFIRE, POSTFIRE
+    )
+    fire_monitor.register(
+        "test",
+        "west",
+        _boundary(0.5, 0.5, 1.5, 1.5),
+        PREFIRE,
+        POSTFIRE,
+        seen_item_ids=["shared_seen"],
+    )
+    fire_monitor.register(
+        "test", "far", _boundary(10, 10, 11, 11), PREFIRE, POSTFIRE
+    )
+    return fire_monitor
+
+
+def test_group_fire_events(fire_monitor):
+    groups = fire_monitor.group_fire_events(list(fire_monitor.fire_events))
+
+    assert sorted(sorted(keys) for __bbox, keys in groups) == [
+        ["test/east", "test/west"],
+        ["test/far"],
+    ]
+
+
+def test_find_new_items(fire_monitor):
+    catalog = StubCatalog(
+        [
+            _item("shared_seen", (2023, 8, 10), 0, 0, 2, 2),
+            _item("shared_new", (2023, 8, 11), 0, 0, 2, 2),
+            _item("west_only", (2023, 8, 12), 1.2, 1.2, 2, 2),
+            _item("prefire", (2023, 7, 1), 0, 0, 2, 2),
+        ]
+    )
+    new_items = fire_monitor.find_new_items(catalog, now=NOW)
+
+    # One search per group of fires, not per fire
+    assert len(catalog.queries) == 2
+    assert catalog.queries[0]["datetime"] == "2023-08-01/2023-08-15"
+
+    assert [item.id for item in new_items["test/east"]] == ["shared_seen", "shared_new"]
+    assert [item.id for item in new_items["test/west"]] == ["shared_new", "west_only"]
+    assert "test/far" not in new_items
+
+
+def test_poll(fire_monitor):
+    catalog = StubCatalog([_item("shared_new", (2023, 8, 11), 0, 0, 2, 2)])
+    fire_monitor.max_concurrent_refreshes = 1
+    refreshing = []
+    lock = threading.Lock()
+
+    def refresh_fire(fire_event, new_items):
+        with lock:
+            refreshing.append(fire_event["fire_event_name"])
+            assert len(refreshing) == 1
+        try:
+            if fire_event["fire_event_name"] == "west":
+                raise RuntimeError("read failed")
+        finally:
+            with lock:
+                refreshing.remove(fire_event["fire_event_name"])
+
+    results = fire_monitor.poll(catalog, refresh_fire, now=NOW)
+
+    assert results["test/east"] == {"n_new_items": 1, "refreshed": True}
+    assert results["test/west"]["refreshed"] is False
+
+    # Items are only marked seen once their refresh succeeds, so failures are retried
+    assert "shared_new" in fire_monitor.fire_events["test/east"]["seen_item_ids"]
+    assert "shared_new" not in fire_monitor.fire_events["test/west"]["seen_item_ids"]
+    assert fire_monitor.find_new_items(catalog, now=NOW).keys() == {"test/west"}
+
+
+def test_poll_drops_ended_fire_events(fire_monitor):
+    catalog = StubCatalog([])
+    fire_monitor.poll(catalog, lambda *_: None, now=NOW + datetime.timedelta(days=30))
+
+    assert fire_monitor.fire_events == {}
+    assert FireMonitor.from_dict(fire_monitor.to_dict()).fire_events == {}
+
+
+def test_poll_shared_state(fire_monitor):
+    # The monitor's state as stored in the cloud, which each poll loads its own copy of
+    shared_state = {"fire_monitor": fire_monitor.to_dict()}
+
+    def update_state(update):
+        latest = FireMonitor.from_dict(shared_state["fire_monitor"])
+        update(latest)
+        shared_state["fire_monitor"] = latest.to_dict()
+        return latest
+
+    catalog = StubCatalog([_item("shared_new", (2023, 8, 11), 0, 0, 2, 2)])
+    refreshed = []
+    concurrent_results = {}
+
+    def refresh_fire(fire_event, new_items):
+        refreshed.append(fire_event["fire_event_name"])
+        if fire_event["fire_event_name"] == "east":
+            # Another instance polls while this one is still refreshing
+            concurrent_results.update(
+                FireMonitor.from_dict(shared_state["fire_monitor"]).poll(
+                    catalog, refresh_fire, now=NOW, update_state=update_state
+                )
+            )
+        return {"satellite_pass_information": {"n_postfire_passes": 1}}
+
+    fire_monitor.max_concurrent_refreshes = 1
+    results = fire_monitor.poll(
+        catalog, refresh_fire, now=NOW, update_state=update_state
+    )
+
+    # Neither poll refreshed a fire the other had claimed
+    assert sorted(refreshed) == ["east", "west"]
+    assert concurrent_results == {}
+    assert results.keys() == {"test/east", "test/west"}
+
+    # Results are recorded in the shared state, with the claims released
+    fire_events = FireMonitor.from_dict(shared_state["fire_monitor"]).fire_events
+    for key in ["test/east", "test/west"]:
+        assert "shared_new" in fire_events[key]["seen_item_ids"]
+        assert "refreshing_since" not in fire_events[key]
+        assert fire_events[key]["satellite_pass_information"] == {
+            "n_postfire_passes": 1
+        }
+    assert fire_monitor.fire_events == fire_events
+
+
+def test_claim_refreshes_expires(fire_monitor):
+    claims = fire_monitor.claim_refreshes(["test/east"], NOW)
+
+    assert fire_monitor.claim_refreshes(["test/east", "test/far"], NOW) == {
+        "test/far": NOW.isoformat()
+    }
+
+    # A claim by a poll which died mid-refresh expires
+    later = NOW + datetime.timedelta(hours=3)
+    assert fire_monitor.claim_refreshes(["test/east"], later) == {
+        "test/east": later.isoformat()
+    }
+
+    # The expired claim's results don't release the new one
+    fire_monitor.complete_refreshes(
+        claims, {"test/east": {"refreshed": False, "error": "timed out"}}, later
+    )
+    assert fire_monitor.fire_events["test/east"]["refreshing_since"] == later.isoformat()
@@ -0,0 +1,99 @@
+import pytest
+import numpy as np
+import rasterio
+from src.lib.nbr_time_series import write_nbr_time_series, read_time_series
+
+
+def _nbr_layers(template, n_layers):
+    for i in range(n_layers):
+        nbr = template.sel(band="band1").copy(deep=True) - 0.1 * i
+        yield f"2023-06-{10 + i}", nbr.rio.write_crs("EPSG:4326")
+
+
+def test_write_and_read_nbr_time_series(test_3d_valid_xarray_epsg_4326, tmp_path):
+    template = test_3d_valid_xarray_epsg_4326.rio.write_crs("EPSG:4326")
+    nbr_prefire = template.sel(band="band2")
+    nbr_path = str(tmp_path / "nbr_time_series.tif")
+    dnbr_path = str(tmp_path / "dnbr_time_series.tif")
+
+    write_nbr_time_series(
+        layers=_nbr_layers(template, 3),
+        n_layers=3,
+        nbr_path=nbr_path,
+        dnbr_path=dnbr_path,
+        nbr_prefire=nbr_prefire,
+    )
+
+    with rasterio.open(nbr_path) as src:
+        assert src.tags(ns="IMAGE_STRUCTURE")["LAYOUT"] == "COG"
+        assert src.count == 3
+        assert src.descriptions == ("2023-06-10", "2023-06-11", "2023-06-12")
+        assert src.dtypes[0] == "float32"
+        np.testing.assert_allclose(
+            src.read(3), template.sel(band="band1").values - 0.2, rtol=1e-5
+        )
+
+    with rasterio.open(dnbr_path) as src:
+        np.testing.assert_allclose(
+            src.read(1),
+            nbr_prefire.values - template.sel(band="band1").values,
+            rtol=1e-5,
+        )
+
+    # Query a single pixel and a polygon covering the whole layer
+    x, y = float(template.x[2]), float(template.y[3])
+    minx, miny, maxx, maxy = template.rio.bounds()
+    geojson = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {},
+                "geometry": {"type": "Point", "coordinates": [x, y]},
+            },
+            {
+                "type": "Feature",
+                "properties": {},
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [
+                        [
+                            [minx, miny],
+                            [maxx, miny],
+                            [maxx, maxy],
+                            [minx, maxy],
+                            [minx, miny],
+                        ]
+                    ],
+                },
+            },
+        ],
+    }
+    result = read_time_series(nbr_path, geojson)
+
+    assert result["acquisition_dates"] == ["2023-06-10", "2023-06-11", "2023-06-12"]
+    point_series, polygon_series = result["time_series"]
+    expected_pixel = float(template.sel(band="band1").values[3, 2])
+    np.testing.assert_allclose(
+        point_series, [expected_pixel - 0.1 * i for i in range(3)], rtol=1e-5
+    )
+    np.testing.assert_allclose(
+        polygon_series,
+        [float(template.sel(band="band1").values.mean()) - 0.1 * i for i in range(3)],
+        rtol=1e-5,
+    )
+
+
+def test_write_nbr_time_series_requires_prefire(test_3d_valid_xarray_epsg_4326, tmp_path):
+    with pytest.raises(ValueError):
+        write_nbr_time_series(
+            layers=_nbr_layers(test_3d_valid_xarray_epsg_4326, 1),
+            n_layers=1,
+            nbr_path=str(tmp_path / "nbr.tif"),
+            dnbr_path=str(tmp_path / "dnbr.tif"),
+        )
+
+
+def test_write_nbr_time_series_requires_layers(tmp_path):
+    with pytest.raises(ValueError, match="at least one layer"):
+        write_nbr_time_series(layers=[], n_layers=0, nbr_path=str(tmp_path / "nbr.tif"))
@@ -0,0 +1,129 @@
+import pytest
+from shapely.geometry import box
+from src.lib.product_index import ProductIndex, product_key, REQUIRED_METRICS
+
+
+def _cog_paths(fire_event_name):
+    return {
+        metric: f"https://test-bucket/public/test_affiliation/{fire_event_name}/{metric}.tif"
+        for metric in REQUIRED_METRICS
+    }
+
+
+def _key(prefire_date_range=("2023-05-01", "2023-06-01"), quantized=False):
+    return product_key(
+        crs="EPSG:4326",
+        resolution=20,
+        prefire_date_range=prefire_date_range,
+        postfire_date_range=("2023-06-15", "2023-07-15"),
+        band_nir="B8A",
+        band_swir="B12",
+        dtype="float32",
+        quantized=quantized,
+    )
+
+
+def test_find_covering():
+    product_index = ProductIndex()
+    product_index.register(
+        key=_key(),
+        affiliation="test_affiliation",
+        fire_event_name="big_fire",
+        boundary_geometry=box(0, 0, 10, 10),
+        cog_paths=_cog_paths("big_fire"),
+        satellite_pass_information={"n_prefire_passes": 4},
+    )
+    product_index.register(
+        key=_key(),
+        affiliation="test_affiliation",
+        fire_event_name="small_fire",
+        boundary_geometry=box(2, 2, 5, 5),
+        cog_paths=_cog_paths("small_fire"),
+        satellite_pass_information={"n_prefire_passes": 4},
+    )
+
+    # Covered by both, so the smaller product is preferred
+    product = product_index.find_covering(_key(), box(3, 3, 4, 4))
+    assert product["fire_event_name"] == "small_fire"
+
+    # Only covered by the bigger product
+    product = product_index.find_covering(_key(), box(1, 1, 8, 8))
+    assert product["fire_event_name"] == "big_fire"
+
+    # Not covered at all, or a different key
+    assert product_index.find_covering(_key(), box(5, 5, 12, 12)) is None
+    # Quantized products aren't served to float requests
+    assert product_index.find_covering(_key(quantized=True), box(3, 3, 4, 4)) is None
+    assert (
+        product_index.find_covering(_key(("2023-04-01", "2023-06-01")), box(3, 3, 4, 4))
+        is None
+    )
+
+
+def test_register_overwrites_fire_event():
+    product_index = ProductIndex()
+    product_index.register(
+        key=_key(),
+        affiliation="test_affiliation",
+        fire_event_name="fire",
+        boundary_geometry=box(0, 0, 10, 10),
+        cog_paths=_cog_paths("fire"),
+        satellite_pass_information={},
+    )
+
+    # Re-running the same fire with different dates overwrites its COGs, so the old product must go
+    product_index.register(
+        key=_key(("2023-04-01", "2023-06-01")),
+        affiliation="test_affiliation",
+        fire_event_name="fire",
+        boundary_geometry=box(0, 0, 10, 10),
+        cog_paths=_cog_paths("fire"),
+        satellite_pass_information={},
+    )
+    assert product_index.find_covering(_key(), box(1, 1, 2, 2)) is None
+
+    # Round trip through the serialized form
+    restored = ProductIndex.from_dict(product_index.to_dict())
+    assert (
+        restored.find_covering(_key(("2023-04-01", "2023-06-01")), box(1, 1, 2, 2))
+        is not None
+    )
+
+    with pytest.raises(ValueError):
+        product_index.register(
+            key=_key(),
+            affiliation="test_affiliation",
+            fire_event_name="fire",
+            boundary_geometry=box(0, 0, 10, 10),
+            cog_paths={"rbr": "rbr.tif"},
+            satellite_pass_information={},
+        )
+
+
+def test_remove_cog_paths():
+    product_index = ProductIndex()
+    product_index.register(
+        key=_key(),
+        affiliation="test_affiliation",
+        fire_event_name="fire",
+        boundary_geometry=box(0, 0, 10, 10),
+        cog_paths=_cog_paths("fire"),
+        satellite_pass_information={},
+    )
+    product_index.register(
+        key=_key(),
+        affiliation="test_affiliation",
+        fire_event_name="other_fire",
+        boundary_geometry=box(0, 0, 20, 20),
+        cog_paths=_cog_paths("other_fire"),
+        satellite_pass_information={},
+    )
+
+    product_index.remove_cog_paths([_cog_paths("other_fire")["rbr"]])
+    assert product_index.find_covering(_key(), box(1, 1, 2, 2))["fire_event_name"] == (
+        "fire"
+    )
+
+    product_index.remove_cog_paths(_cog_paths("fire").values())
+    assert product_index.find_covering(_key(), box(1, 1, 2, 2)) is None
+    assert product_index.to_dict()["products"] == {}
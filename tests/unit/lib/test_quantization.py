@@ -0,0 +1,66 @@
+import pytest
+import numpy as np
+import rioxarray as rxr
+from rio_tiler.models import ImageData
+from src.lib.quantization import (
+    quantize,
+    dequantize,
+    unscale_image_data,
+    QUANTIZED_NODATA,
+    QUANTIZATION_SCALE_TAG,
+    QUANTIZATION_OFFSET_TAG,
+)
+
+
+@pytest.fixture
+def metric(test_3d_valid_xarray_epsg_4326):
+    metric = test_3d_valid_xarray_epsg_4326.sel(band="band1", drop=True) * 2 - 1
+    metric[0, 0] = np.nan
+    metric[0, 1] = 100.0
+    return metric.astype("float32")
+
+
+def test_quantize(metric):
+    quantized = quantize(metric, scale=1e-3)
+
+    assert quantized.dtype == "int16"
+    assert quantized.values[0, 0] == QUANTIZED_NODATA
+    # Values beyond the int16 range are clipped, rather than wrapped or taken as nodata
+    assert quantized.values[0, 1] == np.iinfo("int16").max
+
+    values = dequantize(quantized.values, scale=1e-3)
+    assert np.isnan(values[0, 0])
+    in_range = np.abs(metric.values) < 30
+    np.testing.assert_allclose(values[in_range], metric.values[in_range], atol=5e-4)
+
+
+def test_quantized_cog_round_trip(metric, tmp_path):
+    path = str(tmp_path / "dnbr.tif")
+    quantize(metric, scale=1e-4, offset=0.5).rio.to_raster(path, driver="GTiff")
+
+    # Readers which apply the GDAL scale/offset and nodata get the floats back
+    with rxr.open_rasterio(path, mask_and_scale=True) as decoded:
+        values = decoded.squeeze().values
+
+    assert np.isnan(values[0, 0])
+    np.testing.assert_allclose(values[1:], metric.values[1:], atol=5e-5)
+
+    # As do titiler algorithms, which only see the dataset tags
+    with rxr.open_rasterio(path) as raw:
+        img = ImageData(
+            np.ma.masked_equal(raw.values, QUANTIZED_NODATA),
+            metadata={
+                QUANTIZATION_SCALE_TAG: raw.attrs[QUANTIZATION_SCALE_TAG],
+                QUANTIZATION_OFFSET_TAG: raw.attrs[QUANTIZATION_OFFSET_TAG],
+            },
+        )
+    unscaled = unscale_image_data(img).squeeze()
+    assert np.isnan(unscaled[0, 0])
+    np.testing.assert_allclose(unscaled[1:], metric.values[1:], atol=5e-5)
+
+
+def test_unscale_image_data_float(metric):
+    img = ImageData(np.ma.masked_invalid(metric.values[np.newaxis]))
+    np.testing.assert_array_equal(
+        unscale_image_data(img)[0], metric.values.astype("float32")
+    )
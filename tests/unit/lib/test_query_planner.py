@@ -0,0 +1,61 @@
+import pytest
+import datetime
+from types import SimpleNamespace
+from src.lib.query_planner import estimate_stack_cost, summarize_query_cost
+
+
+def _items(n_items, n_acquisitions):
+    return [
+        SimpleNamespace(
+            id=f"item_{i}",
+            datetime=datetime.datetime(2023, 8, 1 + i % n_acquisitions),
+        )
+        for i in range(n_items)
+    ]
+
+
+def test_estimate_stack_cost():
+    # Two tiles per acquisition
+    cost = estimate_stack_cost(
+        _items(6, 3), height=500, width=2000, n_bands=2, dtype="float32", n_workers=4
+    )
+
+    assert cost["n_scenes"] == 6
+    assert cost["n_unique_acquisitions"] == 3
+    assert cost["pixels_to_read"] == 6 * 2 * 500 * 2000
+    # Whole blocks are read, so bytes grow with the blocks touched rather than the pixels
+    assert cost["n_read_requests"] == 6 * 2 * 2 * 3
+    assert cost["bytes_to_read"] > 0
+    assert cost["peak_memory_bytes"] >= 2 * 500 * 2000 * 4
+    assert cost["wall_time_seconds"] > 0
+
+    larger = estimate_stack_cost(
+        _items(6, 3), height=5000, width=5000, n_bands=2, dtype="float32", n_workers=4
+    )
+    assert larger["bytes_to_read"] > cost["bytes_to_read"]
+    assert larger["peak_memory_bytes"] > cost["peak_memory_bytes"]
+    assert larger["wall_time_seconds"] > cost["wall_time_seconds"]
+
+
+def test_summarize_query_cost():
+    stack_costs = {
+        "prefire": estimate_stack_cost(_items(4, 4), height=100, width=100),
+        "postfire": estimate_stack_cost(_items(2, 2), height=100, width=100),
+    }
+    query_cost = summarize_query_cost(
+        stack_costs, height=100, width=100, memory_budget_bytes=1024**3
+    )
+
+    assert query_cost["n_scenes"] == 6
+    assert query_cost["n_unique_acquisitions"] == 6
+    assert query_cost["bytes_to_read"] == sum(
+        cost["bytes_to_read"] for cost in stack_costs.values()
+    )
+    assert query_cost["peak_memory_bytes"] > stack_costs["prefire"]["peak_memory_bytes"]
+    assert query_cost["sufficient_imagery"]
+    assert not query_cost["exceeds_memory_budget"]
+
+    # A stack without imagery is reported, rather than raised
+    stack_costs["postfire"] = estimate_stack_cost([], height=100, width=100)
+    query_cost = summarize_query_cost(stack_costs, height=100, width=100)
+    assert not query_cost["sufficient_imagery"]
@@ -1,5 +1,6 @@
 # FILEPATH: /workspace/tests/unit/lib/test_query_sentinel.py
 
+import os
 import pytest
 from unittest.mock import MagicMock, patch, call
 from src.lib.query_sentinel import Sentinel2Client
@@ -9,6 +10,7 @@ from shapely.geometry import Polygon
 import xarray as xr
 import numpy as np
 from rioxarray.raster_array import RasterArray
+from datetime import datetime, timezone
 
 
 def test_set_boundary(test_geojson):
@@ -89,7 +91,7 @@ def test_query_fire_event(test_geojson, test_stac_item_collection):
     client.get_items.return_value = test_stac_item_collection
 
     # Mock arrange stack method
-    client.arrange_stack = MagicMock()
+    client.arrange_stack = MagicMock(return_value=_band_stack(client))
 
     # Call the query_fire_event method
     client.query_fire_event(
@@ -111,6 +113,147 @@ def test_query_fire_event(test_geojson, test_stac_item_collection):
     assert client.postfire_stack is not None
 
 
+def _band_stack(client, fill_value=0.5):
+    return xr.DataArray(
+        np.full((2, 3, 3), fill_value),
+        dims=("band", "y", "x"),
+        coords={"band": [client.band_nir, client.band_swir]},
+    )
+
+
+def test_query_fire_event_no_data(test_geojson, test_stac_item_collection):
+    client = Sentinel2Client(test_geojson)
+    client.get_items = MagicMock(return_value=test_stac_item_collection)
+    client.arrange_stack = MagicMock(
+        side_effect=[_band_stack(client), _band_stack(client, fill_value=np.nan)]
+    )
+
+    # The postfire stack has no data in our boundary
+    with pytest.raises(ValueError, match="No data in the stack"):
+        client.query_fire_event(
+            prefire_date_range=("2020-01-01", "2020-02-01"),
+            postfire_date_range=("2020-03-01", "2020-04-01"),
+        )
+
+
+def test_query_fire_event_greedy(test_geojson):
+    from types import SimpleNamespace
+    import dask.array as da
+
+    client = Sentinel2Client(test_geojson, compositing="greedy")
+    client.clip_and_reproject = MagicMock(side_effect=lambda stack, crs: stack)
+    items = [
+        SimpleNamespace(
+            id=f"item_{i}",
+            datetime=datetime(2020, 1 + i, 1, tzinfo=timezone.utc),
+            properties={"proj:epsg": 32611, "eo:cloud_cover": 0},
+        )
+        for i in range(2)
+    ]
+    client.get_items = MagicMock(return_value=items)
+
+    def stack(items, bounds, assets, resolution, **kwargs):
+        minx, miny, maxx, maxy = bounds
+        x = np.arange(minx, maxx, resolution)
+        y = np.arange(maxy, miny, -resolution)
+        # Reflectance of 1, with a clear SCL class (vegetation)
+        values = np.ones((len(items), len(assets), len(y), len(x)), dtype="float32")
+        values[:, assets.index("SCL")] = 4
+        return xr.DataArray(
+            da.from_array(values, chunks=(1, -1, -1, -1)),
+            dims=("time", "band", "y", "x"),
+            coords={
+                "id": ("time", [item.id for item in items]),
+                "band": assets,
+                "y": y,
+                "x": x,
+            },
+        )
+
+    with patch("src.lib.query_sentinel.stackstac.stack", side_effect=stack):
+        client.query_fire_event(
+            prefire_date_range=("2020-01-01", "2020-02-01"),
+            postfire_date_range=("2020-03-01", "2020-04-01"),
+        )
+
+    assert list(client.prefire_stack.band.values) == ["B8A", "B12"]
+    # The same metadata as the median path
+    assert set(client.chunk_plans) == {"prefire", "postfire"}
+    assert client.chunk_plans["prefire"]["chunksize"]
+    assert client.dropped_items == {"prefire": [], "postfire": []}
+
+
+def test_reuses_products(test_geojson):
+    assert Sentinel2Client(test_geojson).reuses_products
+    # The offset is taken from the ring around the requesting AOI
+    assert not Sentinel2Client(test_geojson, offset_dnbr=True).reuses_products
+    # Which scenes fill the composite depends on when the requesting AOI is covered
+    assert not Sentinel2Client(test_geojson, compositing="greedy").reuses_products
+    # Which scenes survive screening depends on their clouds over the requesting AOI
+    assert not Sentinel2Client(test_geojson, screen_scenes=True).reuses_products
+
+
+def test_plan_query(test_geojson, test_stac_item_collection):
+    client = Sentinel2Client(test_geojson)
+    client.get_items = MagicMock(return_value=test_stac_item_collection)
+    client.arrange_stack = MagicMock()
+    client.reduce_items = MagicMock()
+
+    query_plan = client.plan_query(
+        prefire_date_range=("2020-01-01", "2020-02-01"),
+        postfire_date_range=("2020-03-01", "2020-04-01"),
+    )
+
+    # Only the searches are run, no raster data is read
+    assert client.get_items.call_count == 2
+    client.arrange_stack.assert_not_called()
+    client.reduce_items.assert_not_called()
+
+    assert query_plan["n_scenes"] == 2 * len(test_stac_item_collection)
+    assert query_plan["bytes_to_read"] > 0
+    assert query_plan["peak_memory_bytes"] > 0
+    assert set(query_plan["stacks"]) == {"prefire", "postfire"}
+    assert query_plan["not_estimated"] == []
+
+
+def test_plan_query_options(test_geojson, test_stac_item_collection):
+    date_ranges = {
+        "prefire_date_range": ("2020-01-01", "2020-02-01"),
+        "postfire_date_range": ("2020-03-01", "2020-04-01"),
+    }
+
+    def plan(**options):
+        client = Sentinel2Client(test_geojson, **options)
+        client.get_items = MagicMock(return_value=test_stac_item_collection)
+        return client.plan_query(**date_ranges)
+
+    median = plan()
+
+    # The unburned reference ring widens the stacks
+    offset = plan(offset_dnbr=True)
+    assert offset["aoi_shape"][0] > median["aoi_shape"][0]
+    assert offset["pixels_to_read"] > median["pixels_to_read"]
+
+    # The NBR MAD and the metrics' uncertainty are held too
+    uncertainty = plan(uncertainty=True)
+    assert uncertainty["peak_memory_bytes"] > median["peak_memory_bytes"]
+
+    # The scene classification is read too, though fewer scenes may be
+    greedy = plan(compositing="greedy", screen_scenes=True)
+    assert greedy["bytes_to_read"] > median["bytes_to_read"]
+    assert greedy["stacks"]["prefire"]["compositing"] == "greedy"
+    assert greedy["not_estimated"] == ["greedy_early_stopping", "scene_screening"]
+
+    # The prefire composite is computed over whole tiles of the composite tile grid
+    tiled = plan(composite_tile_cache=MagicMock())
+    assert tiled["stacks"]["prefire"]["compositing"] == "tiled"
+    assert (
+        tiled["stacks"]["prefire"]["pixels_to_read"]
+        > median["stacks"]["prefire"]["pixels_to_read"]
+    )
+    assert tiled["stacks"]["postfire"] == median["stacks"]["postfire"]
+
+
 def test_calc_burn_metrics(test_geojson, test_3d_valid_xarray_epsg_4326):
     # Initialize Sentinel2Client
     client = Sentinel2Client(test_geojson)
@@ -143,6 +286,38 @@ def test_calc_burn_metrics(test_geojson, test_3d_valid_xarray_epsg_4326):
     )
 
 
+
+def test_calc_burn_metrics_offset_dnbr(test_3d_valid_xarray_epsg_4326):
+    # A boundary around the central few pixels of the stack, leaving room for a ring
+    x = test_3d_valid_xarray_epsg_4326.x.values
+    y = test_3d_valid_xarray_epsg_4326.y.values
+    boundary = Polygon(
+        [(x[4], y[4]), (x[5], y[4]), (x[5], y[5]), (x[4], y[5]), (x[4], y[4])]
+    )
+    geojson_boundary = gpd.GeoDataFrame(geometry=[boundary], crs="EPSG:4326")
+    client = Sentinel2Client(geojson_boundary, offset_dnbr=True)
+    assert client.reference_ring_distance > 0
+
+    test_3d_valid_xarray_epsg_4326["band"] = ["B8A", "B12"]
+    ring_mask = client.get_reference_ring_mask(test_3d_valid_xarray_epsg_4326)
+    # The ring skips the pixels just outside the boundary, and reaches the edges of the stack
+    assert not ring_mask[3:7, 3:7].any()
+    assert ring_mask[0, 0] and ring_mask[-1, -1]
+
+    client.prefire_stack = test_3d_valid_xarray_epsg_4326
+    client.postfire_stack = test_3d_valid_xarray_epsg_4326 * 0.9
+    client.calc_burn_metrics()
+
+    assert set(client.dnbr_offset_info) == {
+        "dnbr_offset",
+        "dnbr_offset_mad",
+        "n_reference_pixels",
+    }
+    assert client.dnbr_offset_info["n_reference_pixels"] == ring_mask.sum()
+    # The ring is clipped off once the offset has been taken from it
+    assert client.metrics_stack.sizes["x"] < test_3d_valid_xarray_epsg_4326.sizes["x"]
+
+
 ## TODO: Needs a rework for the new derived boundary approach w/ seeds
 
 # def test_derive_boundary(test_geojson, test_3d_valid_xarray_epsg_4326):
@@ -206,3 +381,308 @@ def test_ingest_metrics_stack(test_geojson, test_3d_valid_xarray_epsg_4326):
     missing_metric_metrics_stack = metrics_stack[:3, :, :]
     with pytest.raises(ValueError):
         client.ingest_metrics_stack(missing_metric_metrics_stack)
+
+
+def test_load_metrics_stack_from_cogs(test_3d_valid_xarray_epsg_4326, tmp_path):
+    # Write an existing product's COGs, each metric with a constant offset so we can tell them apart
+    layer = test_3d_valid_xarray_epsg_4326.sel(band="band1").rio.write_crs("EPSG:4326")
+    cog_paths = {}
+    for i, metric in enumerate(["nbr_prefire", "nbr_postfire", "dnbr", "rdnbr", "rbr"]):
+        cog_paths[metric] = str(tmp_path / f"{metric}.tif")
+        (layer + i).rio.to_raster(cog_paths[metric], driver="GTiff")
+
+    # Request a sub-area of the existing product
+    x, y = layer.x.values, layer.y.values
+    sub_aoi = Polygon([(x[2], y[2]), (x[6], y[2]), (x[6], y[6]), (x[2], y[6])])
+    geojson = gpd.GeoDataFrame(geometry=[sub_aoi], crs="EPSG:4326").__geo_interface__
+    client = Sentinel2Client(geojson)
+
+    client.load_metrics_stack_from_cogs(cog_paths)
+
+    assert client.metrics_stack.dtype == client.dtype
+    assert client.metrics_stack.sizes["x"] < layer.sizes["x"]
+    assert client.metrics_stack.sizes["y"] < layer.sizes["y"]
+
+    rbr = client.metrics_stack.sel(burn_metric="rbr")
+    expected = (layer + 4).sel(x=rbr.x, y=rbr.y, method="nearest")
+    valid = ~np.isnan(rbr.values)
+    assert valid.any()
+    np.testing.assert_allclose(rbr.values[valid], expected.values[valid], rtol=1e-5)
+
+
+def _scene_stack(bounds, scene_values, epsg=32611, resolution=20, fail_items=()):
+    # A lazy (time, band, y, x) stack of scenes over `bounds`, one scene per chunk, whose
+    # reads of the items in `fail_items` raise
+    import dask.array as da
+
+    minx, miny, maxx, maxy = bounds
+    x = np.arange(minx, maxx, resolution)
+    y = np.arange(maxy, miny, -resolution)
+    values = np.stack(
+        [np.broadcast_to(value, (2, len(y), len(x))) for value in scene_values]
+    ).astype("float32")
+
+    def read(block, block_info=None):
+        if block_info[0]["chunk-location"][0] in fail_items:
+            raise OSError("Read failed")
+        return block
+
+    stack = xr.DataArray(
+        da.from_array(values, chunks=(1, 1, -1, -1)).map_blocks(read, dtype="float32"),
+        dims=("time", "band", "y", "x"),
+        coords={
+            "id": ("time", [f"item_{i}" for i in range(len(scene_values))]),
+            "band": ["B8A", "B12"],
+            "y": y,
+            "x": x,
+        },
+    )
+    return stack.rio.write_crs(epsg)
+
+
+def _cached_stack_client(geojson, tmp_path, scene_values, **kwargs):
+    from types import SimpleNamespace
+    from src.util.scene_cache import SceneCache
+
+    client = Sentinel2Client(
+        geojson,
+        scene_cache=SceneCache(str(tmp_path / "scenes")),
+        checkpoint_dir=str(tmp_path / "checkpoints"),
+        **kwargs,
+    )
+    client.clip_and_reproject = MagicMock(side_effect=lambda stack, crs: stack)
+    client.stack_scenes = MagicMock(
+        side_effect=lambda items, resolution, bounds: _scene_stack(
+            bounds, scene_values
+        )
+    )
+    items = [SimpleNamespace(properties={"proj:epsg": 32611})] * len(scene_values)
+    return client, items
+
+
+def test_arrange_cached_stack(test_geojson, tmp_path):
+    client, items = _cached_stack_client(test_geojson, tmp_path, [1.0, 2.0, 3.0])
+
+    stack = client.arrange_stack(items)
+    assert np.all(stack.values == 2.0)
+    # Only our AOI is reduced, not the whole of the tiles
+    minx, miny, maxx, maxy = client.get_stack_bounds(32611, 20)
+    assert stack.sizes["x"] <= (maxx - minx) / 20 + 2
+
+    # With a new pass, only the new scene is read - the cached ones would be
+    # replaced with NaNs if they were read again
+    client.stack_scenes.side_effect = lambda items, resolution, bounds: _scene_stack(
+        bounds, [np.nan] * 3 + [10.0]
+    )
+    stack = client.arrange_stack(items + items[:1])
+    assert np.all(stack.values == 2.5)
+
+
+def test_arrange_cached_stack_shares_tiles(test_geojson, tmp_path):
+    client, items = _cached_stack_client(test_geojson, tmp_path, [1.0, 2.0])
+    client.arrange_stack(items)
+
+    # A neighbouring AOI which overlaps ours reuses the tiles they share, even though
+    # its bounds differ
+    neighbour = gpd.GeoDataFrame.from_features(test_geojson["features"], crs="EPSG:4326")
+    neighbour["geometry"] = neighbour.translate(xoff=0.001)
+    neighbour_client, __items = _cached_stack_client(
+        neighbour.__geo_interface__, tmp_path, [np.nan, np.nan]
+    )
+    stack = neighbour_client.arrange_stack(items)
+    assert np.all(stack.values == 1.5)
+
+
+def test_arrange_cached_stack_drop_failed_items(test_geojson, tmp_path):
+    client, items = _cached_stack_client(
+        test_geojson, tmp_path, [1.0, 2.0, 3.0], drop_failed_items=True
+    )
+    client.stack_scenes.side_effect = lambda items, resolution, bounds: _scene_stack(
+        bounds, [1.0, 2.0, 3.0], fail_items=[2]
+    )
+    client.scene_cache.prune = MagicMock()
+
+    with patch("src.lib.resilient_compute.time.sleep"):
+        stack = client.arrange_stack(items)
+
+    assert client.stack_dropped_items == ["item_2"]
+    assert np.all(stack.values == 1.5)
+    client.scene_cache.prune.assert_called_once()
+    # The reduction was checkpointed
+    assert os.listdir(client.checkpoint_dirs[-1])
+
+    # Without dropping failed items, the failure is raised
+    client.drop_failed_items = False
+    client.scene_cache = type(client.scene_cache)(str(tmp_path / "other_scenes"))
+    with patch("src.lib.resilient_compute.time.sleep"), pytest.raises(OSError):
+        client.arrange_stack(items)
+
+
+def test_arrange_cached_stack_uncertainty(test_geojson, tmp_path):
+    rng = np.random.default_rng(0)
+    scene_values = list(rng.uniform(0.1, 0.5, (3, 2, 1, 1)))
+    client, items = _cached_stack_client(
+        test_geojson, tmp_path, scene_values, uncertainty=True
+    )
+
+    reduced = client.arrange_stack(items)
+
+    assert list(reduced.band.values) == ["B8A", "B12", "nbr_mad"]
+    bounds = client.stack_scenes.call_args.kwargs["bounds"]
+    expected = client.reduce_time_range(
+        _scene_stack(bounds, scene_values).compute()
+    ).sel(x=reduced.x, y=reduced.y)
+    np.testing.assert_allclose(reduced.values, expected.values, rtol=1e-6)
+
+
+def test_arrange_tiled_composite(test_geojson, tmp_path):
+    from types import SimpleNamespace
+    from src.util.composite_tile_cache import CompositeTileCache, composite_tile_bounds
+
+    epsg = 32611
+    client = Sentinel2Client(
+        test_geojson, composite_tile_cache=CompositeTileCache(str(tmp_path))
+    )
+    client.clip_and_reproject = MagicMock(side_effect=lambda stack, crs: stack)
+    # The search over the tiles also reaches into the neighbouring UTM zone
+    tile_items = [
+        SimpleNamespace(id="other_zone", properties={"proj:epsg": epsg + 1}),
+        SimpleNamespace(id="tile_item", properties={"proj:epsg": epsg}),
+    ]
+    client.get_items = MagicMock(return_value=tile_items)
+
+    def reduce_tile(items, bounds, resolution, epsg=None):
+        assert [item.id for item in items] == ["tile_item"]
+        assert epsg == 32611
+        minx, miny, maxx, maxy = bounds
+        x = np.arange(minx + resolution / 2, maxx, resolution)
+        y = np.arange(maxy - resolution / 2, miny, -resolution)
+        client.stack_dropped_items = []
+        return xr.DataArray(
+            np.ones((2, len(y), len(x)), dtype="float32"),
+            dims=("band", "y", "x"),
+            coords={"band": ["B8A", "B12"], "y": y, "x": x},
+        ).rio.write_crs(epsg)
+
+    client.reduce_items = MagicMock(side_effect=reduce_tile)
+    items = [SimpleNamespace(properties={"proj:epsg": epsg})]
+    date_range = ("2023-05-01", "2023-06-01")
+
+    stack = client.arrange_tiled_composite(items, date_range)
+    n_tiles = client.stack_composite_info["n_tiles"]
+    assert client.stack_composite_info["n_tiles_computed"] == n_tiles
+    assert client.reduce_items.call_count == n_tiles
+    assert np.all(stack.values == 1)
+
+    # The boundary is within the tiles
+    minx, miny, maxx, maxy = client.get_stack_bounds(epsg, 20)
+    assert stack.x.min() <= minx + 20 and stack.x.max() >= maxx - 20
+
+    # Another fire in the same tiles and season reuses them
+    client.reduce_items.reset_mock()
+    client.arrange_tiled_composite(items, date_range)
+    assert client.stack_composite_info["n_tiles_computed"] == 0
+    client.reduce_items.assert_not_called()
+
+
+def test_reduce_items_epsg(test_geojson):
+    from types import SimpleNamespace
+
+    client = Sentinel2Client(test_geojson)
+    # The first item is in the neighbouring UTM zone, but the bounds are in ours
+    items = [
+        SimpleNamespace(id="other_zone", properties={"proj:epsg": 32612}),
+        SimpleNamespace(id="item", properties={"proj:epsg": 32611}),
+    ]
+    with patch(
+        "src.lib.query_sentinel.stackstac.stack", side_effect=RuntimeError
+    ) as stack, pytest.raises(RuntimeError):
+        client.reduce_items(items, (0, 0, 20480, 20480), 20, epsg=32611)
+    assert stack.call_args.kwargs["epsg"] == 32611
+
+
+def test_calc_burn_metrics_uncertainty(test_geojson, test_4d_valid_xarray_epsg_4326):
+    client = Sentinel2Client(test_geojson, uncertainty=True)
+    assert client.reduced_bands == ["B8A", "B12", "nbr_mad"]
+
+    test_4d_valid_xarray_epsg_4326["band"] = ["B8A", "B12"]
+    reduced = client.reduce_time_range(test_4d_valid_xarray_epsg_4326)
+    assert list(reduced.band.values) == ["B8A", "B12", "nbr_mad"]
+    np.testing.assert_array_equal(
+        reduced.sel(band=["B8A", "B12"]).values,
+        test_4d_valid_xarray_epsg_4326.median(dim="time").values,
+    )
+
+    client.prefire_stack = reduced
+    client.postfire_stack = reduced * 0.9
+    client.calc_burn_metrics()
+
+    assert list(client.metrics_stack.burn_metric.values) == [
+        "nbr_prefire",
+        "nbr_postfire",
+        "dnbr",
+        "rdnbr",
+        "rbr",
+        "dnbr_uncertainty",
+        "rbr_uncertainty",
+    ]
+    assert (client.metrics_stack.sel(burn_metric="dnbr_uncertainty") >= 0).all()
+
+    with pytest.raises(ValueError):
+        Sentinel2Client(test_geojson, uncertainty=True, compositing="greedy")
+
+
+def test_sweep_thresholds(test_geojson, test_3d_valid_xarray_epsg_4326):
+    client = Sentinel2Client(test_geojson)
+    client.metrics_stack = test_3d_valid_xarray_epsg_4326.rename(
+        band="burn_metric"
+    ).assign_coords(burn_metric=["dnbr", "rbr"])
+    dnbr = client.metrics_stack.sel(burn_metric="dnbr", drop=True)
+    client.barc_classifications = dnbr.copy(data=np.where(dnbr < 0.5, 1.0, 2.0))
+
+    result = client.sweep_thresholds([[0.25, 2], [0.5, 2]], classes=[1, 2])
+
+    np.testing.assert_array_equal(result["overall_accuracy"] == 1, [False, True])
+    assert result["best_index"] == 1
+
+
+def test_calc_recovery(test_geojson, test_3d_valid_xarray_epsg_4326):
+    client = Sentinel2Client(test_geojson)
+    test_3d_valid_xarray_epsg_4326["band"] = ["B8A", "B12"]
+    nbr_prefire = (
+        test_3d_valid_xarray_epsg_4326.sel(band="B8A", drop=True)
+        .expand_dims(burn_metric=["nbr_prefire"])
+    )
+    client.metrics_stack = nbr_prefire
+
+    # Imagery in the first and third years after the fire, but not the second
+    def get_items(date_range, **kwargs):
+        if date_range[0].startswith("2022"):
+            return []
+        return [MagicMock(datetime=datetime.fromisoformat(date_range[0]))]
+
+    def arrange_stack(year_client, items, resolution=20):
+        # Each year's per-stack state is its own
+        assert year_client.checkpoint_dirs == []
+        year = items[0].datetime.year
+        year_client.checkpoint_dirs.append(f"checkpoint_{year}")
+        year_client.chunk_plan = {"year": year}
+        year_client.stack_dropped_items = [f"dropped_{year}"]
+        return test_3d_valid_xarray_epsg_4326
+
+    with patch.object(client, "get_items", side_effect=get_items), patch.object(
+        Sentinel2Client, "arrange_stack", autospec=True, side_effect=arrange_stack
+    ):
+        recovery_info = client.calc_recovery(["2020-05-01", "2020-06-30"], n_years=3)
+
+    assert recovery_info["n_passes"] == {1: 1, 2: 0, 3: 1}
+    # ... merged back once every year is done
+    assert sorted(client.checkpoint_dirs) == ["checkpoint_2021", "checkpoint_2023"]
+    assert client.chunk_plans == {
+        "recovery_year_1": {"year": 2021},
+        "recovery_year_3": {"year": 2023},
+    }
+    assert client.dropped_items["recovery_year_3"] == ["dropped_2023"]
+    assert list(client.recovery_dnbr.year.values) == [1, 3]
+    assert client.recovery_dnbr.sizes["y"] == nbr_prefire.sizes["y"]
+    assert client.recovery_dnbr.sizes["x"] == nbr_prefire.sizes["x"]
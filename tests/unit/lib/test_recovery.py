@@ -0,0 +1,36 @@
+import numpy as np
+import xarray as xr
+from src.lib.recovery import recovery_date_ranges, summarize_recovery
+
+
+def test_recovery_date_ranges():
+    date_ranges = recovery_date_ranges(["2020-02-29", "2020-06-30"], n_years=2)
+
+    assert date_ranges == {
+        1: ["2021-02-28", "2021-06-30"],
+        2: ["2022-02-28", "2022-06-30"],
+    }
+
+
+def test_summarize_recovery():
+    # A high severity pixel recovering, a low severity pixel already recovered, and an
+    # unclassified pixel
+    recovery_dnbr = xr.DataArray(
+        [[[0.6, 0.1, 0.0]], [[0.3, 0.0, 0.0]], [[np.nan, np.nan, np.nan]]],
+        dims=("year", "y", "x"),
+        coords={"year": [1, 2, 3]},
+    )
+    severity = xr.DataArray([[3, 1, 255]], dims=("y", "x"))
+
+    summary = summarize_recovery(recovery_dnbr, severity, classes=[1, 2, 3])
+
+    assert summary["years"] == [1, 2, 3]
+    assert summary["classes"]["3"]["n_pixels"] == 1
+    assert summary["classes"]["3"]["p50"] == [0.6, 0.3, None]
+    assert summary["classes"]["1"]["p50"] == [0.1, 0.0, None]
+    assert summary["classes"]["2"] == {
+        "n_pixels": 0,
+        "p25": [None, None, None],
+        "p50": [None, None, None],
+        "p75": [None, None, None],
+    }
@@ -0,0 +1,170 @@
+import pytest
+import numpy as np
+import xarray as xr
+import dask
+import dask.array as da
+from src.lib.resilient_compute import (
+    reduce_stack_by_chunk,
+    retry_with_backoff,
+    ChunkCheckpoint,
+)
+
+N_TIME, N_BAND, HEIGHT, WIDTH = 3, 2, 8, 8
+FAILING_ITEM = 1
+
+
+def _read_item(time_index):
+    if time_index == FAILING_ITEM:
+        raise IOError("Simulated persistent read failure")
+    return np.full((N_BAND, HEIGHT, WIDTH), time_index, dtype="float32")
+
+
+def _safe_read_item(time_index):
+    return np.full((N_BAND, HEIGHT, WIDTH), time_index, dtype="float32")
+
+
+def _stack(read_item, per_item=False):
+    data = da.stack(
+        [
+            da.from_delayed(
+                dask.delayed(read_item)(t), (N_BAND, HEIGHT, WIDTH), "float32"
+            )
+            for t in range(N_TIME)
+        ]
+    )
+    if not per_item:
+        data = data.rechunk((-1, 1, HEIGHT // 2, WIDTH // 2))
+    return xr.DataArray(
+        data,
+        dims=("time", "band", "y", "x"),
+        coords={
+            "time": range(N_TIME),
+            "id": ("time", [f"item_{t}" for t in range(N_TIME)]),
+            "band": ["B8A", "B12"],
+            "y": np.arange(HEIGHT),
+            "x": np.arange(WIDTH),
+        },
+    )
+
+
+def _median(stack):
+    return stack.median(dim="time")
+
+
+def test_retry_with_backoff():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise IOError("Transient")
+        return "ok"
+
+    assert retry_with_backoff(flaky, max_retries=3, backoff_seconds=0) == "ok"
+    assert len(attempts) == 3
+
+    def always_fails():
+        raise IOError("Persistent")
+
+    with pytest.raises(IOError):
+        retry_with_backoff(always_fails, max_retries=1, backoff_seconds=0)
+
+
+def test_reduce_stack_by_chunk_matches_median():
+    stack = _stack(_safe_read_item)
+    reduced, dropped_items = reduce_stack_by_chunk(stack, reducer=_median)
+
+    expected = stack.median(dim="time").compute()
+    assert reduced.dims == ("band", "y", "x")
+    assert list(reduced.band.values) == ["B8A", "B12"]
+    np.testing.assert_array_equal(reduced.values, expected.values)
+    assert dropped_items == []
+
+
+def test_reduce_stack_by_chunk_retries_transient_failure():
+    failures = {"remaining": 2}
+
+    def flaky_median(stack):
+        if failures["remaining"] > 0:
+            failures["remaining"] -= 1
+            raise IOError("Transient")
+        return stack.median(dim="time")
+
+    reduced, dropped_items = reduce_stack_by_chunk(
+        _stack(_safe_read_item),
+        reducer=flaky_median,
+        max_workers=1,
+        backoff_seconds=0,
+    )
+    assert np.all(reduced.values == 1)
+    assert dropped_items == []
+
+
+def test_reduce_stack_by_chunk_persistent_failure():
+    with pytest.raises(IOError):
+        reduce_stack_by_chunk(
+            _stack(_read_item), reducer=_median, max_retries=1, backoff_seconds=0
+        )
+
+
+def test_reduce_stack_by_chunk_drop_failed_items(tmp_path):
+    reduced, dropped_items = reduce_stack_by_chunk(
+        _stack(_read_item),
+        reducer=_median,
+        checkpoint_dir=str(tmp_path),
+        drop_failed_items=True,
+        item_stack=_stack(_read_item, per_item=True),
+        max_retries=1,
+        backoff_seconds=0,
+    )
+    # Median of the remaining items, 0 and 2
+    assert np.all(reduced.values == 1)
+    assert dropped_items == [f"item_{FAILING_ITEM}"]
+
+    # Every chunk is checkpointed, along with the items it dropped
+    assert ChunkCheckpoint(str(tmp_path)).load((1, 1, 1))[1] == [
+        f"item_{FAILING_ITEM}"
+    ]
+
+
+def test_reduce_stack_by_chunk_resumes_from_checkpoint(tmp_path):
+    checkpoint = ChunkCheckpoint(str(tmp_path))
+    n_chunks = 2 * 2 * 2
+    for chunk_index in np.ndindex(2, 2, 2):
+        checkpoint.save(
+            chunk_index, np.full((1, HEIGHT // 2, WIDTH // 2), 7, "float32"), []
+        )
+
+    def unreachable(stack):
+        raise AssertionError("Completed chunks should not be recomputed")
+
+    reduced, __dropped_items = reduce_stack_by_chunk(
+        _stack(_read_item), reducer=unreachable, checkpoint_dir=str(tmp_path)
+    )
+    assert np.all(reduced.values == 7)
+    assert len(list(tmp_path.glob("*.npy"))) == n_chunks
+
+
+def test_reduce_stack_by_chunk_reduced_bands():
+    def median_and_range(stack):
+        reduced = stack.median(dim="time")
+        time_range = (stack.max(dim="time") - stack.min(dim="time")).isel(
+            band=[0]
+        )
+        return xr.concat([reduced, time_range], dim="band")
+
+    stack = _stack(_safe_read_item).chunk({"band": -1})
+    reduced, __dropped_items = reduce_stack_by_chunk(
+        stack, reducer=median_and_range, reduced_bands=["B8A", "B12", "range"]
+    )
+    assert list(reduced.band.values) == ["B8A", "B12", "range"]
+    assert np.all(reduced.sel(band=["B8A", "B12"]).values == 1)
+    assert np.all(reduced.sel(band="range").values == N_TIME - 1)
+
+    # Derived bands need every band of a pixel at once
+    with pytest.raises(ValueError):
+        reduce_stack_by_chunk(
+            _stack(_safe_read_item),
+            reducer=median_and_range,
+            reduced_bands=["B8A", "B12", "range"],
+        )
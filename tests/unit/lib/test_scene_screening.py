@@ -0,0 +1,91 @@
+import pytest
+import numpy as np
+import rasterio
+import geopandas as gpd
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from shapely.geometry import box
+from types import SimpleNamespace
+from src.lib.scene_screening import score_item_cloudiness, screen_items
+
+EPSG = 32611
+ORIGIN_X, ORIGIN_Y = 500000, 3760000
+SIZE = 256
+RESOLUTION = 20
+
+
+def _scl_item(tmp_path, item_id, cloudy_rows):
+    # SCL of vegetation (4), with the given top rows cloudy (9)
+    scl = np.full((SIZE, SIZE), 4, dtype="uint8")
+    scl[:cloudy_rows, :] = 9
+
+    path = str(tmp_path / f"{item_id}_SCL.tif")
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        height=SIZE,
+        width=SIZE,
+        count=1,
+        dtype="uint8",
+        crs=f"EPSG:{EPSG}",
+        transform=from_origin(ORIGIN_X, ORIGIN_Y, RESOLUTION, RESOLUTION),
+        tiled=True,
+        blockxsize=64,
+        blockysize=64,
+    ) as dst:
+        dst.write(scl, 1)
+        dst.build_overviews([2, 4, 8], Resampling.nearest)
+
+    return SimpleNamespace(
+        id=item_id,
+        properties={"proj:epsg": EPSG},
+        assets={"SCL": SimpleNamespace(href=path)},
+    )
+
+
+@pytest.fixture
+def aoi_gpd():
+    # The top half of the scene
+    aoi = box(
+        ORIGIN_X,
+        ORIGIN_Y - RESOLUTION * SIZE / 2,
+        ORIGIN_X + RESOLUTION * SIZE,
+        ORIGIN_Y,
+    )
+    return gpd.GeoDataFrame(geometry=[aoi], crs=f"EPSG:{EPSG}").to_crs("EPSG:4326")
+
+
+def test_score_item_cloudiness(tmp_path, aoi_gpd):
+    # A quarter of the scene is cloudy, but half of our AOI
+    item = _scl_item(tmp_path, "quarter_cloudy", cloudy_rows=SIZE // 4)
+    score = score_item_cloudiness(item, aoi_gpd, decimation=8)
+
+    assert score["cloud_cover"] == pytest.approx(50, abs=5)
+    assert score["data_coverage"] == pytest.approx(100, abs=5)
+
+
+def test_screen_items(tmp_path, aoi_gpd):
+    clear = _scl_item(tmp_path, "clear", cloudy_rows=0)
+    cloudy = _scl_item(tmp_path, "cloudy", cloudy_rows=SIZE // 2)
+    broken = SimpleNamespace(
+        id="broken",
+        properties={"proj:epsg": EPSG},
+        assets={"SCL": SimpleNamespace(href=str(tmp_path / "missing.tif"))},
+    )
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr("src.lib.scene_screening.retry_with_backoff", lambda fn, **_: fn())
+        kept_items, scores = screen_items(
+            [clear, cloudy, broken], aoi_gpd, max_cloud_cover=50
+        )
+
+    # Items which fail to be scored are kept, rather than dropped
+    assert [item.id for item in kept_items] == ["clear", "broken"]
+    assert scores["clear"]["cloud_cover"] == 0
+    assert scores["cloudy"]["cloud_cover"] == pytest.approx(100, abs=5)
+    assert "broken" not in scores
+
+    # If nothing passes, nothing is dropped
+    kept_items, __scores = screen_items([cloudy], aoi_gpd, max_cloud_cover=50)
+    assert kept_items == [cloudy]
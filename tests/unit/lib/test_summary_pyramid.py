@@ -0,0 +1,110 @@
+import pytest
+import numpy as np
+import xarray as xr
+import rioxarray
+import rasterio
+import shapely
+from rasterio.features import geometry_mask
+from rasterio.transform import from_origin
+from src.lib.quantization import quantize
+from src.lib.summary_pyramid import (
+    SummaryPyramid,
+    build_summary_pyramid,
+    cog_window_reader,
+)
+
+BLOCK_SIZES = [4, 16, 64]
+
+
+@pytest.fixture
+def metric_values():
+    rng = np.random.default_rng(0)
+    values = rng.normal(0.3, 0.2, (150, 170))
+    values[::7, ::3] = np.nan
+    # A block with no valid values
+    values[:16, :16] = np.nan
+    return values
+
+
+def _histogram(values, bin_edges):
+    histogram, __edges = np.histogram(values, bins=bin_edges)
+    return histogram
+
+
+def test_window_stats_matches_pixels(metric_values):
+    levels, bin_edges = build_summary_pyramid(metric_values, BLOCK_SIZES, n_bins=8)
+    pyramid = SummaryPyramid(levels, bin_edges, metric_values.shape)
+    read_window = lambda row_start, row_stop, col_start, col_stop: metric_values[
+        row_start:row_stop, col_start:col_stop
+    ]
+
+    stats = pyramid.window_stats(3, 10, 140, 150, read_window)
+
+    window = metric_values[3:143, 10:160]
+    window = window[np.isfinite(window)]
+    assert stats["count"] == window.size
+    assert stats["mean"] == pytest.approx(window.mean())
+    assert stats["std"] == pytest.approx(window.std())
+    assert stats["min"] == window.min()
+    assert stats["max"] == window.max()
+    np.testing.assert_array_equal(
+        stats["histogram"], _histogram(window, bin_edges)
+    )
+    # Only the edges of the window were read at full resolution
+    assert stats["n_pixels_read"] < 140 * 150 / 4
+
+    # A window beyond the raster has no pixels
+    assert pyramid.window_stats(200, 200, 10, 10, read_window)["count"] == 0
+
+
+def test_polygon_stats_matches_pixels(metric_values, tmp_path):
+    transform = from_origin(500000, 4000000, 20, 20)
+    metric = xr.DataArray(
+        metric_values.astype("float32"),
+        dims=("y", "x"),
+        coords={
+            "y": 4000000 - 20 * (np.arange(150) + 0.5),
+            "x": 500000 + 20 * (np.arange(170) + 0.5),
+        },
+    ).rio.write_crs("EPSG:32611")
+    pyramid = SummaryPyramid.from_array(metric, block_sizes=BLOCK_SIZES, n_bins=8)
+
+    # Round trip, and read edges from a quantized COG
+    pyramid_path = str(tmp_path / "dnbr_summary_pyramid.npz")
+    pyramid.to_npz(pyramid_path)
+    pyramid = SummaryPyramid.from_npz(pyramid_path)
+    assert pyramid.transform == transform
+    assert pyramid.block_sizes == BLOCK_SIZES
+
+    cog_path = str(tmp_path / "dnbr.tif")
+    quantize(metric, scale=1e-4).rio.to_raster(cog_path, driver="GTiff")
+
+    polygon = shapely.Point(500000 + 20 * 90, 4000000 - 20 * 70).buffer(20 * 55)
+    with rasterio.open(cog_path) as src:
+        stats = pyramid.polygon_stats(polygon, cog_window_reader(src))
+
+    within = ~geometry_mask([polygon], out_shape=metric.shape, transform=transform)
+    values = metric.values[within]
+    values = values[np.isfinite(values)]
+    assert stats["count"] == values.size
+    assert stats["mean"] == pytest.approx(values.mean(), abs=1e-4)
+    assert stats["max"] == pytest.approx(values.max(), abs=1e-4)
+    assert stats["n_pixels_read"] < within.sum()
+
+
+def test_build_summary_pyramid_levels(metric_values):
+    levels, __bin_edges = build_summary_pyramid(metric_values, BLOCK_SIZES)
+
+    # Coarser levels aggregate the finer ones, and cover the whole raster
+    for block_size in BLOCK_SIZES:
+        assert levels[block_size]["count"].shape == (
+            -(-150 // block_size),
+            -(-170 // block_size),
+        )
+        assert levels[block_size]["count"].sum() == np.isfinite(metric_values).sum()
+        assert levels[block_size]["histogram"].sum() == np.isfinite(metric_values).sum()
+    assert levels[16]["count"][0, 0] == 0
+    assert levels[16]["min"][0, 0] == np.inf
+
+    with pytest.raises(ValueError):
+        build_summary_pyramid(metric_values, [4, 6])
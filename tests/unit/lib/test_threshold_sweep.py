@@ -0,0 +1,63 @@
+import pytest
+import numpy as np
+import xarray as xr
+from src.lib.burn_severity import classify_burn
+from src.lib.threshold_sweep import ThresholdSweep, candidate_threshold_sets
+
+
+def test_candidate_threshold_sets():
+    threshold_sets = candidate_threshold_sets([[0.1, 0.2], [0.2, 0.3], [0.5]])
+
+    np.testing.assert_array_equal(
+        threshold_sets, [[0.1, 0.2, 0.5], [0.1, 0.3, 0.5], [0.2, 0.3, 0.5]]
+    )
+
+
+def test_threshold_sweep_matches_classify_burn():
+    rng = np.random.default_rng(0)
+    metric = rng.uniform(-0.3, 1.0, (40, 50)).astype("float32")
+    metric[::7, ::5] = np.nan
+    reference = np.digitize(metric, [0.1, 0.27, 0.66]).astype("float64") + 1
+    # Some noise in the reference, and unlabelled pixels
+    reference[::3, ::4] = rng.integers(1, 5, reference[::3, ::4].shape)
+    reference[:, :2] = np.nan
+    # Metric values on a threshold, which belong to the class above it
+    metric[10, 10:13] = [0.1, 0.27, 0.66]
+
+    classes = [1, 2, 3, 4]
+    threshold_sets = candidate_threshold_sets(
+        [[-0.1, 0.1], [0.2, 0.27], [0.44, 0.66], [1.5]]
+    )
+    sweep = ThresholdSweep(metric, reference)
+    result = sweep.evaluate(threshold_sets, classes)
+
+    valid = np.isfinite(reference) & np.isfinite(metric)
+    for threshold_set, overall_accuracy, confusion in zip(
+        threshold_sets, result["overall_accuracy"], result["confusion"]
+    ):
+        classified = classify_burn(
+            xr.DataArray(metric), dict(zip(threshold_set, classes))
+        ).values
+        assert overall_accuracy == pytest.approx(
+            np.mean(classified[valid] == reference[valid])
+        )
+        for class_index, reference_class in enumerate(sweep.reference_classes):
+            counts = [
+                np.sum(classified[valid & (reference == reference_class)] == value)
+                for value in classes
+            ]
+            np.testing.assert_array_equal(confusion[class_index, :-1], counts)
+
+    # The published thresholds agree best with a reference derived from them
+    best = result["threshold_sets"][result["best_index"]]
+    np.testing.assert_allclose(best, [0.1, 0.27, 0.66, 1.5])
+    assert result["kappa"][result["best_index"]] < 1
+
+
+def test_threshold_sweep_validates_threshold_sets():
+    sweep = ThresholdSweep(np.array([0.1, 0.5]), np.array([1, 2]))
+
+    with pytest.raises(ValueError):
+        sweep.evaluate([[0.3, 0.2]], [1, 2])
+    with pytest.raises(ValueError):
+        sweep.evaluate([[0.2, 0.3]], [1, 2, 3])
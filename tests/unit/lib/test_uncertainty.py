@@ -0,0 +1,45 @@
+import numpy as np
+import xarray as xr
+from src.lib.uncertainty import (
+    calc_nbr_mad,
+    calc_burn_metric_uncertainty,
+    UNCERTAINTY_METRICS,
+)
+
+
+def test_calc_nbr_mad():
+    # Per-pass NBR of 0.5, 0.6, 0.8 and NaN at the first pixel, and a single pass at the second
+    nir = xr.DataArray(
+        [[0.75, 0.8, 0.9, np.nan], [0.75, np.nan, np.nan, np.nan]], dims=("x", "time")
+    )
+    swir = xr.DataArray(
+        [[0.25, 0.2, 0.1, 0.3], [0.25, 0.2, 0.1, 0.3]], dims=("x", "time")
+    )
+
+    nbr_mad = calc_nbr_mad(nir, swir)
+
+    assert nbr_mad.dims == ("x",)
+    # Median of 0.6, so absolute deviations of 0.1, 0 and 0.2
+    assert np.isclose(nbr_mad.values[0], 0.1)
+    # A single pass has no spread to measure
+    assert np.isnan(nbr_mad.values[1])
+
+
+def test_calc_burn_metric_uncertainty():
+    nbr_prefire = xr.DataArray([0.5, 0.5], dims="x")
+    rbr = xr.DataArray([0.2, 0.2], dims="x")
+    nbr_mad_prefire = xr.DataArray([0.03, 0.0], dims="x")
+    nbr_mad_postfire = xr.DataArray([0.04, 0.0], dims="x")
+
+    uncertainty = calc_burn_metric_uncertainty(
+        nbr_prefire, rbr, nbr_mad_prefire, nbr_mad_postfire
+    )
+
+    assert list(uncertainty.burn_metric.values) == UNCERTAINTY_METRICS
+    np.testing.assert_allclose(
+        uncertainty.sel(burn_metric="dnbr_uncertainty").values, [0.05, 0]
+    )
+    np.testing.assert_allclose(
+        uncertainty.sel(burn_metric="rbr_uncertainty").values,
+        [np.sqrt((0.8 * 0.03) ** 2 + 0.04**2) / 1.501, 0],
+    )
@@ -1,7 +1,14 @@
 import pytest
+import shutil
 from src.util.cloud_static_io import CloudStaticIOClient, BUCKET_HTTPS_PREFIX
 from unittest.mock import patch, MagicMock, ANY, call, mock_open
 from boto3.session import Session
+import rasterio
+from src.lib.quantization import (
+    QUANTIZED_NODATA,
+    METRIC_SCALES,
+    QUANTIZATION_SCALE_TAG,
+)
 
 
 @patch("src.util.cloud_static_io.CloudStaticIOClient.update_manifest")
@@ -61,6 +68,77 @@ def test_upload_fire_event(
     )
 
 
+@patch.object(CloudStaticIOClient, "update_product_index")
+@patch.object(CloudStaticIOClient, "update_manifest")
+@patch.object(CloudStaticIOClient, "upload_cogs")
+@patch.object(CloudStaticIOClient, "get_manifest")
+@patch.object(CloudStaticIOClient, "__init__", return_value=None)
+def test_update_fire_event_unregisters_overwritten_cogs(
+    mock_init,
+    mock_get_manifest,
+    mock_upload_cogs,
+    mock_update_manifest,
+    mock_update_product_index,
+    test_3d_valid_xarray_epsg_4326,
+):
+    from shapely.geometry import box
+    from src.lib.product_index import ProductIndex, REQUIRED_METRICS
+
+    client = CloudStaticIOClient()
+    client.logger = MagicMock()
+    client.https_prefix = "https://test-bucket"
+    client.cloud_cog_paths = {}
+
+    metrics_stack = test_3d_valid_xarray_epsg_4326.rename({"band": "burn_metric"})
+    metrics_stack["burn_metric"] = ["rbr", "dnbr"]
+    mock_get_manifest.return_value = {
+        "test_affiliation": {
+            "test_event": {
+                "bounds": [0, 0, 10, 10],
+                "prefire_date_range": ["2023-05-01", "2023-06-01"],
+                "postfire_date_range": ["2023-06-15", "2023-07-15"],
+                "satellite_pass_information": {},
+            }
+        }
+    }
+
+    def upload_cogs(metrics_stack, fire_event_name, affiliation, quantize_metrics):
+        for metric_name in metrics_stack.burn_metric.to_index():
+            client.cloud_cog_paths[metric_name] = (
+                client.https_prefix
+                + f"/public/{affiliation}/{fire_event_name}/{metric_name}.tif"
+            )
+
+    mock_upload_cogs.side_effect = upload_cogs
+
+    client.update_fire_event(
+        metrics_stack=metrics_stack,
+        fire_event_name="test_event",
+        affiliation="test_affiliation",
+    )
+
+    # The product of the overwritten COGs goes, the one of another fire stays
+    product_index = ProductIndex()
+    for fire_event_name in ["test_event", "other_event"]:
+        product_index.register(
+            key="key",
+            affiliation="test_affiliation",
+            fire_event_name=fire_event_name,
+            boundary_geometry=box(0, 0, 10, 10),
+            cog_paths={
+                metric: client.https_prefix
+                + f"/public/test_affiliation/{fire_event_name}/{metric}.tif"
+                for metric in REQUIRED_METRICS
+            },
+            satellite_pass_information={},
+        )
+    mock_update_product_index.assert_called_once()
+    mock_update_product_index.call_args.args[0](product_index)
+    assert [product["fire_event_name"] for product in product_index.products["key"]] == [
+        "other_event"
+    ]
+
+
 @patch("rioxarray.raster_array.RasterArray.to_raster")
 @patch("rasterio.open")
 @patch.object(CloudStaticIOClient, "upload", return_value=None)
@@ -116,6 +194,65 @@ def test_upload_cogs(
     )
 
 
+@patch.object(CloudStaticIOClient, "__init__", return_value=None)
+def test_write_metric_cog_quantized(
+    mock_init, test_3d_valid_xarray_epsg_4326, tmp_path
+):
+    client = CloudStaticIOClient()
+    dnbr = test_3d_valid_xarray_epsg_4326.sel(band="band1", drop=True)
+
+    float_path = str(tmp_path / "float_dnbr.tif")
+    quantized_path = str(tmp_path / "quantized_dnbr.tif")
+    client.write_metric_cog(dnbr, float_path, "dnbr", quantize_metrics=False)
+    client.write_metric_cog(dnbr, quantized_path, "dnbr", quantize_metrics=True)
+
+    with rasterio.open(float_path) as float_cog:
+        assert float_cog.dtypes[0] == "float32"
+    with rasterio.open(quantized_path) as quantized_cog:
+        assert quantized_cog.dtypes[0] == "int16"
+        assert quantized_cog.nodata == QUANTIZED_NODATA
+        assert quantized_cog.scales[0] == METRIC_SCALES["dnbr"]
+        assert float(quantized_cog.tags()[QUANTIZATION_SCALE_TAG]) == METRIC_SCALES["dnbr"]
+
+
+@patch.object(CloudStaticIOClient, "__init__", return_value=None)
+def test_upload_summary_pyramid(mock_init, test_3d_valid_xarray_epsg_4326, tmp_path):
+    client = CloudStaticIOClient()
+    client.https_prefix = "https://test-bucket.s3.amazonaws.com"
+    client.cloud_cog_paths = {}
+    client.logger = MagicMock()
+    dnbr = test_3d_valid_xarray_epsg_4326.sel(band="band1", drop=True)
+
+    # Upload to, and download from, a local directory
+    def local_upload(source_local_path, remote_path):
+        (tmp_path / remote_path).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(source_local_path, tmp_path / remote_path)
+
+    with patch.object(CloudStaticIOClient, "upload", side_effect=local_upload):
+        client.upload_summary_pyramid(dnbr, "dnbr", "test_event", "test_affiliation")
+    remote_path = "public/test_affiliation/test_event/dnbr_summary_pyramid.npz"
+    assert client.cloud_cog_paths["dnbr_summary_pyramid"] == (
+        f"{client.https_prefix}/{remote_path}"
+    )
+
+    with patch.object(
+        CloudStaticIOClient,
+        "download",
+        side_effect=lambda remote_path, target_local_path: shutil.copy(
+            tmp_path / remote_path, target_local_path
+        ),
+    ):
+        summary_pyramid = client.get_summary_pyramid(
+            "dnbr", "test_event", "test_affiliation"
+        )
+    assert summary_pyramid.shape == dnbr.shape
+    assert summary_pyramid.transform == dnbr.rio.transform()
+    stats = summary_pyramid.window_stats(
+        0, 0, *dnbr.shape, lambda *window: pytest.fail("Read a pixel")
+    )
+    assert stats["count"] == int(dnbr.notnull().sum())
+
+
 @patch("tempfile.TemporaryDirectory")
 @patch("os.path.join")
 @patch("rasterio.open")
@@ -166,22 +303,9 @@ def test_upload_rap_estimates(
     )
 
 
-@patch("tempfile.TemporaryDirectory")
-@patch("os.path.join")
-@patch("builtins.open", new_callable=mock_open)
-@patch("json.dump")
-@patch.object(CloudStaticIOClient, "upload", return_value=None)
+@patch.object(CloudStaticIOClient, "update_json")
 @patch.object(CloudStaticIOClient, "__init__", return_value=None)
-@patch.object(CloudStaticIOClient, "get_manifest")
-def test_update_manifest(
-    mock_get_manifest,
-    mock_init,
-    mock_upload,
-    mock_json_dump,
-    mock_open,
-    mock_os_join,
-    mock_temp_dir,
-):
+def test_update_manifest(mock_init, mock_update_json):
     # Create an instance of CloudStaticIOClient
     client = CloudStaticIOClient()
 
@@ -201,9 +325,6 @@ def test_update_manifest(
         "latest_pass": "2021-01-01",
     }
 
-    # Mock the return value of get_manifest
-    mock_get_manifest.return_value = {}
-
     # Call update_manifest
     client.update_manifest(
         fire_event_name,
@@ -215,15 +336,28 @@ def test_update_manifest(
         satellite_pass_information,
     )
 
-    # Assert that __init__, get_manifest, json.dump and upload were called with the correct arguments
+    # The manifest is written conditionally, through update_json
     mock_init.assert_called_once_with()
-    mock_get_manifest.assert_called_once_with()
-    mock_json_dump.assert_called_once()
-    mock_upload.assert_called_once_with(
-        source_local_path=mock_os_join.return_value,
-        remote_path="manifest.json",
+    mock_update_json.assert_called_once_with("manifest.json", ANY)
+    update = mock_update_json.call_args.args[1]
+
+    # The fire event is added to the latest manifest, keeping concurrently added fire events
+    concurrent_manifest = {
+        "test_affiliation": {"concurrent_event": {}},
+        "other_affiliation": {"test_event": {}},
+    }
+    manifest = update(concurrent_manifest)
+    assert set(manifest["test_affiliation"]) == {"concurrent_event", "test_event"}
+    assert manifest["other_affiliation"] == {"test_event": {}}
+    assert manifest["test_affiliation"]["test_event"]["bounds"] == bounds
+    assert (
+        manifest["test_affiliation"]["test_event"]["satellite_pass_information"]
+        == satellite_pass_information
     )
 
+    # Or to a new manifest, if there is none yet
+    assert set(update(None)["test_affiliation"]) == {"test_event"}
+
 
 @patch("json.load")
 @patch.object(CloudStaticIOClient, "download", return_value=None)
@@ -312,3 +446,72 @@ def test_get_derived_products(mock_init):
     }
 
     assert derived_products == expected_derived_products
+
+
+@patch("src.util.cloud_static_io.time.sleep")
+@patch.object(CloudStaticIOClient, "validate_credentials", return_value=None)
+@patch.object(CloudStaticIOClient, "__init__", return_value=None)
+def test_update_product_index_retries_concurrent_update(
+    mock_init, mock_validate_credentials, mock_sleep
+):
+    import io
+    import json
+    import botocore.exceptions
+    from shapely.geometry import box
+    from src.lib.product_index import ProductIndex, REQUIRED_METRICS
+
+    client = CloudStaticIOClient()
+    client.logger = MagicMock()
+    client.s3_bucket_name = "test_bucket"
+    s3_client = MagicMock()
+    s3_client.exceptions.NoSuchKey = type("NoSuchKey", (Exception,), {})
+    client.boto_session = MagicMock()
+    client.boto_session.client.return_value = s3_client
+
+    def register(product_index, fire_event_name):
+        product_index.register(
+            key="key",
+            affiliation="test_affiliation",
+            fire_event_name=fire_event_name,
+            boundary_geometry=box(0, 0, 1, 1),
+            cog_paths={metric: f"{metric}.tif" for metric in REQUIRED_METRICS},
+            satellite_pass_information={},
+        )
+
+    # Another request registers its product between our read and our write
+    concurrent_index = ProductIndex()
+    register(concurrent_index, "concurrent_event")
+    s3_client.get_object.side_effect = [
+        {"Body": io.BytesIO(b'{"products": {}}'), "ETag": '"1"'},
+        {
+            "Body": io.BytesIO(json.dumps(concurrent_index.to_dict()).encode()),
+            "ETag": '"2"',
+        },
+    ]
+    s3_client.put_object.side_effect = [
+        botocore.exceptions.ClientError(
+            {"Error": {"Code": "PreconditionFailed"}}, "PutObject"
+        ),
+        {},
+    ]
+
+    product_index = client.update_product_index(
+        lambda product_index: register(product_index, "test_event")
+    )
+
+    # Both registrations survive, and the write was conditional on the latest version
+    assert {
+        product["fire_event_name"] for product in product_index.products["key"]
+    } == {"concurrent_event", "test_event"}
+    assert s3_client.put_object.call_args.kwargs["IfMatch"] == '"2"'
+    written = json.loads(s3_client.put_object.call_args.kwargs["Body"])
+    assert len(written["products"]["key"]) == 2
+    mock_sleep.assert_called_once()
+
+    # Without an index yet, it is only created if it still doesn't exist
+    s3_client.get_object.side_effect = s3_client.exceptions.NoSuchKey()
+    s3_client.put_object.side_effect = None
+    client.update_product_index(
+        lambda product_index: register(product_index, "test_event")
+    )
+    assert s3_client.put_object.call_args.kwargs["IfNoneMatch"] == "*"
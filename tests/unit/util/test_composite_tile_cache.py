@@ -0,0 +1,99 @@
+import os
+import time
+import pytest
+import numpy as np
+import xarray as xr
+from src.util.composite_tile_cache import (
+    CompositeTileCache,
+    composite_tiles,
+    composite_tile_bounds,
+    composite_tile_key,
+)
+
+REDUCER_CONFIG = {"reducer": "median", "bands": ["B8A", "B12"], "dtype": "float32"}
+
+
+def _key(date_range=("2023-05-01", "2023-06-01")):
+    return composite_tile_key(32611, (48, 360), 20, date_range, REDUCER_CONFIG)
+
+
+def test_composite_tiles():
+    tile_size = 512 * 20
+    bounds = (tile_size * 2 + 100, tile_size * 5 + 100, tile_size * 3 + 100, tile_size * 5 + 200)
+
+    tiles = composite_tiles(bounds, resolution=20, tile_size_pixels=512)
+    assert sorted(tiles) == [(2, 5), (3, 5)]
+    assert composite_tile_bounds((2, 5), 20, 512) == (
+        tile_size * 2,
+        tile_size * 5,
+        tile_size * 3,
+        tile_size * 6,
+    )
+
+
+def test_composite_tile_key():
+    assert _key() == _key()
+    assert _key() != _key(date_range=("2023-05-01", "2023-06-02"))
+
+
+def test_save_and_load(tmp_path):
+    cache = CompositeTileCache(root_dir=str(tmp_path))
+    tile = xr.DataArray(
+        np.random.rand(2, 8, 8).astype("float32"),
+        dims=("band", "y", "x"),
+        coords={
+            "band": ["B8A", "B12"],
+            "y": np.arange(3700150, 3699990, -20.0),
+            "x": np.arange(500010, 500170, 20.0),
+        },
+    ).rio.write_crs(32611)
+    tile[:, 0, 0] = np.nan
+
+    assert cache.load(_key()) is None
+
+    cache.save(_key(), tile)
+    cached = cache.load(_key())
+
+    assert list(cached.band.values) == ["B8A", "B12"]
+    assert cached.rio.crs == tile.rio.crs
+    np.testing.assert_array_equal(cached.values, tile.values)
+
+    # Stale tiles are ignored
+    stale_time = time.time() - cache.max_age_seconds - 1
+    os.utime(cache.path(_key()), (stale_time, stale_time))
+    assert cache.load(_key()) is None
+
+
+def test_prune(tmp_path):
+    cache = CompositeTileCache(root_dir=str(tmp_path))
+    tile = xr.DataArray(
+        np.zeros((2, 8, 8), dtype="float32"),
+        dims=("band", "y", "x"),
+        coords={
+            "band": ["B8A", "B12"],
+            "y": np.arange(3700150, 3699990, -20.0),
+            "x": np.arange(500010, 500170, 20.0),
+        },
+    ).rio.write_crs(32611)
+    keys = [_key(date_range=(f"2023-0{month}-01", "2023-09-01")) for month in [1, 2, 3]]
+    for key in keys:
+        cache.save(key, tile)
+    tile_bytes = os.path.getsize(cache.path(keys[0]))
+
+    # Cached in order, but the first was used since, and the last is stale
+    now = time.time()
+    for age, key in [(30, keys[0]), (20, keys[1])]:
+        os.utime(cache.path(key), (now - age, now - age))
+    stale_time = now - cache.max_age_seconds - 1
+    os.utime(cache.path(keys[2]), (stale_time, stale_time))
+    assert cache.load(keys[0]) is not None
+
+    cache.prune()
+    assert not os.path.exists(cache.path(keys[2]))
+    assert os.path.exists(cache.path(keys[1]))
+
+    # Over its size, the least recently used tiles are evicted
+    cache.max_bytes = tile_bytes
+    cache.prune()
+    assert os.path.exists(cache.path(keys[0]))
+    assert not os.path.exists(cache.path(keys[1]))
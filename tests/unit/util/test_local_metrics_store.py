@@ -0,0 +1,85 @@
+import pytest
+import numpy as np
+from src.util.local_metrics_store import LocalMetricsStore, metrics_store_signature
+
+
+@pytest.fixture
+def test_metrics_stack(test_3d_valid_xarray_epsg_4326):
+    metrics_stack = test_3d_valid_xarray_epsg_4326.rename({"band": "burn_metric"})
+    metrics_stack["burn_metric"] = ["rbr", "dnbr"]
+    return metrics_stack.rio.write_crs("EPSG:4326")
+
+
+@pytest.fixture
+def test_signature():
+    return metrics_store_signature(
+        bounds=(-116.05, 33.90, -116.04, 33.91),
+        prefire_date_range=("2023-05-01", "2023-06-01"),
+        postfire_date_range=("2023-06-15", "2023-07-15"),
+        satellite_pass_information={"n_prefire_passes": 4, "n_postfire_passes": 4},
+    )
+
+
+def test_save_and_open(test_metrics_stack, test_signature, tmp_path):
+    store = LocalMetricsStore(root_dir=str(tmp_path))
+    store.save(test_metrics_stack, "test_affiliation", "test_event", test_signature)
+
+    metrics_stack = store.open("test_affiliation", "test_event", test_signature)
+
+    # Memory-mapped, rather than read into memory
+    assert isinstance(metrics_stack.data, np.memmap)
+    np.testing.assert_array_equal(metrics_stack.values, test_metrics_stack.values)
+    assert list(metrics_stack.burn_metric.values) == ["rbr", "dnbr"]
+    np.testing.assert_allclose(metrics_stack.x.values, test_metrics_stack.x.values)
+    assert metrics_stack.rio.crs == test_metrics_stack.rio.crs
+
+    # Edits stay private to the caller
+    metrics_stack.values[0, 0, 0] = -1
+    reopened = store.open("test_affiliation", "test_event", test_signature)
+    assert reopened.values[0, 0, 0] == test_metrics_stack.values[0, 0, 0]
+
+
+def test_open_stale(test_metrics_stack, test_signature, tmp_path):
+    store = LocalMetricsStore(root_dir=str(tmp_path))
+    assert store.open("test_affiliation", "test_event") is None
+
+    store.save(test_metrics_stack, "test_affiliation", "test_event", test_signature)
+
+    # A different source (e.g. the fire was re-analyzed with new dates) is stale
+    new_signature = dict(test_signature, prefire_date_range=["2023-04-01", "2023-06-01"])
+    assert store.open("test_affiliation", "test_event", new_signature) is None
+
+    # As is an entry past its max age
+    expired_store = LocalMetricsStore(root_dir=str(tmp_path), max_age_seconds=-1)
+    assert expired_store.open("test_affiliation", "test_event", test_signature) is None
+
+    # Overwriting replaces the entry
+    store.save(test_metrics_stack + 1, "test_affiliation", "test_event", new_signature)
+    metrics_stack = store.open("test_affiliation", "test_event", new_signature)
+    np.testing.assert_array_equal(metrics_stack.values, test_metrics_stack.values + 1)
+
+    store.invalidate("test_affiliation", "test_event")
+    assert store.open("test_affiliation", "test_event") is None
+
+
+def test_save_and_open_histogram(test_metrics_stack, test_signature, tmp_path):
+    store = LocalMetricsStore(root_dir=str(tmp_path))
+    histogram = {"counts": np.array([3, 0, 5]), "bin_edges": np.array([0, 1, 2, 3.0])}
+
+    # Without a persisted stack, there's nothing to keep the histogram with
+    store.save_histogram(histogram, "test_affiliation", "test_event", "rbr")
+    assert store.open_histogram("test_affiliation", "test_event", "rbr") is None
+
+    store.save(test_metrics_stack, "test_affiliation", "test_event", test_signature)
+    store.save_histogram(histogram, "test_affiliation", "test_event", "rbr")
+
+    reopened = store.open_histogram(
+        "test_affiliation", "test_event", "rbr", test_signature
+    )
+    np.testing.assert_array_equal(reopened["counts"], histogram["counts"])
+    np.testing.assert_array_equal(reopened["bin_edges"], histogram["bin_edges"])
+    assert store.open_histogram("test_affiliation", "test_event", "dnbr") is None
+
+    # Replacing the stack drops its histogram
+    store.save(test_metrics_stack, "test_affiliation", "test_event", test_signature)
+    assert store.open_histogram("test_affiliation", "test_event", "rbr") is None
@@ -0,0 +1,72 @@
+import os
+import time
+import pytest
+import numpy as np
+from src.util.scene_cache import SceneCache, scene_tile_key
+
+
+def _tile_key(tile_index=(97, 722)):
+    return scene_tile_key(32611, tile_index, 20, ["B8A", "B12"], "float32")
+
+
+def test_scene_tile_key():
+    assert _tile_key() == _tile_key(tile_index=[97, 722])
+    assert _tile_key() != _tile_key(tile_index=(98, 722))
+    assert _tile_key() != scene_tile_key(
+        32611, (97, 722), 20, ["B8A", "B12"], "float32", tile_size_pixels=512
+    )
+
+
+def test_save_and_load(tmp_path):
+    cache = SceneCache(root_dir=str(tmp_path))
+    values = np.random.rand(2, 4, 4).astype("float32")
+
+    assert cache.load(_tile_key(), "item_1") is None
+
+    cache.save(_tile_key(), "item_1", values)
+    cached = cache.load(_tile_key(), "item_1")
+
+    # Memory-mapped, rather than read into memory
+    assert isinstance(cached, np.memmap)
+    np.testing.assert_array_equal(cached, values)
+
+
+def test_stale_scenes(tmp_path):
+    cache = SceneCache(root_dir=str(tmp_path), max_age_seconds=60)
+    cache.save(_tile_key(), "item_1", np.zeros((2, 4, 4), dtype="float32"))
+    cache.save(_tile_key(), "item_2", np.zeros((2, 4, 4), dtype="float32"))
+
+    stale_time = time.time() - 120
+    os.utime(cache.path(_tile_key(), "item_1"), (stale_time, stale_time))
+
+    assert cache.load(_tile_key(), "item_1") is None
+    assert cache.load(_tile_key(), "item_2") is not None
+
+    cache.prune()
+    assert not os.path.exists(cache.path(_tile_key(), "item_1"))
+    assert os.path.exists(cache.path(_tile_key(), "item_2"))
+
+
+def test_prune_evicts_least_recently_used(tmp_path):
+    values = np.zeros((2, 4, 4), dtype="float32")
+    cache = SceneCache(root_dir=str(tmp_path))
+    for item_id in ["item_1", "item_2", "item_3"]:
+        cache.save(_tile_key(), item_id, values)
+    scene_bytes = os.path.getsize(cache.path(_tile_key(), "item_1"))
+
+    # Cached in order, but item_1 was used since
+    now = time.time()
+    for age, item_id in [(30, "item_1"), (20, "item_2"), (10, "item_3")]:
+        os.utime(cache.path(_tile_key(), item_id), (now - age, now - age))
+    assert cache.load(_tile_key(), "item_1") is not None
+
+    cache.max_bytes = 2 * scene_bytes
+    cache.prune()
+
+    assert os.path.exists(cache.path(_tile_key(), "item_1"))
+    assert not os.path.exists(cache.path(_tile_key(), "item_2"))
+    assert os.path.exists(cache.path(_tile_key(), "item_3"))
+
+    cache.max_bytes = 0
+    cache.prune()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,50 @@
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+from src.util import stac_catalog
+from src.util.stac_catalog import (
+    get_stac_catalog,
+    clear_stac_catalog_cache,
+    STAC_HTTP_POOL_MAXSIZE,
+)
+
+TEST_STAC_URL = "https://example.com/api/stac/v1"
+
+
+@pytest.fixture
+def mock_open():
+    clear_stac_catalog_cache()
+
+    def slow_open(url, modifier=None, stac_io=None):
+        time.sleep(0.05)  # Give concurrent callers the chance to race
+        return MagicMock(stac_io=stac_io)
+
+    with patch.object(stac_catalog.PystacClient, "open", side_effect=slow_open) as mock:
+        yield mock
+
+    clear_stac_catalog_cache()
+
+
+def test_get_stac_catalog_is_shared(mock_open):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        catalogs = list(executor.map(lambda _: get_stac_catalog(TEST_STAC_URL), range(8)))
+
+    assert mock_open.call_count == 1
+    assert all(catalog is catalogs[0] for catalog in catalogs)
+
+
+def test_get_stac_catalog_refresh(mock_open):
+    catalog = get_stac_catalog(TEST_STAC_URL)
+    assert get_stac_catalog(TEST_STAC_URL, refresh_seconds=3600) is catalog
+
+    refreshed = get_stac_catalog(TEST_STAC_URL, refresh_seconds=0)
+    assert refreshed is not catalog
+    assert mock_open.call_count == 2
+
+
+def test_get_stac_catalog_pooled_session(mock_open):
+    catalog = get_stac_catalog(TEST_STAC_URL)
+
+    adapter = catalog.stac_io.session.get_adapter(TEST_STAC_URL)
+    assert adapter._pool_maxsize == STAC_HTTP_POOL_MAXSIZE